@@ -1,7 +1,6 @@
-from flask import Flask, render_template, request, redirect, session, jsonify
+from flask import Flask, Response, render_template, request, redirect, session, jsonify, send_file
 from flask_cors import CORS
 from flask_session import Session
-import requests
 import os
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
@@ -9,9 +8,20 @@ import json
 import logging
 import math
 import random
-from core.database import UserDB, hash_password, get_db
+import threading
+import time
+from core.database import UserDB, hash_password, get_db, PARENT_MESSAGES_LIMIT, bump_counter
 from core.recommendations import recommend
 from core.analytics import log_event, assign_variant, record_ab_outcome
+from core.strava_ingest import build_applied_marker, ingest_applied_markers
+from core.leaderboard import leaderboard
+from core import scoring
+from core.http_cache import conditional, user_state_tag, counter_tag
+from core.blob_store import BlobStore
+from core import events as live_events
+from core.strava_client import get_client as get_strava_client, StravaUnavailable
+from core.strava_ratelimit import RateLimited
+from core import activity_details, activity_files, image_variants, strava_sync, strava_tokens, upload_jobs
 from werkzeug.utils import secure_filename
 
 import pathlib
@@ -87,13 +97,17 @@ if RENDER_EXTERNAL_URL:
 else:
     REDIRECT_URI = 'http://localhost:5000/callback'
 
-STRAVA_API_URL = 'https://www.strava.com/api/v3'
 STRAVA_AUTH_URL = 'https://www.strava.com/oauth/authorize'
-STRAVA_TOKEN_URL = 'https://www.strava.com/oauth/token'
 
 
 def get_strava_access_token():
     """Get or refresh Strava access token"""
+    # Tokens saved on the user document are shared with other requests and workers
+    if 'user_id' in session:
+        token = strava_tokens.token_cache.access_token(session['user_id'])
+        if token:
+            return token
+
     if 'access_token' in session and 'token_expiry' in session:
         if datetime.now() < datetime.fromisoformat(session['token_expiry']):
             return session['access_token']
@@ -106,7 +120,10 @@ def get_strava_access_token():
         'grant_type': 'refresh_token'
     }
     
-    response = requests.post(STRAVA_TOKEN_URL, data=refresh_data)
+    try:
+        response = get_strava_client().post_token(refresh_data)
+    except StravaUnavailable:
+        return None
     if response.status_code == 200:
         token_data = response.json()
         session['access_token'] = token_data['access_token']
@@ -127,51 +144,16 @@ def get_strava_headers():
 
 def get_user_strava_headers(user_id):
     """Get Strava headers for a specific user (refresh token if needed)."""
-    # Fetch user's tokens from DB
-    user = UserDB.get_user_by_id(user_id)
-    if not user:
-        return None
-
-    access_token = user.get('strava_access_token')
-    refresh_token = user.get('strava_refresh_token')
-    token_expiry = user.get('strava_token_expiry')
-
-    # If expiry exists and not expired, use current token
-    try:
-        if access_token and token_expiry:
-            expiry_dt = datetime.fromisoformat(token_expiry)
-            if datetime.now() < expiry_dt:
-                return {'Authorization': f'Bearer {access_token}'}
-    except Exception:
-        # If parsing fails, we'll attempt refresh if refresh_token present
-        pass
-
-    # Attempt to refresh using refresh_token
-    if refresh_token:
-        data = {
-            'client_id': STRAVA_CLIENT_ID,
-            'client_secret': STRAVA_CLIENT_SECRET,
-            'grant_type': 'refresh_token',
-            'refresh_token': refresh_token
-        }
-        try:
-            resp = requests.post(STRAVA_TOKEN_URL, data=data)
-            if resp.status_code == 200:
-                token_data = resp.json()
-                new_access = token_data.get('access_token')
-                new_refresh = token_data.get('refresh_token', refresh_token)
-                expires_at = datetime.fromtimestamp(token_data.get('expires_at'))
-                # Persist updated tokens
-                UserDB.update_strava_token(user_id, new_access, new_refresh, expires_at.isoformat())
-                return {'Authorization': f'Bearer {new_access}'}
-        except Exception:
-            logger.exception('Failed to refresh Strava token for user %s', user_id)
+    return strava_sync.user_strava_headers(user_id)
 
-    # Fallback to whatever access_token exists
-    if access_token:
-        return {'Authorization': f'Bearer {access_token}'}
 
-    return None
+def strava_unavailable_response(error):
+    """JSON error for a Strava call that timed out or was held back by the rate limiter."""
+    if isinstance(error, RateLimited):
+        response = jsonify({'error': 'Strava is busy; try again shortly', 'retry_after': int(error.retry_after)})
+        response.headers['Retry-After'] = str(int(error.retry_after) + 1)
+        return response, 503
+    return jsonify({'error': 'Strava is not responding'}), 504
 
 
 @app.route('/')
@@ -376,13 +358,13 @@ def api_compute_athlete_type():
         users_col = db.get('users')
         gender = None
         try:
-            u = users_col.find_one({'_id': ObjectId(target_user)})
+            u = users_col.find_one({'_id': ObjectId(target_user)}, {'gender': 1, 'sex': 1})
             if u:
                 gender = u.get('gender') or u.get('sex')
         except Exception:
             # target_user may already be string id; try lookup by string
             try:
-                u = users_col.find_one({'user_id': target_user})
+                u = users_col.find_one({'user_id': target_user}, {'gender': 1})
                 if u:
                     gender = u.get('gender')
             except Exception:
@@ -603,7 +585,7 @@ def callback():
     logger.debug(f"Using Client ID: {STRAVA_CLIENT_ID}")
     
     try:
-        response = requests.post(STRAVA_TOKEN_URL, data=token_data)
+        response = get_strava_client().post_token(token_data)
         logger.debug(f"Token response status: {response.status_code}")
         logger.debug(f"Token response: {response.text}")
         
@@ -624,6 +606,7 @@ def callback():
                 refresh_token=data.get('refresh_token'),
                 token_expiry=datetime.fromtimestamp(data['expires_at']).isoformat()
             )
+            strava_tokens.invalidate(session['user_id'])
             
             logger.info(f"Strava authentication successful for {session['athlete_name']}")
             session['strava_connected'] = True
@@ -701,6 +684,32 @@ def preview_dashboard():
 
 
 
+STRAVA_WEBHOOK_VERIFY_TOKEN = os.getenv('STRAVA_WEBHOOK_VERIFY_TOKEN')
+STRAVA_WEBHOOK_SUBSCRIPTION_ID = os.getenv('STRAVA_WEBHOOK_SUBSCRIPTION_ID')
+
+
+@app.route('/strava/webhook', methods=['GET'])
+def strava_webhook_validate():
+    """Answer Strava's push subscription validation handshake."""
+    if (request.args.get('hub.mode') != 'subscribe' or not STRAVA_WEBHOOK_VERIFY_TOKEN
+            or request.args.get('hub.verify_token') != STRAVA_WEBHOOK_VERIFY_TOKEN):
+        return jsonify({'error': 'Invalid verification request'}), 403
+    return jsonify({'hub.challenge': request.args.get('hub.challenge')}), 200
+
+
+@app.route('/strava/webhook', methods=['POST'])
+def strava_webhook_event():
+    """Queue a Strava push event for the task worker. Strava expects a 200 within two seconds."""
+    event = request.get_json(silent=True) or {}
+    if not event.get('object_type') or not event.get('owner_id'):
+        return jsonify({'error': 'Invalid event'}), 400
+    if STRAVA_WEBHOOK_SUBSCRIPTION_ID and str(event.get('subscription_id')) != STRAVA_WEBHOOK_SUBSCRIPTION_ID:
+        logger.warning('Ignoring Strava event for subscription %s', event.get('subscription_id'))
+        return jsonify({'error': 'Unknown subscription'}), 403
+    strava_sync.enqueue_event(event)
+    return jsonify({'received': True}), 200
+
+
 @app.route('/api/athlete')
 def get_athlete():
     """API endpoint to get current athlete info"""
@@ -711,7 +720,10 @@ def get_athlete():
     if not headers:
         return jsonify({'error': 'Failed to get token'}), 401
     
-    response = requests.get(f'{STRAVA_API_URL}/athlete', headers=headers)
+    try:
+        response = get_strava_client().get('/athlete', headers=headers)
+    except (StravaUnavailable, RateLimited) as e:
+        return strava_unavailable_response(e)
     if response.status_code == 200:
         athlete = response.json()
         return jsonify({
@@ -744,116 +756,29 @@ def get_activities():
         'page': 1
     }
     
-    response = requests.get(f'{STRAVA_API_URL}/athlete/activities', headers=headers, params=params)
+    try:
+        response = get_strava_client().get('/athlete/activities', headers=headers, params=params)
+    except (StravaUnavailable, RateLimited) as e:
+        return strava_unavailable_response(e)
     if response.status_code == 200:
         activities = response.json()
         formatted_activities = []
 
-        def compute_earned_minutes_for_strava(distance_km, duration_minutes, avg_hr=None, max_hr=None, pace_min_per_km=None, type_label=None):
-            # Normalize inputs
-            try:
-                d = float(distance_km)
-            except Exception:
-                d = 0.0
-            try:
-                t = float(duration_minutes)
-            except Exception:
-                t = 0.0
-
-            # Compute pace if not provided
-            if pace_min_per_km is None:
-                if d > 0:
-                    pace = t / d
-                else:
-                    pace = 999
-            else:
-                pace = pace_min_per_km
-
-            # Heart-rate based multiplier using chosen thresholds
-            hr_mul = None
-            try:
-                if avg_hr is not None:
-                    avg_hr_f = float(avg_hr)
-                    if avg_hr_f < 150:
-                        hr_mul = 1.0
-                    elif avg_hr_f > 170:
-                        hr_mul = 2.0
-                    else:
-                        hr_mul = 1.5
-            except Exception:
-                hr_mul = None
-
-            # Pace bonus: faster pace gives small bonus
-            pace_bonus = 0.0
-            if pace < 5:
-                pace_bonus = 0.5
-            elif pace < 6.5:
-                pace_bonus = 0.2
-
-            # Intensity multiplier fallback
-            intensity_mul = 1.0
-            # Optional: weight by type (running vs cycling)
-            if type_label:
-                tlabel = type_label.lower()
-                if 'run' in tlabel:
-                    intensity_mul = 1.0
-                elif 'ride' in tlabel:
-                    intensity_mul = 0.8
-
-            # Combine factors
-            if hr_mul is not None:
-                earned = (d * hr_mul) + (t * 0.05) + (d * pace_bonus)
-            else:
-                earned = (d * intensity_mul) + (t * 0.03) + (d * pace_bonus)
-
-            earned_minutes = max(1, int(math.floor(earned)))
-            return earned_minutes
-
-        def compute_intensity_label(avg_hr=None, pace_min_per_km=None):
-            # Prefer HR thresholds if available
-            try:
-                if avg_hr is not None:
-                    avg_hr_f = float(avg_hr)
-                    if avg_hr_f < 150:
-                        return 'Easy'
-                    if avg_hr_f > 170:
-                        return 'Hard'
-                    return 'Medium'
-            except Exception:
-                pass
-
-            # Fallback to pace-based labels
-            try:
-                if pace_min_per_km is not None:
-                    pace = float(pace_min_per_km)
-                    if pace < 5:
-                        return 'Hard'
-                    if pace < 6.5:
-                        return 'Medium'
-                    return 'Easy'
-            except Exception:
-                pass
-
-            return 'Easy'
-
         # Auto-apply Strava-earned minutes for child users with de-duplication.
         db = get_db()
-        activities_collection = db['activities'] if db is not None else None
-        today_str = datetime.utcnow().strftime('%Y-%m-%d')
+        apply_credits = session.get('account_type') == 'child' and db is not None
+        markers = []
+        # Activities before the high-water mark were imported (or checked) already
+        sync_state = None
+        if apply_credits:
+            sync_state = (UserDB.get_user_view(session['user_id'], 'strava') or {}).get('strava_sync')
 
         for activity in activities:
-            dist_km = round(activity.get('distance', 0) / 1000, 2)
-            moving_time = activity.get('moving_time', 0)
-            duration_minutes = moving_time / 60.0 if moving_time else 0
-            pace = None
-            if dist_km > 0:
-                # pace in min/km
-                pace = (moving_time / 60.0) / dist_km
-
-            avg_hr = activity.get('average_heartrate')
-            max_hr = activity.get('max_heartrate')
-            intensity_label = compute_intensity_label(avg_hr=avg_hr, pace_min_per_km=pace)
-            earned = compute_earned_minutes_for_strava(dist_km, duration_minutes, avg_hr=avg_hr, max_hr=max_hr, pace_min_per_km=pace, type_label=activity.get('type'))
+            metrics = scoring.strava_metrics(activity)
+            dist_km = metrics['distance_km']
+            duration_minutes = metrics['duration_minutes']
+            intensity_label = metrics['intensity']
+            earned = metrics['earned_minutes']
 
             formatted_activities.append({
                 'id': activity['id'],
@@ -876,62 +801,29 @@ def get_activities():
             })
 
             # Apply credits only for children with a working DB connection.
-            if session.get('account_type') != 'child' or activities_collection is None:
-                continue
-
-            activity_id = str(activity.get('id'))
-            existing = activities_collection.find_one({
-                'source': 'strava_applied',
-                'external_id': activity_id,
-                'user_id': session['user_id']
-            })
-            if existing:
-                continue
-
-            activity_day = activity.get('start_date')
-            if isinstance(activity_day, str) and 'T' in activity_day:
-                activity_day = activity_day.split('T')[0]
-
-            applied_doc = {
-                'user_id': session['user_id'],
-                'source': 'strava_applied',
-                'external_id': activity_id,
-                'title': activity.get('name'),
-                'date': activity.get('start_date'),
-                'type': activity.get('type'),
-                'distance': dist_km,
-                'time_minutes': int(math.ceil(duration_minutes)),
-                'intensity': intensity_label,
-                'earned_minutes': earned,
-                'created_at': datetime.utcnow()
-            }
-
-            insert_result = None
+            if apply_credits and strava_sync.is_new(activity, sync_state):
+                markers.append(build_applied_marker(
+                    session['user_id'], activity, dist_km, int(math.ceil(duration_minutes)), intensity_label, earned
+                ))
+
+        if markers:
+            # Only today's activity earns a streak reward + notification here.
+            # Historical activities are recorded in activity_dates for streak tracking
+            # but must not flood the notifications panel with duplicate rewards.
             try:
-                insert_result = activities_collection.insert_one(applied_doc)
-                if activity_day == today_str:
-                    UserDB.add_earned_game_time_and_increase_limit(session['user_id'], earned)
-                else:
-                    UserDB.add_earned_game_time(session['user_id'], earned)
-
-                # Only grant streak reward + notification for today's activity.
-                # Historical activities are recorded in activity_dates for streak tracking
-                # but must not flood the notifications panel with duplicate rewards.
-                is_today_act = (activity_day == today_str)
-                UserDB.record_daily_activity(
-                    session['user_id'],
-                    activity_date=activity_day,
-                    source='strava',
-                    grant_reward=is_today_act,
-                    notify=is_today_act
-                )
+                result = ingest_applied_markers(session['user_id'], markers, reward_days='today')
+                if not result['credit_failed']:
+                    strava_sync.record_sync(session['user_id'], activities, sync_state)
             except Exception:
-                logger.exception('Failed applying Strava activity %s for user %s', activity_id, session.get('user_id'))
-                if insert_result is not None:
-                    try:
-                        activities_collection.delete_one({'_id': insert_result.inserted_id})
-                    except Exception:
-                        logger.exception('Failed rollback for Strava marker %s', activity_id)
+                logger.exception('Failed applying Strava activities for user %s', session.get('user_id'))
+        elif apply_credits:
+            strava_sync.record_sync(session['user_id'], activities, sync_state)
+
+        # Warm the detail cache for the cards most likely to be opened next
+        try:
+            activity_details.prefetch(session['user_id'], [a['id'] for a in activities])
+        except Exception:
+            logger.exception('Failed queueing activity detail prefetch for user %s', session.get('user_id'))
 
         return jsonify(formatted_activities)
 
@@ -948,33 +840,14 @@ def get_activity_detail(activity_id):
     if not headers:
         return jsonify({'error': 'Failed to get token'}), 401
     
-    response = requests.get(f'{STRAVA_API_URL}/activities/{activity_id}', headers=headers)
-    if response.status_code == 200:
-        activity = response.json()
-        return jsonify({
-            'id': activity['id'],
-            'name': activity['name'],
-            'type': activity.get('sport_type', activity.get('type')),
-            'distance': round(activity['distance'] / 1000, 2),
-            'moving_time': activity['moving_time'],
-            'elapsed_time': activity['elapsed_time'],
-            'total_elevation_gain': activity.get('total_elevation_gain', 0),
-            'start_date': activity['start_date'],
-            'average_speed': round(activity.get('average_speed', 0) * 3.6, 2),
-            'max_speed': round(activity.get('max_speed', 0) * 3.6, 2),
-            'average_heartrate': activity.get('average_heartrate'),
-            'max_heartrate': activity.get('max_heartrate'),
-            'kilojoules': activity.get('kilojoules'),
-            'average_watts': activity.get('average_watts'),
-            'max_watts': activity.get('max_watts'),
-            'calories': activity.get('calories'),
-            'device_name': activity.get('device_name'),
-            'description': activity.get('description', ''),
-            'gear_id': activity.get('gear_id'),
-            'private': activity.get('private', False)
-        })
-    
-    return jsonify({'error': 'Failed to fetch activity'}), response.status_code
+    try:
+        detail, error_status = activity_details.get_detail(session['user_id'], activity_id, headers)
+    except (StravaUnavailable, RateLimited) as e:
+        return strava_unavailable_response(e)
+    if detail is not None:
+        return jsonify(detail)
+
+    return jsonify({'error': 'Failed to fetch activity'}), error_status
 
 
 @app.route('/parent-dashboard')
@@ -1055,7 +928,7 @@ def api_friend_request():
     friend_requests = db['friend_requests']
 
     # Try to resolve to_user_id if exists
-    to_user = users.find_one({'email': to_email})
+    to_user = users.find_one({'email': to_email}, {'_id': 1})
     to_user_id = str(to_user['_id']) if to_user else None
 
     # Determine which parent accounts need to approve this request
@@ -1064,7 +937,7 @@ def api_friend_request():
         # parents of sender
         if session.get('user_id'):
             try:
-                parents_from = users.find({'account_type': 'parent', 'children': ObjectId(session['user_id'])})
+                parents_from = users.find({'account_type': 'parent', 'children': ObjectId(session['user_id'])}, {'_id': 1})
                 for p in parents_from:
                     parent_ids.append(str(p.get('_id')))
             except Exception:
@@ -1073,7 +946,7 @@ def api_friend_request():
         # parents of recipient (if known)
         if to_user_id:
             try:
-                parents_to = users.find({'account_type': 'parent', 'children': ObjectId(to_user_id)})
+                parents_to = users.find({'account_type': 'parent', 'children': ObjectId(to_user_id)}, {'_id': 1})
                 for p in parents_to:
                     parent_ids.append(str(p.get('_id')))
             except Exception:
@@ -1112,13 +985,20 @@ def api_parent_friend_approvals():
     friend_requests = db['friend_requests']
 
     # Get parent children IDs
-    parent = users.find_one({'_id': ObjectId(session['user_id'])})
+    parent = UserDB.get_user_view(session['user_id'], 'relations')
     children = parent.get('children', []) if parent else []
     child_ids = [str(c) for c in children]
 
     # Find requests where either from_user_id or to_user_id is one of these children and status pending
     pending = list(friend_requests.find({'status': 'pending', '$or': [{'from_user_id': {'$in': child_ids}}, {'to_user_id': {'$in': child_ids}}]}))
 
+    # Resolve every child and parent referenced by these requests in one query
+    referenced_ids = []
+    for p in pending:
+        referenced_ids += [p.get('from_user_id'), p.get('to_user_id')]
+        referenced_ids += p.get('required_approvals', []) + p.get('approvals', [])
+    names = UserDB.get_users_by_ids([i for i in referenced_ids if i], 'identity')
+
     # Normalize and resolve child names, and build parent approval info
     out = []
     for p in pending:
@@ -1130,52 +1010,24 @@ def api_parent_friend_approvals():
         item['created_at'] = p.get('created_at').isoformat() if p.get('created_at') else None
         
         # resolve child names when possible
-        try:
-            if p.get('from_user_id'):
-                fu = users.find_one({'_id': ObjectId(p.get('from_user_id'))})
-                item['from_name'] = fu.get('name') if fu else None
-            else:
-                item['from_name'] = None
-        except Exception:
-            item['from_name'] = None
-
-        try:
-            if p.get('to_user_id'):
-                tu = users.find_one({'_id': ObjectId(p.get('to_user_id'))})
-                item['to_name'] = tu.get('name') if tu else None
-            else:
-                item['to_name'] = None
-        except Exception:
-            item['to_name'] = None
+        fu = names.get(str(p.get('from_user_id')))
+        item['from_name'] = fu.get('name') if fu else None
+        tu = names.get(str(p.get('to_user_id')))
+        item['to_name'] = tu.get('name') if tu else None
 
         # Get approval tracking with parent names
         required_parent_ids = p.get('required_approvals', [])
         approved_parent_ids = p.get('approvals', [])
         
         # Resolve parent names for display
-        required_parents = []
-        for parent_id in required_parent_ids:
-            try:
-                par = users.find_one({'_id': ObjectId(parent_id)})
-                if par:
-                    required_parents.append({
-                        'id': parent_id,
-                        'name': par.get('name', 'Parent')
-                    })
-            except Exception:
-                pass
-        
-        approved_parents = []
-        for parent_id in approved_parent_ids:
-            try:
-                par = users.find_one({'_id': ObjectId(parent_id)})
-                if par:
-                    approved_parents.append({
-                        'id': parent_id,
-                        'name': par.get('name', 'Parent')
-                    })
-            except Exception:
-                pass
+        required_parents = [
+            {'id': parent_id, 'name': names[str(parent_id)].get('name', 'Parent')}
+            for parent_id in required_parent_ids if str(parent_id) in names
+        ]
+        approved_parents = [
+            {'id': parent_id, 'name': names[str(parent_id)].get('name', 'Parent')}
+            for parent_id in approved_parent_ids if str(parent_id) in names
+        ]
         
         item['required_parents'] = required_parents
         item['approved_parents'] = approved_parents
@@ -1224,7 +1076,7 @@ def api_respond_friend_request():
             return jsonify({'error': 'Request not found'}), 404
 
         # Ensure parent is owner of at least one child in the request
-        parent = users.find_one({'_id': ObjectId(session['user_id'])})
+        parent = UserDB.get_user_view(session['user_id'], 'relations')
         children = [str(c) for c in parent.get('children', [])]
         if not (fr.get('from_user_id') in children or (fr.get('to_user_id') and fr.get('to_user_id') in children)):
             return jsonify({'error': 'Not authorized for this request'}), 403
@@ -1251,6 +1103,8 @@ def api_respond_friend_request():
             if from_id and to_id:
                 users.update_one({'_id': ObjectId(from_id)}, {'$addToSet': {'friends': ObjectId(to_id)}})
                 users.update_one({'_id': ObjectId(to_id)}, {'$addToSet': {'friends': ObjectId(from_id)}})
+                UserDB.invalidate_cached_user(from_id)
+                UserDB.invalidate_cached_user(to_id)
             return jsonify({'success': True}), 200
 
         # Check if all required parents have approved
@@ -1263,6 +1117,8 @@ def api_respond_friend_request():
                 if from_id and to_id:
                     users.update_one({'_id': ObjectId(from_id)}, {'$addToSet': {'friends': ObjectId(to_id)}})
                     users.update_one({'_id': ObjectId(to_id)}, {'$addToSet': {'friends': ObjectId(from_id)}})
+                    UserDB.invalidate_cached_user(from_id)
+                    UserDB.invalidate_cached_user(to_id)
                 return jsonify({'success': True, 'finalized': True}), 200
             else:
                 # still pending other parents
@@ -1279,41 +1135,36 @@ def api_respond_friend_request():
 # ------------------------
 @app.route('/api/leaderboard')
 def api_leaderboard():
-    """Return top children across the app or among friends by earned game time."""
-    db = get_db()
-    if db is None:
-        return jsonify({'error': 'Database unavailable'}), 500
+    """Return top children across the app, among friends, or for today / this week.
 
-    users = db['users']
+    scope: global (earned game time), friends, daily or weekly (minutes credited in
+    the current UTC day / ISO week). Served from the in-process leaderboard; when
+    a child is logged in the response also carries their rank in that scope.
+    """
     scope = request.args.get('scope', 'global')
-    
-    query = {'account_type': 'child'}
-    
+    if scope not in ('global', 'friends', 'daily', 'weekly'):
+        return jsonify({'error': 'Unknown scope'}), 400
+
+    me = None
     if scope == 'friends':
         if 'user_id' not in session:
              return jsonify({'error': 'Unauthorized'}), 401
         
-        current_user = users.find_one({'_id': ObjectId(session['user_id'])})
+        current_user = UserDB.get_user_view(session['user_id'], 'relations')
         if not current_user:
             return jsonify({'error': 'User not found'}), 404
-            
-        # Get friend IDs
-        friend_ids = current_user.get('friends', [])
-        # Add current user to list (so they see themselves vs friends)
-        friend_ids.append(ObjectId(session['user_id']))
-        query['_id'] = {'$in': friend_ids}
-
-    # Select children accounts
-    top = list(users.find(query).sort('earned_game_time', -1).limit(20))
-    out = []
-    for u in top:
-        out.append({
-            'id': str(u['_id']),
-            'name': u.get('name', ''),
-            'earned_game_time': int(u.get('earned_game_time', 0)),
-            'daily_screen_time_limit': int(u.get('daily_screen_time_limit', 0))
-        })
-    return jsonify({'leaderboard': out}), 200
+
+        # The current user is included so they see themselves vs friends
+        out = leaderboard.friends(session['user_id'], current_user.get('friends', []))
+        if session.get('account_type') == 'child':
+            position = next((i + 1 for i, row in enumerate(out) if row['id'] == session['user_id']), None)
+            me = {'rank': position, 'total': len(out)}
+    else:
+        out = leaderboard.top(scope, 20)
+        if session.get('account_type') == 'child':
+            me = leaderboard.rank(session['user_id'], scope)
+
+    return jsonify({'leaderboard': out, 'scope': scope, 'me': me}), 200
 
 
 # ------------------------
@@ -1383,6 +1234,7 @@ def api_get_challenge_templates():
     return jsonify({'templates': templates}), 200
 
 @app.route('/api/challenges', methods=['GET'])
+@conditional(lambda: counter_tag('challenges', session.get('user_id'), session.get('account_type')))
 def api_get_challenges():
     """Return list of challenges; include whether current user has unlocked each."""
     db = get_db()
@@ -1424,6 +1276,7 @@ def api_get_challenges():
             'description': ch.get('description'),
             'reward_minutes': int(ch.get('reward_minutes', 0)),
             'image_url': ch.get('image_url'),
+            'image': ch.get('image'),
             'task': ch.get('task', {}),
             'is_unlocked': unlocked,
             'assigned_children': [str(x) for x in (ch.get('assigned_children') or [])],
@@ -1517,6 +1370,7 @@ def api_admin_create_challenge():
     }
     try:
         res = challenges.insert_one(doc)
+        bump_counter('challenges')
         return jsonify({'success': True, 'challenge_id': str(res.inserted_id)}), 201
     except Exception as e:
         logger.exception('Error creating challenge: %s', e)
@@ -1540,6 +1394,7 @@ def api_admin_assign_challenge(challenge_id):
     challenges = db['challenges']
     try:
         challenges.update_one({'_id': ObjectId(challenge_id)}, {'$set': {'visible_to_children': make_visible}, '$addToSet': {'assigned_children': {'$each': children}}})
+        bump_counter('challenges')
         return jsonify({'success': True}), 200
     except Exception as e:
         logger.exception('Error assigning challenge: %s', e)
@@ -1568,15 +1423,22 @@ def api_admin_update_challenge(challenge_id):
     challenges = db['challenges']
     try:
         challenges.update_one({'_id': ObjectId(challenge_id)}, {'$set': updates})
+        bump_counter('challenges')
         return jsonify({'success': True}), 200
     except Exception as e:
         logger.exception('Error updating challenge: %s', e)
         return jsonify({'error': 'Server error'}), 500
 
 
+# Challenge images and other public media, stored by content hash (core/blob_store.py)
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+MEDIA_STORE = BlobStore(pathlib.Path(__file__).parent / 'media')
+MEDIA_MAX_AGE = 365 * 24 * 3600
+
+
 @app.route('/api/challenges/<challenge_id>/upload-image', methods=['POST'])
 def api_challenge_upload_image(challenge_id):
-    """Upload an image file for a challenge. Stores in static/uploads and sets image_url."""
+    """Upload an image file for a challenge. Stores it and its resized variants in the media store."""
     if 'user_id' not in session or session.get('account_type') != 'parent':
         return jsonify({'error': 'Unauthorized'}), 401
 
@@ -1586,23 +1448,39 @@ def api_challenge_upload_image(challenge_id):
     if f.filename == '':
         return jsonify({'error': 'No selected file'}), 400
 
-    from werkzeug.utils import secure_filename
-    upload_dir = os.path.join(os.path.dirname(__file__), 'static', 'uploads')
-    os.makedirs(upload_dir, exist_ok=True)
-    filename = secure_filename(f.filename)
-    dest = os.path.join(upload_dir, filename)
+    file_ext = pathlib.Path(f.filename).suffix.lower()
+    if file_ext not in IMAGE_EXTENSIONS:
+        return jsonify({'error': 'Unsupported image type'}), 400
+
     try:
-        f.save(dest)
-        url_path = f'/static/uploads/{filename}'
+        blob = MEDIA_STORE.save_stream(f.stream, file_ext)
+        try:
+            image = image_variants.build_variants(blob.path, MEDIA_STORE)
+        except image_variants.InvalidImage:
+            if blob.created:
+                blob.path.unlink(missing_ok=True)
+            return jsonify({'error': 'Could not read image'}), 400
+        url_path = f'/media/{blob.name}'
         db = get_db()
         challenges = db['challenges']
-        challenges.update_one({'_id': ObjectId(challenge_id)}, {'$set': {'image_url': url_path}})
-        return jsonify({'success': True, 'image_url': url_path}), 200
+        challenges.update_one({'_id': ObjectId(challenge_id)}, {'$set': {'image_url': url_path, 'image': image}})
+        bump_counter('challenges')
+        return jsonify({'success': True, 'image_url': url_path, 'image': image}), 200
     except Exception as e:
         logger.exception('Error saving uploaded image: %s', e)
         return jsonify({'error': 'Server error'}), 500
 
 
+@app.route('/media/<name>')
+def media_file(name):
+    """Serve a stored media blob. Names are content hashes, so responses never change."""
+    if not MEDIA_STORE.exists(name):
+        return jsonify({'error': 'Not found'}), 404
+    response = send_file(MEDIA_STORE.path_for(name), etag=name.split('.')[0], max_age=MEDIA_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={MEDIA_MAX_AGE}, immutable'
+    return response
+
+
 @app.route('/api/child-friends/<child_id>', methods=['GET'])
 def api_get_child_friends(child_id):
     """Get a child's friends list. Parent can view their child's friends."""
@@ -1623,22 +1501,21 @@ def api_get_child_friends(child_id):
     users = db['users']
     
     try:
-        child = users.find_one({'_id': ObjectId(child_id)})
+        child = UserDB.get_user_view(child_id, 'relations')
         if not child:
             return jsonify({'error': 'Child not found'}), 404
         
+        friend_ids = child.get('friends', [])
+        friend_users = UserDB.get_users_by_ids(friend_ids, 'identity')
         friends = []
-        for friend_id in child.get('friends', []):
-            try:
-                friend_user = users.find_one({'_id': friend_id})
-                if friend_user:
-                    friends.append({
-                        'id': str(friend_user['_id']),
-                        'name': friend_user.get('name', 'Unknown'),
-                        'email': friend_user.get('email', '')
-                    })
-            except Exception:
-                pass
+        for friend_id in friend_ids:
+            friend_user = friend_users.get(str(friend_id))
+            if friend_user:
+                friends.append({
+                    'id': str(friend_user['_id']),
+                    'name': friend_user.get('name', 'Unknown'),
+                    'email': friend_user.get('email', '')
+                })
         
         return jsonify({'friends': friends}), 200
     except Exception as e:
@@ -1665,19 +1542,23 @@ def api_remove_friend():
     try:
         if session.get('account_type') == 'parent' and child_id:
             # verify parent owns child
-            parent = users.find_one({'_id': ObjectId(session['user_id'])})
+            parent = UserDB.get_user_view(session['user_id'], 'relations')
             children = [str(c) for c in parent.get('children', [])]
             if child_id not in children:
                 return jsonify({'error': 'Not authorized for this child'}), 403
             # remove friend relationship between child and friend_id
             users.update_one({'_id': ObjectId(child_id)}, {'$pull': {'friends': ObjectId(friend_id)}})
             users.update_one({'_id': ObjectId(friend_id)}, {'$pull': {'friends': ObjectId(child_id)}})
+            UserDB.invalidate_cached_user(child_id)
+            UserDB.invalidate_cached_user(friend_id)
             return jsonify({'success': True}), 200
         else:
             # child removing their own friend
             uid = session['user_id']
             users.update_one({'_id': ObjectId(uid)}, {'$pull': {'friends': ObjectId(friend_id)}})
             users.update_one({'_id': ObjectId(friend_id)}, {'$pull': {'friends': ObjectId(uid)}})
+            UserDB.invalidate_cached_user(uid)
+            UserDB.invalidate_cached_user(friend_id)
             return jsonify({'success': True}), 200
     except Exception as e:
         logger.exception('Error removing friend: %s', e)
@@ -1697,20 +1578,18 @@ def api_parent_challenge_approvals():
     users = db['users']
     reqs = db['challenge_unlock_requests']
 
-    parent = users.find_one({'_id': ObjectId(session['user_id'])})
+    parent = UserDB.get_user_view(session['user_id'], 'relations')
     children = [str(c) for c in parent.get('children', [])]
 
     pending = list(reqs.find({'status': 'pending', 'user_id': {'$in': children}}))
+    child_users = UserDB.get_users_by_ids([p['user_id'] for p in pending], 'identity')
     out = []
     for p in pending:
         # Resolve child name
         child_name = 'Unknown Child'
-        try:
-            c_user = users.find_one({'_id': ObjectId(p['user_id'])})
-            if c_user:
-                child_name = c_user.get('name', 'Unknown')
-        except Exception:
-            pass
+        c_user = child_users.get(str(p['user_id']))
+        if c_user:
+            child_name = c_user.get('name', 'Unknown')
             
         out.append({
             'id': str(p['_id']),
@@ -1799,19 +1678,17 @@ def api_parent_challenge_completion_requests():
     users = db['users']
     reqs = db['challenge_completion_requests']
 
-    parent = users.find_one({'_id': ObjectId(session['user_id'])})
+    parent = UserDB.get_user_view(session['user_id'], 'relations')
     children = [str(c) for c in parent.get('children', [])]
 
     pending = list(reqs.find({'status': 'pending', 'user_id': {'$in': children}}))
+    child_users = UserDB.get_users_by_ids([p['user_id'] for p in pending], 'identity')
     out = []
     for p in pending:
         child_name = 'Unknown Child'
-        try:
-            c_user = users.find_one({'_id': ObjectId(p['user_id'])})
-            if c_user:
-                child_name = c_user.get('name', 'Unknown')
-        except Exception:
-            pass
+        c_user = child_users.get(str(p['user_id']))
+        if c_user:
+            child_name = c_user.get('name', 'Unknown')
         out.append({'id': str(p['_id']), 'user_id': p['user_id'], 'child_name': child_name, 'challenge_id': p['challenge_id'], 'created_at': p.get('created_at').isoformat()})
     return jsonify({'requests': out}), 200
 
@@ -1843,7 +1720,7 @@ def api_parent_respond_challenge_completion():
             return jsonify({'error': 'Request not found'}), 404
 
         # Verify parent owns child
-        parent = users.find_one({'_id': ObjectId(session['user_id'])})
+        parent = UserDB.get_user_view(session['user_id'], 'relations')
         children = [str(c) for c in parent.get('children', [])]
         if r.get('user_id') not in children:
             return jsonify({'error': 'Not authorized'}), 403
@@ -1898,7 +1775,7 @@ def api_respond_challenge_unlock():
             return jsonify({'error': 'Request not found'}), 404
 
         # Verify parent owns child
-        parent = users.find_one({'_id': ObjectId(session['user_id'])})
+        parent = UserDB.get_user_view(session['user_id'], 'relations')
         children = [str(c) for c in parent.get('children', [])]
         if r.get('user_id') not in children:
             return jsonify({'error': 'Not authorized'}), 403
@@ -1910,6 +1787,7 @@ def api_respond_challenge_unlock():
         # Approve: create unlock record and mark request approved
         reqs.update_one({'_id': ObjectId(req_id)}, {'$set': {'status': 'approved', 'responded_at': datetime.utcnow()}})
         unlocks.insert_one({'user_id': r.get('user_id'), 'challenge_id': r.get('challenge_id'), 'unlocked_at': datetime.utcnow()})
+        bump_counter('challenges')
         return jsonify({'success': True}), 200
     except Exception as e:
         logger.exception('Error responding to challenge unlock: %s', e)
@@ -2072,6 +1950,7 @@ def api_parent_assign_template_challenge():
                 'created_at': datetime.utcnow()
             }
             challenges.insert_one(doc)
+        bump_counter('challenges')
         
         logger.info(f"Parent {session['user_id']} assigned template {template_id} to {len(child_ids)} children with reward {reward_minutes} min")
         return jsonify({'success': True, 'message': f'Challenge assigned to {len(child_ids)} child(ren)'}), 201
@@ -2092,19 +1971,23 @@ def api_get_friends():
     users = db['users']
     friend_requests = db['friend_requests']
 
-    user = users.find_one({'_id': ObjectId(session['user_id'])})
-    friends = []
-    if user:
-        for f in user.get('friends', []):
-            try:
-                fu = users.find_one({'_id': f})
-                if fu:
-                    friends.append({'id': str(fu['_id']), 'name': fu.get('name'), 'email': fu.get('email'), 'status': 'friend'})
-            except Exception:
-                pass
+    user = UserDB.get_user_view(session['user_id'], 'relations')
+    friend_ids = user.get('friends', []) if user else []
 
     # include outgoing requests with approval status
     outgoing = list(friend_requests.find({'from_user_id': session['user_id'], 'status': 'pending'}))
+
+    # Resolve friends and every parent named on the requests in one query
+    referenced_ids = list(friend_ids)
+    for r in outgoing:
+        referenced_ids += r.get('required_approvals', []) + r.get('approvals', [])
+    names = UserDB.get_users_by_ids(referenced_ids, 'identity')
+
+    friends = []
+    for f in friend_ids:
+        fu = names.get(str(f))
+        if fu:
+            friends.append({'id': str(fu['_id']), 'name': fu.get('name'), 'email': fu.get('email'), 'status': 'friend'})
     outgoing_fmt = []
     for r in outgoing:
         req_info = {
@@ -2117,29 +2000,14 @@ def api_get_friends():
         approved_parent_ids = r.get('approvals', [])
         
         # Resolve parent names for display
-        required_parents = []
-        for parent_id in required_parent_ids:
-            try:
-                par = users.find_one({'_id': ObjectId(parent_id)})
-                if par:
-                    required_parents.append({
-                        'id': parent_id,
-                        'name': par.get('name', 'Parent')
-                    })
-            except Exception:
-                pass
-        
-        approved_parents = []
-        for parent_id in approved_parent_ids:
-            try:
-                par = users.find_one({'_id': ObjectId(parent_id)})
-                if par:
-                    approved_parents.append({
-                        'id': parent_id,
-                        'name': par.get('name', 'Parent')
-                    })
-            except Exception:
-                pass
+        required_parents = [
+            {'id': parent_id, 'name': names[str(parent_id)].get('name', 'Parent')}
+            for parent_id in required_parent_ids if str(parent_id) in names
+        ]
+        approved_parents = [
+            {'id': parent_id, 'name': names[str(parent_id)].get('name', 'Parent')}
+            for parent_id in approved_parent_ids if str(parent_id) in names
+        ]
         
         req_info['required_parents'] = required_parents
         req_info['approved_parents'] = approved_parents
@@ -2195,14 +2063,14 @@ def api_update_child_limits(child_id):
     weekly_limit = data.get('weekly_limit')
 
     # Fetch current child limits to produce notifications
-    child_before = UserDB.get_user_by_id(child_id)
+    child_before = UserDB.get_user_view(child_id, 'daily_screen_time_limit', 'weekly_screen_time_limit')
     old_daily = child_before.get('daily_screen_time_limit') if child_before else None
     old_weekly = child_before.get('weekly_screen_time_limit') if child_before else None
     
     success = UserDB.update_child_screen_time_limit(child_id, daily_limit, weekly_limit)
     if success:
         # Create messages for any changes
-        parent = UserDB.get_user_by_id(session['user_id'])
+        parent = UserDB.get_user_view(session['user_id'], 'identity')
         parent_name = parent.get('name', 'Your Parent') if parent else 'Your Parent'
         now = datetime.utcnow()
 
@@ -2247,7 +2115,7 @@ def api_control_timer(child_id):
     
     # Get who is controlling the timer
     if is_parent:
-        controller = UserDB.get_user_by_id(session['user_id'])
+        controller = UserDB.get_user_view(session['user_id'], 'identity')
         controller_name = controller.get('name', 'Your Parent') if controller else 'Your Parent'
         controller_type = 'parent'
     else:
@@ -2255,58 +2123,37 @@ def api_control_timer(child_id):
         controller_type = 'child'
 
     if action == 'start':
-        success = UserDB.set_timer_state(child_id, True, now)
+        msg = f"Timer started by {controller_name} at {now.strftime('%Y-%m-%d %H:%M:%S UTC')}"
+        success = UserDB.start_timer(child_id, now, controller_name, msg)
         if success:
-            msg = f"Timer started by {controller_name} at {now.strftime('%Y-%m-%d %H:%M:%S UTC')}"
-            UserDB.add_parent_message(child_id, controller_name, msg, 0)
             return jsonify({'success': True}), 200
         else:
             return jsonify({'error': 'Failed to start timer'}), 500
 
-    # stop action
-    child = UserDB.get_user_by_id(child_id)
-    started_at = child.get('timer_started_at') if child else None
-    if not started_at:
-        # Nothing to stop
-        UserDB.set_timer_state(child_id, False, None)
-        msg = f"Timer stopped by {controller_name} at {now.strftime('%Y-%m-%d %H:%M:%S UTC')} (no running timer found)"
-        UserDB.add_parent_message(child_id, controller_name, msg, 0)
-        return jsonify({'success': True, 'minutes_recorded': 0}), 200
-
-    # calculate elapsed time with precision to 0.01 minutes (0.6 seconds)
-    try:
-        if isinstance(started_at, str):
-            started_dt = datetime.fromisoformat(started_at)
-        else:
-            started_dt = started_at
-    except Exception:
-        started_dt = None
-
-    if not started_dt:
-        UserDB.set_timer_state(child_id, False, None)
-        msg = f"Timer stopped by {controller_name} at {now.strftime('%Y-%m-%d %H:%M:%S UTC')} (invalid start time)"
-        UserDB.add_parent_message(child_id, controller_name, msg, 0)
-        return jsonify({'success': True, 'minutes_recorded': 0}), 200
+    # stop action: charge elapsed time, clear the timer and notify in one write
+    result = UserDB.stop_timer(
+        child_id,
+        now,
+        controller_name,
+        f"Timer stopped by {controller_name} at {now.strftime('%Y-%m-%d %H:%M:%S UTC')}"
+    )
+    return _stop_timer_response(result)
 
-    elapsed_seconds = (now - started_dt).total_seconds()
-    # Convert to decimal minutes with precision to 2 decimal places (0.01 minutes = 0.6 seconds)
-    # This captures fractional minutes accurately (e.g., 15 seconds = 0.25 minutes)
-    minutes_used = max(0, round(elapsed_seconds / 60.0, 2))
-    
-    # For display purposes, show minutes and remaining seconds
-    total_seconds = int(elapsed_seconds)
-    display_minutes = total_seconds // 60
-    display_seconds = total_seconds % 60
 
-    # Record used time and clear timer
-    UserDB.use_game_time(child_id, minutes_used)
-    UserDB.set_timer_state(child_id, False, None)
+# stop_timer() reasons for which the timer may still be running and nothing was charged
+TIMER_STOP_FAILURES = ('update failed', 'db unavailable')
 
-    time_display = f"{display_minutes}m {display_seconds}s" if display_seconds > 0 else f"{display_minutes}m"
-    msg = f"Timer stopped by {controller_name} at {now.strftime('%Y-%m-%d %H:%M:%S UTC')}. Recorded {time_display} ({minutes_used} min)."
-    UserDB.add_parent_message(child_id, controller_name, msg, 0)
 
-    return jsonify({'success': True, 'minutes_recorded': minutes_used}), 200
+def _stop_timer_response(result):
+    """JSON response for a UserDB.stop_timer() result."""
+    reason = result.get('reason')
+    if reason in TIMER_STOP_FAILURES:
+        return jsonify({'error': 'Failed to stop timer', 'reason': reason}), 500
+    body = {'success': True, 'minutes_recorded': result.get('minutes_recorded', 0)}
+    if reason:
+        # e.g. 'timer already stopped': nothing more to charge
+        body['reason'] = reason
+    return jsonify(body), 200
 
 
 
@@ -2328,7 +2175,7 @@ def api_add_earned_time(child_id):
 
     # Always add a notification when bonus time is granted
     if success:
-        parent = UserDB.get_user_by_id(session.get('user_id'))
+        parent = UserDB.get_user_view(session.get('user_id'), 'identity')
         parent_name = parent.get('name', 'Your Parent') if parent else 'Your Parent'
         
         # If no message provided, create a default one
@@ -2341,7 +2188,7 @@ def api_add_earned_time(child_id):
 
     if success:
         # Return updated values so the client can update UI without a reload
-        child = UserDB.get_user_by_id(child_id)
+        child = UserDB.get_user_view(child_id, 'balance')
         limit = int(child.get('daily_screen_time_limit', 60))
         daily_earned_today = int(child.get('daily_earned_minutes_today', 0) or 0)
         earned = limit + daily_earned_today
@@ -2375,49 +2222,14 @@ def api_control_my_timer():
     now = datetime.utcnow()
 
     if action == 'start':
-        success = UserDB.set_timer_state(child_id, True, now)
+        success = UserDB.start_timer(child_id, now, 'Self', f'Timer started by child at {now.strftime("%Y-%m-%d %H:%M:%S UTC")}')
         if success:
-            UserDB.add_parent_message(child_id, 'Self', f'Timer started by child at {now.strftime("%Y-%m-%d %H:%M:%S UTC")}', 0)
             return jsonify({'success': True}), 200
         return jsonify({'error': 'Failed to start timer'}), 500
 
     # stop
-    child = UserDB.get_user_by_id(child_id)
-    started_at = child.get('timer_started_at') if child else None
-    if not started_at:
-        UserDB.set_timer_state(child_id, False, None)
-        UserDB.add_parent_message(child_id, 'Self', f'Timer stopped by child at {now.strftime("%Y-%m-%d %H:%M:%S UTC")} (no running timer found)', 0)
-        return jsonify({'success': True, 'minutes_recorded': 0}), 200
-
-    try:
-        if isinstance(started_at, str):
-            started_dt = datetime.fromisoformat(started_at)
-        else:
-            started_dt = started_at
-    except Exception:
-        started_dt = None
-
-    if not started_dt:
-        UserDB.set_timer_state(child_id, False, None)
-        UserDB.add_parent_message(child_id, 'Self', f'Timer stopped by child at {now.strftime("%Y-%m-%d %H:%M:%S UTC")} (invalid start time)', 0)
-        return jsonify({'success': True, 'minutes_recorded': 0}), 200
-
-    elapsed_seconds = (now - started_dt).total_seconds()
-    # Convert to decimal minutes with precision to 2 decimal places (0.01 minutes = 0.6 seconds)
-    minutes_used = max(0, round(elapsed_seconds / 60.0, 2))
-    
-    # For display purposes
-    total_seconds = int(elapsed_seconds)
-    display_minutes = total_seconds // 60
-    display_seconds = total_seconds % 60
-
-    UserDB.use_game_time(child_id, minutes_used)
-    UserDB.set_timer_state(child_id, False, None)
-    
-    time_display = f"{display_minutes}m {display_seconds}s" if display_seconds > 0 else f"{display_minutes}m"
-    UserDB.add_parent_message(child_id, 'Self', f'Timer stopped by child at {now.strftime("%Y-%m-%d %H:%M:%S UTC")}. Recorded {time_display} ({minutes_used} min).', 0)
-
-    return jsonify({'success': True, 'minutes_recorded': minutes_used}), 200
+    result = UserDB.stop_timer(child_id, now, 'Self', f'Timer stopped by child at {now.strftime("%Y-%m-%d %H:%M:%S UTC")}')
+    return _stop_timer_response(result)
 
 
 @app.route('/api/get-child-balance/<child_id>', methods=['GET'])
@@ -2433,7 +2245,7 @@ def api_get_child_balance(child_id):
         # ignore reset failures and continue to return current values
         pass
 
-    child = UserDB.get_user_by_id(child_id)
+    child = UserDB.get_user_view(child_id, 'balance')
     if not child:
         return jsonify({'error': 'Child not found'}), 404
 
@@ -2466,7 +2278,7 @@ def api_child_time_used(child_id):
     except Exception:
         pass
 
-    child = UserDB.get_user_by_id(child_id)
+    child = UserDB.get_user_view(child_id, 'balance')
     if not child:
         return jsonify({'error': 'Child not found'}), 404
 
@@ -2485,31 +2297,49 @@ def api_child_time_used(child_id):
 
 
 @app.route('/api/get-parent-messages', methods=['GET'])
+@conditional(lambda: user_state_tag(session.get('user_id'), request.args.get('before'), request.args.get('limit')))
 def api_get_parent_messages():
     """API endpoint to get parent messages for the logged-in child"""
     if 'user_id' not in session or session.get('account_type') != 'child':
         return jsonify({'error': 'Unauthorized'}), 401
     
-    messages = UserDB.get_parent_messages(session['user_id'])
-    return jsonify({'messages': messages}), 200
+    before = request.args.get('before') or None
+    try:
+        limit = min(PARENT_MESSAGES_LIMIT, max(1, int(request.args.get('limit', 20))))
+    except (TypeError, ValueError):
+        limit = 20
 
+    page = UserDB.get_parent_messages(session['user_id'], before=before, limit=limit)
+    return jsonify(page), 200
 
-@app.route('/api/gametime-balance', methods=['GET'])
-def api_gametime_balance():
-    """API endpoint to get current user's game time balance"""
-    if 'user_id' not in session:
+
+@app.route('/api/parent-messages/read', methods=['POST'])
+def api_mark_parent_messages_read():
+    """Mark one parent message (by id) or all of them as read for the logged-in child"""
+    if 'user_id' not in session or session.get('account_type') != 'child':
         return jsonify({'error': 'Unauthorized'}), 401
-    
+
+    data = request.get_json(silent=True) or {}
+    message_id = data.get('id')
+    if message_id:
+        UserDB.mark_message_as_read(session['user_id'], str(message_id))
+    else:
+        UserDB.mark_all_messages_read(session['user_id'])
+    return jsonify({'success': True}), 200
+
+
+def _gametime_balance_payload(user_id):
+    """Today's balance, timer and streak summary for a child, or None if the user is missing."""
     # Reset daily used time on first read each day
     try:
-        UserDB.reset_daily_used_if_needed(session['user_id'])
+        UserDB.reset_daily_used_if_needed(user_id)
     except Exception:
         # ignore reset errors and continue
         pass
 
-    user = UserDB.get_user_by_id(session['user_id'])
+    user = UserDB.get_user_view(user_id, 'balance', 'streak')
     if not user:
-        return jsonify({'error': 'User not found'}), 404
+        return None
 
     # Calculate TODAY's available time
     # Get base daily limit (fixed) and today's earned minutes (tracked in database)
@@ -2518,11 +2348,11 @@ def api_gametime_balance():
     total_available = limit + daily_earned_today  # Total available time for today
     
     # Include running timer elapsed minutes in used
-    used = UserDB.get_current_used_including_running(session['user_id'])
+    used = UserDB.get_current_used_including_running(user_id)
     balance = max(0, total_available - used)
     
-    # Calculate current streak from activity_dates
-    streak_count = UserDB.calculate_current_streak(session['user_id'])
+    # Current streak, read from the stored streak_state
+    streak_count = UserDB.calculate_current_streak(user_id)
     
     # Get parent's streak settings for display calculations
     parent_id = user.get('parent_id')
@@ -2533,7 +2363,7 @@ def api_gametime_balance():
         except Exception:
             pass
 
-    return jsonify({
+    return {
         'earned': total_available,  # Total available for today (base + earned)
         'used': used,
         'balance': balance,
@@ -2542,7 +2372,171 @@ def api_gametime_balance():
         'timer_started_at': user.get('timer_started_at'),
         'streak_count': streak_count,
         'streak_settings': streak_settings
-    }), 200
+    }
+
+
+@app.route('/api/gametime-balance', methods=['GET'])
+@conditional(lambda: user_state_tag(session.get('user_id')))
+def api_gametime_balance():
+    """API endpoint to get current user's game time balance"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    payload = _gametime_balance_payload(session['user_id'])
+    if payload is None:
+        return jsonify({'error': 'User not found'}), 404
+    return jsonify(payload), 200
+
+
+LIVE_HEARTBEAT_SECONDS = int(os.getenv('LIVE_HEARTBEAT_SECONDS', '15'))
+# Streams end after this long; EventSource reconnects (re-checking the session)
+LIVE_STREAM_MAX_SECONDS = int(os.getenv('LIVE_STREAM_MAX_SECONDS', '300'))
+# Each open stream holds a gunicorn thread; past this many per process new streams get 503 and the
+# page keeps polling, so ordinary requests always have threads left (the Dockerfile runs 32 per worker)
+LIVE_MAX_STREAMS = int(os.getenv('LIVE_MAX_STREAMS', '16'))
+_live_stream_slots = threading.BoundedSemaphore(LIVE_MAX_STREAMS)
+
+
+def _live_versions(user_ids):
+    """Current state_version, timer state and unread count for each user, in one query."""
+    return {
+        uid: (doc.get('state_version', 0), doc.get('timer_running', False), doc.get('timer_started_at'),
+              doc.get('unread_message_count'))
+        for uid, doc in UserDB.get_users_by_ids(
+            user_ids, 'state_version', 'timer_running', 'timer_started_at', 'unread_message_count'
+        ).items()
+    }
+
+
+def _live_updates(user_id, is_parent, channels):
+    """Generate SSE frames for a child (own channel) or a parent (their children's channels).
+
+    Runs outside the request context on purpose: every read goes to MongoDB
+    instead of the request-scoped user cache, which would go stale.
+    """
+    sub = live_events.subscribe(channels)
+    deadline = time.monotonic() + LIVE_STREAM_MAX_SECONDS
+    last_balance = [None]
+
+    def frame(event, data):
+        return live_events.format_sse(event, app.json.dumps(data))
+
+    def balance_frame(channel):
+        if is_parent:
+            # The parent dashboard re-reads its own per-child summary
+            return frame('balance', {'child_id': channel})
+        payload = _gametime_balance_payload(channel)
+        if payload is None or payload == last_balance[0]:
+            return None
+        last_balance[0] = payload
+        return frame('balance', payload)
+
+    def timer_frame(channel, running, started_at):
+        return frame('timer', {'child_id': channel, 'timer_running': bool(running), 'timer_started_at': started_at})
+
+    try:
+        yield f"retry: {LIVE_HEARTBEAT_SECONDS * 1000}\n\n"
+        versions = _live_versions(channels)
+        for channel in channels:
+            if is_parent and channel in versions:
+                _, running, started_at, _ = versions[channel]
+                yield timer_frame(channel, running, started_at)
+            elif not is_parent:
+                initial = balance_frame(channel)
+                if initial:
+                    yield initial
+
+        def catch_up(pushed_timers=(), pushed_messages=(), pushed_balances=()):
+            """Frames for writes made by other workers since the last check, skipping what was just pushed."""
+            nonlocal versions
+            current = _live_versions(channels)
+            frames = []
+            for channel, state in current.items():
+                previous = versions.get(channel)
+                if previous is None or previous[0] == state[0]:
+                    continue
+                if previous[1:3] != state[1:3] and channel not in pushed_timers:
+                    frames.append(timer_frame(channel, state[1], state[2]))
+                if not is_parent and previous[3] != state[3] and channel not in pushed_messages:
+                    frames.append(frame('message', None))
+                if channel not in pushed_balances:
+                    update = balance_frame(channel)
+                    if update:
+                        frames.append(update)
+            versions = current
+            return frames
+
+        while time.monotonic() < deadline:
+            event = sub.get(timeout=LIVE_HEARTBEAT_SECONDS)
+            if event is not None and not sub.overflowed:
+                # Coalesce a burst of balance events into one snapshot
+                pending = [event]
+                while True:
+                    more = sub.get(timeout=0)
+                    if more is None:
+                        break
+                    pending.append(more)
+                balance_channels, timer_channels, message_channels = [], set(), set()
+                for item in pending:
+                    channel = item['channel']
+                    if item['event'] == 'timer':
+                        data = item['data'] or {}
+                        timer_channels.add(channel)
+                        yield timer_frame(channel, data.get('timer_running'), data.get('timer_started_at'))
+                    elif item['event'] == 'message' and not is_parent:
+                        message_channels.add(channel)
+                        yield frame('message', item['data'])
+                    elif item['event'] == 'balance' and channel not in balance_channels:
+                        balance_channels.append(channel)
+                for channel in balance_channels:
+                    update = balance_frame(channel)
+                    if update:
+                        yield update
+                # Move the versions past what was pushed, so the next check does not send it again, and
+                # pick up other workers' writes even while pushes keep the stream busy
+                for update in catch_up(timer_channels, message_channels, balance_channels):
+                    yield update
+                continue
+
+            # Idle (or we fell behind): catch up with writes made by other workers
+            sub.overflowed = False
+            frames = catch_up()
+            for update in frames:
+                yield update
+            if not frames:
+                yield ': ping\n\n'
+    finally:
+        sub.close()
+
+
+@app.route('/api/events', methods=['GET'])
+def api_events():
+    """Server-Sent Events: balance, timer and parent message updates for the logged-in user"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    user_id = session['user_id']
+    is_parent = session.get('account_type') == 'parent'
+    if is_parent:
+        parent = UserDB.get_user_view(user_id, 'relations') or {}
+        channels = [str(c) for c in parent.get('children', [])]
+    else:
+        channels = [user_id]
+
+    if not _live_stream_slots.acquire(blocking=False):
+        # The dashboards fall back to polling and retry the stream later
+        response = jsonify({'error': 'Too many live streams', 'poll': True})
+        response.headers['Retry-After'] = str(LIVE_STREAM_MAX_SECONDS // 5)
+        return response, 503
+
+    response = Response(
+        _live_updates(user_id, is_parent, channels),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Released when the response closes, even if the stream never started
+    response.call_on_close(_live_stream_slots.release)
+    return response
 
 
 @app.route('/api/update-child-streak/<child_id>', methods=['POST'])
@@ -2563,7 +2557,7 @@ def api_update_child_streak(child_id):
         
         if result.get('applied'):
             # Create notification message
-            parent = UserDB.get_user_by_id(session['user_id'])
+            parent = UserDB.get_user_view(session['user_id'], 'identity')
             parent_name = parent.get('name', 'Your Parent') if parent else 'Your Parent'
             streak = result.get('streak_count', 0)
             reward = result.get('reward_minutes', 0)
@@ -2642,7 +2636,7 @@ def api_apply_earned_strava(child_id):
         return jsonify({'error': 'Child not found or not owned by parent'}), 403
 
     # Get Strava headers for the child
-    child = UserDB.get_user_by_id(child_id)
+    child = UserDB.get_user_view(child_id, 'strava')
     if not child:
         return jsonify({'error': 'Child not found'}), 404
 
@@ -2653,178 +2647,47 @@ def api_apply_earned_strava(child_id):
     if not headers:
         return jsonify({'error': 'Failed to obtain Strava token for child'}), 500
 
-    # Fetch recent activities for the child
+    # Fetch the child's activities since the last sync (the latest page on the first one)
     request_data = request.get_json(silent=True) or {}
     per_page = request_data.get('per_page', 10) if request.is_json else request.form.get('per_page', 10)
     try:
-        params = {'per_page': int(per_page), 'page': 1}
+        per_page = int(per_page)
     except Exception:
-        params = {'per_page': 10, 'page': 1}
+        per_page = 10
+    sync_state = child.get('strava_sync')
 
-    resp = requests.get(f'{STRAVA_API_URL}/athlete/activities', headers=headers, params=params)
-    if resp.status_code != 200:
-        return jsonify({'error': 'Failed to fetch activities from Strava', 'status': resp.status_code}), 502
+    try:
+        activities, error_status = strava_sync.fetch_new_activities(headers, sync_state, per_page=per_page)
+    except (StravaUnavailable, RateLimited) as e:
+        return strava_unavailable_response(e)
+    if error_status is not None:
+        return jsonify({'error': 'Failed to fetch activities from Strava', 'status': error_status}), 502
 
-    activities = resp.json()
     db = get_db()
     if db is None:
         return jsonify({'error': 'Database connection failed'}), 500
 
-    activities_collection = db['activities']
-
     total_applied = 0
-    applied_items = []
-    total_streak_rewards = 0
-    parent = UserDB.get_user_by_id(session['user_id'])
+    parent = UserDB.get_user_view(session['user_id'], 'identity')
     parent_name = parent.get('name', 'Your Parent') if parent else 'Your Parent'
 
-    # Helper copied from earlier algorithm for fairness
-    def compute_earned(distance_km, duration_minutes, avg_hr=None, max_hr=None, pace=None, type_label=None):
-        try:
-            d = float(distance_km)
-        except Exception:
-            d = 0.0
-        try:
-            t = float(duration_minutes)
-        except Exception:
-            t = 0.0
-
-        if pace is None:
-            if d > 0:
-                pace_calc = t / d
-            else:
-                pace_calc = 999
-        else:
-            pace_calc = pace
-
-        hr_mul = None
-        try:
-            if avg_hr is not None:
-                avg_hr_f = float(avg_hr)
-                if avg_hr_f < 150:
-                    hr_mul = 1.0
-                elif avg_hr_f > 170:
-                    hr_mul = 2.0
-                else:
-                    hr_mul = 1.5
-        except Exception:
-            hr_mul = None
-
-        pace_bonus = 0.0
-        if pace_calc < 5:
-            pace_bonus = 0.5
-        elif pace_calc < 6.5:
-            pace_bonus = 0.2
-
-        intensity_mul = 1.0
-        if type_label:
-            tl = type_label.lower()
-            if 'run' in tl:
-                intensity_mul = 1.0
-            elif 'ride' in tl:
-                intensity_mul = 0.8
-
-        if hr_mul is not None:
-            earned = (d * hr_mul) + (t * 0.05) + (d * pace_bonus)
-        else:
-            earned = (d * intensity_mul) + (t * 0.03) + (d * pace_bonus)
-
-        return max(1, int(math.floor(earned)))
-
-    from datetime import datetime as dt
-
+    markers = []
     for act in activities:
-        act_id = str(act.get('id'))
-        # Skip if already applied (check activities collection for external_id)
-        existing = activities_collection.find_one({'source': 'strava_applied', 'external_id': act_id, 'user_id': child_id})
-        if existing:
-            continue
-
-        dist_km = round(act.get('distance', 0) / 1000, 2)
-        moving = act.get('moving_time', 0)
-        duration_minutes = moving / 60.0 if moving else 0
-        pace = (moving / 60.0) / dist_km if dist_km > 0 else None
-        avg_hr = act.get('average_heartrate')
-        intensity_label = None
-        try:
-            if avg_hr is not None:
-                avg_hr_f = float(avg_hr)
-                if avg_hr_f < 150:
-                    intensity_label = 'Easy'
-                elif avg_hr_f > 170:
-                    intensity_label = 'Hard'
-                else:
-                    intensity_label = 'Medium'
-        except Exception:
-            intensity_label = None
-
-        if not intensity_label:
-            if pace is not None:
-                if pace < 5:
-                    intensity_label = 'Hard'
-                elif pace < 6.5:
-                    intensity_label = 'Medium'
-                else:
-                    intensity_label = 'Easy'
-            else:
-                intensity_label = 'Medium'
-
-        earned = compute_earned(dist_km, duration_minutes, avg_hr=avg_hr, pace=pace, type_label=act.get('type'))
-
-        # Insert record to mark applied activity
-        try:
-            applied_doc = {
-                'user_id': child_id,
-                'source': 'strava_applied',
-                'external_id': act_id,
-                'title': act.get('name'),
-                'date': act.get('start_date'),
-                'type': act.get('type'),
-                'distance': dist_km,
-                'time_minutes': int(math.ceil(duration_minutes)),
-                'intensity': intensity_label,
-                'earned_minutes': earned,
-                'created_at': dt.utcnow()
-            }
-            insert_result = activities_collection.insert_one(applied_doc)
-
-            # Credit earned minutes to child. Today's activities are tracked as daily-earned;
-            # historical activities go only to the persistent earned pool.
-            try:
-                activity_day = act.get('start_date')
-                if activity_day and 'T' in activity_day:
-                    activity_day = activity_day.split('T')[0]
-                today_str = datetime.utcnow().strftime('%Y-%m-%d')
-                
-                if activity_day == today_str:
-                    UserDB.add_earned_game_time_and_increase_limit(child_id, earned)
-                else:
-                    UserDB.add_earned_game_time(child_id, earned)
-
-                total_applied += earned
-                applied_items.append({'external_id': act_id, 'earned_minutes': earned, 'name': act.get('name')})
-            except Exception:
-                logger.exception('Error crediting earned minutes from Strava activity %s', act_id)
-                try:
-                    activities_collection.delete_one({'_id': insert_result.inserted_id})
-                except Exception:
-                    logger.exception('Failed to roll back applied Strava activity marker %s', act_id)
-                applied_items.append({'external_id': act_id, 'earned_minutes': 0, 'name': act.get('name')})
-                continue
-
-            # Record daily activity for streaks (will only apply once per day)
-            try:
-                activity_day = act.get('start_date')
-                if activity_day and 'T' in activity_day:
-                    activity_day = activity_day.split('T')[0]
-                streak_result = UserDB.record_daily_activity(child_id, activity_date=activity_day, source='strava')
-                if streak_result.get('applied') and isinstance(streak_result.get('reward_minutes', 0), int):
-                    total_streak_rewards += int(streak_result.get('reward_minutes', 0))
-            except Exception:
-                logger.exception('Failed to record streak for activity %s', act_id)
-        except Exception:
-            logger.exception('Failed to apply activity %s for child %s', act_id, child_id)
-            continue
+        metrics = scoring.strava_metrics(act)
+        markers.append(build_applied_marker(child_id, act, metrics['distance_km'], int(math.ceil(metrics['duration_minutes'])),
+                                            metrics['intensity'], metrics['earned_minutes']))
+
+    # Insert all new markers, credit minutes and record streak days in a handful of round trips.
+    # Activities applied earlier are skipped by the dedupe index.
+    result = ingest_applied_markers(child_id, markers, reward_days='all')
+    if result['credit_failed']:
+        logger.error('Error crediting earned minutes from Strava activities for child %s', child_id)
+        applied_items = [{'external_id': m['external_id'], 'earned_minutes': 0, 'name': m.get('title')} for m in markers]
+    else:
+        total_applied = result['credited_minutes']
+        applied_items = [{'external_id': m['external_id'], 'earned_minutes': m['earned_minutes'], 'name': m.get('title')} for m in result['inserted']]
+        strava_sync.record_sync(child_id, activities, sync_state)
+    total_streak_rewards = result['streak_rewards']
 
     # Add a parent message summarizing the applied minutes
     if total_applied > 0:
@@ -2852,10 +2715,10 @@ def health():
     return jsonify({'status': 'healthy'}), 200
 
 
-# --- Manual upload endpoint (saves to uploads/) ---
-ALLOWED_EXTENSIONS = {'.gpx', '.tcx', '.fit'}
+# --- Activity file upload endpoint (stored in uploads/, imported by core/upload_jobs.py) ---
+ALLOWED_EXTENSIONS = set(activity_files.EXTENSIONS)
 UPLOAD_DIR = pathlib.Path(__file__).parent / 'uploads'
-UPLOAD_DIR.mkdir(exist_ok=True)
+UPLOAD_STORE = BlobStore(UPLOAD_DIR)
 
 
 @app.route('/api/upload', methods=['POST'])
@@ -2878,16 +2741,39 @@ def api_upload():
 
     try:
         filename = secure_filename(file.filename)
-        save_path = UPLOAD_DIR / f"{session.get('user_id')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{filename}"
-        file.save(str(save_path))
-        logger.info(f"File uploaded: {save_path}")
-        return jsonify({'success': f'File uploaded: {filename}'}), 200
+        blob = UPLOAD_STORE.save_stream(file.stream, file_ext)
+        logger.info(f"File uploaded: {blob.path} ({'new' if blob.created else 'already stored'})")
     except Exception as e:
         logger.exception('Failed to save uploaded file')
         return jsonify({'error': 'Failed to save file'}), 500
 
+    # Parsing and crediting run on the upload pool; poll the status URL for the outcome
+    job_id = upload_jobs.submit(session['user_id'], blob.path, filename, file_ext, title=request.form.get('title'),
+                                digest=blob.digest)
+    if job_id is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    return jsonify({
+        'success': f'File uploaded: {filename}',
+        'job_id': str(job_id),
+        'status': upload_jobs.QUEUED,
+        'status_url': f'/api/upload/{job_id}'
+    }), 202
+
+
+@app.route('/api/upload/<job_id>', methods=['GET'])
+def api_upload_status(job_id):
+    """API endpoint to check an uploaded file's processing job"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    job = upload_jobs.get_job(job_id, session['user_id'])
+    if job is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(job), 200
+
 
 @app.route('/api/manual-activities', methods=['GET'])
+@conditional(lambda: user_state_tag(session.get('user_id'), request.args.get('page', '1')))
 def api_get_manual_activities():
     """API endpoint to get manual and simulated activities for the current user with pagination"""
     if 'user_id' not in session:
@@ -2908,7 +2794,7 @@ def api_get_manual_activities():
     
     # Count total activities
     total_count = activities_collection.count_documents(
-        {'user_id': session['user_id'], 'source': {'$in': ['manual', 'simulated']}}
+        {'user_id': session['user_id'], 'source': {'$in': ['manual', 'simulated', 'file_upload']}}
     )
     
     # Calculate skip for pagination
@@ -2916,7 +2802,7 @@ def api_get_manual_activities():
     
     # Get activities for this page, sorted by their activity date (not creation date)
     activities = list(activities_collection.find(
-        {'user_id': session['user_id'], 'source': {'$in': ['manual', 'simulated']}}
+        {'user_id': session['user_id'], 'source': {'$in': ['manual', 'simulated', 'file_upload']}}
     ).sort('date', -1).skip(skip).limit(per_page))
     
     # Convert ObjectId to string
@@ -2970,6 +2856,7 @@ def skip_strava():
                 {'_id': ObjectId(session['user_id'])},
                 {'$set': {'skip_strava': True}}
             )
+            UserDB.invalidate_cached_user(session['user_id'])
         
         logger.info(f"User {session['user_id']} skipped Strava connection")
         return jsonify({'success': True}), 200
@@ -3042,12 +2929,8 @@ def api_simulate_activities():
         else:
             duration_minutes = random.randint(15, 120)
 
-        # Calculate earned minutes based on distance and duration
-        base_earned = distance * 2  # 2 minutes per km
-
-        # Intensity multiplier
-        intensity_multiplier = {'Easy': 1.0, 'Medium': 1.5, 'Hard': 2.0}[intensity]
-        earned_minutes = int(base_earned * intensity_multiplier)
+        # Same scoring as real uploads, using the randomly chosen intensity
+        earned_minutes = scoring.earned_minutes(distance, duration_minutes, type_label=activity_type, intensity=intensity)
 
         # Create activities for consecutive days: (count-1) days ago through today
         # day_offset: count-1, count-2, ... 1, 0
@@ -3104,6 +2987,10 @@ def api_simulate_activities():
                 logger.debug("Failed to record daily activity for %s: %s", activity_doc.get('date'), e)
         except Exception:
             logger.exception('Error processing simulated activity for streak/reward')
+
+    if created_count:
+        # Backfilled days may not touch the user document, but the activity list changed
+        UserDB.bump_state_version(session['user_id'])
     
     logger.info(f"Created {created_count} simulated activities for user {session['user_id']} across {count} consecutive days; credited_today={credited_today}")
     return jsonify({'success': True, 'count': created_count, 'credited_minutes': credited_today}), 201
@@ -3151,6 +3038,7 @@ def api_update_account():
 
         from bson import ObjectId
         res = users.update_one({'_id': ObjectId(session['user_id'])}, {'$set': update})
+        UserDB.invalidate_cached_user(session['user_id'])
         if res.matched_count:
             # Reflect name/email changes in session
             if 'name' in update:
@@ -3212,60 +3100,8 @@ def upload_activity():
                 return jsonify({'error': error}), 400
             return render_template('upload_activity.html', error=error)
 
-        # Compute earned minutes using HR-aware algorithm when possible, otherwise fallback
-        def compute_earned_minutes(distance_km, duration_minutes, intensity_label=None, avg_hr=None, max_hr=None, pace_min_per_km=None):
-            # Normalize inputs
-            d = float(distance_km)
-            t = float(duration_minutes)
-
-            # Pace in min/km
-            if pace_min_per_km is None:
-                pace = (t / d) if d > 0 else 999
-            else:
-                pace = pace_min_per_km
-
-            # Heart-rate based multiplier
-            hr_mul = None
-            try:
-                if avg_hr and max_hr:
-                    hr_pct = float(avg_hr) / float(max_hr)
-                    if hr_pct < 0.6:
-                        hr_mul = 1.0
-                    elif hr_pct < 0.75:
-                        hr_mul = 1.5
-                    else:
-                        hr_mul = 2.0
-            except Exception:
-                hr_mul = None
-
-            # Pace bonus: faster pace gives small bonus
-            pace_bonus = 0.0
-            if pace < 5:
-                pace_bonus = 0.5
-            elif pace < 6.5:
-                pace_bonus = 0.2
-
-            # Intensity multiplier fallback
-            intensity_mul = 1.0
-            if intensity_label:
-                label = intensity_label.lower()
-                if label == 'easy':
-                    intensity_mul = 1.0
-                elif label == 'medium':
-                    intensity_mul = 1.5
-                elif label == 'hard':
-                    intensity_mul = 2.0
-
-            # Combine factors. Base on distance with multipliers, plus small contribution from duration
-            if hr_mul is not None:
-                earned = (d * hr_mul) + (t * 0.05) + (d * pace_bonus)
-            else:
-                earned = (d * intensity_mul) + (t * 0.03) + (d * pace_bonus)
-
-            earned_minutes = max(1, int(math.floor(earned)))
-            return earned_minutes
-
-        earned_minutes = compute_earned_minutes(distance, time_minutes_total, intensity_label=intensity)
+        # Manual entries have no heart rate, so the chosen intensity sets the multiplier
+        earned_minutes = scoring.earned_minutes(distance, time_minutes_total, intensity=intensity)
         
         # Store activity in database
         db = get_db()
@@ -3361,7 +3197,7 @@ def api_all_activities_for_streak():
     
     # Get ALL activities for this user (no pagination, sorted newest first)
     activities = list(activities_collection.find(
-        {'user_id': session['user_id'], 'source': {'$in': ['manual', 'simulated']}}
+        {'user_id': session['user_id'], 'source': {'$in': ['manual', 'simulated', 'file_upload']}}
     ).sort('date', -1))
     
     # Convert ObjectId and normalize fields
@@ -3412,7 +3248,7 @@ def api_clear_manual_activities():
     # Delete all manual and simulated activities for this user
     result = activities_collection.delete_many({
         'user_id': session['user_id'],
-        'source': {'$in': ['manual', 'simulated']}
+        'source': {'$in': ['manual', 'simulated', 'file_upload']}
     })
     
     deleted_count = result.deleted_count
@@ -3427,8 +3263,10 @@ def api_clear_manual_activities():
             'earned_game_time': 0,
             'daily_screen_time_limit': 60,  # Reset to default
             'daily_earned_minutes_today': 0
-        }}
+        },
+         '$inc': {'state_version': 1}}
     )
+    UserDB.notify_earned_changed(session['user_id'])
     
     return jsonify({'success': True, 'deleted_count': deleted_count}), 200
 
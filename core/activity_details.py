@@ -0,0 +1,226 @@
+"""
+Cache of Strava activity detail responses.
+
+`/api/activity/<id>` used to call Strava on every click. Details now go
+through `get_detail()`, backed by two layers:
+
+- a process-local LRU (`LRU_SIZE` entries, each trusted for at most
+  `LRU_TTL_SECONDS` so other workers' updates show up quickly)
+- the `activity_details` collection, one document per (user, activity), with
+  the formatted detail, Strava's ETag, `fresh_until` and `expires_at` (a TTL
+  index drops entries after `RETAIN_DAYS`)
+
+A fresh entry (`STRAVA_DETAIL_FRESH_SECONDS`, default 1 hour) is served
+without contacting Strava. A stale one is revalidated with `If-None-Match`.
+If Strava is unreachable or over budget, the stale copy is served instead of
+an error.
+
+The activity list prefetches details for the newest activities as
+`strava_activity_detail` tasks (core/task_queue.py). Webhook updates and
+deletes invalidate the cached entry.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from core import strava_tokens, task_queue
+from core.database import get_db
+from core.strava_client import get_client, StravaUnavailable
+from core.strava_ratelimit import BACKGROUND, INTERACTIVE, RateLimited
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = 'activity_details'
+DETAIL_TASK = 'strava_activity_detail'
+FRESH_SECONDS = int(os.getenv('STRAVA_DETAIL_FRESH_SECONDS', '3600'))
+RETAIN_DAYS = 30
+LRU_SIZE = 512
+LRU_TTL_SECONDS = 60
+PREFETCH_COUNT = 3
+PREFETCH_PRIORITY = 5
+FETCH_WAIT_SECONDS = 30
+
+
+def format_detail(activity):
+    """The fields `/api/activity/<id>` returns for a Strava activity."""
+    return {
+        'id': activity['id'],
+        'name': activity['name'],
+        'type': activity.get('sport_type', activity.get('type')),
+        'distance': round(activity['distance'] / 1000, 2),
+        'moving_time': activity['moving_time'],
+        'elapsed_time': activity['elapsed_time'],
+        'total_elevation_gain': activity.get('total_elevation_gain', 0),
+        'start_date': activity['start_date'],
+        'average_speed': round(activity.get('average_speed', 0) * 3.6, 2),
+        'max_speed': round(activity.get('max_speed', 0) * 3.6, 2),
+        'average_heartrate': activity.get('average_heartrate'),
+        'max_heartrate': activity.get('max_heartrate'),
+        'kilojoules': activity.get('kilojoules'),
+        'average_watts': activity.get('average_watts'),
+        'max_watts': activity.get('max_watts'),
+        'calories': activity.get('calories'),
+        'device_name': activity.get('device_name'),
+        'description': activity.get('description', ''),
+        'gear_id': activity.get('gear_id'),
+        'private': activity.get('private', False)
+    }
+
+
+class _LRU:
+
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if time.monotonic() - item[1] > LRU_TTL_SECONDS:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, entry):
+        with self._lock:
+            self._items[key] = (entry, time.monotonic())
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_lru = _LRU(LRU_SIZE)
+
+
+def _key(user_id, activity_id):
+    return f'{user_id}:{activity_id}'
+
+
+def _store(user_id, activity_id, detail, etag):
+    now = datetime.utcnow()
+    entry = {
+        '_id': _key(user_id, activity_id),
+        'user_id': str(user_id),
+        'activity_id': str(activity_id),
+        'detail': detail,
+        'etag': etag,
+        'fetched_at': now,
+        'fresh_until': now + timedelta(seconds=FRESH_SECONDS),
+        'expires_at': now + timedelta(days=RETAIN_DAYS),
+    }
+    _lru.put(entry['_id'], entry)
+    database = get_db()
+    if database is not None:
+        try:
+            database[COLLECTION].replace_one({'_id': entry['_id']}, entry, upsert=True)
+        except Exception as e:
+            logger.exception("Error caching activity detail %s: %s", entry['_id'], e)
+    return entry
+
+
+def _cached(key):
+    entry = _lru.get(key)
+    if entry is not None:
+        return entry
+    database = get_db()
+    if database is None:
+        return None
+    try:
+        entry = database[COLLECTION].find_one({'_id': key})
+    except Exception as e:
+        logger.exception("Error reading cached activity detail %s: %s", key, e)
+        return None
+    if entry is not None:
+        _lru.put(key, entry)
+    return entry
+
+
+def get_detail(user_id, activity_id, headers, priority=INTERACTIVE, wait=0.0):
+    """Activity detail for a user. Returns (detail, None) or (None, Strava status code).
+
+    Raises StravaUnavailable / RateLimited only when there is no cached copy to fall back on.
+    """
+    key = _key(user_id, activity_id)
+    entry = _cached(key)
+    if entry is not None and entry['fresh_until'] > datetime.utcnow():
+        return entry['detail'], None
+
+    request_headers = dict(headers or {})
+    if entry is not None and entry.get('etag'):
+        request_headers['If-None-Match'] = entry['etag']
+    try:
+        resp = get_client().get(f'/activities/{activity_id}', headers=request_headers, priority=priority, wait=wait)
+    except (StravaUnavailable, RateLimited):
+        if entry is not None:
+            return entry['detail'], None
+        raise
+
+    if resp.status_code == 304 and entry is not None:
+        return _store(user_id, activity_id, entry['detail'], entry.get('etag'))['detail'], None
+    if resp.status_code == 200:
+        detail = format_detail(resp.json())
+        return _store(user_id, activity_id, detail, resp.headers.get('ETag'))['detail'], None
+    if resp.status_code in (401, 403, 404):
+        invalidate(user_id, activity_id)
+        return None, resp.status_code
+    if entry is not None:
+        return entry['detail'], None
+    return None, resp.status_code
+
+
+def invalidate(user_id, activity_id):
+    key = _key(user_id, activity_id)
+    _lru.pop(key)
+    database = get_db()
+    if database is not None:
+        try:
+            database[COLLECTION].delete_one({'_id': key})
+        except Exception as e:
+            logger.exception("Error dropping cached activity detail %s: %s", key, e)
+
+
+def prefetch(user_id, activity_ids, count=PREFETCH_COUNT):
+    """Queue background fetches for the first `count` activities that have no fresh cached detail."""
+    keys = {_key(user_id, a): str(a) for a in list(activity_ids)[:count]}
+    if not keys:
+        return 0
+    database = get_db()
+    if database is None:
+        return 0
+    fresh = {doc['_id'] for doc in database[COLLECTION].find(
+        {'_id': {'$in': list(keys)}, 'fresh_until': {'$gt': datetime.utcnow()}}, {'_id': 1})}
+    queued = 0
+    for key, activity_id in keys.items():
+        if key in fresh:
+            continue
+        if task_queue.enqueue(DETAIL_TASK, {'user_id': str(user_id), 'activity_id': activity_id},
+                              dedupe_key=f'detail:{key}', priority=PREFETCH_PRIORITY):
+            queued += 1
+    return queued
+
+
+@task_queue.handler(DETAIL_TASK)
+def prefetch_detail(payload):
+    user_id, activity_id = payload.get('user_id'), payload.get('activity_id')
+    headers = strava_tokens.get_headers(user_id)
+    if not headers:
+        return
+    try:
+        get_detail(user_id, activity_id, headers, priority=BACKGROUND, wait=FETCH_WAIT_SECONDS)
+    except RateLimited as e:
+        raise task_queue.Defer(e.retry_after, str(e))
@@ -0,0 +1,492 @@
+"""
+Uploaded GPX, TCX and FIT activity files.
+
+`parse_activity_file(path)` reads a file once, point by point, and returns a
+summary: start time, sport, distance, moving and elapsed time, elevation gain,
+average/max heart rate and pace. Memory stays bounded however long the
+recording is:
+
+- GPX and TCX are read with `ElementTree.iterparse`. Each trackpoint is folded
+  into the summary, then cleared and detached from its parent.
+- FIT files are decoded message by message from the binary stream. Only the
+  message definitions and the previous point are kept.
+
+`TrackSummary` does the arithmetic for all three formats. Distance comes from
+the device's cumulative distance when the file has it (TCX, FIT), otherwise
+from the GPS positions. Moving time counts the intervals faster than 0.5 m/s
+and shorter than two minutes (longer gaps are pauses). Elevation gain ignores
+climbs under 2 m, which are mostly GPS/barometer noise.
+
+`ingest_file(user_id, path)` scores the summary with core/scoring.py and
+records it as a `file_upload` activity, keyed by the file's SHA-256 so the
+same file is only credited once. It then credits the minutes and records the
+streak day the same way manual activities do.
+"""
+import hashlib
+import logging
+import math
+import os
+import struct
+from datetime import datetime, timezone
+from xml.etree import ElementTree
+
+from pymongo.errors import DuplicateKeyError
+
+from core import scoring
+from core.database import get_db, UserDB
+
+logger = logging.getLogger(__name__)
+
+FILE_UPLOAD_SOURCE = 'file_upload'
+EXTENSIONS = ('.gpx', '.tcx', '.fit')
+
+# Slower than this between two points counts as stopped
+MOVING_SPEED_MS = 0.5
+# A longer gap between two points is a pause, not moving time
+MAX_GAP_SECONDS = 120
+# Climbs smaller than this are treated as noise
+ELEVATION_THRESHOLD_M = 2.0
+EARTH_RADIUS_M = 6371008.8
+
+
+class ActivityFileError(ValueError):
+    """The file is not a readable GPX/TCX/FIT activity."""
+
+
+def _haversine_m(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def sport_label(value):
+    """Map a file's sport name (GPX <type>, TCX Sport, FIT sport) onto the Strava-style type scoring uses."""
+    text = str(value or '').lower()
+    for needle, label in (('run', 'Run'), ('bik', 'Ride'), ('cycl', 'Ride'), ('ride', 'Ride'),
+                          ('walk', 'Walk'), ('hik', 'Hike'), ('swim', 'Swim')):
+        if needle in text:
+            return label
+    return None
+
+
+class TrackSummary:
+    """Running totals over a stream of track points; holds only the previous point."""
+
+    def __init__(self):
+        self.points = 0
+        self.sport = None
+        self.start_time = None
+        self.end_time = None
+        self.distance_m = 0.0
+        self.moving_seconds = 0.0
+        self.elevation_gain_m = 0.0
+        self.hr_sum = 0.0
+        self.hr_count = 0
+        self.max_hr = None
+        # Lap/session totals written by the device, used when the points carry no distance or time
+        self.recorded_distance_m = 0.0
+        self.recorded_seconds = 0.0
+        self._prev_time = None
+        self._prev_position = None
+        self._prev_distance = None
+        self._elevation_ref = None
+
+    def add(self, time=None, lat=None, lon=None, ele=None, hr=None, distance=None):
+        """Fold in one point. time: epoch seconds; distance: the device's cumulative metres, if recorded."""
+        self.points += 1
+
+        step = 0.0
+        if distance is not None:
+            if self._prev_distance is not None and distance > self._prev_distance:
+                step = distance - self._prev_distance
+            self._prev_distance = distance
+        elif lat is not None and lon is not None and self._prev_position is not None:
+            step = _haversine_m(self._prev_position[0], self._prev_position[1], lat, lon)
+        if lat is not None and lon is not None:
+            self._prev_position = (lat, lon)
+        self.distance_m += step
+
+        if time is not None:
+            if self.start_time is None or time < self.start_time:
+                self.start_time = time
+            if self.end_time is None or time > self.end_time:
+                self.end_time = time
+            if self._prev_time is not None:
+                dt = time - self._prev_time
+                if 0 < dt <= MAX_GAP_SECONDS and step / dt >= MOVING_SPEED_MS:
+                    self.moving_seconds += dt
+            self._prev_time = time
+
+        if ele is not None:
+            if self._elevation_ref is None or ele < self._elevation_ref:
+                self._elevation_ref = ele
+            elif ele - self._elevation_ref >= ELEVATION_THRESHOLD_M:
+                self.elevation_gain_m += ele - self._elevation_ref
+                self._elevation_ref = ele
+
+        if hr:
+            self.hr_sum += hr
+            self.hr_count += 1
+            self.max_hr = hr if self.max_hr is None else max(self.max_hr, hr)
+
+    def add_totals(self, distance_m=None, seconds=None):
+        if distance_m:
+            self.recorded_distance_m += distance_m
+        if seconds:
+            self.recorded_seconds += seconds
+
+    def result(self):
+        if not self.points and not self.recorded_distance_m:
+            raise ActivityFileError('No track points found')
+        distance_m = self.distance_m or self.recorded_distance_m
+        moving_seconds = self.moving_seconds or self.recorded_seconds
+        elapsed_seconds = (self.end_time - self.start_time) if self.start_time is not None else moving_seconds
+        distance_km = round(distance_m / 1000, 2)
+        moving_minutes = moving_seconds / 60.0
+        start = (datetime.fromtimestamp(self.start_time, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+                 if self.start_time is not None else None)
+        return {
+            'type': self.sport,
+            'start_date': start,
+            'distance_km': distance_km,
+            'moving_minutes': moving_minutes,
+            'elapsed_minutes': elapsed_seconds / 60.0,
+            'elevation_gain_m': round(self.elevation_gain_m, 1),
+            'average_heartrate': round(self.hr_sum / self.hr_count, 1) if self.hr_count else None,
+            'max_heartrate': self.max_hr,
+            'pace': scoring.pace_min_per_km(distance_km, moving_minutes),
+            'points': self.points,
+        }
+
+
+# --- GPX / TCX ---
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _float(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def _epoch(text):
+    """Epoch seconds from an ISO 8601 timestamp ('2026-03-10T09:00:00Z', with or without fractions)."""
+    if not text:
+        return None
+    try:
+        value = datetime.fromisoformat(text.strip())
+    except ValueError:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _completed(source, tags):
+    """Yield (name, element, parent_name) for each finished element named in `tags`, then drop it from the tree."""
+    stack = []
+    try:
+        for event, elem in ElementTree.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                continue
+            stack.pop()
+            name = _local(elem.tag)
+            if name in tags:
+                yield name, elem, _local(stack[-1].tag) if stack else None
+                elem.clear()
+                if stack:
+                    stack[-1].remove(elem)
+    except ElementTree.ParseError as e:
+        raise ActivityFileError(f'Invalid XML: {e}')
+
+
+def parse_gpx(source):
+    summary = TrackSummary()
+    for name, elem, parent in _completed(source, ('trkpt', 'rtept', 'type')):
+        if name == 'type':
+            if parent == 'trk' and summary.sport is None:
+                summary.sport = sport_label(elem.text)
+            continue
+        time = ele = hr = None
+        for child in elem.iter():
+            child_name = _local(child.tag)
+            if child_name == 'time':
+                time = _epoch(child.text)
+            elif child_name == 'ele':
+                ele = _float(child.text)
+            elif child_name == 'hr':
+                hr = _float(child.text)
+        summary.add(time=time, lat=_float(elem.get('lat')), lon=_float(elem.get('lon')), ele=ele, hr=hr)
+    return summary.result()
+
+
+def parse_tcx(source):
+    summary = TrackSummary()
+    for name, elem, _ in _completed(source, ('Trackpoint', 'Lap', 'Activity')):
+        if name == 'Activity':
+            summary.sport = summary.sport or sport_label(elem.get('Sport'))
+            continue
+        if name == 'Lap':
+            totals = {_local(child.tag): _float(child.text) for child in elem}
+            summary.add_totals(totals.get('DistanceMeters'), totals.get('TotalTimeSeconds'))
+            continue
+        point = {}
+        for child in elem:
+            child_name = _local(child.tag)
+            if child_name == 'Time':
+                point['time'] = _epoch(child.text)
+            elif child_name == 'Position':
+                coords = {_local(c.tag): _float(c.text) for c in child}
+                point['lat'], point['lon'] = coords.get('LatitudeDegrees'), coords.get('LongitudeDegrees')
+            elif child_name == 'AltitudeMeters':
+                point['ele'] = _float(child.text)
+            elif child_name == 'DistanceMeters':
+                point['distance'] = _float(child.text)
+            elif child_name == 'HeartRateBpm':
+                point['hr'] = _float(next((c.text for c in child if _local(c.tag) == 'Value'), None))
+        summary.add(**point)
+    return summary.result()
+
+
+# --- FIT ---
+
+FIT_EPOCH_OFFSET = 631065600  # 1989-12-31T00:00:00Z
+FIT_RECORD = 20
+FIT_SESSION = 18
+FIT_SPORTS = {1: 'Run', 2: 'Ride', 5: 'Swim', 11: 'Walk', 17: 'Hike'}
+SEMICIRCLES_TO_DEGREES = 180.0 / 2 ** 31
+
+# base type -> (struct format, invalid value)
+_FIT_BASE_TYPES = {
+    0x00: ('B', 0xFF), 0x01: ('b', 0x7F), 0x02: ('B', 0xFF),
+    0x83: ('h', 0x7FFF), 0x84: ('H', 0xFFFF), 0x85: ('i', 0x7FFFFFFF), 0x86: ('I', 0xFFFFFFFF),
+    0x0A: ('B', 0), 0x8B: ('H', 0), 0x8C: ('I', 0),
+}
+# Fields decoded per global message; everything else is skipped
+_FIT_FIELDS = {
+    FIT_RECORD: {253: 'timestamp', 0: 'lat', 1: 'lon', 2: 'altitude', 78: 'enhanced_altitude',
+                 3: 'heart_rate', 5: 'distance'},
+    FIT_SESSION: {5: 'sport', 8: 'total_timer_time', 9: 'total_distance'},
+}
+
+
+def _read(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ActivityFileError('Truncated FIT file')
+    return data
+
+
+def _fit_definition(stream, has_developer_fields):
+    """Read a definition message. Returns ((global number, data size, decoded fields), bytes read)."""
+    architecture = _read(stream, 2)[1]
+    endian = '>' if architecture else '<'
+    global_num, field_count = struct.unpack(endian + 'HB', _read(stream, 3))
+    wanted = _FIT_FIELDS.get(global_num, {})
+    fields, offset = [], 0
+    for _ in range(field_count):
+        number, size, base_type = _read(stream, 3)
+        fmt = _FIT_BASE_TYPES.get(base_type)
+        if number in wanted and fmt and struct.calcsize(fmt[0]) == size:
+            fields.append((offset, wanted[number], endian + fmt[0], fmt[1]))
+        offset += size
+    consumed = 5 + 3 * field_count
+    if has_developer_fields:
+        developer_count = _read(stream, 1)[0]
+        for _ in range(developer_count):
+            offset += _read(stream, 3)[1]
+        consumed += 1 + 3 * developer_count
+    return (global_num, offset, fields), consumed
+
+
+def _fit_messages(stream):
+    """Yield (global message number, {field: value}) for the messages in _FIT_FIELDS."""
+    header_size = _read(stream, 1)[0]
+    if header_size < 12:
+        raise ActivityFileError('Not a FIT file')
+    header = _read(stream, header_size - 1)
+    data_size = struct.unpack('<I', header[3:7])[0]
+    if header[7:11] != b'.FIT':
+        raise ActivityFileError('Not a FIT file')
+
+    definitions = {}
+    last_timestamp = None
+    remaining = data_size
+    while remaining > 0:
+        record_header = _read(stream, 1)[0]
+        time_offset = None
+        if record_header & 0x80:
+            # Compressed timestamp header: 5-bit offset from the last full timestamp
+            local_type = (record_header >> 5) & 0x03
+            time_offset = record_header & 0x1F
+        elif record_header & 0x40:
+            definition, consumed = _fit_definition(stream, bool(record_header & 0x20))
+            definitions[record_header & 0x0F] = definition
+            remaining -= 1 + consumed
+            continue
+        else:
+            local_type = record_header & 0x0F
+
+        if local_type not in definitions:
+            raise ActivityFileError(f'FIT data message before its definition ({local_type})')
+        global_num, size, fields = definitions[local_type]
+        data = _read(stream, size)
+        remaining -= 1 + size
+
+        values = {}
+        for offset, name, fmt, invalid in fields:
+            value = struct.unpack_from(fmt, data, offset)[0]
+            if value != invalid:
+                values[name] = value
+        if 'timestamp' in values:
+            last_timestamp = values['timestamp']
+        elif time_offset is not None and last_timestamp is not None:
+            timestamp = (last_timestamp & ~0x1F) + time_offset
+            if time_offset < (last_timestamp & 0x1F):
+                timestamp += 0x20
+            values['timestamp'] = last_timestamp = timestamp
+        if fields:
+            yield global_num, values
+
+
+def parse_fit(source):
+    summary = TrackSummary()
+    for global_num, values in _fit_messages(source):
+        if global_num == FIT_SESSION:
+            summary.sport = summary.sport or FIT_SPORTS.get(values.get('sport'))
+            summary.add_totals(values.get('total_distance', 0) / 100.0, values.get('total_timer_time', 0) / 1000.0)
+            continue
+        altitude = values.get('enhanced_altitude', values.get('altitude'))
+        summary.add(
+            time=values['timestamp'] + FIT_EPOCH_OFFSET if 'timestamp' in values else None,
+            lat=values['lat'] * SEMICIRCLES_TO_DEGREES if 'lat' in values else None,
+            lon=values['lon'] * SEMICIRCLES_TO_DEGREES if 'lon' in values else None,
+            ele=altitude / 5.0 - 500 if altitude is not None else None,
+            hr=values.get('heart_rate'),
+            distance=values['distance'] / 100.0 if 'distance' in values else None,
+        )
+    return summary.result()
+
+
+_PARSERS = {'.gpx': parse_gpx, '.tcx': parse_tcx, '.fit': parse_fit}
+
+
+class _ProgressReader:
+    """File wrapper reporting the fraction read to `callback` as the parser pulls data."""
+
+    def __init__(self, f, total, callback):
+        self._f = f
+        self._total = max(total, 1)
+        self._read = 0
+        self._callback = callback
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self._read += len(data)
+        self._callback(min(1.0, self._read / self._total))
+        return data
+
+
+def parse_activity_file(path, extension=None, progress=None):
+    """Summary dict for a GPX/TCX/FIT file, chosen by `extension` (defaults to the path's suffix).
+
+    progress: optional callback taking the fraction of the file read so far.
+    """
+    extension = (extension or str(path)[str(path).rfind('.'):]).lower()
+    parser = _PARSERS.get(extension)
+    if parser is None:
+        raise ActivityFileError(f'Unsupported file type: {extension}')
+    with open(path, 'rb') as f:
+        source = _ProgressReader(f, os.fstat(f.fileno()).st_size, progress) if progress else f
+        try:
+            return parser(source)
+        except (struct.error, IndexError) as e:
+            raise ActivityFileError(f'Corrupt {extension} file: {e}')
+
+
+def file_digest(path, chunk_size=1 << 16):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_upload_doc(user_id, summary, title, external_id):
+    """The `file_upload` activity document for a parsed file."""
+    label, minutes = scoring.score_activity(summary['distance_km'], summary['moving_minutes'],
+                                            avg_hr=summary['average_heartrate'], pace=summary['pace'],
+                                            type_label=summary['type'])
+    return {
+        'user_id': user_id,
+        'source': FILE_UPLOAD_SOURCE,
+        'external_id': external_id,
+        'title': title or f"{summary['type'] or 'Activity'} upload",
+        'date': summary['start_date'] or datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'type': summary['type'],
+        'distance': summary['distance_km'],
+        'time_minutes': int(math.ceil(summary['moving_minutes'])),
+        'intensity': label,
+        'earned_minutes': minutes,
+        # Scoring inputs, so uploads can be re-scored later (core/rescoring.py)
+        'average_heartrate': summary['average_heartrate'],
+        'duration_minutes': summary['moving_minutes'],
+        'max_heartrate': summary['max_heartrate'],
+        'elevation_gain': summary['elevation_gain_m'],
+        'elapsed_minutes': summary['elapsed_minutes'],
+        'created_at': datetime.utcnow()
+    }
+
+
+def ingest_file(user_id, path, title=None, extension=None, progress=None, digest=None):
+    """Parse, score, record and credit an uploaded file.
+
+    Returns dict with keys: activity (the stored document, None for a file
+    already uploaded), duplicate (bool), streak (record_daily_activity result).
+    Raises ActivityFileError for unreadable files and RuntimeError if the
+    activity could not be stored or credited. The activity is stored with
+    `credited: False` until its minutes are applied, so a run interrupted in
+    between credits it when the job is resumed. `progress` is passed to
+    parse_activity_file(); `digest` is the file's SHA-256 if the caller
+    already has it (core/blob_store.py names files by it).
+    """
+    summary = parse_activity_file(path, extension, progress)
+    doc = build_upload_doc(user_id, summary, title, digest or file_digest(path))
+
+    database = get_db()
+    if database is None:
+        raise RuntimeError('Database connection failed')
+    activities_collection = database['activities']
+    doc['credited'] = False
+    try:
+        activities_collection.insert_one(doc)
+    except DuplicateKeyError:
+        stored = activities_collection.find_one({'user_id': user_id, 'source': FILE_UPLOAD_SOURCE,
+                                                 'external_id': doc['external_id']})
+        if not stored or stored.get('credited') is not False:
+            return {'activity': None, 'duplicate': True, 'streak': {'applied': False}}
+        # An earlier run stored the activity but stopped before it was credited
+        doc = stored
+
+    day = doc['date'].split('T')[0]
+    today_str = datetime.utcnow().strftime('%Y-%m-%d')
+    earned_today = doc['earned_minutes'] if day == today_str else 0
+    # Keyed by the activity, so a retry after a crash never credits it twice
+    if not UserDB.apply_activity_credits(user_id, doc['earned_minutes'], earned_today=earned_today,
+                                         token=f"upload:{doc['_id']}"):
+        activities_collection.delete_one({'_id': doc['_id']})
+        raise RuntimeError(f'Crediting uploaded activity for user {user_id} failed')
+    activities_collection.update_one({'_id': doc['_id']}, {'$set': {'credited': True}})
+    doc['credited'] = True
+
+    try:
+        streak = UserDB.record_daily_activity(user_id, activity_date=day, source='upload')
+    except Exception:
+        logger.exception('Failed to record streak for upload by %s on %s', user_id, day)
+        streak = {'applied': False}
+    return {'activity': doc, 'duplicate': False, 'streak': streak}
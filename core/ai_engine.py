@@ -142,9 +142,8 @@ def _aggregate_features(activities: List[dict], child_id: str) -> dict:
     else:
         avg_pace = None
 
-    child = UserDB.get_user_by_id(child_id)
-    # Calculate streak from activity_dates
-    streak_length = UserDB.calculate_current_streak(child_id) if child else 0
+    # Reads the stored streak state (0 when the child does not exist)
+    streak_length = UserDB.calculate_current_streak(child_id)
 
     # day_of_week (0-6) for today
     from datetime import datetime
@@ -11,6 +11,7 @@ They use the existing `get_db` and `UserDB` helpers in `database.py`.
 """
 from datetime import datetime, timedelta
 from core.database import get_db, UserDB
+from core import streaks
 import logging
 
 logger = logging.getLogger(__name__)
@@ -142,10 +143,14 @@ def has_activity_today(child_id):
     db = get_db()
     today = datetime.utcnow().date().isoformat()
 
-    # Check user document first (fast)
+    # Check the stored streak state first (fast), then the dates for older documents
     try:
-        child = UserDB.get_user_by_id(child_id)
-        if child:
+        child = UserDB.get_user_view(child_id, 'streak_state')
+        if child and child.get('streak_state') is not None:
+            if streaks.contains(child['streak_state'], today):
+                return True
+        elif child:
+            child = UserDB.get_user_view(child_id, 'activity_dates')
             activity_dates = child.get('activity_dates', []) or []
             for activity_day in activity_dates:
                 if isinstance(activity_day, str):
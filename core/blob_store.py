@@ -0,0 +1,77 @@
+"""
+Content-addressed file storage.
+
+A `BlobStore` keeps files under its root named by their SHA-256 and
+extension, sharded two levels deep so no directory grows large:
+
+    <root>/ab/cd/abcd...ef.gpx
+
+- `save_stream()` copies an upload into a temporary file in the store while
+  hashing it, then renames it into place. The data is written once and never
+  read back to hash it.
+- Identical content gets the same name: a second copy of a file already
+  stored is discarded and the existing blob is returned (`created` False).
+- A name never changes meaning, so it can be served with a long-lived
+  immutable cache header.
+
+`app.py` keeps two stores: activity uploads (private, `uploads/`) and media
+such as challenge images (public, `media/`, served from `/media/<name>`).
+"""
+import hashlib
+import os
+import pathlib
+import re
+import tempfile
+from collections import namedtuple
+
+CHUNK_SIZE = 1 << 16
+NAME_PATTERN = re.compile(r'^[0-9a-f]{64}(\.[a-z0-9]{1,8})?$')
+
+Blob = namedtuple('Blob', 'digest name path size created')
+
+
+class BlobStore:
+
+    def __init__(self, root):
+        self.root = pathlib.Path(root)
+
+    def path_for(self, name):
+        """Where the blob called `name` (`<sha256><ext>`) lives. Raises ValueError for any other name."""
+        if not NAME_PATTERN.match(name or ''):
+            raise ValueError(f'Not a blob name: {name!r}')
+        return self.root / name[:2] / name[2:4] / name
+
+    def exists(self, name):
+        try:
+            return self.path_for(name).is_file()
+        except ValueError:
+            return False
+
+    def save_stream(self, stream, extension=''):
+        """Store everything read from `stream`. Returns a Blob; `created` is False if it was already stored."""
+        extension = extension.lower()
+        if extension and not NAME_PATTERN.match('0' * 64 + extension):
+            raise ValueError(f'Unsupported extension: {extension!r}')
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='.incoming-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            name = digest.hexdigest() + extension
+            path = self.path_for(name)
+            if path.is_file():
+                os.unlink(tmp)
+                return Blob(digest.hexdigest(), name, path, size, False)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return Blob(digest.hexdigest(), name, path, size, True)
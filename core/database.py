@@ -1,11 +1,13 @@
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import ConnectionFailure, OperationFailure
 import os
 from dotenv import load_dotenv
 import bcrypt
 from datetime import datetime
 import logging
 
+from core import events, streaks
+
 logger = logging.getLogger(__name__)
 
 load_dotenv()
@@ -46,19 +48,8 @@ def get_db():
         db = client[MONGODB_DB_NAME]
         logger.info(f"✓ Connected to MongoDB database: {MONGODB_DB_NAME}")
         
-        # Create indexes for better performance
-        try:
-            users_collection = db['users']
-            # Create unique index on email for fast lookups and email uniqueness
-            users_collection.create_index('email', unique=True)
-            logger.info("✓ Created email index on users collection")
-            
-            activities_collection = db['activities']
-            # Create index on user_id for faster queries
-            activities_collection.create_index('user_id')
-            logger.info("✓ Created user_id index on activities collection")
-        except Exception as e:
-            logger.warning(f"Index creation warning (may already exist): {e}")
+        # Create indexes for every query shape the app issues
+        ensure_indexes(db)
         
         return db
     except ConnectionFailure as e:
@@ -71,6 +62,436 @@ def get_db():
         return None
 
 
+# Declarative index registry: collection -> list of index specs.
+# Each spec is passed to create_index as keys + options, so names are stable
+# and can be compared against what the server reports.
+INDEX_SPECS = {
+    'users': [
+        {'keys': [('email', ASCENDING)], 'name': 'email_1', 'unique': True},
+        # Leaderboard: children ordered by earned time
+        {'keys': [('account_type', ASCENDING), ('earned_game_time', DESCENDING)], 'name': 'account_type_earned_game_time'},
+        # Parent lookup by child id
+        {'keys': [('account_type', ASCENDING), ('children', ASCENDING)], 'name': 'account_type_children'},
+        # Strava webhook events name the athlete, not our user
+        {'keys': [('strava_id', ASCENDING)], 'name': 'strava_id'},
+    ],
+    'activities': [
+        # Profile ingestion, recommendations and recent activity lists
+        {'keys': [('user_id', ASCENDING), ('created_at', DESCENDING)], 'name': 'user_id_created_at'},
+        # "Did this child do anything today" checks
+        {'keys': [('user_id', ASCENDING), ('date', DESCENDING)], 'name': 'user_id_date'},
+        # Manual/simulated activity history, newest first
+        {'keys': [('user_id', ASCENDING), ('source', ASCENDING), ('date', DESCENDING)], 'name': 'user_id_source_date'},
+        # Imported activity lookups by provider id
+        {'keys': [('source', ASCENDING), ('external_id', ASCENDING), ('user_id', ASCENDING)], 'name': 'source_external_id_user_id'},
+        # Imported activities are deduplicated by this index; manual entries have no external_id
+        {'keys': [('user_id', ASCENDING), ('source', ASCENDING), ('external_id', ASCENDING)],
+         'name': 'user_source_external_id_unique', 'unique': True,
+         'partialFilterExpression': {'external_id': {'$exists': True}}},
+    ],
+    'friend_requests': [
+        {'keys': [('status', ASCENDING), ('from_user_id', ASCENDING)], 'name': 'status_from_user_id'},
+        {'keys': [('status', ASCENDING), ('to_user_id', ASCENDING)], 'name': 'status_to_user_id'},
+    ],
+    'challenge_unlock_requests': [
+        {'keys': [('status', ASCENDING), ('user_id', ASCENDING)], 'name': 'status_user_id'},
+    ],
+    'challenge_completion_requests': [
+        {'keys': [('status', ASCENDING), ('user_id', ASCENDING)], 'name': 'status_user_id'},
+    ],
+    'user_challenges': [
+        {'keys': [('user_id', ASCENDING), ('challenge_id', ASCENDING)], 'name': 'user_id_challenge_id'},
+    ],
+    'challenge_unlocks': [
+        {'keys': [('user_id', ASCENDING), ('challenge_id', ASCENDING)], 'name': 'user_id_challenge_id'},
+    ],
+    'active_challenges': [
+        {'keys': [('user_id', ASCENDING), ('challenge_id', ASCENDING)], 'name': 'user_id_challenge_id'},
+    ],
+    'challenges': [
+        {'keys': [('created_at', DESCENDING)], 'name': 'created_at'},
+    ],
+    'leaderboard_windows': [
+        # Daily/weekly standings for one window, highest first
+        {'keys': [('window', ASCENDING), ('minutes', DESCENDING)], 'name': 'window_minutes'},
+        # Closed windows are dropped by MongoDB once they expire
+        {'keys': [('expires_at', ASCENDING)], 'name': 'expires_at_ttl', 'expireAfterSeconds': 0},
+    ],
+    'user_profiles': [
+        {'keys': [('user_id', ASCENDING)], 'name': 'user_id'},
+    ],
+    'tasks': [
+        # Workers claim the most urgent due task (core/task_queue.py)
+        {'keys': [('status', ASCENDING), ('priority', ASCENDING), ('run_at', ASCENDING)], 'name': 'status_priority_run_at'},
+        # Expired leases are requeued
+        {'keys': [('status', ASCENDING), ('lease_until', ASCENDING)], 'name': 'status_lease_until'},
+        # The same event is only queued once
+        {'keys': [('dedupe_key', ASCENDING)], 'name': 'dedupe_key_unique', 'unique': True,
+         'partialFilterExpression': {'dedupe_key': {'$exists': True}}},
+        # Finished tasks are dropped once they expire
+        {'keys': [('expires_at', ASCENDING)], 'name': 'expires_at_ttl', 'expireAfterSeconds': 0},
+    ],
+    'activity_details': [
+        # Cached Strava details are looked up by _id and dropped once they expire (core/activity_details.py)
+        {'keys': [('expires_at', ASCENDING)], 'name': 'expires_at_ttl', 'expireAfterSeconds': 0},
+    ],
+    'upload_jobs': [
+        # Each host resumes its own unfinished uploads (core/upload_jobs.py)
+        {'keys': [('host', ASCENDING), ('status', ASCENDING)], 'name': 'host_status'},
+        # Finished jobs are dropped once they expire
+        {'keys': [('expires_at', ASCENDING)], 'name': 'expires_at_ttl', 'expireAfterSeconds': 0},
+    ],
+}
+
+# Representative query for each hot shape: (collection, filter, sort).
+# verify_query_plans() explains these and flags any that fall back to a COLLSCAN.
+_PROBE_ID = '000000000000000000000000'
+QUERY_SHAPES = [
+    ('users', {'account_type': 'child'}, [('earned_game_time', DESCENDING)]),
+    ('users', {'account_type': 'parent', 'children': _PROBE_ID}, None),
+    ('users', {'strava_id': 0}, None),
+    ('activities', {'user_id': _PROBE_ID, 'created_at': {'$gte': datetime(1970, 1, 1)}}, [('created_at', DESCENDING)]),
+    ('activities', {'user_id': _PROBE_ID, 'date': '1970-01-01'}, None),
+    ('activities', {'user_id': _PROBE_ID, 'source': {'$in': ['manual', 'simulated', 'file_upload']}}, [('date', DESCENDING)]),
+    ('activities', {'source': 'strava_applied', 'external_id': {'$in': ['0']}, 'user_id': _PROBE_ID}, None),
+    ('friend_requests', {'status': 'pending', '$or': [{'from_user_id': {'$in': [_PROBE_ID]}},
+                                                      {'to_user_id': {'$in': [_PROBE_ID]}}]}, None),
+    ('friend_requests', {'from_user_id': _PROBE_ID, 'status': 'pending'}, None),
+    ('challenge_unlock_requests', {'status': 'pending', 'user_id': {'$in': [_PROBE_ID]}}, None),
+    ('challenge_completion_requests', {'status': 'pending', 'user_id': {'$in': [_PROBE_ID]}}, None),
+    ('user_challenges', {'user_id': _PROBE_ID, 'challenge_id': _PROBE_ID}, None),
+    ('challenge_unlocks', {'user_id': _PROBE_ID, 'challenge_id': _PROBE_ID}, None),
+    ('tasks', {'status': 'queued', 'run_at': {'$lte': datetime(1970, 1, 1)}}, [('priority', ASCENDING), ('run_at', ASCENDING)]),
+    ('tasks', {'status': 'running', 'lease_until': {'$lt': datetime(1970, 1, 1)}}, None),
+    ('upload_jobs', {'host': '', 'status': 'queued'}, None),
+]
+
+
+def ensure_indexes(database=None):
+    """Create every index in INDEX_SPECS. Returns a list of (collection, name, error) failures."""
+    database = database if database is not None else get_db()
+    if database is None:
+        return [(None, None, 'Database connection failed')]
+
+    failures = []
+    for collection_name, specs in INDEX_SPECS.items():
+        for spec in specs:
+            options = {k: v for k, v in spec.items() if k != 'keys'}
+            try:
+                database[collection_name].create_index(spec['keys'], **options)
+            except Exception as e:
+                # e.g. duplicate data under a unique index, or the same keys under another name
+                logger.warning(f"Index {collection_name}.{spec['name']} not created: {e}")
+                failures.append((collection_name, spec['name'], str(e)))
+    if not failures:
+        logger.info("✓ Ensured indexes on %d collections", len(INDEX_SPECS))
+    return failures
+
+
+def report_indexes(database=None):
+    """Compare INDEX_SPECS with the server.
+
+    Returns dict keyed by collection with lists: missing (in the registry but not
+    on the server), unmanaged (on the server but not in the registry) and unused
+    (no recorded accesses since the server last restarted, per $indexStats).
+    """
+    database = database if database is not None else get_db()
+    if database is None:
+        return {}
+
+    report = {}
+    for collection_name, specs in INDEX_SPECS.items():
+        collection = database[collection_name]
+        expected = {spec['name'] for spec in specs}
+        try:
+            existing = set(collection.index_information().keys()) - {'_id_'}
+        except OperationFailure:
+            existing = set()
+        try:
+            stats = list(collection.aggregate([{'$indexStats': {}}]))
+        except OperationFailure:
+            # $indexStats needs the clusterMonitor role on some hosted tiers
+            stats = []
+        unused = sorted(
+            s['name'] for s in stats
+            if s.get('name') != '_id_' and int((s.get('accesses') or {}).get('ops', 0)) == 0
+        )
+        report[collection_name] = {
+            'missing': sorted(expected - existing),
+            'unmanaged': sorted(existing - expected),
+            'unused': unused,
+        }
+    return report
+
+
+def _plan_stages(plan):
+    """Yield every stage name in an explain() plan tree."""
+    if not isinstance(plan, dict):
+        return
+    if 'stage' in plan:
+        yield plan['stage']
+    for key in ('inputStage', 'queryPlan', 'winningPlan'):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get('inputStages', []) or []:
+        yield from _plan_stages(child)
+
+
+def verify_query_plans(database=None):
+    """Explain every QUERY_SHAPES entry; return the shapes whose winning plan is a COLLSCAN.
+
+    Raises RuntimeError when there is no database connection, so a deploy gate
+    cannot pass without having checked anything.
+    """
+    database = database if database is not None else get_db()
+    if database is None:
+        raise RuntimeError('Database connection failed; query plans were not checked')
+
+    scans = []
+    for collection_name, query, sort in QUERY_SHAPES:
+        cursor = database[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            explain = cursor.explain()
+        except OperationFailure as e:
+            logger.warning(f"Could not explain query on {collection_name}: {e}")
+            continue
+        winning = (explain.get('queryPlanner') or {}).get('winningPlan', {})
+        if 'COLLSCAN' in set(_plan_stages(winning)):
+            scans.append({'collection': collection_name, 'filter': query, 'sort': sort})
+    return scans
+
+
+def _request_user_cache():
+    """Return the per-request identity map of user documents, or None outside a request.
+
+    Entries are keyed by the string form of their ``_id`` and live on ``flask.g``,
+    so each user is loaded at most once per request and nothing leaks between requests.
+    Each entry is ``{'doc': dict, 'fields': set or None}``; ``fields`` is None for a
+    full document, otherwise the fields that have been loaded through projections.
+    """
+    try:
+        from flask import g, has_request_context
+    except Exception:
+        return None
+    if not has_request_context():
+        return None
+    cache = getattr(g, '_user_doc_cache', None)
+    if cache is None:
+        cache = {}
+        g._user_doc_cache = cache
+    return cache
+
+
+def _invalidate_cached_user(user_id):
+    """Drop a user document from the request identity map after a write."""
+    cache = _request_user_cache()
+    if cache is not None and user_id is not None:
+        cache.pop(str(user_id), None)
+
+
+# Every UserDB write to a user document also bumps its `state_version`, so
+# polled endpoints can tag responses with it and answer 304 (core/http_cache.py).
+STATE_VERSION_FIELD = 'state_version'
+
+
+def _versioned(update):
+    """Return a copy of an update document (or pipeline) that also bumps state_version."""
+    if isinstance(update, list):
+        return update + [{'$set': {STATE_VERSION_FIELD: {'$add': [{'$ifNull': ['$' + STATE_VERSION_FIELD, 0]}, 1]}}}]
+    update = dict(update)
+    update['$inc'] = dict(update.get('$inc') or {}, **{STATE_VERSION_FIELD: 1})
+    return update
+
+
+def _published_changes(update):
+    """Live-update events (core/events.py) implied by an update document or pipeline."""
+    stages = update if isinstance(update, list) else [update]
+    sets, messages = {}, []
+    for stage in stages:
+        sets.update(stage.get('$set') or {})
+        pushed = (stage.get('$push') or {}).get('parent_messages')
+        if isinstance(pushed, dict):
+            messages.extend(pushed.get('$each', []))
+    changes = []
+    if 'timer_running' in sets:
+        changes.append(('timer', {'timer_running': sets['timer_running'],
+                                  'timer_started_at': sets.get('timer_started_at')}))
+    changes.extend(('message', msg) for msg in messages)
+    changes.append(('balance', None))
+    return changes
+
+
+def _publish_user_change(query, update):
+    target = query.get('_id') if isinstance(query, dict) else None
+    user_ids = target.get('$in', []) if isinstance(target, dict) else [target]
+    changes = _published_changes(update)
+    for user_id in user_ids:
+        if user_id is None:
+            continue
+        for event, data in changes:
+            events.publish(user_id, event, data)
+
+
+class _VersionedUsers:
+    """The `users` collection with state_version bumped (and a live update published) on every update."""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def update_one(self, query, update, *args, **kwargs):
+        result = self._collection.update_one(query, _versioned(update), *args, **kwargs)
+        if result.modified_count:
+            _publish_user_change(query, update)
+        return result
+
+    def update_many(self, query, update, *args, **kwargs):
+        result = self._collection.update_many(query, _versioned(update), *args, **kwargs)
+        if result.modified_count:
+            _publish_user_change(query, update)
+        return result
+
+    def find_one_and_update(self, query, update, *args, **kwargs):
+        doc = self._collection.find_one_and_update(query, _versioned(update), *args, **kwargs)
+        if doc is not None:
+            _publish_user_change(query, update)
+        return doc
+
+
+def _users_collection(database):
+    return _VersionedUsers(database['users'])
+
+
+def bump_counter(name):
+    """Increment a named version counter in the `counters` collection (shared data such as challenges)."""
+    database = get_db()
+    if database is None:
+        return
+    try:
+        database['counters'].update_one({'_id': name}, {'$inc': {'version': 1}}, upsert=True)
+    except Exception as e:
+        logger.warning(f"Could not bump counter {name}: {e}")
+
+
+def get_counter(name):
+    """Current value of a named version counter (0 if never bumped), or None without a database."""
+    database = get_db()
+    if database is None:
+        return None
+    try:
+        doc = database['counters'].find_one({'_id': name}, {'version': 1})
+    except Exception:
+        return None
+    return int((doc or {}).get('version', 0))
+
+
+# Named projections for UserDB.get_user_view(). Each lists only the fields its
+# callers read, so hot paths skip the password hash, tokens and large arrays.
+USER_VIEWS = {
+    'identity': ('name', 'email', 'account_type', 'parent_id'),
+    'balance': ('account_type', 'daily_screen_time_limit', 'daily_earned_minutes_today', 'earned_game_time',
+                'used_game_time', 'timer_running', 'timer_started_at'),
+    'timer': ('timer_running', 'timer_started_at'),
+    'streak': ('parent_id', 'streak_state'),
+    'streak_settings': ('account_type', 'streak_reward_base_minutes', 'streak_reward_increment_minutes',
+                        'streak_reward_cap_minutes'),
+    'relations': ('name', 'account_type', 'parent_id', 'children', 'friends'),
+    'strava': ('strava_connected', 'strava_id', 'strava_athlete_name', 'strava_access_token',
+               'strava_refresh_token', 'strava_token_expiry', 'strava_sync'),
+    'child_summary': ('name', 'email', 'earned_game_time', 'used_game_time', 'daily_screen_time_limit',
+                      'weekly_screen_time_limit', 'timer_running', 'timer_started_at', 'streak_state'),
+}
+
+
+def _view_fields(views):
+    """Resolve view names and/or raw field names into one field set."""
+    fields = set()
+    for name in views:
+        fields.update(USER_VIEWS.get(name, (name,)))
+    return fields
+
+
+# Callbacks run after a child's earned_game_time changes: fn(user_id, minutes).
+# minutes is the credited amount, or None when the change is not a known credit
+# (daily reset, deletion), in which case listeners should re-read the user.
+_credit_listeners = []
+
+
+def _notify_credit(user_id, minutes):
+    for listener in list(_credit_listeners):
+        try:
+            listener(str(user_id), minutes)
+        except Exception:
+            logger.exception("Credit listener failed for %s", user_id)
+
+
+# Children keep only their most recent notifications on the user document
+PARENT_MESSAGES_LIMIT = 50
+# apply_activity_credits(token=...) remembers this many recent tokens per user
+CREDIT_TOKEN_HISTORY = 50
+
+
+def _parent_message_doc(from_parent, message, minutes=0):
+    """Build an entry for a child's `parent_messages` array."""
+    from bson import ObjectId
+    return {
+        'id': str(ObjectId()),
+        'from_parent': from_parent,
+        'message': message,
+        'bonus_minutes': minutes,
+        'created_at': datetime.utcnow(),
+        'read': False
+    }
+
+
+def _legacy_message_id(msg):
+    """Id for a message stored before ids were assigned: its timestamp."""
+    created = msg.get('created_at')
+    return created.isoformat() if isinstance(created, datetime) else str(created)
+
+
+def _push_parent_message(update, from_parent, message, minutes=0):
+    """Add a capped `parent_messages` push and an unread-count bump to an update document.
+
+    The bump is not undone when the slice drops an unread message; get_parent_messages()
+    recounts the window and corrects the stored count.
+    """
+    update.setdefault('$push', {})['parent_messages'] = {
+        '$each': [_parent_message_doc(from_parent, message, minutes)],
+        '$slice': -PARENT_MESSAGES_LIMIT
+    }
+    update.setdefault('$inc', {})['unread_message_count'] = 1
+    return update
+
+
+def _activity_dates(child, child_id):
+    """Return a child's activity_dates, loading them if the document came from a view."""
+    if 'activity_dates' not in child:
+        doc = UserDB.get_user_view(child_id, 'activity_dates') or {}
+        child['activity_dates'] = doc.get('activity_dates', [])
+    return child['activity_dates']
+
+
+def _current_streak_state(child, child_id):
+    """Stored streak state, or one rebuilt from activity_dates for documents that predate it."""
+    state = child.get('streak_state')
+    if state is None:
+        state = streaks.state_from_dates(_activity_dates(child, child_id))
+    return state
+
+
+def _streak_state_after(child, child_id, days):
+    """Streak state once `days` are recorded; falls back to a recompute for deep backfills."""
+    state = streaks.advance_many(_current_streak_state(child, child_id), days)
+    if state is None:
+        state = streaks.state_from_dates(list(_activity_dates(child, child_id)) + list(days))
+    return state
+
+
 def hash_password(password):
     """Hash a password using bcrypt"""
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
@@ -91,7 +512,7 @@ class UserDB:
         if database is None:
             return False, "Database connection failed"
         
-        users = database['users']
+        users = _users_collection(database)
         
         # Check if user already exists
         if users.find_one({'email': email}):
@@ -129,7 +550,8 @@ class UserDB:
             user_doc['daily_used_minutes_today'] = 0  # Used minutes today (resets daily)
             user_doc['daily_earned_minutes_today'] = 0  # Earned minutes awarded today (resets daily)
             user_doc['last_daily_reset_date'] = datetime.utcnow().date().isoformat()  # Date of last daily reset
-            user_doc['parent_messages'] = []  # Messages from parent
+            user_doc['parent_messages'] = []  # Messages from parent (most recent PARENT_MESSAGES_LIMIT)
+            user_doc['unread_message_count'] = 0
             user_doc['activity_dates'] = []  # Array of dates with activities (ISO format YYYY-MM-DD)
             user_doc['timer_running'] = False  # Is timer currently running
             user_doc['timer_started_at'] = None  # When timer was started
@@ -147,24 +569,118 @@ class UserDB:
         if database is None:
             return None
         
-        users = database['users']
+        users = _users_collection(database)
         return users.find_one({'email': email})
     
     @staticmethod
     def get_user_by_id(user_id):
-        """Get user by ID"""
+        """Get user by ID.
+
+        Within a Flask request the document is served from a request-scoped
+        identity map, so repeated lookups of the same user cost one round trip.
+        Prefer get_user_view() when only a few fields are needed.
+        """
+        cache = _request_user_cache()
+        entry = cache.get(str(user_id)) if cache is not None else None
+        if entry is not None and entry['fields'] is None:
+            return entry['doc']
+
         database = get_db()
         if database is None:
             return None
         
         from bson import ObjectId
-        users = database['users']
+        users = _users_collection(database)
         
         try:
-            return users.find_one({'_id': ObjectId(user_id)})
+            user = users.find_one({'_id': ObjectId(user_id)})
         except:
             return None
-    
+
+        if cache is not None and user is not None:
+            if entry is not None:
+                # Keep the same dict so earlier view callers see the full document too
+                entry['doc'].update(user)
+                user = entry['doc']
+            cache[str(user_id)] = {'doc': user, 'fields': None}
+        return user
+
+    @staticmethod
+    def get_user_view(user_id, *views):
+        """Get only the fields of a user that the named views need.
+
+        views: names from USER_VIEWS ('identity', 'balance', 'streak', ...) and/or
+        raw field names. Within a request, fields already loaded for this user are
+        not fetched again and new ones are merged into the cached document.
+        Returns a dict with `_id` plus the requested fields that exist, or None.
+        """
+        fields = _view_fields(views)
+        cache = _request_user_cache()
+        entry = cache.get(str(user_id)) if cache is not None else None
+        if entry is not None:
+            if entry['fields'] is None or fields <= entry['fields']:
+                return entry['doc']
+            missing = fields - entry['fields']
+        else:
+            missing = fields
+
+        database = get_db()
+        if database is None:
+            return None
+
+        from bson import ObjectId
+        users = _users_collection(database)
+
+        try:
+            user = users.find_one({'_id': ObjectId(user_id)}, {f: 1 for f in missing})
+        except Exception:
+            return None
+        if user is None:
+            return None
+
+        if cache is not None:
+            if entry is not None:
+                entry['doc'].update(user)
+                entry['fields'] |= missing
+                return entry['doc']
+            cache[str(user_id)] = {'doc': user, 'fields': set(missing)}
+        return user
+
+    @staticmethod
+    def invalidate_cached_user(user_id):
+        """Forget any request-cached copy of a user after writing to it outside UserDB."""
+        _invalidate_cached_user(user_id)
+
+    @staticmethod
+    def add_credit_listener(listener):
+        """Register fn(user_id, minutes) to run after earned_game_time changes.
+
+        minutes is None when the new total is not a simple credit (daily reset,
+        deletion, direct writes reported through notify_earned_changed()).
+        """
+        if listener not in _credit_listeners:
+            _credit_listeners.append(listener)
+
+    @staticmethod
+    def notify_earned_changed(user_id):
+        """Report a write to earned_game_time made outside UserDB."""
+        _invalidate_cached_user(user_id)
+        _notify_credit(user_id, None)
+        events.publish(user_id, 'balance')
+
+    @staticmethod
+    def bump_state_version(user_id):
+        """Mark a user's polled responses stale after a write outside UserDB (e.g. to `activities`)."""
+        database = get_db()
+        if database is None:
+            return
+        from bson import ObjectId
+        try:
+            _users_collection(database).update_one({'_id': ObjectId(user_id)}, {'$inc': {STATE_VERSION_FIELD: 1}})
+            _invalidate_cached_user(user_id)
+        except Exception as e:
+            logger.warning(f"Could not bump state version for {user_id}: {e}")
+
     @staticmethod
     def verify_login(email, password):
         """Verify user email and password"""
@@ -193,7 +709,7 @@ class UserDB:
             return False
         
         from bson import ObjectId
-        users = database['users']
+        users = _users_collection(database)
         
         try:
             result = users.update_one(
@@ -207,15 +723,144 @@ class UserDB:
                     'strava_athlete_name': athlete_name
                 }}
             )
+            _invalidate_cached_user(user_id)
             return result.modified_count > 0
         except Exception as e:
             logger.exception("Error updating Strava credentials: %s", e)
             return False
     
+    @staticmethod
+    def get_users_by_ids(user_ids, *views):
+        """Resolve many users with one `$in` query.
+
+        user_ids: ObjectIds or id strings; invalid and duplicate ids are skipped.
+        views: as for get_user_view(); with no views the full documents are loaded.
+        Returns dict mapping the string id to the user document for every user found.
+        Users already cached in the request with the needed fields are not fetched again.
+        """
+        from bson import ObjectId
+        from bson.errors import InvalidId
+
+        fields = _view_fields(views) if views else None
+        cache = _request_user_cache()
+        found = {}
+        to_fetch = {}
+        for uid in user_ids or []:
+            key = str(uid)
+            if not key or key in found or key in to_fetch:
+                continue
+            entry = cache.get(key) if cache is not None else None
+            if entry is not None and (entry['fields'] is None or (fields is not None and fields <= entry['fields'])):
+                found[key] = entry['doc']
+                continue
+            try:
+                to_fetch[key] = uid if isinstance(uid, ObjectId) else ObjectId(key)
+            except (InvalidId, TypeError):
+                continue
+
+        if not to_fetch:
+            return found
+
+        database = get_db()
+        if database is None:
+            return found
+
+        projection = {f: 1 for f in fields} if fields is not None else None
+        try:
+            docs = database['users'].find({'_id': {'$in': list(to_fetch.values())}}, projection)
+        except Exception as e:
+            logger.exception("Error resolving users: %s", e)
+            return found
+
+        for doc in docs:
+            key = str(doc['_id'])
+            if cache is not None:
+                entry = cache.get(key)
+                if entry is None:
+                    cache[key] = {'doc': doc, 'fields': set(fields) if fields is not None else None}
+                else:
+                    # A partial view was cached; merge so earlier callers see the new fields
+                    entry['doc'].update(doc)
+                    entry['fields'] = None if fields is None else entry['fields'] | fields
+                    doc = entry['doc']
+            found[key] = doc
+        return found
+
+    @staticmethod
+    def get_user_by_strava_id(athlete_id, *views):
+        """Find the user connected to a Strava athlete id (projected to `views` if given), or None."""
+        database = get_db()
+        if database is None:
+            return None
+        projection = {f: 1 for f in _view_fields(views)} if views else None
+        try:
+            return database['users'].find_one({'strava_id': athlete_id}, projection)
+        except Exception as e:
+            logger.exception("Error finding user for Strava athlete %s: %s", athlete_id, e)
+            return None
+
+    @staticmethod
+    def clear_strava_credentials(user_id):
+        """Forget a user's Strava tokens (e.g. after they revoke access on Strava)."""
+        database = get_db()
+        if database is None:
+            return False
+
+        from bson import ObjectId
+        users = _users_collection(database)
+
+        try:
+            result = users.update_one(
+                {'_id': ObjectId(user_id)},
+                {'$set': {
+                    'strava_connected': False,
+                    'strava_access_token': None,
+                    'strava_refresh_token': None,
+                    'strava_token_expiry': None
+                }}
+            )
+            _invalidate_cached_user(user_id)
+            return result.modified_count > 0
+        except Exception as e:
+            logger.exception("Error clearing Strava credentials: %s", e)
+            return False
+
+    @staticmethod
+    def update_strava_sync(user_id, high_water=None, backfill_before=None, backfill_done=None):
+        """Advance a user's Strava sync cursors (`strava_sync` subdocument).
+
+        high_water: epoch of the newest activity imported; only ever moves forward.
+        backfill_before / backfill_done: how far back the history backfill has got.
+        """
+        database = get_db()
+        if database is None:
+            return False
+
+        from bson import ObjectId
+        users = _users_collection(database)
+
+        update = {}
+        if high_water is not None:
+            update['$max'] = {'strava_sync.high_water': int(high_water)}
+        sets = {'strava_sync.updated_at': datetime.utcnow()}
+        if backfill_before is not None:
+            sets['strava_sync.backfill_before'] = int(backfill_before)
+        if backfill_done is not None:
+            sets['strava_sync.backfill_done'] = bool(backfill_done)
+        update['$set'] = sets
+
+        try:
+            result = users.update_one({'_id': ObjectId(user_id)}, update)
+            _invalidate_cached_user(user_id)
+            return result.modified_count > 0
+        except Exception as e:
+            logger.exception("Error updating Strava sync state: %s", e)
+            return False
+
     @staticmethod
     def get_strava_token(user_id):
         """Get user's Strava access token"""
-        user = UserDB.get_user_by_id(user_id)
+        user = UserDB.get_user_view(user_id, 'strava')
         if user:
             return user.get('strava_access_token')
         return None
@@ -228,7 +873,7 @@ class UserDB:
             return False
         
         from bson import ObjectId
-        users = database['users']
+        users = _users_collection(database)
         
         try:
             result = users.update_one(
@@ -239,6 +884,7 @@ class UserDB:
                     'strava_token_expiry': expires_at
                 }}
             )
+            _invalidate_cached_user(user_id)
             return result.modified_count > 0
         except Exception as e:
             logger.exception("Error updating Strava token: %s", e)
@@ -252,7 +898,7 @@ class UserDB:
             return False
 
         from bson import ObjectId
-        users = database['users']
+        users = _users_collection(database)
 
         update_data = {'timer_running': bool(running)}
         if started_at is not None:
@@ -265,6 +911,7 @@ class UserDB:
                 {'_id': ObjectId(child_id)},
                 {'$set': update_data}
             )
+            _invalidate_cached_user(child_id)
             return result.modified_count > 0
         except Exception as e:
             logger.exception("Error setting timer state: %s", e)
@@ -273,7 +920,7 @@ class UserDB:
     @staticmethod
     def get_timer_info(child_id):
         """Return timer info for a child (timer_running and timer_started_at)"""
-        child = UserDB.get_user_by_id(child_id)
+        child = UserDB.get_user_view(child_id, 'timer')
         if not child:
             return {'timer_running': False, 'timer_started_at': None}
 
@@ -282,6 +929,103 @@ class UserDB:
             'timer_started_at': child.get('timer_started_at')
         }
 
+    @staticmethod
+    def start_timer(child_id, started_at, from_name, message):
+        """Start a child's timer and log the notification in a single write.
+
+        A timer that is already running keeps its original start time, so a
+        parent and child pressing start together cannot reset each other.
+        """
+        database = get_db()
+        if database is None:
+            return False
+
+        from bson import ObjectId
+        users = _users_collection(database)
+
+        try:
+            result = users.update_one(
+                {'_id': ObjectId(child_id), 'timer_running': {'$ne': True}},
+                _push_parent_message({'$set': {'timer_running': True, 'timer_started_at': started_at}}, from_name, message)
+            )
+            _invalidate_cached_user(child_id)
+            if result.matched_count:
+                return True
+            # Nothing matched: either the timer is already running or the child is gone
+            return users.count_documents({'_id': ObjectId(child_id)}, limit=1) > 0
+        except Exception as e:
+            logger.exception("Error starting timer: %s", e)
+            return False
+
+    @staticmethod
+    def stop_timer(child_id, stopped_at, from_name, message_prefix):
+        """Stop a child's timer, charge the elapsed minutes and log a message in one write.
+
+        The update is conditional on the `timer_started_at` value that was read,
+        so when two callers stop the same timer only one of them charges the time.
+        `message_prefix` is the start of the notification text; the recorded
+        duration (or the reason nothing was recorded) is appended to it.
+
+        Returns dict with keys: stopped (bool), minutes_recorded (float), reason (str or None)
+        """
+        database = get_db()
+        if database is None:
+            return {'stopped': False, 'minutes_recorded': 0, 'reason': 'db unavailable'}
+
+        from bson import ObjectId
+        users = _users_collection(database)
+
+        child = UserDB.get_user_view(child_id, 'timer')
+        started_at = child.get('timer_started_at') if child else None
+
+        started_dt = None
+        try:
+            if isinstance(started_at, str):
+                started_dt = datetime.fromisoformat(started_at)
+            else:
+                started_dt = started_at
+        except Exception:
+            started_dt = None
+
+        try:
+            if not started_dt:
+                reason = 'invalid start time' if started_at else 'no running timer found'
+                users.update_one(
+                    {'_id': ObjectId(child_id)},
+                    _push_parent_message(
+                        {'$set': {'timer_running': False, 'timer_started_at': None}},
+                        from_name, f"{message_prefix} ({reason})"
+                    )
+                )
+                _invalidate_cached_user(child_id)
+                return {'stopped': False, 'minutes_recorded': 0, 'reason': reason}
+
+            elapsed_seconds = (stopped_at - started_dt).total_seconds()
+            # Decimal minutes to 0.01 min (0.6 s) so short sessions are still charged
+            minutes_used = max(0, round(elapsed_seconds / 60.0, 2))
+
+            total_seconds = int(elapsed_seconds)
+            display_minutes = total_seconds // 60
+            display_seconds = total_seconds % 60
+            time_display = f"{display_minutes}m {display_seconds}s" if display_seconds > 0 else f"{display_minutes}m"
+            message = f"{message_prefix}. Recorded {time_display} ({minutes_used} min)."
+
+            result = users.update_one(
+                {'_id': ObjectId(child_id), 'timer_started_at': started_at},
+                _push_parent_message({
+                    '$inc': {'used_game_time': minutes_used},
+                    '$set': {'timer_running': False, 'timer_started_at': None}
+                }, from_name, message)
+            )
+            _invalidate_cached_user(child_id)
+            if not result.matched_count:
+                # Someone else stopped (or restarted) the timer between our read and write
+                return {'stopped': False, 'minutes_recorded': 0, 'reason': 'timer already stopped'}
+            return {'stopped': True, 'minutes_recorded': minutes_used, 'reason': None}
+        except Exception as e:
+            logger.exception("Error stopping timer: %s", e)
+            return {'stopped': False, 'minutes_recorded': 0, 'reason': 'update failed'}
+
     @staticmethod
     def add_child(parent_id, child_email, child_password, child_name):
         """Add a child to parent's account"""
@@ -290,7 +1034,7 @@ class UserDB:
             return False, "Database connection failed"
         
         from bson import ObjectId
-        users = database['users']
+        users = _users_collection(database)
         
         # Create child user first
         success, child_id = UserDB.create_user(child_email, child_password, child_name, is_parent=False)
@@ -303,12 +1047,14 @@ class UserDB:
                 {'_id': ObjectId(parent_id)},
                 {'$push': {'children': ObjectId(child_id)}}
             )
+            _invalidate_cached_user(parent_id)
             
             # Set parent_id on child
             users.update_one(
                 {'_id': ObjectId(child_id)},
                 {'$set': {'parent_id': ObjectId(parent_id)}}
             )
+            _invalidate_cached_user(child_id)
             
             return True, str(child_id)
         except Exception as e:
@@ -323,17 +1069,17 @@ class UserDB:
             return []
         
         from bson import ObjectId
-        parent = UserDB.get_user_by_id(parent_id)
+        parent = UserDB.get_user_view(parent_id, 'relations')
         if not parent or parent.get('account_type') != 'parent':
             return []
         
-        users = database['users']
         children_ids = parent.get('children', [])
+        children_by_id = UserDB.get_users_by_ids(children_ids, 'child_summary')
         children = []
         
         from datetime import datetime
         for child_id in children_ids:
-            child = users.find_one({'_id': child_id})
+            child = children_by_id.get(str(child_id))
             if child:
                 # Compute used time including any currently running timer
                 used = child.get('used_game_time', 0)
@@ -364,7 +1110,7 @@ class UserDB:
                     'weekly_screen_time_limit': child.get('weekly_screen_time_limit', 420),
                     'timer_running': timer_running,
                     'timer_started_at': child.get('timer_started_at'),
-                    'activity_dates': child.get('activity_dates', [])
+                    'streak_count': streaks.streak_length(child.get('streak_state'))
                 })
         
         return children
@@ -377,7 +1123,7 @@ class UserDB:
             return False
         
         from bson import ObjectId
-        users = database['users']
+        users = _users_collection(database)
         
         update_data = {}
         if daily_limit is not None:
@@ -390,6 +1136,7 @@ class UserDB:
                 {'_id': ObjectId(child_id)},
                 {'$set': update_data}
             )
+            _invalidate_cached_user(child_id)
             return result.modified_count > 0
         except Exception as e:
             logger.exception("Error updating screen time limits: %s", e)
@@ -403,13 +1150,16 @@ class UserDB:
             return False
         
         from bson import ObjectId
-        users = database['users']
+        users = _users_collection(database)
         
         try:
             result = users.update_one(
                 {'_id': ObjectId(child_id)},
                 {'$inc': {'earned_game_time': minutes}}
             )
+            _invalidate_cached_user(child_id)
+            if result.modified_count:
+                _notify_credit(child_id, minutes)
             return result.modified_count > 0
         except Exception as e:
             logger.exception("Error adding earned game time: %s", e)
@@ -431,7 +1181,7 @@ class UserDB:
             return False
 
         from bson import ObjectId
-        users = database['users']
+        users = _users_collection(database)
 
         try:
             # Increment earned_game_time (persistent across days)
@@ -441,11 +1191,119 @@ class UserDB:
                 inc_fields['daily_earned_minutes_today'] = int(minutes)
 
             result = users.update_one({'_id': ObjectId(child_id)}, {'$inc': inc_fields})
+            _invalidate_cached_user(child_id)
+            if result.modified_count:
+                _notify_credit(child_id, int(minutes))
             return result.modified_count > 0
         except Exception as e:
             logger.exception("Error adding earned game time: %s", e)
             return False
 
+    @staticmethod
+    def apply_activity_credits(child_id, earned_minutes, earned_today=0, activity_dates=None, token=None):
+        """Credit a batch of activity minutes and record their dates in one update.
+
+        `earned_minutes` is the total for the batch; `earned_today` is the part
+        that came from today's activities and is also tracked in
+        `daily_earned_minutes_today`. `activity_dates` are added to
+        `activity_dates` and folded into `streak_state` without granting
+        streak rewards. With a `token`, a credit already applied under it (one
+        of the user's last CREDIT_TOKEN_HISTORY) is not applied again and
+        counts as a success, so an interrupted credit can be retried.
+        """
+        database = get_db()
+        if database is None:
+            return False
+
+        from bson import ObjectId
+        users = _users_collection(database)
+
+        update = {}
+        inc_fields = {}
+        if earned_minutes:
+            inc_fields['earned_game_time'] = int(earned_minutes)
+        if earned_today:
+            inc_fields['daily_earned_minutes_today'] = int(earned_today)
+        if inc_fields:
+            update['$inc'] = inc_fields
+
+        if not update and not activity_dates:
+            return True
+
+        try:
+            for _ in range(3):
+                query = {'_id': ObjectId(child_id)}
+                if activity_dates:
+                    # Backfilled dates move the stored streak state; guard it like record_activity_date
+                    child = UserDB.get_user_view(child_id, 'streak')
+                    if not child:
+                        return False
+                    query['streak_state'] = child.get('streak_state')
+                    update['$addToSet'] = {'activity_dates': {'$each': sorted(set(activity_dates))}}
+                    update['$set'] = {'streak_state': _streak_state_after(child, child_id, activity_dates)}
+
+                if token:
+                    query['activity_credit_tokens'] = {'$ne': token}
+                    update['$push'] = {'activity_credit_tokens': {'$each': [token], '$slice': -CREDIT_TOKEN_HISTORY}}
+
+                result = users.update_one(query, update)
+                _invalidate_cached_user(child_id)
+                if result.matched_count > 0 and earned_minutes:
+                    _notify_credit(child_id, int(earned_minutes))
+                if result.matched_count > 0:
+                    return True
+                if token and users.find_one({'_id': ObjectId(child_id), 'activity_credit_tokens': token}, {'_id': 1}):
+                    return True
+                if not activity_dates:
+                    return False
+            return False
+        except Exception as e:
+            logger.exception("Error applying activity credits: %s", e)
+            return False
+
+    @staticmethod
+    def apply_credit_adjustments(adjustments, token=None):
+        """Apply signed earned-minute corrections with one update per user in one bulk_write.
+
+        adjustments: {user_id: (earned_delta, today_delta)}; today_delta also
+            moves `daily_earned_minutes_today`. A (0, 0) entry only bumps the
+            user's state_version, e.g. after their activities were rewritten.
+        token: when given, a user already adjusted under this token is skipped,
+            so a batch can be replayed safely after a crash.
+        Returns the number of users modified, or None if the write failed.
+        """
+        database = get_db()
+        if database is None:
+            return None
+
+        from bson import ObjectId
+        from pymongo import UpdateOne
+
+        ops = []
+        for user_id, (earned_delta, today_delta) in adjustments.items():
+            inc_fields = {}
+            if earned_delta:
+                inc_fields['earned_game_time'] = int(earned_delta)
+            if today_delta:
+                inc_fields['daily_earned_minutes_today'] = int(today_delta)
+            query = {'_id': ObjectId(user_id)}
+            update = {'$inc': inc_fields} if inc_fields else {}
+            if token:
+                query['credit_adjustment_token'] = {'$ne': token}
+                update['$set'] = {'credit_adjustment_token': token}
+            ops.append(UpdateOne(query, _versioned(update)))
+        if not ops:
+            return 0
+
+        try:
+            result = database['users'].bulk_write(ops, ordered=False)
+        except Exception as e:
+            logger.exception("Error applying credit adjustments: %s", e)
+            return None
+        for user_id in adjustments:
+            UserDB.notify_earned_changed(user_id)
+        return result.modified_count
+
     @staticmethod
     def use_game_time(child_id, minutes):
         """Deduct game time from child's available time"""
@@ -454,13 +1312,14 @@ class UserDB:
             return False
         
         from bson import ObjectId
-        users = database['users']
+        users = _users_collection(database)
         
         try:
             result = users.update_one(
                 {'_id': ObjectId(child_id)},
                 {'$inc': {'used_game_time': minutes}}
             )
+            _invalidate_cached_user(child_id)
             return result.modified_count > 0
         except Exception as e:
             logger.exception("Error using game time: %s", e)
@@ -469,7 +1328,7 @@ class UserDB:
     @staticmethod
     def get_current_used_including_running(child_id):
         """Return used game time (minutes) including any currently running timer elapsed minutes."""
-        child = UserDB.get_user_by_id(child_id)
+        child = UserDB.get_user_view(child_id, 'balance')
         if not child:
             return 0
 
@@ -497,7 +1356,7 @@ class UserDB:
     @staticmethod
     def get_child_game_time_balance(child_id):
         """Get remaining game time balance for a child"""
-        child = UserDB.get_user_by_id(child_id)
+        child = UserDB.get_user_view(child_id, 'balance')
         if not child:
             return 0
         
@@ -514,108 +1373,166 @@ class UserDB:
             return False
         
         from bson import ObjectId
-        users = database['users']
+        users = _users_collection(database)
         
         try:
-            message_doc = {
-                'from_parent': parent_name,
-                'message': message,
-                'bonus_minutes': minutes,
-                'created_at': datetime.utcnow(),
-                'read': False
-            }
-            
             result = users.update_one(
                 {'_id': ObjectId(child_id)},
-                {'$push': {'parent_messages': message_doc}}
+                _push_parent_message({}, parent_name, message, minutes)
             )
+            _invalidate_cached_user(child_id)
             return result.modified_count > 0
         except Exception as e:
             logger.exception("Error adding parent message: %s", e)
             return False
 
     @staticmethod
-    def get_parent_messages(child_id):
-        """Get all messages from parent for a child"""
-        child = UserDB.get_user_by_id(child_id)
+    def get_parent_messages(child_id, before=None, limit=20):
+        """Get a page of messages from parent for a child, most recent first.
+
+        before: id of the last message on the previous page (None => newest page).
+        Returns dict with keys: messages (list), next_cursor (str or None), unread_count (int)
+        """
+        empty = {'messages': [], 'next_cursor': None, 'unread_count': 0}
+        database = get_db()
+        if database is None:
+            return empty
+
+        from bson import ObjectId
+        # Read path: the counter backfill below does not change what clients see,
+        # so it does not bump state_version
+        users = database['users']
+
+        try:
+            # Only the message window is needed, not the rest of the user document
+            child = users.find_one(
+                {'_id': ObjectId(child_id)},
+                {'parent_messages': 1, 'unread_message_count': 1}
+            )
+        except Exception as e:
+            logger.exception("Error loading parent messages: %s", e)
+            return empty
         if not child:
-            return []
-        
-        messages = child.get('parent_messages', [])
-        # Sort by most recent first
-        return sorted(messages, key=lambda x: x.get('created_at', datetime.utcnow()), reverse=True)
+            return empty
+
+        stored = child.get('parent_messages', [])
+        messages = list(reversed(stored))
+        if any('id' not in msg for msg in stored):
+            # Messages written before ids were assigned are addressed by timestamp. The id is
+            # stored too, so mark_message_as_read can find them (a lost race retries next read).
+            original = [dict(msg) for msg in stored]
+            for msg in messages:
+                if 'id' not in msg:
+                    msg['id'] = _legacy_message_id(msg)
+            try:
+                users.update_one({'_id': ObjectId(child_id), 'parent_messages': original},
+                                 {'$set': {'parent_messages': stored}})
+                _invalidate_cached_user(child_id)
+            except Exception as e:
+                logger.warning("Could not store message ids for %s: %s", child_id, e)
+
+        start = 0
+        if before:
+            ids = [m['id'] for m in messages]
+            start = ids.index(before) + 1 if before in ids else len(messages)
+        limit = max(1, int(limit))
+        page = messages[start:start + limit]
+        next_cursor = page[-1]['id'] if page and start + limit < len(messages) else None
+
+        stored_count = child.get('unread_message_count')
+        # The window is already loaded, so count it. The stored counter drifts when a push slices an
+        # unread message out of the window, and is missing on documents from before it existed.
+        unread_count = sum(1 for m in messages if not m.get('read'))
+        if stored_count != unread_count:
+            try:
+                users.update_one(
+                    {'_id': ObjectId(child_id), 'unread_message_count': stored_count},
+                    {'$set': {'unread_message_count': unread_count}}
+                )
+                _invalidate_cached_user(child_id)
+            except Exception as e:
+                logger.warning("Could not store unread count for %s: %s", child_id, e)
+
+        return {'messages': page, 'next_cursor': next_cursor, 'unread_count': unread_count}
 
     @staticmethod
-    def mark_message_as_read(child_id, message_index):
-        """Mark a message as read"""
+    def mark_message_as_read(child_id, message_id):
+        """Mark one message as read by its id; the unread count drops only if it was unread."""
         database = get_db()
         if database is None:
             return False
         
         from bson import ObjectId
-        users = database['users']
+        users = _users_collection(database)
         
+        match = {'id': message_id, 'read': False}
+        try:
+            # Legacy messages whose id was never stored are matched by the timestamp their id came from
+            match = {'$or': [match, {'id': {'$exists': False}, 'created_at': datetime.fromisoformat(message_id),
+                                     'read': {'$ne': True}}]}
+        except (TypeError, ValueError):
+            pass
+
         try:
             result = users.update_one(
-                {'_id': ObjectId(child_id)},
-                {'$set': {f'parent_messages.{message_index}.read': True}}
+                {'_id': ObjectId(child_id), 'parent_messages': {'$elemMatch': match}},
+                {'$set': {'parent_messages.$.read': True}, '$inc': {'unread_message_count': -1}}
             )
+            _invalidate_cached_user(child_id)
             return result.modified_count > 0
         except Exception as e:
             logger.exception("Error marking message as read: %s", e)
             return False
 
+    @staticmethod
+    def mark_all_messages_read(child_id):
+        """Mark every message in the window as read and clear the unread count."""
+        database = get_db()
+        if database is None:
+            return False
+
+        from bson import ObjectId
+        users = _users_collection(database)
+
+        try:
+            result = users.update_one(
+                {'_id': ObjectId(child_id), 'parent_messages.0': {'$exists': True}},
+                {'$set': {'parent_messages.$[].read': True, 'unread_message_count': 0}}
+            )
+            _invalidate_cached_user(child_id)
+            return result.matched_count > 0
+        except Exception as e:
+            logger.exception("Error marking messages as read: %s", e)
+            return False
+
     @staticmethod
     def calculate_current_streak(child_id):
-        """Calculate current streak from activity_dates array.
-        
-        Returns the length of the most recent consecutive day streak.
+        """Return the length of the most recent consecutive day streak.
+
+        Read from the stored `streak_state`. Documents written before the state
+        existed get it rebuilt from `activity_dates` once and saved.
         """
-        child = UserDB.get_user_by_id(child_id)
+        child = UserDB.get_user_view(child_id, 'streak')
         if not child:
             return 0
-        
-        activity_dates = child.get('activity_dates', [])
-        if not activity_dates:
-            return 0
-        
-        # Filter and deduplicate valid dates, sort descending (newest first)
-        from datetime import datetime, timedelta
-        valid_dates = []
-        for date_str in activity_dates:
-            try:
-                # Parse date, handling various formats
-                if isinstance(date_str, str):
-                    if 'T' in date_str:
-                        date_str = date_str.split('T')[0]
-                    parsed_date = datetime.fromisoformat(date_str).date()
-                    valid_dates.append(parsed_date)
-            except (ValueError, AttributeError):
-                logger.debug("Invalid date format in activity_dates: %s", date_str)
-                continue
-        
-        if not valid_dates:
-            return 0
-        
-        # Remove duplicates and sort (newest first)
-        unique_dates = sorted(set(valid_dates), reverse=True)
-        
-        # Count consecutive days from the most recent date
-        streak = 1
-        most_recent = unique_dates[0]
-        
-        for i in range(1, len(unique_dates)):
-            current_date = unique_dates[i]
-            expected_date = most_recent - timedelta(days=i)
-            
-            if current_date == expected_date:
-                streak += 1
-            else:
-                # Streak broken
-                logger.debug("Streak broken at position %d: current=%s expected=%s", i, current_date, expected_date)
-                break
-        
-        logger.debug("calculate_current_streak: child=%s unique_dates=%d streak=%d", child_id, len(unique_dates), streak)
+
+        state = _current_streak_state(child, child_id)
+        if state is not None and child.get('streak_state') is None:
+            database = get_db()
+            if database is not None:
+                from bson import ObjectId
+                try:
+                    database['users'].update_one(
+                        {'_id': ObjectId(child_id), 'streak_state': {'$exists': False}},
+                        {'$set': {'streak_state': state}}
+                    )
+                    # Keep the cached document in step instead of dropping it
+                    child['streak_state'] = state
+                except Exception as e:
+                    logger.warning("Could not store streak state for %s: %s", child_id, e)
+
+        streak = streaks.streak_length(state)
+        logger.debug("calculate_current_streak: child=%s streak=%d", child_id, streak)
         return streak
     
     @staticmethod
@@ -634,8 +1551,8 @@ class UserDB:
         from bson import ObjectId
         from datetime import datetime, timedelta
         
-        users = database['users']
-        child = UserDB.get_user_by_id(child_id)
+        users = _users_collection(database)
+        child = UserDB.get_user_view(child_id, 'streak')
         if not child:
             return {'applied': False, 'reason': 'child not found', 'streak_count': 0, 'reward_minutes': 0}
         
@@ -651,31 +1568,7 @@ class UserDB:
         else:
             activity_day = datetime.utcnow().date().isoformat()
         
-        # Check if this date is already recorded
-        existing_dates = child.get('activity_dates', [])
-        if activity_day in existing_dates:
-            logger.debug("record_activity_date: child=%s date=%s already recorded", child_id, activity_day)
-            # Already recorded for this day - no new streak reward
-            streak = UserDB.calculate_current_streak(child_id)
-            return {'applied': False, 'reason': 'already recorded', 'streak_count': streak, 'reward_minutes': 0}
-        
-        # Calculate what the streak will be with this new activity
-        temp_dates = existing_dates + [activity_day]
-        sorted_dates = sorted(set(temp_dates), reverse=True)
-        
-        # Count consecutive days from the most recent date
-        streak = 1
-        if len(sorted_dates) > 1:
-            most_recent = datetime.fromisoformat(sorted_dates[0]).date()
-            for i in range(1, len(sorted_dates)):
-                current_date = datetime.fromisoformat(sorted_dates[i]).date()
-                expected_date = most_recent - timedelta(days=i)
-                if current_date == expected_date:
-                    streak += 1
-                else:
-                    break
-        
-        # Calculate reward based on streak
+        # Calculate reward settings once; they don't change between attempts
         parent_id = child.get('parent_id')
         settings = {'base_minutes': 5, 'increment_minutes': 2, 'cap_minutes': 60}
         if parent_id:
@@ -688,59 +1581,77 @@ class UserDB:
         inc = int(settings.get('increment_minutes', 2))
         cap = int(settings.get('cap_minutes', 60))
         
-        reward = base + (max(0, streak - 1) * inc)
-        if cap and reward > cap:
-            reward = cap
-        
-        logger.debug("record_activity_date: child=%s date=%s streak=%s reward=%s", child_id, activity_day, streak, reward)
-        
-        # Add activity date and reward time
-        try:
-            today_str = datetime.utcnow().date().isoformat()
-            is_today = (activity_day == today_str)
+        today_str = datetime.utcnow().date().isoformat()
+        is_today = (activity_day == today_str)
+        
+        # The write is conditional on the date being new and on the streak state we
+        # read, so a concurrent recording of another day makes us re-read and retry.
+        for _ in range(3):
+            stored_state = child.get('streak_state')
+            state = _current_streak_state(child, child_id)
+            known = streaks.contains(state, activity_day)
+            if known is None:
+                # Older than the state's window
+                known = activity_day in _activity_dates(child, child_id)
+            if known:
+                logger.debug("record_activity_date: child=%s date=%s already recorded", child_id, activity_day)
+                return {'applied': False, 'reason': 'already recorded', 'streak_count': streaks.streak_length(state), 'reward_minutes': 0}
             
-            # Add the activity date to the array and earned time
-            update_fields = {
-                '$push': {'activity_dates': activity_day},
-            }
+            new_state = _streak_state_after(child, child_id, [activity_day])
+            streak = streaks.streak_length(new_state)
             
-            if grant_reward:
-                update_fields['$inc'] = {'earned_game_time': int(reward)}
-                # If today's activity, also track in daily_earned_minutes_today
-                if is_today:
-                    update_fields['$inc']['daily_earned_minutes_today'] = int(reward)
+            reward = base + (max(0, streak - 1) * inc)
+            if cap and reward > cap:
+                reward = cap
             
-            res = users.update_one({'_id': ObjectId(child_id)}, update_fields)
-            logger.debug("record_activity_date: update result matched=%s modified=%s", 
-                        getattr(res, 'matched_count', None), getattr(res, 'modified_count', None))
+            logger.debug("record_activity_date: child=%s date=%s streak=%s reward=%s", child_id, activity_day, streak, reward)
             
-            if notify and grant_reward:
-                try:
-                    parent = None
-                    if parent_id:
-                        parent = users.find_one({'_id': parent_id})
-                    parent_name = parent.get('name') if parent else 'Your Parent'
-                    msg = f"Earned {reward} min for {streak}-day streak ({activity_day})."
-                    users.update_one({'_id': ObjectId(child_id)},
-                        {'$push': {'parent_messages': {
-                            'from_parent': parent_name,
-                            'message': msg,
-                            'bonus_minutes': reward,
-                            'created_at': datetime.utcnow(),
-                            'read': False
-                        }}})
-                except Exception:
-                    pass
-            
-            return {'applied': True, 'streak_count': streak, 'reward_minutes': reward}
-        except Exception as e:
-            logger.exception("Error recording activity date: %s", e)
-            return {'applied': False, 'reason': 'update failed', 'streak_count': 0, 'reward_minutes': 0}
+            # Add activity date, streak state, reward time and notification in one conditional write.
+            try:
+                update_fields = {
+                    '$push': {'activity_dates': activity_day},
+                    '$set': {'streak_state': new_state},
+                }
+                
+                if grant_reward:
+                    update_fields['$inc'] = {'earned_game_time': int(reward)}
+                    # If today's activity, also track in daily_earned_minutes_today
+                    if is_today:
+                        update_fields['$inc']['daily_earned_minutes_today'] = int(reward)
+
+                    if notify:
+                        parent = UserDB.get_user_view(str(parent_id), 'identity') if parent_id else None
+                        parent_name = parent.get('name') if parent else 'Your Parent'
+                        msg = f"Earned {reward} min for {streak}-day streak ({activity_day})."
+                        _push_parent_message(update_fields, parent_name, msg, reward)
+                
+                res = users.update_one(
+                    {'_id': ObjectId(child_id), 'activity_dates': {'$ne': activity_day}, 'streak_state': stored_state},
+                    update_fields
+                )
+                _invalidate_cached_user(child_id)
+                logger.debug("record_activity_date: update result matched=%s modified=%s", 
+                            getattr(res, 'matched_count', None), getattr(res, 'modified_count', None))
+            except Exception as e:
+                logger.exception("Error recording activity date: %s", e)
+                return {'applied': False, 'reason': 'update failed', 'streak_count': 0, 'reward_minutes': 0}
+
+            if res.matched_count:
+                if grant_reward:
+                    _notify_credit(child_id, int(reward))
+                return {'applied': True, 'streak_count': streak, 'reward_minutes': reward}
+
+            # Another request recorded a day between our read and write
+            child = UserDB.get_user_view(child_id, 'streak')
+            if not child:
+                return {'applied': False, 'reason': 'child not found', 'streak_count': 0, 'reward_minutes': 0}
+
+        return {'applied': False, 'reason': 'concurrent update', 'streak_count': UserDB.calculate_current_streak(child_id), 'reward_minutes': 0}
 
     @staticmethod
     def get_parent_streak_settings(parent_id):
         """Return parent's streak reward settings or defaults."""
-        parent = UserDB.get_user_by_id(parent_id)
+        parent = UserDB.get_user_view(parent_id, 'streak_settings')
         if not parent:
             return {'base_minutes': 5, 'increment_minutes': 2, 'cap_minutes': 60}
 
@@ -758,7 +1669,7 @@ class UserDB:
             return False
 
         from bson import ObjectId
-        users = database['users']
+        users = _users_collection(database)
         update = {}
         if base_minutes is not None:
             update['streak_reward_base_minutes'] = int(base_minutes)
@@ -771,7 +1682,13 @@ class UserDB:
             return True
 
         try:
-            users.update_one({'_id': ObjectId(parent_id)}, {'$set': update})
+            parent = users.find_one_and_update({'_id': ObjectId(parent_id)}, {'$set': update},
+                                               projection={'children': 1})
+            _invalidate_cached_user(parent_id)
+            # Children's balance responses embed these settings
+            children = (parent or {}).get('children') or []
+            if children:
+                users.update_many({'_id': {'$in': children}}, {'$inc': {STATE_VERSION_FIELD: 1}})
             return True
         except Exception as e:
             logger.exception("Error setting parent streak settings: %s", e)
@@ -798,50 +1715,34 @@ class UserDB:
             return
         
         from bson import ObjectId
-        users = database['users']
+        users = _users_collection(database)
         
         try:
-            child = UserDB.get_user_by_id(child_id)
-            if not child:
-                return
-            
             today_str = datetime.utcnow().date().isoformat()
-            last_reset = child.get('last_daily_reset_date')
-            
-            # If last_reset is not set or is a different day, reset
-            if not last_reset or str(last_reset) != today_str:
-                logger.debug("reset_daily_used_if_needed: child=%s last_reset=%s today=%s - resetting", child_id, last_reset, today_str)
-                
-                # Reset daily usage, timer state, and track reset date
-                # Also revert any earned minutes that were awarded today so they don't carry across days
-                daily_earned = int(child.get('daily_earned_minutes_today', 0) or 0)
-                updates = {
-                    '$set': {
-                        'daily_used_minutes_today': 0,
-                        'timer_running': False,
-                        'timer_started_at': None,
-                        'last_daily_reset_date': today_str,
-                        'daily_earned_minutes_today': 0
-                    }
-                }
 
-                # If there were daily earned minutes, subtract them from persistent earned_game_time
-                # (daily_screen_time_limit never changes - it's the base)
-                if daily_earned > 0:
-                    # Ensure we don't underflow earned_game_time
-                    try:
-                        # Use $inc with negative value to subtract only from earned_game_time
-                        users.update_one({'_id': ObjectId(child_id)}, {'$inc': {'earned_game_time': -int(daily_earned)}})
-                    except Exception:
-                        # If decrement fails, continue to at least reset daily fields
-                        pass
-
-                result = users.update_one(
-                    {'_id': ObjectId(child_id)},
-                    updates
-                )
-                
-                logger.debug("reset_daily_used_if_needed: reset completed, modified=%s", getattr(result, 'modified_count', None))
+            # Single pipeline update: the filter only matches when the stored reset date
+            # is stale, and today's earned bonus is reverted from earned_game_time in the
+            # same write (daily_screen_time_limit never changes - it's the base).
+            result = users.update_one(
+                {'_id': ObjectId(child_id), 'last_daily_reset_date': {'$ne': today_str}},
+                [{'$set': {
+                    'earned_game_time': {'$subtract': [
+                        {'$ifNull': ['$earned_game_time', 0]},
+                        {'$max': [0, {'$ifNull': ['$daily_earned_minutes_today', 0]}]}
+                    ]},
+                    'daily_used_minutes_today': 0,
+                    'timer_running': False,
+                    'timer_started_at': None,
+                    'last_daily_reset_date': today_str,
+                    'daily_earned_minutes_today': 0
+                }}]
+            )
+
+            if result.modified_count:
+                _invalidate_cached_user(child_id)
+                # Today's bonus was taken back out of earned_game_time
+                _notify_credit(child_id, None)
+                logger.debug("reset_daily_used_if_needed: child=%s reset for %s", child_id, today_str)
         except Exception as e:
             logger.exception("Error resetting daily used time: %s", e)
 
@@ -853,7 +1754,7 @@ class UserDB:
             return False
         
         from bson import ObjectId
-        users = database['users']
+        users = _users_collection(database)
         
         try:
             # Remove child from parent's children list
@@ -861,9 +1762,12 @@ class UserDB:
                 {'_id': ObjectId(parent_id)},
                 {'$pull': {'children': ObjectId(child_id)}}
             )
+            _invalidate_cached_user(parent_id)
             
             # Delete the child user account
             result = users.delete_one({'_id': ObjectId(child_id)})
+            _invalidate_cached_user(child_id)
+            _notify_credit(child_id, None)
             return result.deleted_count > 0
         except Exception as e:
             logger.exception("Error deleting child: %s", e)
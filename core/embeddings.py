@@ -1,6 +1,64 @@
-"""Lightweight embeddings utilities with graceful degradation when
-heavy dependencies (sentence-transformers / scikit-learn) are not installed.
 """
+Persistent user embedding index for recommendations.
+
+Each `user_profiles` document is embedded once by the backend selected with
+`EMBEDDING_BACKEND` and stored on disk under `EMBEDDING_INDEX_DIR`:
+
+- `transformer` (default): the profile as text through sentence-transformers;
+- `numeric`: weekly_km, days since the last activity, the session cap, a
+  one-hot athlete cluster and the activity mix, standardised column by
+  column. No model is loaded, and encoding is plain arithmetic.
+
+Files:
+
+- `vectors-<version>.npy`: float32 matrix, one row per user (normalised for
+  the transformer backend, raw features for the numeric one),
+  opened memory-mapped so every gunicorn worker shares the OS page cache;
+- `index.json`: the row -> user_id map, a fingerprint of the profile fields
+  each row was encoded from, the backend name, the current vectors file and
+  (numeric backend) the column means and deviations.
+
+`get_index()` returns a long-lived in-process `EmbeddingIndex`. Queries are an
+exact cosine top-k (`top_k()`): one matrix product per `BLOCK_ROWS` rows of the
+mapped matrix, so a large index is never copied into memory whole. Nothing is
+re-encoded or refitted on the request path. At most every
+`EMBEDDING_REFRESH_SECONDS` a background thread reconciles the index with
+`user_profiles`. It re-encodes only profiles whose fields changed, drops
+deleted ones, then writes a new vectors file and swaps `index.json`
+atomically. Other processes pick the new files up on their next check instead
+of encoding the same profiles again.
+
+Degrades gracefully: with the transformer backend but no sentence-transformers
+(or before the first build finishes) `similar()` returns an empty list and
+callers fall back to rules.
+"""
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+
+from core.database import get_db
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+INDEX_DIR = os.getenv('EMBEDDING_INDEX_DIR', str(pathlib.Path(__file__).resolve().parent.parent / 'embeddings'))
+REFRESH_SECONDS = int(os.getenv('EMBEDDING_REFRESH_SECONDS', '300'))
+BACKEND = os.getenv('EMBEDDING_BACKEND', 'transformer')
+META_FILE = 'index.json'
+# Rows scored per matrix product when searching
+BLOCK_ROWS = 65536
+# Numeric features
+MIX_TYPES = ('run', 'ride', 'walk', 'other')
+CLUSTER_SLOTS = 8
+RECENCY_CAP_DAYS = 60
 
 _embed_model = None
 
@@ -15,83 +73,303 @@ def _get_model():
     except Exception:
         return None
     try:
-        _embed_model = SentenceTransformer('all-MiniLM-L6-v2')
+        _embed_model = SentenceTransformer(MODEL_NAME)
         return _embed_model
     except Exception:
         return None
 
 
-def _has_sklearn():
-    try:
-        from sklearn.neighbors import NearestNeighbors  # noqa: F401
-        return True
-    except Exception:
-        return False
+def _encode_with_model(texts):
+    model = _get_model()
+    if model is None:
+        return None
+    return model.encode(texts, convert_to_numpy=True)
 
 
-from core.database import get_db
+def profile_text(profile):
+    """The text a profile is embedded from; its hash decides whether a row is stale."""
+    weekly = profile.get('weekly_km', 0)
+    last = profile.get('last_activity')
+    return f"weekly_km:{weekly} last:{last} max_minutes:{profile.get('max_minutes_per_session', 120)}"
 
 
-def build_user_embeddings():
-    """Attempt to build an in-memory embeddings index. Returns None if resources
-    (sentence-transformers or scikit-learn) are unavailable.
-    """
-    db = get_db()
-    if db is None:
-        return None
+def _fingerprint(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
 
-    profiles = list(db['user_profiles'].find({}))
-    texts = []
-    ids = []
-    for p in profiles:
-        uid = p.get('user_id')
-        weekly = p.get('weekly_km', 0)
-        last = p.get('last_activity')
-        t = f"weekly_km:{weekly} last:{last} max_minutes:{p.get('max_minutes_per_session',120)}"
-        texts.append(t)
-        ids.append(uid)
-
-    if not texts:
-        return None
 
-    model = _get_model()
-    if model is None or not _has_sklearn():
-        # Dependencies not available locally; return None so caller can fallback
+def _normalise(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class TransformerBackend:
+    """Embeds `profile_text()` with sentence-transformers; rows are stored normalised."""
+
+    name = MODEL_NAME
+    fields = ('weekly_km', 'last_activity', 'max_minutes_per_session')
+
+    def __init__(self, encoder=None):
+        self.encoder = encoder or _encode_with_model
+
+    def key(self, profile):
+        return profile_text(profile)
+
+    def encode(self, profiles):
+        vectors = self.encoder([profile_text(p) for p in profiles])
+        return None if vectors is None else _normalise(vectors)
+
+    def scale(self, vectors):
         return None
 
+
+def _recency_days(last, now):
+    if isinstance(last, str):
+        try:
+            last = datetime.fromisoformat(last.replace('Z', ''))
+        except ValueError:
+            last = None
+    if not isinstance(last, datetime):
+        return RECENCY_CAP_DAYS
+    if last.tzinfo is not None:
+        last = last.replace(tzinfo=None) - last.utcoffset()
+    return min(max((now - last).days, 0), RECENCY_CAP_DAYS)
+
+
+def numeric_features(profile, now=None):
+    """Unscaled feature row: weekly_km, recency days, session cap, cluster one-hot, activity mix shares."""
+    now = now or datetime.utcnow()
+    cluster = [0.0] * CLUSTER_SLOTS
     try:
-        import numpy as np
-        from sklearn.neighbors import NearestNeighbors
-        vectors = model.encode(texts, convert_to_numpy=True)
-        nbrs = NearestNeighbors(n_neighbors=min(10, len(vectors)), metric='cosine')
-        nbrs.fit(vectors)
-        return {'model': model, 'nbrs': nbrs, 'vectors': vectors, 'ids': ids}
-    except Exception:
-        return None
+        slot = int(profile.get('athlete_cluster'))
+        if 0 <= slot < CLUSTER_SLOTS:
+            cluster[slot] = 1.0
+    except (TypeError, ValueError):
+        pass
+    mix = profile.get('activity_mix') or {}
+    return ([float(profile.get('weekly_km') or 0),
+             float(_recency_days(profile.get('last_activity'), now)),
+             float(profile.get('max_minutes_per_session') or 120)]
+            + cluster
+            + [float(mix.get(t) or 0) for t in MIX_TYPES])
+
+
+class NumericBackend:
+    """Standardised numeric profile features; no model to load."""
 
+    name = 'numeric-v1'
+    fields = ('weekly_km', 'last_activity', 'max_minutes_per_session', 'athlete_cluster', 'activity_mix')
 
-def query_similar_users(user_id, embeddings_index, topk=5):
-    """Return topk similar user_ids to given user_id using built index.
+    def key(self, profile):
+        # Recency is part of the key, so rows age by whole days as time passes
+        return ','.join(f'{x:.6g}' for x in numeric_features(profile))
 
-    If embeddings_index is None, returns empty list to signal fallback behavior.
+    def encode(self, profiles):
+        return np.array([numeric_features(p) for p in profiles], dtype=np.float32)
+
+    def scale(self, vectors):
+        mean = np.asarray(vectors, dtype=np.float64).mean(axis=0)
+        std = np.asarray(vectors, dtype=np.float64).std(axis=0)
+        std[std < 1e-6] = 1.0
+        return {'mean': mean.tolist(), 'std': std.tolist()}
+
+
+BACKENDS = {'transformer': TransformerBackend, 'numeric': NumericBackend}
+
+
+def _prepare(block, scale):
+    """Rows as unit vectors ready for cosine: stored rows are already normalised unless a scale applies."""
+    block = np.asarray(block, dtype=np.float32)
+    if scale is None:
+        return block
+    return _normalise((block - scale[0]) / scale[1])
+
+
+def top_k(vectors, query, k, scale=None, exclude=None, block_rows=BLOCK_ROWS):
+    """Rows of `vectors` with the highest cosine to `query`, best first.
+
+    Exact: every row is scored, `block_rows` at a time with one matrix product
+    per block, keeping a running top-k. `exclude` is a row to leave out.
     """
-    if embeddings_index is None:
-        return []
-    ids = embeddings_index.get('ids', [])
-    if user_id not in ids:
-        return []
-    try:
-        idx = ids.index(user_id)
-        vec = embeddings_index['vectors'][idx].reshape(1, -1)
-        dists, inds = embeddings_index['nbrs'].kneighbors(vec, n_neighbors=min(topk+1, len(ids)))
-        results = []
-        for i in inds[0]:
-            uid = ids[i]
-            if uid == user_id:
-                continue
-            results.append(uid)
-            if len(results) >= topk:
-                break
-        return results
-    except Exception:
-        return []
+    best_rows = np.empty(0, dtype=np.int64)
+    best_scores = np.empty(0, dtype=np.float32)
+    for start in range(0, len(vectors), block_rows):
+        scores = _prepare(vectors[start:start + block_rows], scale) @ query
+        if exclude is not None and start <= exclude < start + len(scores):
+            scores[exclude - start] = -np.inf
+        rows = np.concatenate([best_rows, np.arange(start, start + len(scores))])
+        scores = np.concatenate([best_scores, scores])
+        if len(scores) > k:
+            keep = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[keep], scores[keep]
+        best_rows, best_scores = rows, scores
+    order = np.argsort(-best_scores, kind='stable')
+    return [int(row) for row, score in zip(best_rows[order], best_scores[order]) if np.isfinite(score)]
+
+
+class EmbeddingIndex:
+    """Memory-mapped embedding matrix plus id map, refreshed incrementally from `user_profiles`."""
+
+    def __init__(self, directory=INDEX_DIR, database=None, backend=None, refresh_seconds=REFRESH_SECONDS):
+        self.directory = pathlib.Path(directory)
+        self.database = database
+        self.backend = backend or TransformerBackend()
+        self.refresh_seconds = refresh_seconds
+        # (ids, {user_id: row}, fingerprints, vectors, scale) - replaced as a whole, never mutated
+        self._state = ([], {}, [], None, None)
+        self._loaded_version = None
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._refreshing = False
+
+    def __len__(self):
+        return len(self._state[0])
+
+    # -- disk ---------------------------------------------------------------
+
+    def _read_meta(self, any_backend=False):
+        try:
+            meta = json.loads((self.directory / META_FILE).read_text())
+        except (OSError, ValueError):
+            return None
+        if not any_backend and meta.get('model') != self.backend.name:
+            return None
+        return meta
+
+    def load(self):
+        """Map the index written on disk (by this or another process) if it is newer. Returns True if it did."""
+        meta = self._read_meta()
+        if meta is None or meta['vectors'] == self._loaded_version:
+            return False
+        try:
+            vectors = np.load(self.directory / meta['vectors'], mmap_mode='r')
+        except (OSError, ValueError):
+            # Replaced by another process between reading index.json and opening it
+            return False
+        ids = meta['ids']
+        if vectors.shape[0] != len(ids):
+            return False
+        scale = meta.get('scale')
+        if scale is not None:
+            scale = (np.asarray(scale['mean'], dtype=np.float32), np.asarray(scale['std'], dtype=np.float32))
+        self._state = (ids, {uid: row for row, uid in enumerate(ids)}, meta['fingerprints'], vectors, scale)
+        self._loaded_version = meta['vectors']
+        return True
+
+    def _write(self, ids, fingerprints, vectors):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Also replaces an index built by another backend
+        previous = self._read_meta(any_backend=True)
+        name = f'vectors-{uuid.uuid4().hex}.npy'
+        np.save(self.directory / name, vectors)
+        meta = {'model': self.backend.name, 'vectors': name, 'ids': ids, 'fingerprints': fingerprints,
+                'scale': self.backend.scale(vectors)}
+        tmp = self.directory / f'{META_FILE}.{os.getpid()}.tmp'
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, self.directory / META_FILE)
+        if previous and previous['vectors'] != name:
+            # Processes that still map it keep reading it until they reload
+            try:
+                (self.directory / previous['vectors']).unlink()
+            except OSError:
+                pass
+
+    # -- refresh ------------------------------------------------------------
+
+    def refresh(self):
+        """Bring the index up to date with `user_profiles`. Returns how many profiles were (re-)encoded."""
+        with self._lock:
+            self.load()
+            database = self.database if self.database is not None else get_db()
+            if database is None:
+                return 0
+            projection = {'_id': 0, 'user_id': 1, **{field: 1 for field in self.backend.fields}}
+            profiles = [p for p in database['user_profiles'].find({}, projection) if p.get('user_id')]
+
+            old_ids, old_rows, old_fingerprints, old_vectors, _ = self._state
+            ids, fingerprints, stale = [], [], []
+            for p in profiles:
+                uid = str(p['user_id'])
+                fingerprint = _fingerprint(self.backend.key(p))
+                row = old_rows.get(uid)
+                if row is None or old_fingerprints[row] != fingerprint:
+                    stale.append(len(ids))
+                ids.append(uid)
+                fingerprints.append(fingerprint)
+
+            if not stale and ids == old_ids:
+                return 0
+            if not ids:
+                self._state = ([], {}, [], None, None)
+                return 0
+
+            encoded = None
+            if stale:
+                encoded = self.backend.encode([profiles[i] for i in stale])
+                if encoded is None:
+                    return 0
+
+            dim = encoded.shape[1] if encoded is not None else old_vectors.shape[1]
+            vectors = np.empty((len(ids), dim), dtype=np.float32)
+            fresh = dict(zip(stale, encoded)) if encoded is not None else {}
+            for row, uid in enumerate(ids):
+                vectors[row] = fresh[row] if row in fresh else old_vectors[old_rows[uid]]
+
+            self._write(ids, fingerprints, vectors)
+            self.load()
+            logger.info("Embedding index: %d profiles, %d re-encoded", len(ids), len(stale))
+            return len(stale)
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Embedding index refresh failed")
+        finally:
+            self._refreshing = False
+
+    def _maybe_refresh(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.refresh_seconds:
+            return
+        self._checked_at = now
+        if self._loaded_version is None:
+            self.load()
+        if not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self._refresh_in_background, name='embedding-refresh', daemon=True).start()
+
+    # -- queries ------------------------------------------------------------
+
+    def similar(self, user_id, topk=5):
+        """Up to `topk` user_ids whose profiles are most similar (cosine) to `user_id`'s, best first."""
+        self._maybe_refresh()
+        ids, rows, _, vectors, scale = self._state
+        row = rows.get(str(user_id))
+        if row is None or vectors is None or len(ids) < 2:
+            return []
+        query = _prepare(vectors[row:row + 1], scale)[0]
+        return [ids[i] for i in top_k(vectors, query, min(topk, len(ids) - 1), scale=scale, exclude=row)]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            backend = BACKENDS.get(BACKEND)
+            if backend is None:
+                logger.warning("Unknown EMBEDDING_BACKEND %r, using transformer", BACKEND)
+                backend = TransformerBackend
+            _index = EmbeddingIndex(backend=backend())
+        return _index
+
+
+def set_index(index):
+    global _index
+    with _index_lock:
+        _index = index
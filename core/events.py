@@ -0,0 +1,122 @@
+"""
+In-process publish/subscribe for live updates.
+
+`UserDB` publishes on a channel named after the user id whenever it writes a
+user document (see `_VersionedUsers` in core/database.py):
+
+- `timer`: {'timer_running', 'timer_started_at'} when the timer state changes
+- `message`: the new `parent_messages` entry
+- `balance`: no data; something that feeds the balance changed
+
+`/api/events` subscribes to these and relays them as Server-Sent Events.
+
+`LocalBus` only reaches subscribers in the same process. Anything with the same
+`publish()` / `subscribe()` interface (e.g. backed by a local Redis or NATS
+broker) can be installed with `set_bus()`; until then streams also compare
+`state_version` while idle so they pick up writes made by other workers.
+"""
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """A bounded queue of events for one consumer. Iterate with get()."""
+
+    def __init__(self, bus, channels, maxsize=100):
+        self.bus = bus
+        self.channels = set(channels)
+        self.overflowed = False
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # The consumer is behind; it should resynchronise from the database
+            self.overflowed = True
+
+    def get(self, timeout=None):
+        """Next event dict ({'channel', 'event', 'data'}), or None after `timeout` seconds."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LocalBus:
+    """Fan-out to subscribers in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, channels, maxsize=100):
+        sub = Subscription(self, channels, maxsize)
+        with self._lock:
+            for channel in sub.channels:
+                self._subscribers.setdefault(channel, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            for channel in sub.channels:
+                subs = self._subscribers.get(channel)
+                if subs is None:
+                    continue
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[channel]
+
+    def publish(self, channel, event, data=None):
+        with self._lock:
+            subs = list(self._subscribers.get(channel, ()))
+        for sub in subs:
+            sub.put({'channel': channel, 'event': event, 'data': data})
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+
+_bus = LocalBus()
+
+
+def get_bus():
+    return _bus
+
+
+def set_bus(bus):
+    """Install another bus implementation (same publish/subscribe interface)."""
+    global _bus
+    _bus = bus
+
+
+def publish(channel, event, data=None):
+    """Publish an event; never raises into the writer."""
+    try:
+        _bus.publish(str(channel), event, data)
+    except Exception:
+        logger.exception("Failed to publish %s on %s", event, channel)
+
+
+def subscribe(channels, maxsize=100):
+    return _bus.subscribe([str(c) for c in channels], maxsize=maxsize)
+
+
+def format_sse(event, data):
+    """Encode one Server-Sent Event; `data` is an already serialized string."""
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in str(data).split('\n'))
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,90 @@
+"""
+Conditional GET for polled JSON endpoints.
+
+A view decorated with `conditional(tag_func)` gets a weak ETag computed by
+`tag_func` *before* the view runs. If the client's If-None-Match already holds
+that tag the view is skipped and a bodiless 304 is returned, so a steady-state
+poll costs one small projected read instead of rebuilding the payload.
+
+Tags are built from version counters that writers bump:
+- `state_version` on the user document, bumped by every UserDB write
+  (see `_VersionedUsers` in core/database.py), and
+- named counters in the `counters` collection for shared data (challenges).
+
+The tag is taken before the view runs, so a write made while the view builds
+its payload can only make the tag older than the body, never newer: the next
+poll then misses and receives a fresh response.
+"""
+import functools
+import hashlib
+import logging
+from datetime import datetime
+
+from flask import current_app, make_response, request
+
+from core.database import UserDB, STATE_VERSION_FIELD, get_counter
+
+logger = logging.getLogger(__name__)
+
+CACHE_CONTROL = 'private, no-cache'
+
+
+def _digest(parts):
+    return hashlib.sha1('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()[:20]
+
+
+def user_state_tag(user_id, *extra):
+    """Tag for a response derived from one user's state, or None if it cannot be determined.
+
+    The UTC date is included because several payloads change at the daily reset,
+    and the minute while a game timer runs because elapsed time is added server side.
+    """
+    if not user_id:
+        return None
+    user = UserDB.get_user_view(user_id, STATE_VERSION_FIELD, 'timer_running')
+    if not user:
+        return None
+    now = datetime.utcnow()
+    parts = [user_id, user.get(STATE_VERSION_FIELD, 0), now.date().isoformat()]
+    if user.get('timer_running'):
+        parts.append(now.strftime('%H:%M'))
+    return _digest(parts + list(extra))
+
+
+def counter_tag(name, *extra):
+    """Tag for a response derived from data versioned by a named counter."""
+    version = get_counter(name)
+    if version is None:
+        return None
+    return _digest([name, version] + list(extra))
+
+
+def conditional(tag_func):
+    """Decorate a GET view so unchanged responses are answered with 304 Not Modified.
+
+    tag_func() runs inside the request and returns the current tag, or None to
+    skip conditional handling (e.g. unauthenticated requests). Only 200
+    responses are tagged.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            try:
+                tag = tag_func()
+            except Exception:
+                logger.exception("Could not compute ETag for %s", request.path)
+                tag = None
+            if tag is None:
+                return view(*args, **kwargs)
+
+            if request.if_none_match.contains_weak(tag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(tag, weak=True)
+            response.headers['Cache-Control'] = CACHE_CONTROL
+            return response
+        return wrapped
+    return decorator
@@ -0,0 +1,97 @@
+"""
+Responsive variants of uploaded images.
+
+`build_variants(path, store)` decodes an uploaded image once and writes
+resized copies to a BlobStore (core/blob_store.py):
+
+- WebP and JPEG at each of `WIDTHS` narrower than the original, plus the
+  original width (capped at the largest of `WIDTHS`), and
+- a `PLACEHOLDER_WIDTH`-pixel blurred JPEG, returned inline as a data URI
+  for the card to show while the real image loads.
+
+It returns the description stored on the challenge as `image` and returned
+by `/api/challenges`:
+
+    {'width', 'height', 'src', 'srcset': {'webp', 'jpeg'}, 'placeholder'}
+
+`srcset` values are ready for `<source srcset>` / `<img srcset>`. Variant
+names are content hashes like every other media blob, so they are served
+immutable and re-uploading the same image writes nothing new.
+"""
+import base64
+import io
+
+from PIL import Image, ImageFilter, ImageOps
+
+WIDTHS = (320, 640, 1024)
+PLACEHOLDER_WIDTH = 16
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+# The `src` fallback for browsers without srcset
+DEFAULT_WIDTH = 640
+
+
+class InvalidImage(ValueError):
+    """The upload is not an image Pillow can read (or is too large to decode safely)."""
+
+
+def _target_widths(width):
+    """WIDTHS below the image's own width, plus the image width itself (capped at the largest)."""
+    return sorted({w for w in WIDTHS if w < width} | {min(width, WIDTHS[-1])})
+
+
+def _flatten(image):
+    """RGB copy for JPEG: transparency is composited onto white."""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _encode(image, fmt, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **options)
+    buffer.seek(0)
+    return buffer
+
+
+def build_variants(path, store, url_prefix='/media/'):
+    """Write WebP/JPEG variants of the image at `path` to `store`. Raises InvalidImage for unreadable images."""
+    try:
+        with Image.open(path) as source:
+            source = ImageOps.exif_transpose(source)
+            source.load()
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise InvalidImage(str(e))
+    width, height = source.size
+    has_alpha = source.mode in ('RGBA', 'LA', 'P')
+    rgb = _flatten(source)
+
+    srcset = {'webp': [], 'jpeg': []}
+    src = None
+    for target in _target_widths(width):
+        size = (target, max(1, round(height * target / width)))
+        resized_rgb = rgb.resize(size, Image.LANCZOS)
+        webp_source = source.convert('RGBA').resize(size, Image.LANCZOS) if has_alpha else resized_rgb
+
+        webp = store.save_stream(_encode(webp_source, 'WEBP', quality=WEBP_QUALITY, method=4), '.webp')
+        jpeg = store.save_stream(_encode(resized_rgb, 'JPEG', quality=JPEG_QUALITY, optimize=True,
+                                         progressive=True), '.jpg')
+        srcset['webp'].append(f'{url_prefix}{webp.name} {target}w')
+        srcset['jpeg'].append(f'{url_prefix}{jpeg.name} {target}w')
+        if src is None or target <= DEFAULT_WIDTH:
+            src = f'{url_prefix}{jpeg.name}'
+
+    tiny = rgb.resize((PLACEHOLDER_WIDTH, max(1, round(height * PLACEHOLDER_WIDTH / width))), Image.BILINEAR)
+    tiny = tiny.filter(ImageFilter.GaussianBlur(1))
+    placeholder = base64.b64encode(_encode(tiny, 'JPEG', quality=50).getvalue()).decode('ascii')
+
+    return {
+        'width': width,
+        'height': height,
+        'src': src,
+        'srcset': {fmt: ', '.join(entries) for fmt, entries in srcset.items()},
+        'placeholder': f'data:image/jpeg;base64,{placeholder}',
+    }
@@ -0,0 +1,349 @@
+"""
+Materialized leaderboards kept in process memory.
+
+Windows:
+- `global`: each child's current `earned_game_time`
+- `daily:<YYYY-MM-DD>` and `weekly:<YYYY-Www>`: minutes credited in that UTC day / ISO week
+- friends: the global scores of a child's friend circle
+
+`UserDB` reports every earned-minutes credit through a credit listener, which
+adjusts the boards in place. Top-N reads slice a sorted list and "my rank" is a
+bisect, so neither depends on a Mongo sort. Window credits are written to
+`leaderboard_windows` with `$inc` upserts as they happen, so they survive a
+restart and reach every process, including the task worker (worker.py imports
+this module to register the listener). Writes that fail stay buffered and are
+retried with the next credit, reseed or at exit. Every `reseed_seconds` the
+process reloads from MongoDB so workers converge on credits made by each other
+and on writes that bypass the listener.
+
+Only the first load happens on a request. Later reseeds run on a background
+thread while reads keep using the current boards. Children credited while a
+reseed is reading are re-read once the new boards are in place, so a credit
+that lands between the scan and the swap is not lost.
+"""
+import atexit
+import bisect
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+from core.database import get_db, UserDB
+
+logger = logging.getLogger(__name__)
+
+GLOBAL = 'global'
+DAILY = 'daily'
+WEEKLY = 'weekly'
+WINDOWS = (GLOBAL, DAILY, WEEKLY)
+
+# Keep closed windows around for a while so "last week" style views stay possible
+_WINDOW_RETENTION = {DAILY: timedelta(days=8), WEEKLY: timedelta(weeks=5)}
+
+
+class SortedBoard:
+    """Scores plus a list of (-score, member) kept sorted with bisect."""
+
+    def __init__(self):
+        self._scores = {}
+        self._keys = []
+
+    def __len__(self):
+        return len(self._keys)
+
+    def score(self, member):
+        return self._scores.get(member)
+
+    def set(self, member, score):
+        self.remove(member)
+        self._scores[member] = score
+        bisect.insort(self._keys, (-score, member))
+
+    def add(self, member, delta):
+        self.set(member, self._scores.get(member, 0) + delta)
+
+    def remove(self, member):
+        old = self._scores.pop(member, None)
+        if old is None:
+            return
+        i = bisect.bisect_left(self._keys, (-old, member))
+        if i < len(self._keys) and self._keys[i] == (-old, member):
+            del self._keys[i]
+
+    def top(self, n):
+        return [(member, -neg) for neg, member in self._keys[:n]]
+
+    def rank(self, member):
+        """1-based rank, or None if the member has no score."""
+        score = self._scores.get(member)
+        if score is None:
+            return None
+        # Ties share the best rank
+        return bisect.bisect_left(self._keys, (-score, '')) + 1
+
+
+def window_key(window, now=None):
+    """Board key for a window at `now` (UTC)."""
+    now = now or datetime.utcnow()
+    if window == DAILY:
+        return f"{DAILY}:{now.date().isoformat()}"
+    if window == WEEKLY:
+        year, week, _ = now.isocalendar()
+        return f"{WEEKLY}:{year}-W{week:02d}"
+    return GLOBAL
+
+
+class Leaderboard:
+    """All leaderboard windows for this process."""
+
+    def __init__(self, reseed_seconds=60, collection_name='leaderboard_windows'):
+        self.reseed_seconds = reseed_seconds
+        self.collection_name = collection_name
+        self._lock = threading.RLock()
+        # Held while window credits are written, so a re-read never sees them half-way
+        self._flush_lock = threading.Lock()
+        self._boards = {}
+        self._members = {}
+        self._pending = {}
+        self._stale = set()
+        self._loaded_at = None
+        self._reseeding = False
+        # Children credited while a reseed is reading MongoDB; None when no reseed is running
+        self._touched = None
+
+    # --- updates -------------------------------------------------------
+
+    def on_credit(self, user_id, minutes):
+        """Credit listener registered with UserDB. Writes window credits but never reads MongoDB."""
+        if minutes is None:
+            with self._lock:
+                self._stale.add(user_id)
+        else:
+            self.credit(user_id, minutes)
+
+    def credit(self, user_id, minutes, now=None):
+        minutes = int(minutes or 0)
+        if not minutes:
+            return
+        now = now or datetime.utcnow()
+        with self._lock:
+            if self._touched is not None:
+                self._touched.add(user_id)
+            if user_id in self._members:
+                self._board(GLOBAL).add(user_id, minutes)
+            else:
+                # Unknown child (created after the last reseed): load its real total on next read
+                self._stale.add(user_id)
+            for window in (DAILY, WEEKLY):
+                key = window_key(window, now)
+                self._board(key).add(user_id, minutes)
+                self._pending[(key, user_id)] = self._pending.get((key, user_id), 0) + minutes
+        self.flush()
+
+    def refresh_users(self, user_ids):
+        """Re-read children's global scores and display fields with one query."""
+        users = UserDB.get_users_by_ids(
+            user_ids, 'name', 'account_type', 'earned_game_time', 'daily_screen_time_limit'
+        )
+        with self._lock:
+            for user_id in user_ids:
+                user = users.get(user_id)
+                if not user or user.get('account_type') != 'child':
+                    self._members.pop(user_id, None)
+                    for board in self._boards.values():
+                        board.remove(user_id)
+                    continue
+                self._members[user_id] = {
+                    'name': user.get('name', ''),
+                    'daily_screen_time_limit': int(user.get('daily_screen_time_limit', 0) or 0),
+                }
+                self._board(GLOBAL).set(user_id, int(user.get('earned_game_time', 0) or 0))
+
+    # --- reads ---------------------------------------------------------
+
+    def top(self, window=GLOBAL, n=20, now=None):
+        self._ensure_fresh()
+        with self._lock:
+            board = self._boards.get(window_key(window, now))
+            if board is None:
+                return []
+            return [self._row(member, score) for member, score in board.top(n)]
+
+    def rank(self, user_id, window=GLOBAL, now=None):
+        self._ensure_fresh()
+        with self._lock:
+            board = self._boards.get(window_key(window, now))
+            if board is None or board.score(user_id) is None:
+                return {'rank': None, 'score': 0, 'total': len(board) if board else 0}
+            return {'rank': board.rank(user_id), 'score': board.score(user_id), 'total': len(board)}
+
+    def friends(self, user_id, friend_ids, n=20):
+        """Top-N among a child and their friends, by global score."""
+        self._ensure_fresh()
+        with self._lock:
+            board = self._board(GLOBAL)
+            circle = {str(f) for f in friend_ids} | {str(user_id)}
+            scored = [(board.score(m), m) for m in circle if board.score(m) is not None]
+            scored.sort(key=lambda item: (-item[0], item[1]))
+            return [self._row(member, score) for score, member in scored[:n]]
+
+    # --- persistence ---------------------------------------------------
+
+    def flush(self):
+        """Persist buffered window credits with $inc upserts."""
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        database = get_db()
+        if database is None:
+            self._requeue(pending)
+            return
+        ops = []
+        for (key, user_id), minutes in pending.items():
+            window = key.split(':', 1)[0]
+            ops.append(UpdateOne(
+                {'_id': f"{key}:{user_id}"},
+                {
+                    '$inc': {'minutes': minutes},
+                    '$set': {'window': key, 'user_id': user_id,
+                             'expires_at': datetime.utcnow() + _WINDOW_RETENTION[window]}
+                },
+                upsert=True
+            ))
+        try:
+            database[self.collection_name].bulk_write(ops, ordered=False)
+        except Exception:
+            logger.exception('Failed to persist leaderboard windows; will retry')
+            self._requeue(pending)
+
+    def reseed(self, now=None):
+        """Flush local credits, then rebuild every board from MongoDB."""
+        self.flush()
+        database = get_db()
+        if database is None:
+            return False
+        now = now or datetime.utcnow()
+        with self._lock:
+            self._touched = set()
+        try:
+            boards = {GLOBAL: SortedBoard()}
+            members = {}
+            for u in database['users'].find(
+                {'account_type': 'child'},
+                {'name': 1, 'earned_game_time': 1, 'daily_screen_time_limit': 1}
+            ):
+                member = str(u['_id'])
+                members[member] = {
+                    'name': u.get('name', ''),
+                    'daily_screen_time_limit': int(u.get('daily_screen_time_limit', 0) or 0),
+                }
+                boards[GLOBAL].set(member, int(u.get('earned_game_time', 0) or 0))
+
+            keys = [window_key(DAILY, now), window_key(WEEKLY, now)]
+            for key in keys:
+                boards[key] = SortedBoard()
+            for doc in database[self.collection_name].find({'window': {'$in': keys}}):
+                if doc.get('user_id') in members:
+                    boards[doc['window']].set(doc['user_id'], int(doc.get('minutes', 0)))
+        except Exception:
+            logger.exception('Leaderboard reseed failed')
+            with self._lock:
+                self._touched = None
+            return False
+
+        with self._lock:
+            # Credits that arrived while we were reading are not in Mongo yet; re-apply them
+            for (key, member), minutes in self._pending.items():
+                if key in boards and member in members:
+                    boards[key].add(member, minutes)
+            self._boards = boards
+            self._members = members
+            self._loaded_at = time.monotonic()
+            touched, self._touched = self._touched, None
+        # The scan may have read these before or after their credit; MongoDB has the real total now
+        touched &= set(members)
+        if touched:
+            self.refresh_users(sorted(touched))
+            self._refresh_windows(database, sorted(touched), keys)
+        return True
+
+    def _refresh_windows(self, database, user_ids, keys):
+        """Re-read children's window totals, plus whatever is still waiting to be written."""
+        ids = [f"{key}:{user_id}" for key in keys for user_id in user_ids]
+        with self._flush_lock:
+            try:
+                docs = {doc['_id']: doc for doc in database[self.collection_name].find({'_id': {'$in': ids}})}
+            except Exception:
+                logger.exception('Failed to re-read leaderboard windows')
+                return
+            with self._lock:
+                for key in keys:
+                    board = self._board(key)
+                    for user_id in user_ids:
+                        doc = docs.get(f"{key}:{user_id}")
+                        minutes = int(doc.get('minutes', 0)) if doc else 0
+                        minutes += self._pending.get((key, user_id), 0)
+                        if minutes:
+                            board.set(user_id, minutes)
+
+    # --- internals -----------------------------------------------------
+
+    def _board(self, key):
+        board = self._boards.get(key)
+        if board is None:
+            board = self._boards[key] = SortedBoard()
+        return board
+
+    def _row(self, member, score):
+        info = self._members.get(member, {})
+        return {
+            'id': member,
+            'name': info.get('name', ''),
+            'earned_game_time': int(score),
+            'daily_screen_time_limit': info.get('daily_screen_time_limit', 0),
+        }
+
+    def _requeue(self, pending):
+        with self._lock:
+            for k, minutes in pending.items():
+                self._pending[k] = self._pending.get(k, 0) + minutes
+
+    def _reseed_in_background(self):
+        try:
+            self.reseed()
+        except Exception:
+            logger.exception('Leaderboard reseed failed')
+        finally:
+            with self._lock:
+                self._reseeding = False
+
+    def _ensure_fresh(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None:
+            # Nothing to serve yet
+            with self._lock:
+                self._stale.clear()
+            self.reseed()
+            return
+        if time.monotonic() - loaded_at >= self.reseed_seconds:
+            with self._lock:
+                start, self._reseeding = not self._reseeding, True
+            if start:
+                threading.Thread(target=self._reseed_in_background, name='leaderboard-reseed', daemon=True).start()
+        with self._lock:
+            stale, self._stale = list(self._stale), set()
+        if stale:
+            self.refresh_users(stale)
+
+
+leaderboard = Leaderboard(reseed_seconds=int(os.getenv('LEADERBOARD_RESEED_SECONDS', '60')))
+UserDB.add_credit_listener(leaderboard.on_credit)
+atexit.register(leaderboard.flush)
@@ -20,11 +20,33 @@ def compute_weekly_km(db, user_id):
     return total
 
 
+def _mix_type(activity_type):
+    t = str(activity_type or '').lower()
+    if 'run' in t:
+        return 'run'
+    if 'ride' in t or 'cycl' in t or 'bike' in t:
+        return 'ride'
+    if 'walk' in t or 'hike' in t:
+        return 'walk'
+    return 'other'
+
+
+def compute_activity_mix(db, user_id, days=28):
+    """Share of the user's activities in the last `days` by kind: run, ride, walk, other."""
+    since = datetime.utcnow() - timedelta(days=days)
+    counts = {'run': 0, 'ride': 0, 'walk': 0, 'other': 0}
+    for a in db['activities'].find({'user_id': user_id, 'created_at': {'$gte': since}}, {'type': 1, 'sport_type': 1}):
+        counts[_mix_type(a.get('type') or a.get('sport_type'))] += 1
+    total = sum(counts.values())
+    return {k: round(v / total, 3) if total else 0.0 for k, v in counts.items()}
+
+
 def compute_user_profiles():
     """Compute lightweight user profiles and write to `user_profiles` collection.
 
     Fields: user_id, weekly_km, last_activity, avg_session_minutes (best-effort),
-            max_minutes_per_session (default 120)
+            max_minutes_per_session (default 120), activity_mix (shares of
+            run/ride/walk/other over the last 28 days)
     """
     db = get_db()
     if db is None:
@@ -45,7 +67,8 @@ def compute_user_profiles():
             'user_id': uid,
             'weekly_km': weekly_km,
             'last_activity': last_date,
-            'max_minutes_per_session': u.get('preferred_max_minutes', 120)
+            'max_minutes_per_session': u.get('preferred_max_minutes', 120),
+            'activity_mix': compute_activity_mix(db, uid),
         }
 
         profiles.update_one({'user_id': uid}, {'$set': profile_doc}, upsert=True)
@@ -56,3 +79,7 @@ def compute_user_profiles():
 if __name__ == '__main__':
     ok = compute_user_profiles()
     print('profiles computed' if ok else 'failed')
+    if ok:
+        # Encode changed profiles now so web processes only have to map the result
+        from core.embeddings import get_index
+        print(f'{get_index().refresh()} profile embedding(s) updated')
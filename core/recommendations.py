@@ -1,6 +1,6 @@
 from datetime import datetime, timedelta, date
 from core.database import get_db
-from core.embeddings import build_user_embeddings, query_similar_users
+from core.embeddings import get_index
 
 
 def get_today_activity(user_id):
@@ -205,25 +205,20 @@ def recommend(user_id, constraints=None):
         profile = db['user_profiles'].find_one({'user_id': user_id})
     # If we have enough users, try personalization via embeddings to adjust the profile
     try:
-        emb_index = build_user_embeddings()
-        if emb_index:
-            similar = query_similar_users(user_id, emb_index, topk=3)
-            # If similar users exist and this user has low weekly km, prefer sessions similar users accept
-            if similar:
-                sim_kms = []
-                for s in similar:
-                    p = db['user_profiles'].find_one({'user_id': s})
-                    if p:
-                        sim_kms.append(p.get('weekly_km', 0))
-                if sim_kms:
-                    avg_sim = sum(sim_kms)/len(sim_kms)
-                    if profile is None:
-                        profile = {'max_minutes_per_session': 120}
-                    profile_adjusted = dict(profile)
-                    if avg_sim > (profile.get('weekly_km', 0)):
-                        profile_adjusted['max_minutes_per_session'] = min(180, profile_adjusted.get('max_minutes_per_session',120) + 15)
-                    # Use the adjusted profile going forward
-                    profile = profile_adjusted
+        similar = get_index().similar(user_id, topk=3)
+        # If similar users exist and this user has low weekly km, prefer sessions similar users accept
+        if similar and db is not None:
+            sim_kms = [p.get('weekly_km', 0) for p in
+                       db['user_profiles'].find({'user_id': {'$in': similar}}, {'weekly_km': 1})]
+            if sim_kms:
+                avg_sim = sum(sim_kms)/len(sim_kms)
+                if profile is None:
+                    profile = {'max_minutes_per_session': 120}
+                profile_adjusted = dict(profile)
+                if avg_sim > (profile.get('weekly_km', 0)):
+                    profile_adjusted['max_minutes_per_session'] = min(180, profile_adjusted.get('max_minutes_per_session',120) + 15)
+                # Use the adjusted profile going forward
+                profile = profile_adjusted
     except Exception:
         pass
 
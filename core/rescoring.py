@@ -0,0 +1,263 @@
+"""
+Re-score stored activities after the rules in core/scoring.py change.
+
+The job walks `activities` in `_id` order with a batched cursor. Each batch is
+scored in one `scoring.score_batch()` call. Only the rows whose minutes or
+label changed are written back, with one unordered `bulk_write`. Each update
+is conditional on the old `earned_minutes` and tags the row with the batch
+token. The credit differences of the rows actually rewritten are summed per
+user and applied with `UserDB.apply_credit_adjustments()`, one update per
+user; a row changed underneath the job (e.g. edited or deleted) keeps its
+minutes, so its user is not adjusted for it either.
+
+Which minutes a user actually holds for an activity follows how it was
+credited:
+- Activities logged on their own day counted as "today" minutes. They were
+  taken back out at that day's reset, so they are only adjusted while the day
+  is still today; then `daily_earned_minutes_today` moves too.
+- Activities logged for an earlier day were credited permanently.
+- Simulated activities were only credited for the current day (`day_offset` 0).
+
+Progress lives in `job_checkpoints` under the job id, with a `run_id` that is
+new whenever the checkpoint is (a first run or `restart`). Before a batch is
+written, its planned writes are saved as `pending`. A crashed run replays
+`pending` on restart: the activity writes are conditional, and the user
+adjustments carry a `<job>:<run_id>:<seq>` token, so replaying applies
+nothing twice while a later run's batches never reuse an earlier token.
+Dry runs write nothing and only report the differences.
+
+Strava markers created before their heart rate was stored cannot be re-scored
+faithfully and are skipped, as are backfilled markers that were never
+credited (`credited: False`).
+"""
+import logging
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from core import scoring
+from core.database import get_db, UserDB
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINTS = 'job_checkpoints'
+PROJECTION = {
+    'user_id': 1, 'source': 1, 'type': 1, 'distance': 1, 'time_minutes': 1, 'duration_minutes': 1,
+    'average_heartrate': 1, 'intensity': 1, 'earned_minutes': 1, 'date': 1, 'created_at': 1, 'day_offset': 1,
+    'credited': 1,
+}
+SAMPLE_DIFFS = 20
+
+
+def _day(value):
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, str):
+        return value.split('T')[0]
+    return None
+
+
+def scoring_inputs(doc):
+    """(distance, duration, avg_hr, pace, type, intensity) for score_batch, or None to skip."""
+    source = doc.get('source')
+    if doc.get('credited') is False:
+        return None
+    if source == 'strava_applied':
+        if 'average_heartrate' not in doc:
+            return None
+        duration = doc.get('duration_minutes', doc.get('time_minutes'))
+        return (doc.get('distance'), duration, doc.get('average_heartrate'), None, doc.get('type'), None)
+    if source == 'file_upload':
+        return (doc.get('distance'), doc.get('duration_minutes'), doc.get('average_heartrate'), None, doc.get('type'), None)
+    if source == 'simulated':
+        return (doc.get('distance'), doc.get('time_minutes'), None, None, doc.get('type'), doc.get('intensity'))
+    if source == 'manual':
+        # Uploads are scored without the activity type
+        return (doc.get('distance'), doc.get('time_minutes'), None, None, None, doc.get('intensity'))
+    return None
+
+
+def credit_delta(doc, delta, today):
+    """(earned_delta, today_delta) a user should receive when an activity's minutes change by `delta`."""
+    day = _day(doc.get('date'))
+    if doc.get('source') == 'simulated':
+        if doc.get('day_offset') != 0:
+            return 0, 0
+        logged_same_day = True
+    else:
+        logged_same_day = _day(doc.get('created_at')) == day
+    if not logged_same_day:
+        return delta, 0
+    if day == today:
+        return delta, delta
+    return 0, 0
+
+
+def _diff_batch(docs, today):
+    """Score a batch; return (diffs, adjustments, skipped)."""
+    rows, inputs = [], []
+    for doc in docs:
+        row = scoring_inputs(doc)
+        if row is not None:
+            rows.append(doc)
+            inputs.append(row)
+    skipped = len(docs) - len(rows)
+    if not rows:
+        return [], {}, skipped
+
+    labels, minutes = scoring.score_batch(*zip(*inputs))
+    diffs, adjustments = [], {}
+    for doc, label, new_minutes in zip(rows, labels.tolist(), minutes.tolist()):
+        old_minutes = doc.get('earned_minutes')
+        if old_minutes == new_minutes and doc.get('intensity') == label:
+            continue
+        diffs.append({
+            '_id': doc['_id'], 'user_id': doc.get('user_id'), 'source': doc.get('source'), 'date': doc.get('date'),
+            'old_minutes': old_minutes, 'new_minutes': new_minutes,
+            'old_intensity': doc.get('intensity'), 'new_intensity': label,
+        })
+        earned, today_delta = credit_delta(doc, new_minutes - int(old_minutes or 0), today)
+        diffs[-1].update(earned_delta=earned, today_delta=today_delta)
+        if doc.get('user_id'):
+            # Zero entries still bump the user's state_version for /api/manual-activities
+            prev = adjustments.get(doc['user_id'], (0, 0))
+            adjustments[doc['user_id']] = (prev[0] + earned, prev[1] + today_delta)
+    return diffs, adjustments, skipped
+
+
+def _apply_batch(database, job_id, batch):
+    """Write a planned batch. Safe to call again for the same batch."""
+    # Batches saved before run ids existed replay under their old token
+    token = batch.get('token') or f"{job_id}:{batch['seq']}"
+    ops = [
+        UpdateOne({'_id': op['_id'], 'earned_minutes': op['old_minutes']},
+                  {'$set': {'earned_minutes': op['new_minutes'], 'intensity': op['new_intensity'],
+                            'rescored_at': datetime.utcnow(), 'rescore_job': job_id, 'rescore_batch': token}})
+        for op in batch['ops']
+    ]
+    rewritten = {op['_id'] for op in batch['ops']}
+    if ops:
+        result = database['activities'].bulk_write(ops, ordered=False)
+        if result.matched_count < len(ops):
+            # Rows already written by this batch (a replay) carry its token; the rest changed underneath us
+            rewritten = {doc['_id'] for doc in database['activities'].find(
+                {'_id': {'$in': list(rewritten)}, 'rescore_batch': token}, {'_id': 1})}
+            logger.info("Rescore %s batch %s: %d of %d activities changed by someone else, not adjusted",
+                        job_id, batch['seq'], len(ops) - len(rewritten), len(ops))
+
+    if batch['ops'] and 'earned_delta' in batch['ops'][0]:
+        adjustments = {}
+        for op in batch['ops']:
+            if op['_id'] in rewritten and op.get('user_id'):
+                prev = adjustments.get(op['user_id'], (0, 0))
+                adjustments[op['user_id']] = (prev[0] + op['earned_delta'], prev[1] + op['today_delta'])
+    else:
+        adjustments = {uid: (earned, today) for uid, earned, today in batch['adjustments']}
+    if adjustments:
+        if UserDB.apply_credit_adjustments(adjustments, token=token) is None:
+            raise RuntimeError(f"Credit adjustments failed for {job_id} batch {batch['seq']}")
+
+
+def rescore_activities(job_id='rescore', dry_run=True, batch_size=1000, restart=False, limit=None,
+                       on_diff=None, database=None, today=None):
+    """Re-score activities in batches; see the module docstring.
+
+    on_diff: optional callback receiving every diff dict (e.g. to write a report).
+    Returns a summary dict: scanned, skipped, changed, minutes_delta,
+    users_adjusted, credit_delta, label_changes, sample, resumed_from, dry_run.
+    """
+    database = database if database is not None else get_db()
+    if database is None:
+        raise RuntimeError('Database connection failed')
+    today = today or datetime.utcnow().date().isoformat()
+    checkpoints = database[CHECKPOINTS]
+
+    summary = {'scanned': 0, 'skipped': 0, 'changed': 0, 'minutes_delta': 0, 'users_adjusted': 0,
+               'credit_delta': 0, 'label_changes': Counter(), 'sample': [], 'resumed_from': None,
+               'dry_run': dry_run}
+    users_seen = set()
+
+    checkpoint = {}
+    run_id = None
+    if not dry_run:
+        if restart:
+            checkpoints.delete_one({'_id': job_id})
+        checkpoint = checkpoints.find_one({'_id': job_id}) or {}
+        pending = checkpoint.get('pending')
+        if pending:
+            logger.info("Rescore %s: replaying interrupted batch %s", job_id, pending['seq'])
+            _apply_batch(database, job_id, pending)
+            # `batches` is only written once a batch finishes, so the replayed one is not counted yet
+            checkpoints.update_one({'_id': job_id}, {
+                '$set': {'last_id': pending['last_id'], 'batches': pending['seq']},
+                '$unset': {'pending': ''},
+            })
+            checkpoint['last_id'] = pending['last_id']
+            checkpoint['batches'] = pending['seq']
+        run_id = checkpoint.get('run_id') or uuid.uuid4().hex
+        checkpoints.update_one({'_id': job_id}, {'$setOnInsert': {'started_at': datetime.utcnow()},
+                                                 '$set': {'run_id': run_id},
+                                                 '$unset': {'finished_at': ''}}, upsert=True)
+
+    last_id = checkpoint.get('last_id')
+    summary['resumed_from'] = last_id
+    seq = int(checkpoint.get('batches', 0))
+    query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+    cursor = database['activities'].find(query, PROJECTION).sort('_id', 1).batch_size(batch_size)
+
+    def process(docs):
+        nonlocal seq
+        diffs, adjustments, skipped = _diff_batch(docs, today)
+        summary['scanned'] += len(docs)
+        summary['skipped'] += skipped
+        summary['changed'] += len(diffs)
+        for diff in diffs:
+            summary['minutes_delta'] += diff['new_minutes'] - int(diff['old_minutes'] or 0)
+            if diff['old_intensity'] != diff['new_intensity']:
+                summary['label_changes'][f"{diff['old_intensity']}->{diff['new_intensity']}"] += 1
+            if len(summary['sample']) < SAMPLE_DIFFS:
+                summary['sample'].append(diff)
+            if on_diff is not None:
+                on_diff(diff)
+        for user_id, (earned, _) in adjustments.items():
+            if earned:
+                users_seen.add(user_id)
+                summary['credit_delta'] += earned
+        if dry_run:
+            return
+
+        seq += 1
+        batch = {
+            'seq': seq,
+            'token': f"{job_id}:{run_id}:{seq}",
+            'last_id': docs[-1]['_id'],
+            'ops': [{k: d[k] for k in ('_id', 'user_id', 'old_minutes', 'new_minutes', 'new_intensity',
+                                       'earned_delta', 'today_delta')} for d in diffs],
+            'adjustments': [[uid, earned, today_delta] for uid, (earned, today_delta) in adjustments.items()],
+        }
+        checkpoints.update_one({'_id': job_id}, {'$set': {'pending': batch}})
+        _apply_batch(database, job_id, batch)
+        checkpoints.update_one({'_id': job_id}, {
+            '$set': {'last_id': batch['last_id'], 'batches': seq, 'updated_at': datetime.utcnow()},
+            '$unset': {'pending': ''},
+            '$inc': {'scanned': len(docs), 'changed': len(diffs)}
+        })
+
+    chunk = []
+    for doc in cursor:
+        chunk.append(doc)
+        if len(chunk) >= batch_size:
+            process(chunk)
+            chunk = []
+        if limit is not None and summary['scanned'] + len(chunk) >= limit:
+            break
+    if chunk:
+        process(chunk)
+
+    if not dry_run:
+        checkpoints.update_one({'_id': job_id}, {'$set': {'finished_at': datetime.utcnow()}})
+    summary['users_adjusted'] = len(users_seen)
+    summary['label_changes'] = dict(summary['label_changes'])
+    return summary
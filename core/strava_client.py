@@ -0,0 +1,161 @@
+"""
+HTTP client for the Strava API.
+
+One pooled `requests.Session` per process, shared by every request thread:
+- connect/read timeouts on every call (`STRAVA_CONNECT_TIMEOUT`,
+  `STRAVA_READ_TIMEOUT`, default 3 s / 10 s)
+- retries with exponential backoff (`STRAVA_RETRIES`, default 3) on connection
+  errors and 502/503/504. It honours `Retry-After`. GETs are also retried
+  after read errors; token exchanges are not, because an authorization code
+  can only be used once
+- `INTERACTIVE` GETs run on a second session that retries a read timeout
+  only `STRAVA_INTERACTIVE_READ_RETRIES` times (default 1), so a request
+  thread waits at most about 20 s for a Strava that has stopped answering;
+  `BACKGROUND` calls keep the full `STRAVA_RETRIES`
+- `fetch_many()` runs several GETs on a thread pool (e.g. many athletes or
+  activity pages) and returns the results in order
+- API calls are budgeted by a `RateLimiter` (core/strava_ratelimit.py) fed
+  from Strava's rate-limit headers. `get()` runs at `INTERACTIVE` priority by
+  default and `fetch_many()` at `BACKGROUND`; a call over budget raises
+  `RateLimited`
+
+Network failures that outlive the retries raise `StravaUnavailable`; HTTP
+error statuses are returned as responses for the caller to map.
+
+`get_client()` returns the shared client; `set_client()` swaps it (e.g. for
+one pointed at a local stub server in tests).
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from core.strava_ratelimit import BACKGROUND, INTERACTIVE, RateLimited, RateLimiter
+
+logger = logging.getLogger(__name__)
+
+STRAVA_API_URL = 'https://www.strava.com/api/v3'
+STRAVA_TOKEN_URL = 'https://www.strava.com/oauth/token'
+
+CONNECT_TIMEOUT = float(os.getenv('STRAVA_CONNECT_TIMEOUT', '3'))
+READ_TIMEOUT = float(os.getenv('STRAVA_READ_TIMEOUT', '10'))
+RETRIES = int(os.getenv('STRAVA_RETRIES', '3'))
+INTERACTIVE_READ_RETRIES = int(os.getenv('STRAVA_INTERACTIVE_READ_RETRIES', '1'))
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (502, 503, 504)
+MAX_WORKERS = 8
+
+
+class StravaUnavailable(Exception):
+    """Strava could not be reached (timeouts or connection errors after retries)."""
+
+
+class StravaClient:
+
+    def __init__(self, api_url=STRAVA_API_URL, token_url=STRAVA_TOKEN_URL, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                 retries=RETRIES, backoff_factor=BACKOFF_FACTOR, max_workers=MAX_WORKERS, limiter=None,
+                 interactive_read_retries=INTERACTIVE_READ_RETRIES):
+        self.api_url = api_url.rstrip('/')
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.token_url = token_url
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.session = self._session(retries, retries, backoff_factor, max_workers)
+        self.interactive_session = self._session(retries, min(retries, interactive_read_retries),
+                                                 backoff_factor, max_workers)
+
+    @staticmethod
+    def _session(retries, read_retries, backoff_factor, max_workers):
+        session = requests.Session()
+        retry = Retry(total=retries, connect=retries, read=read_retries, status=retries,
+                      backoff_factor=backoff_factor, status_forcelist=RETRY_STATUSES,
+                      allowed_methods=frozenset({'GET'}), respect_retry_after_header=True,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=max(10, max_workers))
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _send(self, method, url, session=None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            return (session or self.session).request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            logger.warning("Strava %s %s failed: %s", method, url, e)
+            raise StravaUnavailable(str(e)) from e
+
+    def get(self, path, headers=None, params=None, priority=INTERACTIVE, wait=0.0):
+        """GET an API path such as '/athlete/activities'. Returns the response.
+
+        wait: seconds this call may queue for the rate-limit window to reset
+            before RateLimited is raised.
+        """
+        self.limiter.acquire(priority, wait)
+        session = self.interactive_session if priority == INTERACTIVE else self.session
+        response = self._send('GET', f'{self.api_url}{path}', session=session, headers=headers, params=params)
+        if response.status_code == 429:
+            self.limiter.exhausted(response.headers)
+        else:
+            self.limiter.update(response.headers)
+        return response
+
+    def post_token(self, data):
+        """POST to the OAuth token endpoint (code exchange or refresh). Returns the response."""
+        return self._send('POST', self.token_url, data=data)
+
+    def fetch_many(self, calls, max_workers=None, priority=BACKGROUND, wait=0.0):
+        """Run GETs concurrently.
+
+        calls: iterable of (path, headers, params) tuples.
+        Returns one entry per call, in order: the response, or the
+        StravaUnavailable / RateLimited raised for it.
+        """
+        calls = list(calls)
+        if not calls:
+            return []
+
+        def run(call):
+            path, headers, params = call
+            try:
+                return self.get(path, headers=headers, params=params, priority=priority, wait=wait)
+            except (StravaUnavailable, RateLimited) as e:
+                return e
+
+        workers = min(max_workers or self.max_workers, len(calls))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(run, calls))
+
+    def activity_pages(self, headers, pages, per_page=30, priority=BACKGROUND, **params):
+        """Fetch pages 1..pages of /athlete/activities concurrently; returns one entry per page."""
+        calls = [('/athlete/activities', headers, dict(params, page=page, per_page=per_page))
+                 for page in range(1, pages + 1)]
+        return self.fetch_many(calls, priority=priority)
+
+    def close(self):
+        self.session.close()
+        self.interactive_session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = StravaClient()
+    return _client
+
+
+def set_client(client):
+    """Install a different client (returns the previous one)."""
+    global _client
+    with _client_lock:
+        previous, _client = _client, client
+    return previous
@@ -0,0 +1,209 @@
+"""
+Bulk ingestion of Strava activities into the `activities` collection.
+
+Every imported Strava activity is recorded as a `strava_applied` marker so it
+is only credited once. Instead of a find/insert/$inc/record round trip per
+activity, a batch is ingested with:
+
+- one `$in` lookup for markers that already exist,
+- one unordered `bulk_write` of the new markers (a unique index on
+  (user_id, source, external_id) rejects anything a concurrent request
+  inserted first),
+- one aggregated `UserDB.apply_activity_credits` update for the minutes and
+  activity dates, and
+- one `record_daily_activity` call per distinct day that earns a streak reward.
+
+If storing any marker or the aggregated credit fails (including connection
+errors such as `AutoReconnect`; only duplicate keys are expected), the markers
+inserted by this batch are removed again and `credit_failed` is reported.
+Callers then leave the sync mark where it was, so the activities are retried on
+the next sync.
+
+History imported by the backfill (`credit=False`) is recorded without earning
+anything: the markers store `earned_minutes: 0` and `credited: False`, and
+only their days are added to `activity_dates` / `streak_state`.
+"""
+import logging
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from core.database import get_db, UserDB
+
+logger = logging.getLogger(__name__)
+
+STRAVA_APPLIED_SOURCE = 'strava_applied'
+DUPLICATE_KEY_ERROR = 11000
+
+
+def activity_day(start_date):
+    """Return the YYYY-MM-DD part of a Strava start_date (or None)."""
+    if isinstance(start_date, str) and 'T' in start_date:
+        return start_date.split('T')[0]
+    return start_date
+
+
+def build_applied_marker(user_id, activity, distance_km, time_minutes, intensity, earned_minutes):
+    """Build the `strava_applied` marker document for one Strava activity."""
+    return {
+        'user_id': user_id,
+        'source': STRAVA_APPLIED_SOURCE,
+        'external_id': str(activity.get('id')),
+        'title': activity.get('name'),
+        'date': activity.get('start_date'),
+        'type': activity.get('type'),
+        'distance': distance_km,
+        'time_minutes': time_minutes,
+        'intensity': intensity,
+        'earned_minutes': earned_minutes,
+        # Scoring inputs, so markers can be re-scored later (core/rescoring.py)
+        'average_heartrate': activity.get('average_heartrate'),
+        'duration_minutes': (activity.get('moving_time') or 0) / 60.0,
+        'created_at': datetime.utcnow()
+    }
+
+
+class MarkerWriteError(Exception):
+    """A marker was rejected for a reason other than already existing."""
+
+    def __init__(self, inserted):
+        super().__init__('Failed to insert Strava markers')
+        self.inserted = inserted
+
+
+def _insert_new_markers(activities_collection, user_id, markers):
+    """Insert markers not yet applied for this user; return the inserted ones.
+
+    Raises MarkerWriteError (carrying the markers that were inserted) if any
+    marker failed for a reason other than a duplicate key.
+    """
+    ids = list(dict.fromkeys(m['external_id'] for m in markers))
+    existing = {
+        doc.get('external_id')
+        for doc in activities_collection.find(
+            {'user_id': user_id, 'source': STRAVA_APPLIED_SOURCE, 'external_id': {'$in': ids}},
+            {'external_id': 1}
+        )
+    }
+
+    pending = []
+    seen = set(existing)
+    for marker in markers:
+        if marker['external_id'] in seen:
+            continue
+        seen.add(marker['external_id'])
+        # Assign ids up front so a failed credit can roll the batch back
+        marker.setdefault('_id', ObjectId())
+        pending.append(marker)
+
+    if not pending:
+        return []
+
+    failed = set()
+    errors = False
+    try:
+        activities_collection.bulk_write([InsertOne(m) for m in pending], ordered=False)
+    except BulkWriteError as e:
+        for err in e.details.get('writeErrors', []):
+            failed.add(err.get('index'))
+            if err.get('code') != DUPLICATE_KEY_ERROR:
+                errors = True
+                logger.error('Failed to insert Strava marker %s for user %s: %s',
+                             pending[err.get('index')]['external_id'], user_id, err.get('errmsg'))
+
+    inserted = [m for i, m in enumerate(pending) if i not in failed]
+    if errors:
+        raise MarkerWriteError(inserted)
+    return inserted
+
+
+def _remove_markers(activities_collection, user_id, markers):
+    """Roll back markers this batch inserted (best effort)."""
+    if not markers:
+        return
+    try:
+        activities_collection.delete_many({'_id': {'$in': [m['_id'] for m in markers]}})
+    except Exception:
+        logger.exception('Failed to roll back Strava markers for user %s', user_id)
+
+
+def ingest_applied_markers(user_id, markers, reward_days='today', notify=True, credit=True):
+    """Record and credit a batch of Strava activities for a child.
+
+    reward_days: 'today' grants the streak reward only for today's activity and
+        records older days silently; 'all' runs the streak reward for every new day.
+    notify: passed through to the streak reward notification.
+    credit: False records the activities and their days without crediting
+        minutes or granting streak rewards.
+
+    Returns dict with keys: inserted (list of marker docs), credited_minutes (int),
+    credit_failed (bool), streak_rewards (int)
+    """
+    summary = {'inserted': [], 'credited_minutes': 0, 'credit_failed': False, 'streak_rewards': 0}
+    if not markers:
+        return summary
+
+    database = get_db()
+    if database is None:
+        summary['credit_failed'] = True
+        return summary
+
+    activities_collection = database['activities']
+    if not credit:
+        for marker in markers:
+            marker['earned_minutes'] = 0
+            marker['credited'] = False
+    try:
+        inserted = _insert_new_markers(activities_collection, user_id, markers)
+    except MarkerWriteError as e:
+        summary['credit_failed'] = True
+        _remove_markers(activities_collection, user_id, e.inserted)
+        return summary
+    except PyMongoError:
+        logger.exception('Error recording Strava activities for user %s', user_id)
+        summary['credit_failed'] = True
+        # The batch may be partly written; only markers given an id here can be ours
+        _remove_markers(activities_collection, user_id, [m for m in markers if '_id' in m])
+        return summary
+    if not inserted:
+        return summary
+
+    today_str = datetime.utcnow().strftime('%Y-%m-%d')
+    total = sum(int(m.get('earned_minutes') or 0) for m in inserted)
+    today_total = sum(int(m.get('earned_minutes') or 0) for m in inserted if activity_day(m.get('date')) == today_str)
+
+    days = sorted({activity_day(m.get('date')) for m in inserted if m.get('date')})
+    if not credit:
+        rewarded_days = []
+    elif reward_days == 'all':
+        rewarded_days = days
+    else:
+        rewarded_days = [d for d in days if d == today_str]
+    silent_days = [d for d in days if d not in rewarded_days]
+
+    try:
+        credited = UserDB.apply_activity_credits(user_id, total, earned_today=today_total, activity_dates=silent_days)
+    except Exception:
+        logger.exception('Error crediting Strava activities for user %s', user_id)
+        credited = False
+
+    if not credited:
+        summary['credit_failed'] = True
+        _remove_markers(activities_collection, user_id, inserted)
+        return summary
+
+    summary['inserted'] = inserted
+    summary['credited_minutes'] = total
+
+    # Streak rewards depend on the days before them, so apply oldest first
+    for day in rewarded_days:
+        try:
+            streak_result = UserDB.record_daily_activity(user_id, activity_date=day, source='strava', notify=notify)
+            if streak_result.get('applied') and isinstance(streak_result.get('reward_minutes', 0), int):
+                summary['streak_rewards'] += int(streak_result.get('reward_minutes', 0))
+        except Exception:
+            logger.exception('Failed to record streak for %s on %s', user_id, day)
+
+    return summary
@@ -0,0 +1,147 @@
+"""
+Client-side budget for Strava's application rate limits.
+
+Strava counts every API request against two budgets per application: a
+15-minute window (reset on the quarter hour) and a daily window (reset at
+midnight UTC). Each response reports both in `X-RateLimit-Limit` and
+`X-RateLimit-Usage` ("short,daily"). Since those headers count calls from
+every worker, each process re-syncs from them after every call.
+
+`RateLimiter.acquire(priority)` reserves one call before it is sent:
+- `INTERACTIVE` (dashboard requests) may use the budget up to a small safety
+  margin (`STRAVA_RATE_SAFETY`, default 2% of each limit)
+- `BACKGROUND` (syncs, backfills) only up to `STRAVA_BACKGROUND_SHARE`
+  (default 0.8) of each limit, so background work never starves the dashboard
+- waiting interactive calls go before waiting background calls
+
+When the budget is spent, the call waits for the window to reset if that
+happens within its `wait` seconds; otherwise it is shed with `RateLimited`,
+which carries `retry_after` so the caller can defer the work. A 429 from
+Strava closes the window until it resets.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+SHORT_WINDOW_SECONDS = 15 * 60
+DAILY_WINDOW_SECONDS = 24 * 60 * 60
+DEFAULT_LIMITS = (int(os.getenv('STRAVA_RATE_LIMIT_15MIN', '200')), int(os.getenv('STRAVA_RATE_LIMIT_DAILY', '2000')))
+SAFETY_SHARE = float(os.getenv('STRAVA_RATE_SAFETY', '0.02'))
+BACKGROUND_SHARE = float(os.getenv('STRAVA_BACKGROUND_SHARE', '0.8'))
+
+
+class RateLimited(Exception):
+    """The Strava budget for this priority is spent; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Strava rate limit reached; retry in {int(retry_after)}s')
+        self.retry_after = retry_after
+
+
+def _parse_pair(value):
+    """'600,30000' -> (600, 30000); None if missing or malformed."""
+    try:
+        short, daily = (int(part) for part in value.split(',')[:2])
+        return short, daily
+    except (AttributeError, ValueError):
+        return None
+
+
+class RateLimiter:
+
+    def __init__(self, limits=DEFAULT_LIMITS, safety_share=SAFETY_SHARE, background_share=BACKGROUND_SHARE,
+                 clock=time.time):
+        self.limits = list(limits)
+        self.usage = [0, 0]
+        self.safety_share = safety_share
+        self.background_share = background_share
+        self._clock = clock
+        self._windows = self._current_windows()
+        self._blocked_until = 0.0
+        self._waiting = [0, 0]
+        self._cond = threading.Condition()
+
+    def _current_windows(self):
+        now = self._clock()
+        return [int(now // SHORT_WINDOW_SECONDS), int(now // DAILY_WINDOW_SECONDS)]
+
+    def _roll(self):
+        windows = self._current_windows()
+        for i in (0, 1):
+            if windows[i] != self._windows[i]:
+                self._windows[i] = windows[i]
+                self.usage[i] = 0
+
+    def _ceiling(self, i, priority):
+        limit = self.limits[i]
+        if priority == BACKGROUND:
+            return int(limit * self.background_share)
+        return limit - max(1, int(limit * self.safety_share))
+
+    def _seconds_until_open(self, priority):
+        """0 if a call at `priority` may go now, else seconds until the blocking window resets."""
+        now = self._clock()
+        wait = max(0.0, self._blocked_until - now)
+        for i, length in ((0, SHORT_WINDOW_SECONDS), (1, DAILY_WINDOW_SECONDS)):
+            if self.usage[i] >= self._ceiling(i, priority):
+                wait = max(wait, (self._windows[i] + 1) * length - now)
+        return wait
+
+    def acquire(self, priority=INTERACTIVE, wait=0.0):
+        """Reserve one call, waiting up to `wait` seconds for a window reset; else raise RateLimited."""
+        deadline = self._clock() + wait
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    self._roll()
+                    retry_after = self._seconds_until_open(priority)
+                    queued_ahead = priority == BACKGROUND and self._waiting[INTERACTIVE] > 0
+                    if not retry_after and not queued_ahead:
+                        self.usage[0] += 1
+                        self.usage[1] += 1
+                        return
+                    remaining = deadline - self._clock()
+                    if retry_after > remaining:
+                        raise RateLimited(retry_after)
+                    self._cond.wait(min(retry_after, remaining) or remaining)
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+    def update(self, headers):
+        """Sync limits and usage from a Strava response's headers."""
+        limits = _parse_pair(headers.get('X-RateLimit-Limit'))
+        usage = _parse_pair(headers.get('X-RateLimit-Usage'))
+        if not limits or not usage:
+            return
+        with self._cond:
+            self._roll()
+            self.limits = list(limits)
+            # The server counts every worker; keep local reservations it has not seen yet
+            self.usage = [max(self.usage[0], usage[0]), max(self.usage[1], usage[1])]
+            self._cond.notify_all()
+
+    def exhausted(self, headers=None):
+        """Record a 429: nothing goes out until the window resets."""
+        if headers:
+            self.update(headers)
+        with self._cond:
+            now = self._clock()
+            daily_spent = self.usage[1] >= self.limits[1]
+            length = DAILY_WINDOW_SECONDS if daily_spent else SHORT_WINDOW_SECONDS
+            self._blocked_until = (int(now // length) + 1) * length
+            logger.warning("Strava rate limit hit (usage %s of %s); pausing calls for %ds",
+                           self.usage, self.limits, self._blocked_until - now)
+
+    def snapshot(self):
+        with self._cond:
+            self._roll()
+            return {'limits': list(self.limits), 'usage': list(self.usage),
+                    'blocked_for': max(0.0, self._blocked_until - self._clock())}
@@ -0,0 +1,288 @@
+"""
+Background Strava sync: webhook events, sync cursors and history backfill.
+
+Strava pushes an event to `/strava/webhook` whenever a connected athlete
+creates, updates or deletes an activity, or revokes access. The route only
+queues the event (`enqueue_event()`); a task worker (core/task_queue.py) runs
+`handle_event()` off the request path:
+
+- create/update: fetch the activity at background priority, then score,
+  record, credit and reward it through `ingest_applied_markers()`, the same
+  path the dashboard import uses (an already-imported activity is not
+  credited twice). An update only refreshes the stored title and type.
+- delete: the marker is flagged `deleted_at` but kept, so the id is never
+  credited again; minutes already earned stay earned.
+- athlete deauthorization: the user's tokens are cleared.
+
+Updates and deletes also drop the cached activity detail
+(core/activity_details.py), for parents as well as children.
+
+Each connected child also carries a `strava_sync` cursor on their user
+document:
+
+- `high_water`: start time (epoch) of the newest activity imported. Syncs ask
+  Strava only for activities after it (`after=`, minus a small overlap for
+  late uploads), so an up-to-date user costs one small request.
+- `backfill_before` / `backfill_done`: the `strava_backfill` task pages back
+  through the history before `high_water` with `before=` cursors. It saves
+  its cursor after every page, so it resumes where it stopped after a rate
+  limit or a crash. Backfilled activities only fill in activity dates and the
+  streak state; they earn no game time (`credit=False`). Anything newer than
+  the mark is left to the syncs, which credit it.
+
+Strava being rate limited or down defers or retries the task instead of
+failing it.
+"""
+import calendar
+import logging
+import math
+from datetime import datetime
+
+from core import activity_details, scoring, strava_tokens, task_queue
+from core.database import get_db, UserDB
+from core.strava_client import get_client, StravaUnavailable
+from core.strava_ingest import STRAVA_APPLIED_SOURCE, build_applied_marker, ingest_applied_markers
+from core.strava_ratelimit import BACKGROUND, INTERACTIVE, RateLimited
+
+logger = logging.getLogger(__name__)
+
+EVENT_TASK = 'strava_event'
+BACKFILL_TASK = 'strava_backfill'
+# Seconds a background fetch may wait for the rate-limit window before the task is deferred
+FETCH_WAIT_SECONDS = 30
+# Strava's maximum page size
+PAGE_SIZE = 200
+# Pages per backfill run before the task yields to other work
+BACKFILL_PAGES_PER_RUN = 10
+# Pages a sync reads after the high-water mark
+SYNC_MAX_PAGES = 5
+# Activities uploaded late can start before the mark; look back this far
+HIGH_WATER_OVERLAP_SECONDS = 6 * 3600
+# Backfills run after webhook events
+BACKFILL_PRIORITY = 10
+
+
+def user_strava_headers(user_id):
+    """Authorization headers for a user's Strava token, refreshing and saving it if it expires soon."""
+    return strava_tokens.get_headers(user_id)
+
+
+def start_epoch(activity):
+    """Epoch seconds of a Strava activity's start_date ('2026-03-10T09:00:00Z'), or None."""
+    try:
+        return calendar.timegm(datetime.strptime(activity.get('start_date'), '%Y-%m-%dT%H:%M:%SZ').timetuple())
+    except (TypeError, ValueError):
+        return None
+
+
+def sync_params(sync_state, per_page=PAGE_SIZE):
+    """Query for activities new since the user's high-water mark (or the latest page without one)."""
+    high_water = (sync_state or {}).get('high_water')
+    if high_water:
+        return {'after': int(high_water) - HIGH_WATER_OVERLAP_SECONDS, 'per_page': per_page}
+    return {'per_page': per_page, 'page': 1}
+
+
+def fetch_new_activities(headers, sync_state, per_page=PAGE_SIZE, priority=INTERACTIVE, wait=0.0):
+    """Activities since the high-water mark, following pages while they come back full.
+
+    Returns (activities, None), or (None, status) if Strava answered with an error.
+    Raises StravaUnavailable / RateLimited like StravaClient.get().
+    """
+    params = sync_params(sync_state, per_page)
+    activities = []
+    pages = SYNC_MAX_PAGES if 'after' in params else 1
+    for page in range(1, pages + 1):
+        resp = get_client().get('/athlete/activities', headers=headers, params=dict(params, page=page),
+                                priority=priority, wait=wait)
+        if resp.status_code != 200:
+            return None, resp.status_code
+        batch = resp.json()
+        activities.extend(batch)
+        if len(batch) < per_page:
+            break
+    return activities, None
+
+
+def record_sync(user_id, activities, sync_state=None):
+    """Advance the high-water mark past `activities` and queue the history backfill if it has not finished."""
+    epochs = [e for e in (start_epoch(a) for a in activities) if e is not None]
+    if epochs:
+        UserDB.update_strava_sync(user_id, high_water=max(epochs))
+    if not (sync_state or {}).get('backfill_done'):
+        request_backfill(user_id)
+
+
+def is_new(activity, sync_state):
+    """False for activities at or before the high-water mark (already imported or checked)."""
+    high_water = (sync_state or {}).get('high_water')
+    epoch = start_epoch(activity)
+    return not high_water or epoch is None or epoch > int(high_water) - HIGH_WATER_OVERLAP_SECONDS
+
+
+def request_backfill(user_id):
+    """Queue the history backfill for a user (a no-op while one is already pending)."""
+    return task_queue.enqueue(BACKFILL_TASK, {'user_id': str(user_id)}, dedupe_key=f'strava_backfill:{user_id}',
+                              priority=BACKFILL_PRIORITY)
+
+
+def _markers(user_id, activities):
+    markers = []
+    for activity in activities:
+        metrics = scoring.strava_metrics(activity)
+        markers.append(build_applied_marker(user_id, activity, metrics['distance_km'],
+                                            int(math.ceil(metrics['duration_minutes'])),
+                                            metrics['intensity'], metrics['earned_minutes']))
+    return markers
+
+
+@task_queue.handler(BACKFILL_TASK)
+def backfill_user(payload):
+    """Record a child's Strava history a page at a time (dates only, no credit), saving the cursor per page."""
+    user_id = payload.get('user_id')
+    user = UserDB.get_user_view(user_id, 'strava', 'account_type')
+    if not user or user.get('account_type') != 'child' or not user.get('strava_connected'):
+        return
+    state = user.get('strava_sync') or {}
+    if state.get('backfill_done'):
+        return
+    high_water = state.get('high_water')
+    if not high_water:
+        # No activity synced yet, so there is no history behind the mark
+        UserDB.update_strava_sync(user_id, backfill_done=True)
+        return
+    headers = user_strava_headers(user_id)
+    if not headers:
+        return
+
+    before = state.get('backfill_before') or int(high_water) + 1
+    for _ in range(BACKFILL_PAGES_PER_RUN):
+        try:
+            resp = get_client().get('/athlete/activities', headers=headers,
+                                    params={'before': before, 'per_page': PAGE_SIZE},
+                                    priority=BACKGROUND, wait=FETCH_WAIT_SECONDS)
+        except RateLimited as e:
+            raise task_queue.Defer(e.retry_after, str(e))
+        if resp.status_code in (401, 403):
+            strava_tokens.invalidate(user_id)
+            logger.info('Strava access lost for user %s; stopping backfill', user_id)
+            return
+        if resp.status_code != 200:
+            raise StravaUnavailable(f'Strava returned {resp.status_code} during backfill')
+
+        activities = resp.json()
+        history = [a for a in activities if (start_epoch(a) or 0) <= high_water]
+        if history:
+            summary = ingest_applied_markers(user_id, _markers(user_id, history), credit=False)
+            if summary['credit_failed']:
+                raise RuntimeError(f'Recording backfilled activities for user {user_id} failed')
+        epochs = [e for e in (start_epoch(a) for a in activities) if e is not None]
+        done = len(activities) < PAGE_SIZE or not epochs
+        before = min(epochs) if epochs else before
+        UserDB.update_strava_sync(user_id, backfill_before=before, backfill_done=done)
+        if done:
+            logger.info('Strava backfill finished for user %s', user_id)
+            return
+
+    # Let other tasks run; the saved cursor picks up from here
+    raise task_queue.Defer(1, 'backfill continues')
+
+
+def enqueue_event(event):
+    """Queue a Strava webhook event. Returns the task id, or None if it was already queued."""
+    dedupe_key = 'strava:{}:{}:{}:{}'.format(event.get('object_type'), event.get('object_id'),
+                                             event.get('aspect_type'), event.get('event_time'))
+    return task_queue.enqueue(EVENT_TASK, event, dedupe_key=dedupe_key)
+
+
+def _mark_deleted(user_id, activity_id):
+    database = get_db()
+    if database is None:
+        raise RuntimeError('Database connection failed')
+    database['activities'].update_one(
+        {'user_id': user_id, 'source': STRAVA_APPLIED_SOURCE, 'external_id': str(activity_id)},
+        {'$set': {'deleted_at': datetime.utcnow()}}
+    )
+    UserDB.bump_state_version(user_id)
+
+
+def _refresh_marker(user_id, activity):
+    """Copy an edited activity's title and type onto its marker. Returns False if there is no marker yet."""
+    database = get_db()
+    if database is None:
+        raise RuntimeError('Database connection failed')
+    result = database['activities'].update_one(
+        {'user_id': user_id, 'source': STRAVA_APPLIED_SOURCE, 'external_id': str(activity.get('id'))},
+        {'$set': {'title': activity.get('name'), 'type': activity.get('type')}}
+    )
+    if result.matched_count:
+        UserDB.bump_state_version(user_id)
+    return bool(result.matched_count)
+
+
+def _fetch_activity(user_id, activity_id):
+    """The activity JSON, or None if it is gone or not visible to us."""
+    headers = user_strava_headers(user_id)
+    if not headers:
+        logger.info('No Strava token for user %s; dropping activity %s', user_id, activity_id)
+        return None
+    try:
+        resp = get_client().get(f'/activities/{activity_id}', headers=headers, priority=BACKGROUND,
+                                wait=FETCH_WAIT_SECONDS)
+    except RateLimited as e:
+        raise task_queue.Defer(e.retry_after, str(e))
+    if resp.status_code == 429:
+        raise task_queue.Defer(60, 'Strava rate limit')
+    if resp.status_code == 401:
+        strava_tokens.invalidate(user_id)
+    if resp.status_code in (401, 403, 404):
+        logger.info('Strava activity %s for user %s not available (%s)', activity_id, user_id, resp.status_code)
+        return None
+    if resp.status_code != 200:
+        raise StravaUnavailable(f'Strava returned {resp.status_code} for activity {activity_id}')
+    return resp.json()
+
+
+@task_queue.handler(EVENT_TASK)
+def handle_event(event):
+    object_type = event.get('object_type')
+    aspect = event.get('aspect_type')
+    user = UserDB.get_user_by_strava_id(event.get('owner_id'), 'identity')
+    if not user:
+        logger.info('Strava event for unknown athlete %s', event.get('owner_id'))
+        return
+    user_id = str(user['_id'])
+
+    if object_type == 'athlete':
+        if str((event.get('updates') or {}).get('authorized')).lower() == 'false':
+            UserDB.clear_strava_credentials(user_id)
+            strava_tokens.invalidate(user_id)
+            logger.info('User %s revoked Strava access', user_id)
+        return
+    if object_type != 'activity':
+        return
+    activity_id = event.get('object_id')
+    if aspect in ('update', 'delete'):
+        activity_details.invalidate(user_id, activity_id)
+    if user.get('account_type') != 'child':
+        return
+
+    if aspect == 'delete':
+        _mark_deleted(user_id, activity_id)
+        return
+
+    activity = _fetch_activity(user_id, activity_id)
+    if activity is None:
+        return
+    if aspect == 'update' and _refresh_marker(user_id, activity):
+        return
+
+    summary = ingest_applied_markers(user_id, _markers(user_id, [activity]), reward_days='today')
+    if summary['credit_failed']:
+        raise RuntimeError(f'Crediting Strava activity {activity_id} for user {user_id} failed')
+    if summary['inserted']:
+        logger.info('Credited %d minutes to user %s for Strava activity %s',
+                    summary['credited_minutes'], user_id, activity_id)
+    epoch = start_epoch(activity)
+    if epoch is not None:
+        UserDB.update_strava_sync(user_id, high_water=epoch)
@@ -0,0 +1,161 @@
+"""
+Per-user Strava access tokens, cached and refreshed once.
+
+`get_headers(user_id)` returns the Authorization header for a user's token:
+
+- Tokens are kept in a process-local LRU (`STRAVA_TOKEN_CACHE_SIZE`, default
+  1024 users). An entry is reused while the token has more than
+  `STRAVA_TOKEN_REFRESH_MARGIN` seconds left (default 600) and was read from
+  MongoDB less than `CACHE_TTL_SECONDS` ago. After that the user document is
+  read again, which picks up a reconnect or another worker's refresh.
+- When the token is inside the margin it is refreshed ahead of expiry. There
+  is one lock per user, so concurrent callers wait for the same refresh
+  instead of each POSTing to Strava. The new token is saved on the user
+  document.
+- If a proactive refresh fails, the old token is used until it actually
+  expires.
+
+`invalidate(user_id)` drops a user's entry (after a reconnect, a revoke, or a
+401 from Strava).
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from core.database import UserDB
+from core.strava_client import get_client
+
+logger = logging.getLogger(__name__)
+
+CACHE_SIZE = int(os.getenv('STRAVA_TOKEN_CACHE_SIZE', '1024'))
+REFRESH_MARGIN_SECONDS = int(os.getenv('STRAVA_TOKEN_REFRESH_MARGIN', '600'))
+CACHE_TTL_SECONDS = 300
+RETRY_REFRESH_SECONDS = 30
+
+
+def _expiry_epoch(token_expiry):
+    """Epoch seconds from the stored ISO expiry (naive local time, as written by the OAuth callback)."""
+    if not token_expiry:
+        return None
+    try:
+        return datetime.fromisoformat(token_expiry).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenCache:
+
+    def __init__(self, size=CACHE_SIZE, margin=REFRESH_MARGIN_SECONDS, ttl=CACHE_TTL_SECONDS, clock=time.time):
+        self.size = size
+        self.margin = margin
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+            return entry
+
+    def _put(self, user_id, entry):
+        with self._lock:
+            self._entries[user_id] = entry
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.size:
+                evicted, _ = self._entries.popitem(last=False)
+                self._locks.pop(evicted, None)
+
+    def _user_lock(self, user_id):
+        with self._lock:
+            return self._locks.setdefault(user_id, threading.Lock())
+
+    def _fresh(self, entry, now):
+        if entry is None or not entry['access_token'] or entry['expires_at'] is None:
+            return False
+        if now - entry['loaded_at'] >= self.ttl:
+            return False
+        if entry['expires_at'] - now > self.margin:
+            return True
+        # Inside the margin after a failed refresh: keep the old token briefly before trying again
+        return entry['expires_at'] > now and now < entry.get('retry_refresh_at', 0)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def access_token(self, user_id):
+        """A usable access token for the user, refreshing it if needed; None if there is none."""
+        user_id = str(user_id)
+        entry = self._get(user_id)
+        if self._fresh(entry, self._clock()):
+            return entry['access_token']
+
+        # Single flight: whoever holds the lock refreshes, the rest reuse its result
+        with self._user_lock(user_id):
+            now = self._clock()
+            entry = self._get(user_id)
+            if self._fresh(entry, now):
+                return entry['access_token']
+
+            user = UserDB.get_user_view(user_id, 'strava')
+            if not user:
+                return None
+            entry = {
+                'access_token': user.get('strava_access_token'),
+                'refresh_token': user.get('strava_refresh_token'),
+                'expires_at': _expiry_epoch(user.get('strava_token_expiry')),
+                'loaded_at': now,
+            }
+            if not self._fresh(entry, now) and entry['refresh_token']:
+                entry = self._refresh(user_id, entry, now)
+
+            if entry['access_token']:
+                self._put(user_id, entry)
+            return entry['access_token']
+
+    def _refresh(self, user_id, entry, now):
+        data = {
+            'client_id': os.getenv('STRAVA_CLIENT_ID'),
+            'client_secret': os.getenv('STRAVA_CLIENT_SECRET'),
+            'grant_type': 'refresh_token',
+            'refresh_token': entry['refresh_token']
+        }
+        try:
+            resp = get_client().post_token(data)
+            if resp.status_code == 200:
+                token_data = resp.json()
+                expires_at = datetime.fromtimestamp(token_data.get('expires_at'))
+                refreshed = {
+                    'access_token': token_data.get('access_token'),
+                    'refresh_token': token_data.get('refresh_token', entry['refresh_token']),
+                    'expires_at': expires_at.timestamp(),
+                    'loaded_at': now,
+                }
+                UserDB.update_strava_token(user_id, refreshed['access_token'], refreshed['refresh_token'],
+                                           expires_at.isoformat())
+                return refreshed
+            logger.warning('Strava token refresh for user %s returned %s', user_id, resp.status_code)
+        except Exception:
+            logger.exception('Failed to refresh Strava token for user %s', user_id)
+        # Keep using the old token; try the refresh again shortly
+        return dict(entry, retry_refresh_at=now + RETRY_REFRESH_SECONDS)
+
+
+token_cache = TokenCache()
+
+
+def get_headers(user_id):
+    """Authorization headers for a user's Strava token, or None."""
+    token = token_cache.access_token(user_id)
+    return {'Authorization': f'Bearer {token}'} if token else None
+
+
+def invalidate(user_id):
+    token_cache.invalidate(user_id)
@@ -0,0 +1,132 @@
+"""
+Compact streak state stored on child documents as `streak_state`.
+
+    {'length': 3, 'last_day': '2026-03-10', 'bitmap': 0b111}
+
+- `length` is the run of consecutive active days ending at `last_day` (the
+  most recent recorded day), matching what `calculate_current_streak` has
+  always returned.
+- `bitmap` bit i is set when `last_day - i days` is an active day, for the
+  last WINDOW_DAYS days. It lets an out-of-order (backfilled) date be merged
+  without re-reading `activity_dates`.
+
+Recording a new latest day is a shift and an add. A backfilled date is a bit
+set, plus a walk over the window when it joins the current run to older days.
+Only a backfill that reaches past the window needs a full recompute from
+`activity_dates`; `advance()` returns None in that case.
+"""
+from datetime import date, timedelta
+
+# 62 bits keeps the bitmap inside a signed BSON int64
+WINDOW_DAYS = 62
+_MASK = (1 << WINDOW_DAYS) - 1
+
+
+def parse_day(value):
+    """Return a date for 'YYYY-MM-DD' / ISO datetime strings or dates, else None."""
+    if isinstance(value, date):
+        return value
+    if not isinstance(value, str):
+        return None
+    try:
+        return date.fromisoformat(value.split('T')[0])
+    except ValueError:
+        return None
+
+
+def _state(length, last_day, bitmap):
+    # Fixed key order so the stored subdocument can be matched by equality
+    return {'length': int(length), 'last_day': last_day.isoformat(), 'bitmap': int(bitmap & _MASK)}
+
+
+def state_from_dates(dates):
+    """Build the streak state from a full list of activity dates (migration / fallback path)."""
+    days = sorted({d for d in (parse_day(v) for v in dates or []) if d is not None}, reverse=True)
+    if not days:
+        return None
+
+    last_day = days[0]
+    length = 1
+    for i in range(1, len(days)):
+        if days[i] == last_day - timedelta(days=i):
+            length += 1
+        else:
+            break
+
+    bitmap = 0
+    for d in days:
+        offset = (last_day - d).days
+        if offset >= WINDOW_DAYS:
+            break
+        bitmap |= 1 << offset
+    return _state(length, last_day, bitmap)
+
+
+def contains(state, day):
+    """True/False if the state knows whether `day` is recorded, None if it is outside the window."""
+    if not state:
+        return False
+    day = parse_day(day)
+    if day is None:
+        return None
+    offset = (parse_day(state['last_day']) - day).days
+    if offset < 0:
+        return False
+    if offset < int(state['length']):
+        return True
+    if offset < WINDOW_DAYS:
+        return bool(int(state['bitmap']) >> offset & 1)
+    return None
+
+
+def advance(state, day):
+    """Return the state after recording `day`, or None if a full recompute is needed.
+
+    Recording a day that is already part of the state returns it unchanged.
+    """
+    day = parse_day(day)
+    if day is None:
+        return state
+    if not state:
+        return _state(1, day, 1)
+
+    last_day = parse_day(state['last_day'])
+    length = int(state['length'])
+    bitmap = int(state['bitmap'])
+    delta = (day - last_day).days
+
+    if delta > 0:
+        # New most recent day
+        new_length = length + 1 if delta == 1 else 1
+        shifted = (bitmap << delta) if delta < WINDOW_DAYS else 0
+        return _state(new_length, day, shifted | 1)
+
+    offset = -delta
+    if offset < length:
+        return state
+    if offset >= WINDOW_DAYS:
+        # Older than the bitmap: harmless unless it touches the current run
+        return None if offset == length else state
+
+    bitmap |= 1 << offset
+    if offset == length:
+        # Backfill closes the gap below the current run; absorb older active days
+        length += 1
+        while length < WINDOW_DAYS and bitmap >> length & 1:
+            length += 1
+        if length >= WINDOW_DAYS:
+            return None
+    return _state(length, last_day, bitmap)
+
+
+def advance_many(state, days):
+    """Apply several dates in any order; None if any of them needs a recompute."""
+    for day in sorted({d for d in (parse_day(v) for v in days or []) if d is not None}):
+        state = advance(state, day)
+        if state is None:
+            return None
+    return state
+
+
+def streak_length(state):
+    return int(state['length']) if state else 0
@@ -0,0 +1,246 @@
+"""
+A small MongoDB-backed task queue for work that should not run on the request path.
+
+Tasks are documents in `tasks`:
+
+    {kind, payload, status, priority, run_at, attempts, max_attempts,
+     dedupe_key?, worker?, lease_until?, last_error?, created_at, finished_at?, expires_at?}
+
+- `enqueue()` inserts a `queued` task. A `dedupe_key` (unique index) keeps
+  one pending copy of a task: enqueueing it again is a no-op until the task
+  finishes, when the key is released.
+- `claim()` atomically moves the most urgent due task to `running` with
+  `find_one_and_update`. Lower `priority` runs first. The claim holds a lease;
+  `requeue_expired()` puts tasks whose worker died back in the queue.
+- Handlers are registered per kind with `@handler('kind')`. A handler that
+  returns finishes the task (`done`, kept for `TASK_RETENTION_HOURS` by a TTL
+  index). Raising `Defer(seconds)` reschedules without using up an attempt.
+  Any other exception retries with exponential backoff until `max_attempts`,
+  after which the task is `dead` and left for inspection.
+
+`Worker` runs a pool of threads that claim and run tasks. `worker.py` starts
+one as its own process (`TASK_WORKER_THREADS`), and `wsgi.py` can start one
+inside each web worker (`TASK_WORKER_THREADS_IN_WEB`).
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from core.database import get_db
+
+logger = logging.getLogger(__name__)
+
+TASKS = 'tasks'
+QUEUED, RUNNING, DONE, DEAD = 'queued', 'running', 'done', 'dead'
+
+DEFAULT_MAX_ATTEMPTS = 5
+LEASE_SECONDS = 300
+RETRY_BASE_SECONDS = 10
+RETRY_MAX_SECONDS = 3600
+RETENTION_HOURS = int(os.getenv('TASK_RETENTION_HOURS', '72'))
+REQUEUE_INTERVAL_SECONDS = 30
+
+_handlers = {}
+
+
+class Defer(Exception):
+    """Raised by a handler to run the task again after `delay` seconds without counting an attempt."""
+
+    def __init__(self, delay, reason=''):
+        super().__init__(reason or f'deferred for {delay}s')
+        self.delay = delay
+
+
+def handler(kind):
+    """Register the decorated function as the handler for tasks of `kind`. It receives the payload."""
+    def register(func):
+        _handlers[kind] = func
+        return func
+    return register
+
+
+def registered_kinds():
+    return sorted(_handlers)
+
+
+def _tasks(database=None):
+    database = database if database is not None else get_db()
+    return database[TASKS] if database is not None else None
+
+
+def enqueue(kind, payload, dedupe_key=None, priority=0, delay=0, max_attempts=DEFAULT_MAX_ATTEMPTS, database=None):
+    """Queue a task. Returns its id, or None if a task with the same dedupe_key exists or the write failed."""
+    tasks = _tasks(database)
+    if tasks is None:
+        return None
+    now = datetime.utcnow()
+    doc = {
+        'kind': kind,
+        'payload': payload,
+        'status': QUEUED,
+        'priority': priority,
+        'run_at': now + timedelta(seconds=delay),
+        'attempts': 0,
+        'max_attempts': max_attempts,
+        'created_at': now,
+    }
+    if dedupe_key is not None:
+        doc['dedupe_key'] = dedupe_key
+    try:
+        return tasks.insert_one(doc).inserted_id
+    except DuplicateKeyError:
+        logger.debug("Task %s already queued", dedupe_key)
+        return None
+    except Exception as e:
+        logger.exception("Error queueing %s task: %s", kind, e)
+        return None
+
+
+def claim(worker_id, kinds=None, lease_seconds=LEASE_SECONDS, database=None):
+    """Take the most urgent due task and lease it to `worker_id`. Returns the task or None."""
+    tasks = _tasks(database)
+    if tasks is None:
+        return None
+    now = datetime.utcnow()
+    query = {'status': QUEUED, 'run_at': {'$lte': now}}
+    if kinds:
+        query['kind'] = {'$in': list(kinds)}
+    return tasks.find_one_and_update(
+        query,
+        {'$set': {'status': RUNNING, 'worker': worker_id, 'started_at': now,
+                  'lease_until': now + timedelta(seconds=lease_seconds)},
+         '$inc': {'attempts': 1}},
+        sort=[('priority', ASCENDING), ('run_at', ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def complete(task, database=None):
+    now = datetime.utcnow()
+    _tasks(database).update_one(
+        {'_id': task['_id'], 'status': RUNNING, 'worker': task.get('worker')},
+        {'$set': {'status': DONE, 'finished_at': now, 'expires_at': now + timedelta(hours=RETENTION_HOURS)},
+         '$unset': {'lease_until': '', 'dedupe_key': ''}}
+    )
+
+
+def retry(task, error, delay=None, count_attempt=True, database=None):
+    """Put a failed task back in the queue with backoff, or mark it dead once out of attempts."""
+    now = datetime.utcnow()
+    attempts = task.get('attempts', 1)
+    query = {'_id': task['_id'], 'status': RUNNING, 'worker': task.get('worker')}
+    if count_attempt and attempts >= task.get('max_attempts', DEFAULT_MAX_ATTEMPTS):
+        logger.error("Task %s (%s) failed %d times; giving up: %s", task['_id'], task.get('kind'), attempts, error)
+        _tasks(database).update_one(query, {'$set': {'status': DEAD, 'last_error': str(error), 'finished_at': now},
+                                            '$unset': {'lease_until': '', 'dedupe_key': ''}})
+        return
+    if delay is None:
+        delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+    update = {'$set': {'status': QUEUED, 'run_at': now + timedelta(seconds=delay), 'last_error': str(error)},
+              '$unset': {'lease_until': '', 'worker': ''}}
+    if not count_attempt:
+        update['$inc'] = {'attempts': -1}
+    _tasks(database).update_one(query, update)
+
+
+def requeue_expired(database=None):
+    """Return tasks whose lease ran out (their worker died) to the queue. Returns how many."""
+    tasks = _tasks(database)
+    if tasks is None:
+        return 0
+    result = tasks.update_many(
+        {'status': RUNNING, 'lease_until': {'$lt': datetime.utcnow()}},
+        {'$set': {'status': QUEUED, 'run_at': datetime.utcnow(), 'last_error': 'lease expired'},
+         '$unset': {'lease_until': '', 'worker': ''}}
+    )
+    if result.modified_count:
+        logger.warning("Requeued %d task(s) with expired leases", result.modified_count)
+    return result.modified_count
+
+
+def queue_stats(database=None):
+    """Task counts by (kind, status)."""
+    tasks = _tasks(database)
+    if tasks is None:
+        return {}
+    rows = tasks.aggregate([{'$group': {'_id': {'kind': '$kind', 'status': '$status'}, 'count': {'$sum': 1}}}])
+    return {(row['_id']['kind'], row['_id']['status']): row['count'] for row in rows}
+
+
+def run_task(task, database=None):
+    """Run one claimed task through its handler and record the outcome."""
+    func = _handlers.get(task.get('kind'))
+    if func is None:
+        retry(dict(task, max_attempts=0), f"no handler for {task.get('kind')}", database=database)
+        return
+    try:
+        func(task.get('payload') or {})
+    except Defer as d:
+        retry(task, d, delay=d.delay, count_attempt=False, database=database)
+    except Exception as e:
+        logger.exception("Task %s (%s) failed", task['_id'], task.get('kind'))
+        retry(task, e, database=database)
+    else:
+        complete(task, database=database)
+
+
+class Worker:
+    """A pool of threads claiming and running tasks until stop() is called."""
+
+    def __init__(self, threads=4, kinds=None, poll_interval=1.0, lease_seconds=LEASE_SECONDS, database=None):
+        self.threads = threads
+        self.kinds = kinds
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.database = database
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        self._stop = threading.Event()
+        self._threads = []
+
+    def run_once(self):
+        """Claim and run one task. Returns False when nothing was due."""
+        task = claim(self.worker_id, self.kinds, self.lease_seconds, database=self.database)
+        if task is None:
+            return False
+        run_task(task, database=self.database)
+        return True
+
+    def _loop(self, index):
+        last_requeue = 0.0
+        while not self._stop.is_set():
+            try:
+                if index == 0 and time.monotonic() - last_requeue > REQUEUE_INTERVAL_SECONDS:
+                    last_requeue = time.monotonic()
+                    requeue_expired(database=self.database)
+                if not self.run_once():
+                    self._stop.wait(self.poll_interval)
+            except Exception:
+                logger.exception("Task worker loop error")
+                self._stop.wait(self.poll_interval)
+
+    def start(self):
+        for index in range(self.threads):
+            thread = threading.Thread(target=self._loop, args=(index,), name=f'task-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("Task worker %s started with %d thread(s)", self.worker_id, self.threads)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run_forever(self):
+        self.start()
+        try:
+            while not self._stop.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            self.stop()
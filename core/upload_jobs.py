@@ -0,0 +1,288 @@
+"""
+Background processing of activity file uploads.
+
+`/api/upload` only writes the file to disk and calls `submit()`. That records
+an `upload_jobs` document and answers 202 with its id. A process-local thread
+pool (`UPLOAD_WORKER_THREADS`, default 2) parses and ingests the file with
+core/activity_files.py, writing progress and the outcome back to the job.
+`/api/upload/<job_id>` reports them.
+
+Statuses: queued -> processing -> done | duplicate | failed.
+
+The file sits on the disk of the instance that received it, so jobs are
+processed there rather than by the shared task worker (core/task_queue.py).
+Each job records its `host`:
+
+- Workers claim a job with a conditional update, so every gunicorn worker on
+  a host can share the queue.
+- `resume()` runs when the pool starts. It requeues this host's jobs whose
+  lease expired (their process died mid-run) and picks up queued ones.
+- A redeploy or restart brings a new host name and an empty disk, so nothing
+  would ever resume the old host's jobs. `resume()` and the status endpoint
+  fail them instead, once their lease expired or they are older than
+  `ORPHAN_HOURS`.
+- The activity is stored before it is credited; core/activity_files.py credits
+  it idempotently, so a resumed job never credits it twice or skips it.
+- Finished jobs expire after `RETENTION_DAYS`.
+"""
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+
+from core import activity_files
+from core.database import get_db
+
+logger = logging.getLogger(__name__)
+
+JOBS = 'upload_jobs'
+QUEUED, PROCESSING, DONE, DUPLICATE, FAILED = 'queued', 'processing', 'done', 'duplicate', 'failed'
+WORKER_THREADS = int(os.getenv('UPLOAD_WORKER_THREADS', '2'))
+LEASE_SECONDS = 600
+RETENTION_DAYS = 7
+# Another host's unfinished job older than this is failed even if its lease has not expired
+ORPHAN_HOURS = 1
+ORPHANED_ERROR = 'Upload was interrupted by a server restart, please upload the file again'
+# Parsing fills 0-90%; storing and crediting the activity takes the job to 100%
+PARSE_SHARE = 90
+# Progress is written at most every this many percent
+PROGRESS_STEP = 10
+HOST = socket.gethostname()
+
+
+def _jobs(database=None):
+    database = database if database is not None else get_db()
+    return database[JOBS] if database is not None else None
+
+
+def _object_id(job_id):
+    try:
+        return ObjectId(job_id)
+    except (InvalidId, TypeError):
+        return None
+
+
+def create_job(user_id, path, filename, extension, title=None, digest=None, database=None):
+    """Record a queued job for a saved upload. Returns its id, or None if the write failed."""
+    jobs = _jobs(database)
+    if jobs is None:
+        return None
+    now = datetime.utcnow()
+    try:
+        return jobs.insert_one({
+            'user_id': user_id,
+            'path': str(path),
+            'filename': filename,
+            'extension': extension,
+            'title': title,
+            'digest': digest,
+            'host': HOST,
+            'status': QUEUED,
+            'progress': 0,
+            'created_at': now,
+            'updated_at': now,
+        }).inserted_id
+    except Exception as e:
+        logger.exception("Error creating upload job for %s: %s", user_id, e)
+        return None
+
+
+def public_view(job):
+    view = {
+        'job_id': str(job['_id']),
+        'status': job.get('status'),
+        'progress': job.get('progress', 0),
+        'filename': job.get('filename'),
+        'created_at': job['created_at'].isoformat() if job.get('created_at') else None,
+    }
+    if job.get('result') is not None:
+        view['result'] = job['result']
+    if job.get('error'):
+        view['error'] = job['error']
+    return view
+
+
+def get_job(job_id, user_id, database=None):
+    """The user's job as returned by the status endpoint, or None."""
+    oid = _object_id(job_id)
+    jobs = _jobs(database)
+    if oid is None or jobs is None:
+        return None
+    job = jobs.find_one({'_id': oid, 'user_id': user_id})
+    if job and job.get('status') in (QUEUED, PROCESSING) and job.get('host') != HOST:
+        if fail_orphaned(jobs, {'_id': oid}):
+            job = jobs.find_one({'_id': oid, 'user_id': user_id})
+    return public_view(job) if job else None
+
+
+def fail_orphaned(jobs, query=None):
+    """Fail unfinished jobs of other hosts that nothing will resume. Returns how many."""
+    now = datetime.utcnow()
+    orphaned = {
+        'host': {'$ne': HOST},
+        '$or': [
+            {'status': PROCESSING, 'lease_until': {'$lt': now}},
+            {'status': {'$in': [QUEUED, PROCESSING]}, 'created_at': {'$lt': now - timedelta(hours=ORPHAN_HOURS)}},
+        ],
+    }
+    orphaned.update(query or {})
+    result = jobs.update_many(orphaned, {
+        '$set': {'status': FAILED, 'progress': 100, 'error': ORPHANED_ERROR, 'updated_at': now,
+                 'finished_at': now, 'expires_at': now + timedelta(days=RETENTION_DAYS)},
+        '$unset': {'lease_until': ''},
+    })
+    return result.modified_count
+
+
+def _claim(job_id, jobs):
+    now = datetime.utcnow()
+    return jobs.find_one_and_update(
+        {'_id': job_id, 'status': QUEUED},
+        {'$set': {'status': PROCESSING, 'lease_until': now + timedelta(seconds=LEASE_SECONDS), 'updated_at': now}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _progress_writer(job_id, jobs):
+    last = [0]
+
+    def report(fraction):
+        percent = int(fraction * PARSE_SHARE)
+        if percent - last[0] >= PROGRESS_STEP:
+            last[0] = percent
+            jobs.update_one({'_id': job_id, 'status': PROCESSING},
+                            {'$set': {'progress': percent, 'updated_at': datetime.utcnow()}})
+    return report
+
+
+def _finish(job_id, jobs, status, result=None, error=None):
+    now = datetime.utcnow()
+    jobs.update_one({'_id': job_id}, {
+        '$set': {'status': status, 'progress': 100, 'result': result, 'error': error, 'updated_at': now,
+                 'finished_at': now, 'expires_at': now + timedelta(days=RETENTION_DAYS)},
+        '$unset': {'lease_until': ''},
+    })
+
+
+def _result_view(result):
+    activity = result['activity']
+    view = {
+        'activity_id': str(activity['_id']),
+        'title': activity['title'],
+        'date': activity['date'],
+        'type': activity['type'],
+        'distance': activity['distance'],
+        'time_minutes': activity['time_minutes'],
+        'elevation_gain': activity['elevation_gain'],
+        'average_heartrate': activity['average_heartrate'],
+        'intensity': activity['intensity'],
+        'earned_minutes': activity['earned_minutes'],
+    }
+    streak = result['streak']
+    if streak.get('applied'):
+        view['streak_reward_minutes'] = streak.get('reward_minutes', 0)
+        view['streak_count'] = streak.get('streak_count')
+    return view
+
+
+def process(job_id, database=None):
+    """Claim and run one job. Returns False if it was not queued (already taken or finished)."""
+    jobs = _jobs(database)
+    if jobs is None:
+        return False
+    job = _claim(job_id, jobs)
+    if job is None:
+        return False
+
+    try:
+        result = activity_files.ingest_file(job['user_id'], job['path'], title=job.get('title'),
+                                            extension=job.get('extension'), digest=job.get('digest'),
+                                            progress=_progress_writer(job_id, jobs))
+    except activity_files.ActivityFileError as e:
+        _finish(job_id, jobs, FAILED, error=f'Could not read activity file: {e}')
+    except Exception:
+        logger.exception("Upload job %s failed", job_id)
+        _finish(job_id, jobs, FAILED, error='Failed to import activity')
+    else:
+        if result['duplicate']:
+            _finish(job_id, jobs, DUPLICATE)
+        else:
+            _finish(job_id, jobs, DONE, result=_result_view(result))
+    return True
+
+
+class UploadProcessor:
+    """Thread pool running this host's upload jobs."""
+
+    def __init__(self, threads=WORKER_THREADS, database=None):
+        self.database = database
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='upload-job')
+
+    def submit(self, job_id):
+        self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        try:
+            process(job_id, database=self.database)
+        except Exception:
+            logger.exception("Upload job %s crashed", job_id)
+
+    def resume(self):
+        """Requeue this host's jobs with expired leases and submit every queued one. Returns how many.
+
+        Other hosts' orphaned jobs are failed first (see fail_orphaned()).
+        """
+        jobs = _jobs(self.database)
+        if jobs is None:
+            return 0
+        orphaned = fail_orphaned(jobs)
+        if orphaned:
+            logger.warning("Failed %d upload job(s) left behind by other hosts", orphaned)
+        now = datetime.utcnow()
+        jobs.update_many({'host': HOST, 'status': PROCESSING, 'lease_until': {'$lt': now}},
+                         {'$set': {'status': QUEUED, 'updated_at': now}, '$unset': {'lease_until': ''}})
+        pending = [job['_id'] for job in jobs.find({'host': HOST, 'status': QUEUED}, {'_id': 1})]
+        for job_id in pending:
+            self.submit(job_id)
+        if pending:
+            logger.info("Resumed %d upload job(s)", len(pending))
+        return len(pending)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+_processor = None
+_processor_lock = threading.Lock()
+
+
+def get_processor():
+    global _processor
+    with _processor_lock:
+        if _processor is None:
+            _processor = UploadProcessor()
+            try:
+                _processor.resume()
+            except Exception:
+                logger.exception("Failed to resume upload jobs")
+        return _processor
+
+
+def set_processor(processor):
+    global _processor
+    with _processor_lock:
+        _processor = processor
+
+
+def submit(user_id, path, filename, extension, title=None, digest=None):
+    """Queue a saved upload for processing. Returns the job id, or None if it could not be recorded."""
+    job_id = create_job(user_id, path, filename, extension, title, digest)
+    if job_id is not None:
+        get_processor().submit(job_id)
+    return job_id
@@ -13,6 +13,7 @@ if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
 from core.database import get_db, UserDB
+from core import streaks
 
 load_dotenv()
 
@@ -221,7 +222,7 @@ def reset_all_user_game_time():
                 'current_used_game_time': 0,
                 'daily_screen_time_limit': 60,
                 'activity_dates': []
-            }}
+            }, '$unset': {'streak_state': ''}}
         )
         print(f"✓ Reset game time for {result.modified_count} user(s)")
     
@@ -287,7 +288,8 @@ def list_all_users():
             'earned_game_time': 1,
             'current_used_game_time': 1,
             'daily_screen_time_limit': 1,
-            'activity_dates': 1
+            'activity_dates': 1,
+            'streak_state': 1
         }))
         
         if not users:
@@ -306,25 +308,9 @@ def list_all_users():
             used = str(user.get('current_used_game_time', 0))[:9]
             limit = str(user.get('daily_screen_time_limit', 0))[:9]
             
-            # Calculate streak from activity_dates
-            from datetime import datetime, timedelta
-            activity_dates = user.get('activity_dates', [])
-            if activity_dates:
-                sorted_dates = sorted(set(activity_dates), reverse=True)
-                streak = 1
-                try:
-                    most_recent = datetime.fromisoformat(sorted_dates[0]).date()
-                    for i in range(1, len(sorted_dates)):
-                        current_date = datetime.fromisoformat(sorted_dates[i]).date()
-                        expected_date = most_recent - timedelta(days=i)
-                        if current_date == expected_date:
-                            streak += 1
-                        else:
-                            break
-                except Exception:
-                    streak = 0
-            else:
-                streak = 0
+            # Stored streak state, rebuilt from activity_dates for older documents
+            state = user.get('streak_state') or streaks.state_from_dates(user.get('activity_dates', []))
+            streak = streaks.streak_length(state)
             streak = str(streak)[:7]
             
             print(f"{name:<20} {email:<30} {account_type:<15} {earned:<10} {used:<10} {limit:<10} {streak:<8}")
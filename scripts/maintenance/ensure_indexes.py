@@ -0,0 +1,58 @@
+"""Create, report and verify the MongoDB indexes declared in core.database.INDEX_SPECS.
+
+Usage:
+    python scripts/maintenance/ensure_indexes.py            # create missing indexes
+    python scripts/maintenance/ensure_indexes.py --report   # list missing / unmanaged / unused indexes
+    python scripts/maintenance/ensure_indexes.py --check    # exit 1 if any hot query plans a COLLSCAN
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from core.database import get_db, ensure_indexes, report_indexes, verify_query_plans
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--report', action='store_true', help='report missing, unmanaged and unused indexes')
+    parser.add_argument('--check', action='store_true', help='fail if any registered query shape scans a collection')
+    args = parser.parse_args(argv)
+
+    database = get_db()
+    if database is None:
+        print("ERROR: Could not connect to MongoDB")
+        return 1
+
+    status = 0
+    failures = ensure_indexes(database)
+    for collection_name, name, error in failures:
+        print(f"✗ {collection_name}.{name}: {error}")
+        status = 1
+    if not failures:
+        print("✓ All registered indexes exist")
+
+    if args.report:
+        for collection_name, entry in report_indexes(database).items():
+            print(f"\n{collection_name}")
+            for key in ('missing', 'unmanaged', 'unused'):
+                print(f"  {key}: {', '.join(entry[key]) or '-'}")
+
+    if args.check:
+        scans = verify_query_plans(database)
+        for scan in scans:
+            print(f"✗ COLLSCAN on {scan['collection']}: filter={scan['filter']} sort={scan['sort']}")
+        if scans:
+            status = 1
+        else:
+            print("✓ No collection scans in registered query shapes")
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""Re-score stored activities with the current rules in core.scoring.
+
+Usage:
+    python scripts/maintenance/rescore_activities.py                          # dry run: report what would change
+    python scripts/maintenance/rescore_activities.py --diff-file diffs.jsonl  # dry run, every diff as JSON lines
+    python scripts/maintenance/rescore_activities.py --apply                  # write changes, resuming from the checkpoint
+    python scripts/maintenance/rescore_activities.py --apply --restart        # start the job again from the first activity
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from core.database import get_db
+from core.rescoring import rescore_activities
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--apply', action='store_true', help='write the new scores and credit adjustments')
+    parser.add_argument('--job-id', default='rescore', help='checkpoint name (default: rescore)')
+    parser.add_argument('--batch-size', type=int, default=1000, help='activities per batch (default: 1000)')
+    parser.add_argument('--restart', action='store_true', help='ignore the saved checkpoint')
+    parser.add_argument('--limit', type=int, help='stop after roughly this many activities')
+    parser.add_argument('--diff-file', help='write every diff to this file as JSON lines')
+    args = parser.parse_args(argv)
+
+    database = get_db()
+    if database is None:
+        print("ERROR: Could not connect to MongoDB")
+        return 1
+
+    diff_file = open(args.diff_file, 'w') if args.diff_file else None
+    try:
+        on_diff = (lambda diff: diff_file.write(json.dumps(diff, default=str) + '\n')) if diff_file else None
+        summary = rescore_activities(job_id=args.job_id, dry_run=not args.apply, batch_size=args.batch_size,
+                                     restart=args.restart, limit=args.limit, on_diff=on_diff, database=database)
+    finally:
+        if diff_file:
+            diff_file.close()
+
+    mode = 'Applied' if args.apply else 'Dry run'
+    if summary['resumed_from'] is not None:
+        print(f"Resumed after activity {summary['resumed_from']}")
+    print(f"{mode}: scanned {summary['scanned']}, skipped {summary['skipped']}, changed {summary['changed']}")
+    print(f"  activity minutes delta: {summary['minutes_delta']:+d}")
+    print(f"  credited minutes delta: {summary['credit_delta']:+d} across {summary['users_adjusted']} users")
+    for change, count in sorted(summary['label_changes'].items()):
+        print(f"  {change}: {count}")
+    for diff in summary['sample']:
+        print(f"  {diff['_id']} ({diff['source']}, {diff['date']}): "
+              f"{diff['old_minutes']} -> {diff['new_minutes']} min, {diff['old_intensity']} -> {diff['new_intensity']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
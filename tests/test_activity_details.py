@@ -0,0 +1,121 @@
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core import activity_details, task_queue
+from core.strava_client import StravaUnavailable
+from core.strava_ratelimit import RateLimited
+
+USER_ID = '507f1f77bcf86cd799439131'
+HEADERS = {'Authorization': 'Bearer t'}
+
+
+def _activity(i):
+    return {'id': i, 'name': f'Ride {i}', 'type': 'Ride', 'distance': 12000, 'moving_time': 1800,
+            'elapsed_time': 1900, 'start_date': '2026-03-10T09:00:00Z'}
+
+
+def _response(status, body=None, etag=None):
+    resp = MagicMock()
+    resp.status_code = status
+    resp.json.return_value = body
+    resp.headers = {'ETag': etag} if etag else {}
+    return resp
+
+
+def _entry(activity_id, fresh_for):
+    now = datetime.utcnow()
+    return {'_id': f'{USER_ID}:{activity_id}', 'detail': {'id': activity_id, 'name': 'cached'}, 'etag': '"v1"',
+            'fresh_until': now + timedelta(seconds=fresh_for), 'expires_at': now + timedelta(days=30)}
+
+
+class ActivityDetailCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        activity_details._lru.clear()
+        self.addCleanup(activity_details._lru.clear)
+        self.collection = MagicMock()
+        self.collection.find_one.return_value = None
+        database = MagicMock()
+        database.__getitem__.return_value = self.collection
+        patches = [patch('core.activity_details.get_db', return_value=database),
+                   patch('core.activity_details.get_client')]
+        mocks = [p.start() for p in patches]
+        for p in patches:
+            self.addCleanup(p.stop)
+        self.get = mocks[1].return_value.get
+
+    def test_miss_fetches_once_then_serves_from_memory(self):
+        self.get.return_value = _response(200, _activity(5), etag='"v1"')
+
+        first, error = activity_details.get_detail(USER_ID, 5, HEADERS)
+        second, _ = activity_details.get_detail(USER_ID, 5, HEADERS)
+
+        self.assertIsNone(error)
+        self.assertEqual(first['distance'], 12.0)
+        self.assertEqual(second, first)
+        self.assertEqual(self.get.call_count, 1)
+        stored = self.collection.replace_one.call_args[0][1]
+        self.assertEqual((stored['_id'], stored['etag']), (f'{USER_ID}:5', '"v1"'))
+
+    def test_fresh_mongo_entry_costs_no_strava_call(self):
+        self.collection.find_one.return_value = _entry(5, 600)
+
+        detail, _ = activity_details.get_detail(USER_ID, 5, HEADERS)
+
+        self.assertEqual(detail['name'], 'cached')
+        self.get.assert_not_called()
+
+    def test_stale_entry_is_revalidated_with_its_etag(self):
+        self.collection.find_one.return_value = _entry(5, -1)
+        self.get.return_value = _response(304)
+
+        detail, _ = activity_details.get_detail(USER_ID, 5, HEADERS)
+
+        self.assertEqual(detail['name'], 'cached')
+        self.assertEqual(self.get.call_args[1]['headers']['If-None-Match'], '"v1"')
+        self.assertGreater(self.collection.replace_one.call_args[0][1]['fresh_until'], datetime.utcnow())
+
+    def test_stale_entry_is_served_when_strava_is_unavailable(self):
+        self.collection.find_one.return_value = _entry(5, -1)
+        for error in (StravaUnavailable('down'), RateLimited(60)):
+            self.get.side_effect = error
+            activity_details._lru.clear()
+            detail, _ = activity_details.get_detail(USER_ID, 5, HEADERS)
+            self.assertEqual(detail['name'], 'cached')
+
+    def test_miss_without_strava_raises_and_not_found_is_dropped(self):
+        self.get.side_effect = StravaUnavailable('down')
+        with self.assertRaises(StravaUnavailable):
+            activity_details.get_detail(USER_ID, 5, HEADERS)
+
+        self.get.side_effect = None
+        self.get.return_value = _response(404)
+        self.assertEqual(activity_details.get_detail(USER_ID, 6, HEADERS), (None, 404))
+        self.collection.delete_one.assert_called_once_with({'_id': f'{USER_ID}:6'})
+
+    @patch('core.activity_details.task_queue.enqueue')
+    def test_prefetch_queues_only_newest_uncached_activities(self, mock_enqueue):
+        self.collection.find.return_value = [{'_id': f'{USER_ID}:2'}]
+
+        queued = activity_details.prefetch(USER_ID, [1, 2, 3, 4])
+
+        self.assertEqual(queued, 2)
+        self.assertEqual([c[0][1]['activity_id'] for c in mock_enqueue.call_args_list], ['1', '3'])
+        self.assertEqual(mock_enqueue.call_args[1]['dedupe_key'], f'detail:{USER_ID}:3')
+
+    @patch('core.activity_details.strava_tokens.get_headers', return_value=HEADERS)
+    def test_prefetch_task_defers_when_over_budget(self, _):
+        self.get.side_effect = RateLimited(120)
+
+        with self.assertRaises(task_queue.Defer):
+            activity_details.prefetch_detail({'user_id': USER_ID, 'activity_id': '5'})
+        self.assertEqual(self.get.call_args[1]['priority'], activity_details.BACKGROUND)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+import io
+import os
+import struct
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from pymongo.errors import DuplicateKeyError
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core import activity_files
+from core.activity_files import ActivityFileError, parse_fit, parse_gpx, parse_tcx
+from core.database import UserDB
+
+USER_ID = '507f1f77bcf86cd799439141'
+# About 111 m per 0.001 degree of latitude
+STEP_DEG = 0.001
+
+GPX = """<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="test" xmlns="http://www.topografix.com/GPX/1/1"
+     xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1">
+  <trk><name>Morning Run</name><type>running</type><trkseg>
+{points}
+  </trkseg></trk>
+</gpx>"""
+
+GPX_POINT = """    <trkpt lat="{lat}" lon="0.0"><ele>{ele}</ele><time>2026-03-10T09:{m:02d}:{s:02d}Z</time>
+      <extensions><gpxtpx:TrackPointExtension><gpxtpx:hr>{hr}</gpxtpx:hr></gpxtpx:TrackPointExtension></extensions>
+    </trkpt>"""
+
+TCX = """<?xml version="1.0" encoding="UTF-8"?>
+<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">
+  <Activities><Activity Sport="Biking"><Id>2026-03-10T09:00:00Z</Id>
+    <Lap StartTime="2026-03-10T09:00:00Z"><TotalTimeSeconds>60</TotalTimeSeconds><DistanceMeters>600</DistanceMeters>
+      <Track>
+{points}
+      </Track>
+    </Lap>
+  </Activity></Activities>
+</TrainingCenterDatabase>"""
+
+TCX_POINT = """        <Trackpoint><Time>2026-03-10T09:{m:02d}:{s:02d}Z</Time><AltitudeMeters>10</AltitudeMeters>
+          <DistanceMeters>{d}</DistanceMeters><HeartRateBpm><Value>{hr}</Value></HeartRateBpm></Trackpoint>"""
+
+
+def _gpx(n, hr=140):
+    points = [GPX_POINT.format(lat=i * STEP_DEG, ele=100 + (i % 2) * 1.0 + (3 if i == n - 1 else 0),
+                               m=(i * 30) // 60, s=(i * 30) % 60, hr=hr) for i in range(n)]
+    return GPX.format(points='\n'.join(points)).encode()
+
+
+def _fit(records, sport=1, big_endian=False):
+    """A FIT file: a record definition, `records` (seconds, distance_m, hr) and a session message."""
+    endian = '>' if big_endian else '<'
+    body = bytearray()
+    # Definition for local type 0 -> record: timestamp, distance, heart_rate, plus an unknown field
+    body += bytes([0x40, 0, 1 if big_endian else 0]) + struct.pack(endian + 'HB', 20, 4)
+    body += bytes([253, 4, 0x86, 5, 4, 0x86, 3, 1, 0x02, 99, 2, 0x84])
+    for i, (seconds, distance, hr) in enumerate(records):
+        if i and i % 2:
+            # Compressed timestamp header for every other record (needs no timestamp field)
+            body += bytes([0x80 | 1 << 5 | ((1_000_000 + seconds) & 0x1F)])
+            body += struct.pack(endian + 'IBH', int(distance * 100), hr, 7)
+            continue
+        body += bytes([0]) + struct.pack(endian + 'IIBH', 1_000_000 + seconds, int(distance * 100), hr, 7)
+    # Compressed headers use local type 1 with the same layout minus the timestamp
+    definition_1 = bytes([0x41, 0, 1 if big_endian else 0]) + struct.pack(endian + 'HB', 20, 3)
+    definition_1 += bytes([5, 4, 0x86, 3, 1, 0x02, 99, 2, 0x84])
+    body = definition_1 + body
+    # Session carrying the sport
+    body += bytes([0x42, 0, 1 if big_endian else 0]) + struct.pack(endian + 'HB', 18, 1) + bytes([5, 1, 0x00])
+    body += bytes([0x02, sport])
+    header = struct.pack('<BBHI4s', 12, 0x20, 2100, len(body), b'.FIT')
+    return header + bytes(body) + b'\x00\x00'
+
+
+class ParserTests(unittest.TestCase):
+
+    def test_gpx_summary(self):
+        summary = parse_gpx(io.BytesIO(_gpx(21)))
+
+        self.assertEqual(summary['type'], 'Run')
+        self.assertEqual(summary['start_date'], '2026-03-10T09:00:00Z')
+        self.assertAlmostEqual(summary['distance_km'], 2.22, places=2)
+        self.assertEqual(summary['moving_minutes'], 10.0)
+        self.assertEqual(summary['average_heartrate'], 140)
+        # 1 m wobble is noise; the final 3 m climb counts
+        self.assertEqual(summary['elevation_gain_m'], 3.0)
+        self.assertAlmostEqual(summary['pace'], 10.0 / 2.22)
+
+    def test_pause_is_not_moving_time(self):
+        points = [GPX_POINT.format(lat=0, ele=0, m=0, s=0, hr=120),
+                  GPX_POINT.format(lat=STEP_DEG, ele=0, m=0, s=30, hr=120),
+                  GPX_POINT.format(lat=2 * STEP_DEG, ele=0, m=20, s=0, hr=120)]
+        summary = parse_gpx(io.BytesIO(GPX.format(points='\n'.join(points)).encode()))
+
+        self.assertEqual(summary['moving_minutes'], 0.5)
+        self.assertEqual(summary['elapsed_minutes'], 20.0)
+
+    def test_tcx_uses_device_distance_and_sport(self):
+        points = [TCX_POINT.format(m=i // 6, s=i % 6 * 10, d=i * 100, hr=150 + i) for i in range(7)]
+        summary = parse_tcx(io.BytesIO(TCX.format(points='\n'.join(points)).encode()))
+
+        self.assertEqual(summary['type'], 'Ride')
+        self.assertEqual(summary['distance_km'], 0.6)
+        self.assertEqual(summary['moving_minutes'], 1.0)
+        self.assertEqual(summary['max_heartrate'], 156)
+
+    def test_fit_records_and_session(self):
+        for big_endian in (False, True):
+            records = [(i, i * 3.0, 130 + i % 10) for i in range(3600)]
+            summary = parse_fit(io.BytesIO(_fit(records, big_endian=big_endian)))
+
+            self.assertEqual(summary['type'], 'Run')
+            self.assertEqual(summary['points'], 3600)
+            self.assertAlmostEqual(summary['distance_km'], 10.8, places=2)
+            self.assertAlmostEqual(summary['moving_minutes'], 3599 / 60.0)
+            self.assertEqual(summary['max_heartrate'], 139)
+
+    def test_bad_files_raise(self):
+        with self.assertRaises(ActivityFileError):
+            parse_gpx(io.BytesIO(b'<gpx><trk>'))
+        with self.assertRaises(ActivityFileError):
+            parse_fit(io.BytesIO(b'\x0c\x10' + b'\x00' * 10))
+        with self.assertRaises(ActivityFileError):
+            parse_fit(io.BytesIO(_fit([(0, 0, 120), (1, 3, 120)])[:-10]))
+        with self.assertRaises(ActivityFileError):
+            parse_gpx(io.BytesIO(GPX.format(points='').encode()))
+
+
+class IngestFileTests(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.gpx')
+        with os.fdopen(handle, 'wb') as f:
+            f.write(_gpx(21))
+        self.addCleanup(os.remove, self.path)
+        self.collection = MagicMock()
+        self.collection.insert_one.side_effect = lambda doc: doc.setdefault('_id', 'new-id')
+        database = MagicMock()
+        database.__getitem__.return_value = self.collection
+        patches = {
+            'db': patch('core.activity_files.get_db', return_value=database),
+            'credit': patch('core.activity_files.UserDB.apply_activity_credits', return_value=True),
+            'streak': patch('core.activity_files.UserDB.record_daily_activity', return_value={'applied': False}),
+        }
+        self.mocks = {name: p.start() for name, p in patches.items()}
+        for p in patches.values():
+            self.addCleanup(p.stop)
+
+    def test_uploaded_file_is_scored_recorded_and_credited(self):
+        result = activity_files.ingest_file(USER_ID, self.path)
+
+        doc = result['activity']
+        self.assertEqual(doc['source'], 'file_upload')
+        self.assertEqual(doc['external_id'], activity_files.file_digest(self.path))
+        self.assertEqual(doc['intensity'], 'Easy')
+        self.mocks['credit'].assert_called_once_with(USER_ID, doc['earned_minutes'], earned_today=0,
+                                                     token='upload:new-id')
+        self.collection.update_one.assert_called_once_with({'_id': 'new-id'}, {'$set': {'credited': True}})
+        self.assertTrue(doc['credited'])
+        self.mocks['streak'].assert_called_once_with(USER_ID, activity_date='2026-03-10', source='upload')
+
+    def test_same_file_twice_is_not_credited_again(self):
+        self.collection.insert_one.side_effect = DuplicateKeyError('E11000')
+        self.collection.find_one.return_value = {'_id': 'old-id', 'credited': True}
+
+        result = activity_files.ingest_file(USER_ID, self.path)
+
+        self.assertTrue(result['duplicate'])
+        self.mocks['credit'].assert_not_called()
+
+    def test_activity_stored_before_a_crash_is_credited_on_resume(self):
+        self.collection.insert_one.side_effect = DuplicateKeyError('E11000')
+        self.collection.find_one.return_value = {'_id': 'old-id', 'credited': False, 'date': '2026-03-10T09:00:00Z',
+                                                 'earned_minutes': 4}
+
+        result = activity_files.ingest_file(USER_ID, self.path)
+
+        self.assertFalse(result['duplicate'])
+        self.mocks['credit'].assert_called_once_with(USER_ID, 4, earned_today=0, token='upload:old-id')
+        self.collection.update_one.assert_called_once_with({'_id': 'old-id'}, {'$set': {'credited': True}})
+
+    def test_failed_credit_removes_the_activity(self):
+        self.mocks['credit'].return_value = False
+
+        with self.assertRaises(RuntimeError):
+            activity_files.ingest_file(USER_ID, self.path)
+        self.collection.delete_one.assert_called_once_with({'_id': 'new-id'})
+
+
+
+class CreditTokenTests(unittest.TestCase):
+
+    @patch('core.database._notify_credit')
+    @patch('core.database.get_db')
+    def test_credit_already_applied_under_the_token_is_not_repeated(self, mock_get_db, mock_notify):
+        users = mock_get_db.return_value.__getitem__.return_value
+        users.update_one.return_value.matched_count = 0
+        users.update_one.return_value.modified_count = 0
+        users.find_one.return_value = {'_id': USER_ID}
+
+        self.assertTrue(UserDB.apply_activity_credits(USER_ID, 9, token='upload:a'))
+
+        query, update = users.update_one.call_args[0]
+        self.assertEqual(query['activity_credit_tokens'], {'$ne': 'upload:a'})
+        self.assertEqual(update['$push']['activity_credit_tokens']['$each'], ['upload:a'])
+        self.assertEqual(update['$inc']['earned_game_time'], 9)
+        mock_notify.assert_not_called()
+
+        users.find_one.return_value = None
+        self.assertFalse(UserDB.apply_activity_credits(USER_ID, 9, token='upload:a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.blob_store import BlobStore
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 200_000
+
+
+class BlobStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.store = BlobStore(self.root)
+
+    def test_file_is_named_and_sharded_by_its_hash(self):
+        blob = self.store.save_stream(io.BytesIO(PNG), '.PNG')
+
+        digest = hashlib.sha256(PNG).hexdigest()
+        self.assertEqual(blob.name, digest + '.png')
+        self.assertEqual(blob.path, self.store.root / digest[:2] / digest[2:4] / blob.name)
+        self.assertEqual(blob.path.read_bytes(), PNG)
+        self.assertEqual(blob.size, len(PNG))
+        self.assertTrue(blob.created)
+
+    def test_identical_upload_is_stored_once(self):
+        first = self.store.save_stream(io.BytesIO(PNG), '.png')
+        second = self.store.save_stream(io.BytesIO(PNG), '.png')
+
+        self.assertFalse(second.created)
+        self.assertEqual(first.path, second.path)
+        stored = [f for _, _, files in os.walk(self.root) for f in files]
+        self.assertEqual(stored, [first.name])
+
+    def test_only_blob_names_resolve(self):
+        blob = self.store.save_stream(io.BytesIO(b'x'), '.gpx')
+
+        self.assertTrue(self.store.exists(blob.name))
+        for name in ('../../etc/passwd', blob.name.upper(), 'abc.png', ''):
+            self.assertFalse(self.store.exists(name))
+            with self.assertRaises(ValueError):
+                self.store.path_for(name)
+
+    def test_failed_read_leaves_nothing_behind(self):
+        class Broken(io.BytesIO):
+            def read(self, size=-1):
+                raise IOError('client went away')
+
+        with self.assertRaises(IOError):
+            self.store.save_stream(Broken(), '.png')
+        self.assertEqual(os.listdir(self.root), [])
+
+
+class MediaRouteTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        os.environ['FLASK_SECRET_KEY'] = 'test_key'
+        import app as app_module
+        cls.app_module = app_module
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.original_store = self.app_module.MEDIA_STORE
+        self.app_module.MEDIA_STORE = BlobStore(self.root)
+        self.addCleanup(setattr, self.app_module, 'MEDIA_STORE', self.original_store)
+        self.client = self.app_module.app.test_client()
+
+    def test_media_is_served_immutable_and_revalidates(self):
+        blob = self.app_module.MEDIA_STORE.save_stream(io.BytesIO(PNG), '.png')
+
+        response = self.client.get(f'/media/{blob.name}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response.headers['Content-Type'], 'image/png')
+        response.close()
+
+        again = self.client.get(f'/media/{blob.name}', headers={'If-None-Match': f'"{blob.digest}"'})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(self.client.get('/media/missing.png').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core import embeddings, profile_ingest, recommendations
+
+
+class FakeEncoder:
+    """Embeds a profile as [weekly_km, 10] so nearer weekly_km means higher cosine."""
+
+    def __init__(self):
+        self.texts = []
+
+    def __call__(self, texts):
+        self.texts.extend(texts)
+        return np.array([[float(t.split()[0].split(':')[1]), 10.0] for t in texts])
+
+
+def _profile(user_id, weekly_km):
+    return {'user_id': user_id, 'weekly_km': weekly_km, 'last_activity': None, 'max_minutes_per_session': 120}
+
+
+class EmbeddingIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.profiles = MagicMock()
+        self.profiles.find.return_value = [_profile('a', 10), _profile('b', 11), _profile('c', 100), _profile('d', 12)]
+        self.database = MagicMock()
+        self.database.__getitem__.return_value = self.profiles
+        self.encoder = FakeEncoder()
+
+    def _index(self, encoder=None):
+        backend = embeddings.TransformerBackend(encoder or self.encoder)
+        index = embeddings.EmbeddingIndex(self.directory, database=self.database, backend=backend)
+        index._checked_at = float('inf')  # no background refreshes in tests
+        return index
+
+    def test_build_and_query_from_memory_mapped_matrix(self):
+        index = self._index()
+
+        self.assertEqual(index.refresh(), 4)
+
+        self.assertEqual(index.similar('a', topk=2), ['b', 'd'])
+        self.assertEqual(index.similar('c', topk=1), ['d'])
+        self.assertEqual(index.similar('unknown'), [])
+        self.assertIsInstance(index._state[3], np.memmap)
+
+    def test_only_changed_and_new_profiles_are_encoded(self):
+        index = self._index()
+        index.refresh()
+        self.encoder.texts.clear()
+
+        self.profiles.find.return_value = [_profile('a', 10), _profile('b', 90), _profile('c', 100), _profile('e', 9)]
+        self.assertEqual(index.refresh(), 2)
+
+        self.assertEqual([t.split()[0] for t in self.encoder.texts], ['weekly_km:90', 'weekly_km:9'])
+        self.assertEqual(index.similar('c', topk=1), ['b'])
+        self.assertEqual(index.similar('d'), [])
+        self.assertEqual(index.refresh(), 0)
+
+    def test_another_process_reuses_the_stored_index(self):
+        self._index().refresh()
+        encoder = FakeEncoder()
+
+        other = self._index(encoder)
+        self.assertEqual(other.refresh(), 0)
+
+        self.assertEqual(encoder.texts, [])
+        self.assertEqual(len(other), 4)
+        self.assertEqual(other.similar('a', topk=1), ['b'])
+        self.assertEqual(len([f for f in os.listdir(self.directory) if f.endswith('.npy')]), 1)
+
+    def test_without_a_model_nothing_is_indexed(self):
+        index = self._index(encoder=lambda texts: None)
+
+        self.assertEqual(index.refresh(), 0)
+        self.assertEqual(index.similar('a'), [])
+
+
+class NumericBackendTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        now = datetime.utcnow()
+        self.profiles = MagicMock()
+        self.profiles.find.return_value = [
+            {'user_id': 'runner', 'weekly_km': 30, 'last_activity': now, 'max_minutes_per_session': 90,
+             'athlete_cluster': 1, 'activity_mix': {'run': 1.0}},
+            {'user_id': 'runner2', 'weekly_km': 25, 'last_activity': now - timedelta(days=1),
+             'max_minutes_per_session': 90, 'athlete_cluster': 1, 'activity_mix': {'run': 0.8, 'walk': 0.2}},
+            {'user_id': 'walker', 'weekly_km': 4, 'last_activity': now - timedelta(days=20),
+             'max_minutes_per_session': 30, 'athlete_cluster': 0, 'activity_mix': {'walk': 1.0}},
+            {'user_id': 'new', 'weekly_km': 0, 'max_minutes_per_session': 120},
+        ]
+        self.database = MagicMock()
+        self.database.__getitem__.return_value = self.profiles
+
+    def test_features_are_standardised_and_need_no_model(self):
+        index = embeddings.EmbeddingIndex(self.directory, database=self.database, backend=embeddings.NumericBackend())
+        index._checked_at = float('inf')
+
+        with patch('core.embeddings._get_model') as mock_model:
+            self.assertEqual(index.refresh(), 4)
+            self.assertEqual(index.similar('runner', topk=1), ['runner2'])
+        mock_model.assert_not_called()
+
+        projection = self.profiles.find.call_args[0][1]
+        self.assertEqual(projection['activity_mix'], 1)
+        mean, std = index._state[4]
+        self.assertAlmostEqual(float(mean[0]), 14.75, places=4)
+        row = embeddings.numeric_features(self.profiles.find.return_value[3])
+        self.assertEqual(row[:3], [0.0, float(embeddings.RECENCY_CAP_DAYS), 120.0])
+
+    def test_blocked_top_k_matches_a_full_sort(self):
+        rng = np.random.default_rng(7)
+        vectors = embeddings._normalise(rng.normal(size=(1000, 12)))
+        query = vectors[3]
+
+        expected = [int(i) for i in np.argsort(-(vectors @ query))[1:11]]
+
+        self.assertEqual(embeddings.top_k(vectors, query, 10, exclude=3, block_rows=64), expected)
+        self.assertEqual(embeddings.top_k(vectors, query, 10, exclude=3), expected)
+
+    def test_activity_mix_shares(self):
+        db = MagicMock()
+        db['activities'].find.return_value = [{'type': 'Run'}, {'type': 'VirtualRide'}, {'sport_type': 'Hike'},
+                                              {'type': 'Run'}]
+
+        self.assertEqual(profile_ingest.compute_activity_mix(db, 'u1'),
+                         {'run': 0.5, 'ride': 0.25, 'walk': 0.25, 'other': 0.0})
+
+
+class RecommendWithIndexTests(unittest.TestCase):
+
+    @patch('core.recommendations.rule_based_session')
+    @patch('core.recommendations.get_index')
+    @patch('core.recommendations.get_db')
+    def test_similar_users_raise_the_session_cap(self, mock_get_db, mock_get_index, mock_rules):
+        profiles = MagicMock()
+        profiles.find_one.return_value = {'user_id': 'a', 'weekly_km': 5, 'max_minutes_per_session': 60}
+        profiles.find.return_value = [{'weekly_km': 20}, {'weekly_km': 30}]
+        mock_get_db.return_value.__getitem__.return_value = profiles
+        mock_get_index.return_value.similar.return_value = ['b', 'c']
+        mock_rules.return_value = {'type': 'easy_run', 'duration_min': 30}
+
+        recommendations.recommend('a')
+
+        self.assertEqual(profiles.find.call_args[0][0], {'user_id': {'$in': ['b', 'c']}})
+        self.assertEqual(mock_rules.call_args[0][1]['max_minutes_per_session'], 75)
+
+
+if __name__ == '__main__':
+    unittest.main()
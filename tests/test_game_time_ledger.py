@@ -0,0 +1,124 @@
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.database import UserDB
+
+
+class GameTimeLedgerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.child_id = '507f1f77bcf86cd799439051'
+        self.users = MagicMock()
+        self.db = MagicMock()
+        self.db.__getitem__.return_value = self.users
+
+    @patch('core.database.get_db')
+    def test_reset_is_single_conditional_pipeline_update(self, mock_get_db):
+        mock_get_db.return_value = self.db
+
+        UserDB.reset_daily_used_if_needed(self.child_id)
+
+        self.users.find_one.assert_not_called()
+        self.assertEqual(self.users.update_one.call_count, 1)
+        query, pipeline = self.users.update_one.call_args[0]
+        today = datetime.utcnow().date().isoformat()
+        self.assertEqual(query['last_daily_reset_date'], {'$ne': today})
+        self.assertIsInstance(pipeline, list)
+        self.assertEqual(pipeline[0]['$set']['daily_earned_minutes_today'], 0)
+
+    @patch('core.database.get_db')
+    def test_stop_timer_charges_and_notifies_in_one_write(self, mock_get_db):
+        mock_get_db.return_value = self.db
+        started = datetime(2026, 3, 10, 9, 0, 0)
+        self.users.find_one.return_value = {'_id': self.child_id, 'timer_running': True, 'timer_started_at': started}
+        self.users.update_one.return_value.matched_count = 1
+
+        result = UserDB.stop_timer(self.child_id, started + timedelta(minutes=12, seconds=30), 'Self', 'Timer stopped by child')
+
+        self.assertTrue(result['stopped'])
+        self.assertEqual(result['minutes_recorded'], 12.5)
+        self.assertEqual(self.users.update_one.call_count, 1)
+        query, update = self.users.update_one.call_args[0]
+        self.assertEqual(query['timer_started_at'], started)
+        self.assertEqual(update['$inc']['used_game_time'], 12.5)
+        self.assertIn('Recorded 12m 30s', update['$push']['parent_messages']['$each'][0]['message'])
+        self.assertEqual(update['$inc']['unread_message_count'], 1)
+
+    @patch('core.database.get_db')
+    def test_concurrent_stop_does_not_double_charge(self, mock_get_db):
+        mock_get_db.return_value = self.db
+        started = datetime(2026, 3, 10, 9, 0, 0)
+        self.users.find_one.return_value = {'_id': self.child_id, 'timer_running': True, 'timer_started_at': started}
+        self.users.update_one.return_value.matched_count = 0
+
+        result = UserDB.stop_timer(self.child_id, started + timedelta(minutes=5), 'Parent', 'Timer stopped by Parent')
+
+        self.assertFalse(result['stopped'])
+        self.assertEqual(result['minutes_recorded'], 0)
+
+    @patch('core.database.get_db')
+    def test_record_activity_date_writes_date_reward_and_message_together(self, mock_get_db):
+        mock_get_db.return_value = self.db
+        parent_oid = '507f1f77bcf86cd799439059'
+        child = {'_id': self.child_id, 'parent_id': parent_oid, 'activity_dates': ['2026-03-09']}
+        parent = {'_id': parent_oid, 'name': 'Pat'}
+        self.users.find_one.side_effect = lambda q, *a, **k: child if str(q['_id']) == self.child_id else parent
+        self.users.update_one.return_value.matched_count = 1
+
+        result = UserDB.record_activity_date(self.child_id, '2026-03-10')
+
+        self.assertTrue(result['applied'])
+        self.assertEqual(result['streak_count'], 2)
+        self.assertEqual(self.users.update_one.call_count, 1)
+        query, update = self.users.update_one.call_args[0]
+        self.assertEqual(query['activity_dates'], {'$ne': '2026-03-10'})
+        self.assertEqual(update['$push']['activity_dates'], '2026-03-10')
+        self.assertEqual(update['$push']['parent_messages']['$each'][0]['from_parent'], 'Pat')
+        self.assertEqual(update['$inc']['earned_game_time'], 7)
+
+
+
+class StopTimerRouteTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        os.environ['FLASK_SECRET_KEY'] = 'test_key'
+        import app as app_module
+        cls.app = app_module.app
+
+    def setUp(self):
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = '507f1f77bcf86cd799439011'
+            sess['account_type'] = 'child'
+
+    @patch('app.UserDB.stop_timer')
+    def test_failed_stop_is_reported(self, mock_stop):
+        mock_stop.return_value = {'stopped': False, 'minutes_recorded': 0, 'reason': 'update failed'}
+
+        response = self.client.post('/api/control-my-timer', json={'action': 'stop'})
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.get_json()['reason'], 'update failed')
+
+    @patch('app.UserDB.stop_timer')
+    def test_already_stopped_timer_is_a_success_with_nothing_recorded(self, mock_stop):
+        mock_stop.return_value = {'stopped': False, 'minutes_recorded': 0, 'reason': 'timer already stopped'}
+
+        body = self.client.post('/api/control-my-timer', json={'action': 'stop'}).get_json()
+
+        self.assertEqual(body, {'success': True, 'minutes_recorded': 0, 'reason': 'timer already stopped'})
+
+        mock_stop.return_value = {'stopped': True, 'minutes_recorded': 12, 'reason': None}
+        body = self.client.post('/api/control-my-timer', json={'action': 'stop'}).get_json()
+        self.assertEqual(body, {'success': True, 'minutes_recorded': 12})
+
+
+if __name__ == '__main__':
+    unittest.main()
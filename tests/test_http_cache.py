@@ -0,0 +1,78 @@
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+from flask import Flask, jsonify
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.database import UserDB
+from core.http_cache import conditional, user_state_tag
+
+
+class ConditionalGetTests(unittest.TestCase):
+
+    def setUp(self):
+        self.child_id = '507f1f77bcf86cd799439071'
+        self.users = MagicMock()
+        self.users.find_one.return_value = {'_id': self.child_id, 'state_version': 3, 'timer_running': False}
+        self.db = MagicMock()
+        self.db.__getitem__.return_value = self.users
+
+        self.calls = 0
+        self.flask_app = Flask(__name__)
+
+        @self.flask_app.route('/balance')
+        @conditional(lambda: user_state_tag(self.child_id))
+        def balance():
+            self.calls += 1
+            return jsonify({'balance': 10}), 200
+
+        self.client = self.flask_app.test_client()
+
+    @patch('core.database.get_db')
+    def test_matching_etag_skips_the_view(self, mock_get_db):
+        mock_get_db.return_value = self.db
+
+        first = self.client.get('/balance')
+        etag = first.headers['ETag']
+        second = self.client.get('/balance', headers={'If-None-Match': etag})
+
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(etag.startswith('W/'))
+        self.assertEqual(first.headers['Cache-Control'], 'private, no-cache')
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.data, b'')
+        self.assertEqual(second.headers['ETag'], etag)
+        self.assertEqual(self.calls, 1)
+        # The tag check is one projected read
+        self.assertEqual(self.users.find_one.call_args[0][1], {'state_version': 1, 'timer_running': 1})
+
+    @patch('core.database.get_db')
+    def test_version_bump_changes_the_tag(self, mock_get_db):
+        mock_get_db.return_value = self.db
+
+        etag = self.client.get('/balance').headers['ETag']
+        self.users.find_one.return_value = {'_id': self.child_id, 'state_version': 4, 'timer_running': False}
+        again = self.client.get('/balance', headers={'If-None-Match': etag})
+
+        self.assertEqual(again.status_code, 200)
+        self.assertNotEqual(again.headers['ETag'], etag)
+        self.assertEqual(self.calls, 2)
+
+    @patch('core.database.get_db')
+    def test_userdb_writes_bump_state_version(self, mock_get_db):
+        mock_get_db.return_value = self.db
+
+        UserDB.add_earned_game_time(self.child_id, 5)
+        _, update = self.users.update_one.call_args[0]
+        self.assertEqual(update['$inc'], {'earned_game_time': 5, 'state_version': 1})
+
+        UserDB.reset_daily_used_if_needed(self.child_id)
+        _, pipeline = self.users.update_one.call_args[0]
+        self.assertIn('state_version', pipeline[-1]['$set'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from PIL import Image
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.blob_store import BlobStore
+from core.image_variants import InvalidImage, build_variants
+
+
+class ImageVariantTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.store = BlobStore(os.path.join(self.root, 'media'))
+
+    def _image(self, name, size, mode='RGB', color=(200, 40, 40)):
+        path = os.path.join(self.root, name)
+        Image.new(mode, size, color).save(path)
+        return path
+
+    def _stored(self, url):
+        return Image.open(self.store.path_for(url.split()[0].rsplit('/', 1)[1]))
+
+    def test_variants_at_each_width_in_both_formats(self):
+        image = build_variants(self._image('photo.jpg', (1500, 1000)), self.store)
+
+        self.assertEqual((image['width'], image['height']), (1500, 1000))
+        for fmt, expected in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+            entries = image['srcset'][fmt].split(', ')
+            self.assertEqual([e.split()[1] for e in entries], ['320w', '640w', '1024w'])
+            variant = self._stored(entries[1])
+            self.assertEqual((variant.format, variant.size), (expected, (640, 427)))
+        self.assertEqual(image['src'], image['srcset']['jpeg'].split(', ')[1].split()[0])
+        self.assertTrue(image['placeholder'].startswith('data:image/jpeg;base64,'))
+        self.assertLess(len(image['placeholder']), 1000)
+
+    def test_small_transparent_image_keeps_its_width(self):
+        image = build_variants(self._image('icon.png', (200, 100), 'RGBA', (0, 0, 0, 0)), self.store)
+
+        self.assertEqual(image['srcset']['jpeg'].split()[1], '200w')
+        jpeg = self._stored(image['srcset']['jpeg'])
+        self.assertEqual(jpeg.getpixel((10, 10))[:3], (255, 255, 255))
+        self.assertEqual(self._stored(image['srcset']['webp']).mode, 'RGBA')
+
+    def test_same_image_writes_nothing_new(self):
+        path = self._image('photo.jpg', (800, 600))
+        first = build_variants(path, self.store)
+        files = sorted(f for _, _, names in os.walk(self.store.root) for f in names)
+
+        second = build_variants(path, self.store)
+
+        self.assertEqual(first, second)
+        self.assertEqual(sorted(f for _, _, names in os.walk(self.store.root) for f in names), files)
+
+    def test_non_image_is_rejected(self):
+        path = os.path.join(self.root, 'fake.png')
+        with open(path, 'wb') as f:
+            f.write(b'not an image')
+        with self.assertRaises(InvalidImage):
+            build_variants(path, self.store)
+
+
+if __name__ == '__main__':
+    unittest.main()
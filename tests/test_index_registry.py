@@ -0,0 +1,71 @@
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.database import INDEX_SPECS, QUERY_SHAPES, ensure_indexes, report_indexes, verify_query_plans
+
+
+class IndexRegistryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.collections = {}
+        self.db = MagicMock()
+        self.db.__getitem__.side_effect = lambda name: self.collections.setdefault(name, MagicMock())
+
+    def test_every_query_shape_has_registered_collection(self):
+        for collection_name, _, _ in QUERY_SHAPES:
+            self.assertIn(collection_name, INDEX_SPECS)
+
+    def test_ensure_indexes_creates_each_spec_and_reports_failures(self):
+        def create_index(keys, **options):
+            if options['name'] == 'user_source_external_id_unique':
+                raise Exception('E11000 duplicate key')
+        self.db['activities'].create_index.side_effect = create_index
+
+        failures = ensure_indexes(self.db)
+
+        self.assertEqual(failures, [('activities', 'user_source_external_id_unique', 'E11000 duplicate key')])
+        self.assertEqual(self.db['activities'].create_index.call_count, len(INDEX_SPECS['activities']))
+        self.db['users'].create_index.assert_any_call([('email', 1)], name='email_1', unique=True)
+
+    def test_report_lists_missing_unmanaged_and_unused(self):
+        users = self.db['users']
+        users.index_information.return_value = {'_id_': {}, 'email_1': {}, 'legacy_1': {}}
+        users.aggregate.return_value = [
+            {'name': 'email_1', 'accesses': {'ops': 12}},
+            {'name': 'legacy_1', 'accesses': {'ops': 0}},
+        ]
+
+        report = report_indexes(self.db)['users']
+
+        self.assertEqual(report['missing'], ['account_type_children', 'account_type_earned_game_time', 'strava_id'])
+        self.assertEqual(report['unmanaged'], ['legacy_1'])
+        self.assertEqual(report['unused'], ['legacy_1'])
+
+    def test_verify_query_plans_flags_collscan(self):
+        ixscan = {'queryPlanner': {'winningPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}}}}
+        collscan = {'queryPlanner': {'winningPlan': {'stage': 'SORT', 'inputStage': {'stage': 'COLLSCAN'}}}}
+
+        def explain_for(name):
+            cursor = MagicMock()
+            cursor.sort.return_value = cursor
+            cursor.explain.return_value = collscan if name == 'user_challenges' else ixscan
+            return cursor
+        for name in INDEX_SPECS:
+            self.db[name].find.return_value = explain_for(name)
+
+        scans = verify_query_plans(self.db)
+
+        self.assertEqual([s['collection'] for s in scans], ['user_challenges'])
+
+    @patch('core.database.get_db', return_value=None)
+    def test_verify_query_plans_fails_without_a_database(self, mock_get_db):
+        with self.assertRaises(RuntimeError):
+            verify_query_plans()
+
+
+if __name__ == '__main__':
+    unittest.main()
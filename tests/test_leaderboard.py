@@ -0,0 +1,158 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.leaderboard import Leaderboard, SortedBoard, window_key
+
+
+class SortedBoardTests(unittest.TestCase):
+
+    def test_top_and_rank_follow_updates(self):
+        board = SortedBoard()
+        board.set('a', 30)
+        board.set('b', 50)
+        board.set('c', 30)
+        board.add('a', 25)
+
+        self.assertEqual(board.top(2), [('a', 55), ('b', 50)])
+        self.assertEqual(board.rank('a'), 1)
+        self.assertEqual(board.rank('c'), 3)
+        board.remove('b')
+        self.assertEqual(board.rank('c'), 2)
+        self.assertIsNone(board.rank('b'))
+
+
+class LeaderboardTests(unittest.TestCase):
+
+    def setUp(self):
+        self.now = datetime(2026, 3, 10, 15, 0, 0)
+        self.users = MagicMock()
+        self.users.find.return_value = [
+            {'_id': 'kid1', 'name': 'Ada', 'earned_game_time': 40, 'daily_screen_time_limit': 60},
+            {'_id': 'kid2', 'name': 'Bo', 'earned_game_time': 25, 'daily_screen_time_limit': 60},
+            {'_id': 'kid3', 'name': 'Cy', 'earned_game_time': 10, 'daily_screen_time_limit': 60},
+        ]
+        self.windows = MagicMock()
+        self.windows.find.return_value = [
+            {'window': window_key('daily', self.now), 'user_id': 'kid3', 'minutes': 12},
+        ]
+        self.db = MagicMock()
+        self.db.__getitem__.side_effect = {'users': self.users, 'leaderboard_windows': self.windows}.get
+        self.board = Leaderboard(reseed_seconds=3600)
+
+    @patch('core.leaderboard.get_db')
+    def test_credit_updates_global_and_windows_without_resorting(self, mock_get_db):
+        mock_get_db.return_value = self.db
+        self.board.reseed(now=self.now)
+
+        self.board.credit('kid3', 35, now=self.now)
+
+        self.assertEqual([r['id'] for r in self.board.top('global', 2, now=self.now)], ['kid3', 'kid1'])
+        self.assertEqual(self.board.rank('kid3', 'daily', now=self.now), {'rank': 1, 'score': 47, 'total': 1})
+        self.assertEqual(self.board.rank('kid2', 'weekly', now=self.now)['rank'], None)
+        self.assertEqual(self.users.find.call_count, 1)
+
+    @patch('core.leaderboard.get_db')
+    def test_credit_persists_window_increments_without_a_read(self, mock_get_db):
+        mock_get_db.return_value = self.db
+
+        self.board.credit('kid1', 5, now=self.now)
+
+        ops = self.windows.bulk_write.call_args[0][0]
+        self.assertEqual({op._filter['_id'] for op in ops},
+                         {f"{window_key('daily', self.now)}:kid1", f"{window_key('weekly', self.now)}:kid1"})
+        self.assertEqual({op._doc['$inc']['minutes'] for op in ops}, {5})
+        self.assertEqual(self.board._pending, {})
+        self.users.find.assert_not_called()
+
+    @patch('core.leaderboard.get_db')
+    def test_failed_window_write_is_retried_with_the_next_credit(self, mock_get_db):
+        mock_get_db.return_value = self.db
+        self.windows.bulk_write.side_effect = [Exception('primary stepped down'), None]
+
+        self.board.credit('kid1', 5, now=self.now)
+        self.assertEqual(len(self.board._pending), 2)
+        self.board.credit('kid1', 7, now=self.now)
+
+        ops = self.windows.bulk_write.call_args[0][0]
+        self.assertEqual({op._doc['$inc']['minutes'] for op in ops}, {12})
+        self.assertEqual(self.board._pending, {})
+
+    def test_task_worker_registers_the_credit_listener(self):
+        import worker  # noqa: F401
+        from core import database, leaderboard
+        self.assertIn(leaderboard.leaderboard.on_credit, database._credit_listeners)
+
+    @patch('core.leaderboard.get_db')
+    def test_friends_scope_ranks_circle_from_memory(self, mock_get_db):
+        mock_get_db.return_value = self.db
+        self.board.reseed(now=self.now)
+
+        rows = self.board.friends('kid3', ['kid1'])
+
+        self.assertEqual([r['name'] for r in rows], ['Ada', 'Cy'])
+
+    @patch('core.leaderboard.UserDB.get_users_by_ids')
+    @patch('core.leaderboard.get_db')
+    def test_credit_during_the_scan_survives_the_swap(self, mock_get_db, mock_get_users):
+        mock_get_db.return_value = self.db
+        rows = list(self.users.find.return_value)
+
+        def scan(*args, **kwargs):
+            yield rows[0]
+            # kid1 is credited (and its total written to MongoDB) after the scan read it
+            self.board.credit('kid1', 10, now=self.now)
+            yield from rows[1:]
+        self.users.find.side_effect = scan
+        daily = window_key('daily', self.now)
+        self.windows.find.side_effect = [
+            self.windows.find.return_value,
+            [{'_id': f'{daily}:kid1', 'window': daily, 'user_id': 'kid1', 'minutes': 10}],
+        ]
+        mock_get_users.return_value = {'kid1': {'name': 'Ada', 'account_type': 'child', 'earned_game_time': 50}}
+
+        self.board.reseed(now=self.now)
+
+        mock_get_users.assert_called_once()
+        self.assertEqual(mock_get_users.call_args[0][0], ['kid1'])
+        self.assertEqual(self.board.rank('kid1', now=self.now)['score'], 50)
+        # The window scan missed the credit; kid1's window rows are re-read
+        self.assertIn(f'{daily}:kid1', self.windows.find.call_args[0][0]['_id']['$in'])
+        self.assertEqual(self.board.rank('kid1', 'daily', now=self.now)['score'], 10)
+        self.assertIsNone(self.board._touched)
+
+    @patch('core.leaderboard.get_db')
+    def test_expired_boards_are_reseeded_off_the_request(self, mock_get_db):
+        mock_get_db.return_value = self.db
+        self.board.reseed(now=self.now)
+        self.board._loaded_at -= 7200
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_reseed():
+            started.set()
+            release.wait(5)
+        with patch.object(self.board, 'reseed', side_effect=slow_reseed) as mock_reseed:
+            rows = self.board.top('global', 2, now=self.now)
+            self.assertTrue(started.wait(5))
+            # A second read while the reseed runs starts no other
+            self.board.top('global', 2, now=self.now)
+            release.set()
+            for _ in range(100):
+                if not self.board._reseeding:
+                    break
+                time.sleep(0.01)
+
+        self.assertEqual([r['id'] for r in rows], ['kid1', 'kid2'])
+        self.assertEqual(mock_reseed.call_count, 1)
+        self.assertFalse(self.board._reseeding)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import json
+import os
+import sys
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core import events
+from core.database import UserDB
+
+
+class LocalBusTests(unittest.TestCase):
+
+    def test_publish_reaches_only_subscribed_channels(self):
+        bus = events.LocalBus()
+        sub = bus.subscribe(['child-1'])
+
+        bus.publish('child-2', 'balance')
+        bus.publish('child-1', 'timer', {'timer_running': True})
+
+        self.assertEqual(sub.get(timeout=0), {'channel': 'child-1', 'event': 'timer', 'data': {'timer_running': True}})
+        self.assertIsNone(sub.get(timeout=0))
+        sub.close()
+        self.assertEqual(bus.subscriber_count(), 0)
+
+    def test_full_queue_marks_overflow_instead_of_blocking(self):
+        bus = events.LocalBus()
+        sub = bus.subscribe(['child-1'], maxsize=1)
+
+        bus.publish('child-1', 'balance')
+        bus.publish('child-1', 'balance')
+
+        self.assertTrue(sub.overflowed)
+
+    def test_format_sse_prefixes_every_line(self):
+        self.assertEqual(events.format_sse('message', 'a\nb'), 'event: message\ndata: a\ndata: b\n\n')
+
+
+class UserWritePublishTests(unittest.TestCase):
+
+    def setUp(self):
+        self.child_id = '507f1f77bcf86cd799439081'
+        self.users = MagicMock()
+        self.users.update_one.return_value.modified_count = 1
+        self.db = MagicMock()
+        self.db.__getitem__.return_value = self.users
+
+    @patch('core.database.get_db')
+    def test_start_timer_publishes_timer_message_and_balance(self, mock_get_db):
+        mock_get_db.return_value = self.db
+        with events.subscribe([self.child_id]) as sub:
+            UserDB.start_timer(self.child_id, 'now', 'Pat', 'Timer started')
+            published = [sub.get(timeout=0) for _ in range(3)]
+
+        self.assertEqual([e['event'] for e in published], ['timer', 'message', 'balance'])
+        self.assertTrue(published[0]['data']['timer_running'])
+        self.assertEqual(published[1]['data']['message'], 'Timer started')
+
+    @patch('core.database.get_db')
+    def test_unmodified_write_publishes_nothing(self, mock_get_db):
+        mock_get_db.return_value = self.db
+        self.users.update_one.return_value.modified_count = 0
+        with events.subscribe([self.child_id]) as sub:
+            UserDB.add_earned_game_time(self.child_id, 5)
+            self.assertIsNone(sub.get(timeout=0))
+
+
+class EventStreamTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        os.environ['FLASK_SECRET_KEY'] = 'test_key'
+        import app as app_module
+        cls.app_module = app_module
+
+    @patch('app.UserDB.get_users_by_ids')
+    @patch('app._gametime_balance_payload')
+    def test_child_stream_sends_snapshot_then_pushed_updates(self, mock_payload, mock_versions):
+        child_id = '507f1f77bcf86cd799439082'
+        mock_versions.return_value = {child_id: {'state_version': 1}}
+        mock_payload.side_effect = [{'balance': 30}, {'balance': 20}]
+
+        stream = self.app_module._live_updates(child_id, False, [child_id])
+        self.assertTrue(next(stream).startswith('retry:'))
+        self.assertEqual(json.loads(next(stream).split('data: ')[1]), {'balance': 30})
+
+        events.publish(child_id, 'timer', {'timer_running': True, 'timer_started_at': None})
+        events.publish(child_id, 'balance')
+        events.publish(child_id, 'balance')
+        timer_frame = next(stream)
+        balance_frame = next(stream)
+        stream.close()
+
+        self.assertTrue(timer_frame.startswith('event: timer'))
+        self.assertEqual(json.loads(balance_frame.split('data: ')[1]), {'balance': 20})
+        # Two balance events in one burst cost one snapshot
+        self.assertEqual(mock_payload.call_count, 2)
+        self.assertEqual(events.get_bus().subscriber_count(), 0)
+
+    @patch('app.UserDB.get_users_by_ids')
+    def test_pushed_changes_are_not_sent_again_by_the_next_check(self, mock_versions):
+        parent_channel = '507f1f77bcf86cd799439083'
+        mock_versions.side_effect = [
+            {parent_channel: {'state_version': 1, 'timer_running': False}},
+            {parent_channel: {'state_version': 2, 'timer_running': True}},
+            {parent_channel: {'state_version': 2, 'timer_running': True}},
+        ]
+
+        with patch.object(self.app_module, 'LIVE_HEARTBEAT_SECONDS', 0):
+            stream = self.app_module._live_updates('parent', True, [parent_channel])
+            next(stream)
+            self.assertTrue(next(stream).startswith('event: timer'))
+
+            # What UserDB publishes for a timer start
+            events.publish(parent_channel, 'timer', {'timer_running': True, 'timer_started_at': None})
+            events.publish(parent_channel, 'balance')
+            pushed = [next(stream), next(stream)]
+            # The check after the push sees state_version 2 but skips what it just sent
+            idle = next(stream)
+            stream.close()
+
+        self.assertIn('"timer_running": true', pushed[0])
+        self.assertTrue(pushed[1].startswith('event: balance'))
+        self.assertEqual(idle, ': ping\n\n')
+        self.assertEqual(mock_versions.call_count, 3)
+
+    def test_streams_beyond_the_cap_get_503(self):
+        client = self.app_module.app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = '507f1f77bcf86cd799439084'
+            sess['account_type'] = 'child'
+
+        with patch.object(self.app_module, '_live_stream_slots', threading.BoundedSemaphore(1)) as slots:
+            slots.acquire()
+            response = client.get('/api/events')
+            self.assertEqual(response.status_code, 503)
+            self.assertTrue(response.get_json()['poll'])
+            slots.release()
+
+            with patch.object(self.app_module, '_live_updates', return_value=iter([': ping\n\n'])):
+                response = client.get('/api/events')
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(slots.acquire(blocking=False))
+                response.close()
+            self.assertTrue(slots.acquire(blocking=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.database import UserDB, PARENT_MESSAGES_LIMIT
+
+
+class ParentMessagesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.child_id = '507f1f77bcf86cd799439081'
+        self.users = MagicMock()
+        self.db = MagicMock()
+        self.db.__getitem__.return_value = self.users
+        start = datetime(2026, 3, 10, 8, 0, 0)
+        # Stored oldest first, as $push appends
+        self.window = [
+            {'id': f'm{i}', 'message': f'msg {i}', 'created_at': start + timedelta(minutes=i), 'read': i < 3}
+            for i in range(5)
+        ]
+
+    @patch('core.database.get_db')
+    def test_add_message_pushes_into_capped_window(self, mock_get_db):
+        mock_get_db.return_value = self.db
+
+        UserDB.add_parent_message(self.child_id, 'Pat', 'Well done', 5)
+
+        update = self.users.update_one.call_args[0][1]
+        self.assertEqual(update['$push']['parent_messages']['$slice'], -PARENT_MESSAGES_LIMIT)
+        self.assertEqual(update['$push']['parent_messages']['$each'][0]['bonus_minutes'], 5)
+        self.assertIn('id', update['$push']['parent_messages']['$each'][0])
+        self.assertEqual(update['$inc']['unread_message_count'], 1)
+
+    @patch('core.database.get_db')
+    def test_pages_walk_newest_to_oldest(self, mock_get_db):
+        mock_get_db.return_value = self.db
+        self.users.find_one.return_value = {'parent_messages': self.window, 'unread_message_count': 2}
+
+        first = UserDB.get_parent_messages(self.child_id, limit=2)
+        second = UserDB.get_parent_messages(self.child_id, before=first['next_cursor'], limit=2)
+        last = UserDB.get_parent_messages(self.child_id, before=second['next_cursor'], limit=2)
+
+        self.assertEqual([m['id'] for m in first['messages']], ['m4', 'm3'])
+        self.assertEqual([m['id'] for m in second['messages']], ['m2', 'm1'])
+        self.assertEqual([m['id'] for m in last['messages']], ['m0'])
+        self.assertIsNone(last['next_cursor'])
+        self.assertEqual(first['unread_count'], 2)
+        self.assertEqual(self.users.find_one.call_args[0][1], {'parent_messages': 1, 'unread_message_count': 1})
+
+    @patch('core.database.get_db')
+    def test_unread_count_backfilled_for_old_documents(self, mock_get_db):
+        mock_get_db.return_value = self.db
+        self.users.find_one.return_value = {'parent_messages': self.window}
+
+        page = UserDB.get_parent_messages(self.child_id)
+
+        self.assertEqual(page['unread_count'], 2)
+        query, update = self.users.update_one.call_args[0]
+        self.assertIsNone(query['unread_message_count'])
+        self.assertEqual(update, {'$set': {'unread_message_count': 2}})
+
+    @patch('core.database.get_db')
+    def test_count_inflated_by_sliced_out_messages_is_corrected(self, mock_get_db):
+        mock_get_db.return_value = self.db
+        # Two unread messages were pushed out of the window; the counter still includes them
+        self.users.find_one.return_value = {'parent_messages': self.window, 'unread_message_count': 4}
+
+        page = UserDB.get_parent_messages(self.child_id)
+
+        self.assertEqual(page['unread_count'], 2)
+        query, update = self.users.update_one.call_args[0]
+        self.assertEqual(query['unread_message_count'], 4)
+        self.assertEqual(update, {'$set': {'unread_message_count': 2}})
+
+    @patch('core.database.get_db')
+    def test_legacy_messages_get_stored_ids_they_can_be_marked_read_by(self, mock_get_db):
+        mock_get_db.return_value = self.db
+        legacy = [{k: v for k, v in m.items() if k != 'id'} for m in self.window[:2]] + self.window[2:]
+        self.users.find_one.return_value = {'parent_messages': legacy, 'unread_message_count': 2}
+
+        page = UserDB.get_parent_messages(self.child_id)
+
+        legacy_id = self.window[0]['created_at'].isoformat()
+        self.assertEqual(page['messages'][-1]['id'], legacy_id)
+        query, update = self.users.update_one.call_args_list[0][0]
+        self.assertNotIn('id', query['parent_messages'][0])
+        self.assertEqual(update['$set']['parent_messages'][0]['id'], legacy_id)
+
+        UserDB.mark_message_as_read(self.child_id, legacy_id)
+
+        match = self.users.update_one.call_args[0][0]['parent_messages']['$elemMatch']
+        self.assertIn({'id': {'$exists': False}, 'created_at': self.window[0]['created_at'], 'read': {'$ne': True}},
+                      match['$or'])
+
+    @patch('core.database.get_db')
+    def test_mark_read_by_id_only_counts_unread_messages(self, mock_get_db):
+        mock_get_db.return_value = self.db
+
+        UserDB.mark_message_as_read(self.child_id, 'm4')
+
+        query, update = self.users.update_one.call_args[0]
+        self.assertEqual(query['parent_messages'], {'$elemMatch': {'id': 'm4', 'read': False}})
+        self.assertEqual(update['$inc'], {'unread_message_count': -1, 'state_version': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+import os
+import sys
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core import rescoring
+
+TODAY = '2026-03-10'
+
+
+def _manual(oid, user_id, minutes, date=TODAY, created=datetime(2026, 3, 10, 9, 0), intensity='Hard'):
+    # 10 km in 60 min, Hard label: 10*2.0 + 60*0.03 + 10*0.2 = 23.8 -> 23
+    return {'_id': oid, 'user_id': user_id, 'source': 'manual', 'distance': 10, 'time_minutes': 60,
+            'intensity': intensity, 'earned_minutes': minutes, 'date': date, 'created_at': created}
+
+
+class CreditDeltaTests(unittest.TestCase):
+
+    def test_same_day_credit_adjusts_today_only_while_it_is_today(self):
+        doc = _manual(1, 'u1', 10)
+        self.assertEqual(rescoring.credit_delta(doc, 5, TODAY), (5, 5))
+        self.assertEqual(rescoring.credit_delta(doc, 5, '2026-03-11'), (0, 0))
+
+    def test_backdated_credit_is_permanent(self):
+        doc = _manual(1, 'u1', 10, date='2026-03-01')
+        self.assertEqual(rescoring.credit_delta(doc, -3, TODAY), (-3, 0))
+
+    def test_simulated_history_was_never_credited(self):
+        doc = {'source': 'simulated', 'date': '2026-03-08', 'day_offset': 2}
+        self.assertEqual(rescoring.credit_delta(doc, 4, TODAY), (0, 0))
+
+    def test_strava_markers_without_heart_rate_are_skipped(self):
+        self.assertIsNone(rescoring.scoring_inputs({'source': 'strava_applied', 'distance': 5}))
+        self.assertIsNotNone(rescoring.scoring_inputs({'source': 'strava_applied', 'distance': 5,
+                                                       'average_heartrate': None, 'duration_minutes': 30}))
+
+
+class RescoreJobTests(unittest.TestCase):
+
+    def setUp(self):
+        self.docs = [
+            _manual(1, 'u1', 23),                       # unchanged
+            _manual(2, 'u1', 20),                       # today: +3 earned and today
+            _manual(3, 'u2', 30, date='2026-03-01'),    # backdated: -7 earned
+            {'_id': 4, 'user_id': 'u2', 'source': 'strava_applied', 'distance': 5, 'earned_minutes': 9},
+        ]
+        self.activities = MagicMock()
+        self.activities.find.return_value.sort.return_value.batch_size.return_value = iter(self.docs)
+        self.activities.bulk_write.return_value.matched_count = 2
+        self.checkpoints = MagicMock()
+        self.checkpoints.find_one.return_value = None
+        self.db = MagicMock()
+        self.db.__getitem__.side_effect = lambda name: {
+            'activities': self.activities, rescoring.CHECKPOINTS: self.checkpoints}[name]
+
+    @patch('core.rescoring.UserDB.apply_credit_adjustments')
+    def test_dry_run_reports_without_writing(self, mock_adjust):
+        diffs = []
+        summary = rescoring.rescore_activities(dry_run=True, database=self.db, today=TODAY, on_diff=diffs.append)
+
+        self.assertEqual((summary['scanned'], summary['skipped'], summary['changed']), (4, 1, 2))
+        self.assertEqual(summary['minutes_delta'], -4)
+        self.assertEqual(summary['credit_delta'], -4)
+        self.assertEqual(summary['users_adjusted'], 2)
+        self.assertEqual([d['_id'] for d in diffs], [2, 3])
+        self.activities.bulk_write.assert_not_called()
+        self.checkpoints.update_one.assert_not_called()
+        mock_adjust.assert_not_called()
+
+    @patch('core.rescoring.UserDB.apply_credit_adjustments')
+    def test_apply_writes_conditional_updates_and_one_adjustment_per_user(self, mock_adjust):
+        mock_adjust.return_value = 2
+        rescoring.rescore_activities(job_id='job', dry_run=False, batch_size=10, database=self.db, today=TODAY)
+
+        ops = self.activities.bulk_write.call_args[0][0]
+        self.assertEqual([op._filter for op in ops], [{'_id': 2, 'earned_minutes': 20},
+                                                      {'_id': 3, 'earned_minutes': 30}])
+        self.assertEqual(ops[0]._doc['$set']['earned_minutes'], 23)
+        run_id = self.checkpoints.update_one.call_args_list[0][0][1]['$set']['run_id']
+        mock_adjust.assert_called_once_with({'u1': (3, 3), 'u2': (-7, 0)}, token=f'job:{run_id}:1')
+        self.activities.find.assert_called_once()
+
+        pending = self.checkpoints.update_one.call_args_list[1][0][1]['$set']['pending']
+        self.assertEqual(pending['last_id'], 4)
+        done = self.checkpoints.update_one.call_args_list[2][0][1]
+        self.assertEqual(done['$set']['last_id'], 4)
+        self.assertEqual(done['$unset'], {'pending': ''})
+
+    @patch('core.rescoring.UserDB.apply_credit_adjustments')
+    def test_interrupted_batch_is_replayed_before_resuming(self, mock_adjust):
+        mock_adjust.return_value = 1
+        pending = {'seq': 3, 'token': 'job:r1:3', 'last_id': 1,
+                   'ops': [{'_id': 1, 'user_id': 'u1', 'old_minutes': 20, 'new_minutes': 23, 'new_intensity': 'Hard',
+                            'earned_delta': 3, 'today_delta': 3}],
+                   'adjustments': [['u1', 3, 3]]}
+        # A crash mid-batch leaves `batches` at the last finished batch
+        self.checkpoints.find_one.return_value = {'_id': 'job', 'run_id': 'r1', 'last_id': 0, 'batches': 2,
+                                                  'pending': pending}
+        self.activities.bulk_write.return_value.matched_count = 1
+        self.activities.find.return_value.sort.return_value.batch_size.return_value = iter([_manual(5, 'u1', 20)])
+
+        summary = rescoring.rescore_activities(job_id='job', dry_run=False, database=self.db, today=TODAY)
+
+        self.assertEqual([c[1]['token'] for c in mock_adjust.call_args_list], ['job:r1:3', 'job:r1:4'])
+        self.assertEqual(mock_adjust.call_args_list[0][0][0], {'u1': (3, 3)})
+        replayed = self.checkpoints.update_one.call_args_list[0][0][1]
+        self.assertEqual(replayed['$set'], {'last_id': 1, 'batches': 3})
+        self.activities.find.assert_called_once_with({'_id': {'$gt': 1}}, rescoring.PROJECTION)
+        self.assertEqual(summary['resumed_from'], 1)
+
+    @patch('core.rescoring.UserDB.apply_credit_adjustments')
+    def test_rows_changed_underneath_the_job_are_not_adjusted(self, mock_adjust):
+        mock_adjust.return_value = 1
+        # Activity 3 was edited after the scan; only activity 2 was rewritten under this batch
+        self.activities.bulk_write.return_value.matched_count = 1
+        self.activities.find.side_effect = [self.activities.find.return_value, [{'_id': 2}]]
+
+        rescoring.rescore_activities(job_id='job', dry_run=False, database=self.db, today=TODAY)
+
+        self.assertEqual(self.activities.find.call_args[0][0]['_id'], {'$in': [2, 3]})
+        self.assertEqual(mock_adjust.call_args[0][0], {'u1': (3, 3)})
+
+    @patch('core.rescoring.scoring.score_batch')
+    @patch('core.rescoring.UserDB.apply_credit_adjustments')
+    def test_rescoring_again_after_a_restart_is_applied(self, mock_adjust, mock_score):
+        applied, last_token = {}, {}
+
+        def adjust(adjustments, token=None):
+            # Same token skip as UserDB.apply_credit_adjustments
+            for uid, (earned, _) in adjustments.items():
+                if last_token.get(uid) != token:
+                    applied[uid] = applied.get(uid, 0) + earned
+                    last_token[uid] = token
+            return len(adjustments)
+        mock_adjust.side_effect = adjust
+        self.activities.bulk_write.return_value.matched_count = 1
+
+        mock_score.return_value = (np.array(['Hard']), np.array([23]))
+        self.activities.find.return_value.sort.return_value.batch_size.return_value = iter([_manual(2, 'u1', 20)])
+        rescoring.rescore_activities(job_id='rescore', dry_run=False, database=self.db, today=TODAY)
+
+        # The rules change again and the job is restarted from scratch
+        mock_score.return_value = (np.array(['Hard']), np.array([26]))
+        self.activities.find.return_value.sort.return_value.batch_size.return_value = iter([_manual(2, 'u1', 23)])
+        rescoring.rescore_activities(job_id='rescore', dry_run=False, restart=True, database=self.db, today=TODAY)
+
+        self.assertEqual(applied, {'u1': 6})
+        tokens = [c[1]['token'] for c in mock_adjust.call_args_list]
+        self.assertNotEqual(tokens[0], tokens[1])
+
+    @patch('core.rescoring.UserDB.apply_credit_adjustments')
+    def test_failed_adjustment_keeps_the_batch_pending(self, mock_adjust):
+        mock_adjust.return_value = None
+        with self.assertRaises(RuntimeError):
+            rescoring.rescore_activities(job_id='job', dry_run=False, database=self.db, today=TODAY)
+        last_update = self.checkpoints.update_one.call_args[0][1]
+        self.assertIn('pending', last_update['$set'])
+
+
+class CreditAdjustmentWriteTests(unittest.TestCase):
+
+    @patch('core.database.get_db')
+    def test_token_makes_replay_a_no_op(self, mock_get_db):
+        from core.database import UserDB
+        users = MagicMock()
+        users.bulk_write.return_value.modified_count = 1
+        mock_get_db.return_value.__getitem__.return_value = users
+        uid = '507f1f77bcf86cd799439091'
+
+        UserDB.apply_credit_adjustments({uid: (-5, 0)}, token='job:1')
+
+        op = users.bulk_write.call_args[0][0][0]
+        self.assertEqual(op._filter['credit_adjustment_token'], {'$ne': 'job:1'})
+        self.assertEqual(op._doc['$inc'], {'earned_game_time': -5, 'state_version': 1})
+        self.assertEqual(op._doc['$set'], {'credit_adjustment_token': 'job:1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
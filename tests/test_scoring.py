@@ -0,0 +1,49 @@
+import itertools
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core import scoring
+
+
+class ScoringTests(unittest.TestCase):
+
+    def test_strava_formula_matches_previous_results(self):
+        # 10 km in 50 min, no heart rate: 10*1.0 + 50*0.03 + 10*0.2
+        self.assertEqual(scoring.score_activity(10, 50, type_label='Run'), ('Medium', 13))
+        # Same run at 160 bpm: 10*1.5 + 50*0.05 + 10*0.2
+        self.assertEqual(scoring.score_activity(10, 50, avg_hr=160, type_label='Run'), ('Medium', 19))
+        # 20 km ride in 40 min: 20*0.8 + 40*0.03 + 20*0.5
+        self.assertEqual(scoring.score_activity(20, 40, type_label='Ride'), ('Hard', 27))
+        self.assertEqual(scoring.score_activity(0, 0), ('Easy', 1))
+
+    def test_chosen_intensity_sets_multiplier_and_label(self):
+        # 5 km in 40 min marked Hard: 5*2.0 + 40*0.03, no pace bonus
+        self.assertEqual(scoring.score_activity(5, 40, intensity='Hard'), ('Hard', 11))
+
+    def test_strava_metrics(self):
+        metrics = scoring.strava_metrics({'distance': 10000, 'moving_time': 3000, 'type': 'Run',
+                                          'average_heartrate': 175})
+        self.assertEqual(metrics['distance_km'], 10.0)
+        self.assertEqual(metrics['intensity'], 'Hard')
+        self.assertEqual(metrics['earned_minutes'], 24)
+
+    def test_batch_matches_scalar(self):
+        rows = list(itertools.product(
+            [0, 0.4, 3.3, 10, 42.2, None],
+            [0, 17, 50, 181.5, None],
+            [None, 120, 150, 160, 170, 171, 'n/a'],
+            [None, 4.99, 5.0, 6.5],
+            [None, 'Run', 'Ride', 'VirtualRide', 'Swim'],
+            [None, 'Easy', 'medium', 'Hard', 'bogus'],
+        ))
+        labels, minutes = scoring.score_batch(*zip(*rows))
+
+        expected = [scoring.score_activity(*row) for row in rows]
+        self.assertEqual(list(zip(labels.tolist(), minutes.tolist())), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
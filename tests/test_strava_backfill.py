@@ -0,0 +1,148 @@
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core import strava_sync, task_queue
+from core.strava_ingest import ingest_applied_markers
+
+CHILD_ID = '507f1f77bcf86cd799439111'
+
+
+def _activity(i, start_date='2026-03-10T09:00:00Z'):
+    return {'id': i, 'name': f'Run {i}', 'type': 'Run', 'distance': 5000, 'moving_time': 1800,
+            'start_date': start_date}
+
+
+def _response(activities, status=200):
+    resp = MagicMock()
+    resp.status_code = status
+    resp.json.return_value = activities
+    return resp
+
+
+class SyncCursorTests(unittest.TestCase):
+
+    def test_first_sync_reads_the_latest_page_then_only_newer_activities(self):
+        self.assertEqual(strava_sync.sync_params(None, per_page=10), {'per_page': 10, 'page': 1})
+        params = strava_sync.sync_params({'high_water': 1773133200}, per_page=10)
+        self.assertEqual(params, {'after': 1773133200 - strava_sync.HIGH_WATER_OVERLAP_SECONDS, 'per_page': 10})
+
+    def test_start_epoch_parses_strava_timestamps(self):
+        self.assertEqual(strava_sync.start_epoch(_activity(1, '1970-01-02T00:00:00Z')), 86400)
+        self.assertIsNone(strava_sync.start_epoch({'start_date': None}))
+
+    @patch('core.strava_sync.get_client')
+    def test_sync_follows_full_pages_after_the_mark(self, mock_client):
+        mock_client.return_value.get.side_effect = [_response([_activity(1), _activity(2)]), _response([_activity(3)])]
+
+        activities, error = strava_sync.fetch_new_activities({}, {'high_water': 1000}, per_page=2)
+
+        self.assertIsNone(error)
+        self.assertEqual([a['id'] for a in activities], [1, 2, 3])
+        pages = [c[1]['params']['page'] for c in mock_client.return_value.get.call_args_list]
+        self.assertEqual(pages, [1, 2])
+
+    @patch('core.strava_sync.request_backfill')
+    @patch('core.strava_sync.UserDB.update_strava_sync')
+    def test_record_sync_advances_mark_and_queues_unfinished_backfill(self, mock_update, mock_backfill):
+        strava_sync.record_sync(CHILD_ID, [_activity(1, '1970-01-02T00:00:00Z'), _activity(2, '1970-01-01T00:00:00Z')])
+        mock_update.assert_called_once_with(CHILD_ID, high_water=86400)
+        mock_backfill.assert_called_once_with(CHILD_ID)
+
+        mock_backfill.reset_mock()
+        strava_sync.record_sync(CHILD_ID, [], {'backfill_done': True})
+        mock_backfill.assert_not_called()
+
+
+class BackfillTaskTests(unittest.TestCase):
+
+    def setUp(self):
+        patches = {
+            'view': patch('core.strava_sync.UserDB.get_user_view'),
+            'headers': patch('core.strava_sync.user_strava_headers'),
+            'client': patch('core.strava_sync.get_client'),
+            'ingest': patch('core.strava_sync.ingest_applied_markers'),
+            'update': patch('core.strava_sync.UserDB.update_strava_sync'),
+        }
+        self.mocks = {name: p.start() for name, p in patches.items()}
+        for p in patches.values():
+            self.addCleanup(p.stop)
+        self.mocks['view'].return_value = {'_id': CHILD_ID, 'account_type': 'child', 'strava_connected': True,
+                                           'strava_sync': {'high_water': 9000, 'backfill_before': 5000}}
+        self.mocks['headers'].return_value = {'Authorization': 'Bearer t'}
+        self.mocks['ingest'].return_value = {'inserted': [], 'credit_failed': False}
+        self.get = self.mocks['client'].return_value.get
+
+    @patch('core.strava_sync.PAGE_SIZE', 2)
+    def test_resumes_from_saved_cursor_and_stops_on_a_short_page(self):
+        self.get.side_effect = [
+            _response([_activity(1, '1970-01-01T01:00:00Z'), _activity(2, '1970-01-01T00:30:00Z')]),
+            _response([_activity(3, '1970-01-01T00:10:00Z')]),
+        ]
+
+        strava_sync.backfill_user({'user_id': CHILD_ID})
+
+        befores = [c[1]['params']['before'] for c in self.get.call_args_list]
+        self.assertEqual(befores, [5000, 1800])
+        self.assertEqual(self.mocks['update'].call_args_list[0][1]['backfill_before'], 1800)
+        self.assertFalse(self.mocks['update'].call_args_list[0][1]['backfill_done'])
+        self.assertTrue(self.mocks['update'].call_args_list[1][1]['backfill_done'])
+        self.assertEqual(self.get.call_args[1]['priority'], strava_sync.BACKGROUND)
+
+    @patch('core.strava_sync.BACKFILL_PAGES_PER_RUN', 1)
+    @patch('core.strava_sync.PAGE_SIZE', 1)
+    def test_long_history_yields_after_a_few_pages(self):
+        self.get.return_value = _response([_activity(1, '1970-01-01T01:00:00Z')])
+
+        with self.assertRaises(task_queue.Defer):
+            strava_sync.backfill_user({'user_id': CHILD_ID})
+        self.assertEqual(self.mocks['update'].call_args[1]['backfill_before'], 3600)
+
+    def test_history_is_recorded_without_credit_and_leaves_the_mark_alone(self):
+        self.mocks['view'].return_value['strava_sync'] = {'high_water': 3600}
+        # An activity after the mark is left for the sync to credit
+        self.get.return_value = _response([_activity(2, '1970-01-01T02:00:00Z'), _activity(1, '1970-01-01T01:00:00Z')])
+
+        strava_sync.backfill_user({'user_id': CHILD_ID})
+
+        self.assertEqual(self.get.call_args[1]['params']['before'], 3601)
+        markers = self.mocks['ingest'].call_args[0][1]
+        self.assertEqual([m['external_id'] for m in markers], ['1'])
+        self.assertIs(self.mocks['ingest'].call_args[1]['credit'], False)
+        self.assertNotIn('high_water', self.mocks['update'].call_args[1])
+
+    @patch('core.database.get_db')
+    def test_backfill_does_not_move_earned_game_time(self, mock_get_db):
+        users = MagicMock()
+        users.update_one.return_value.matched_count = 1
+        activities = MagicMock()
+        activities.find.return_value = []
+        mock_get_db.return_value.__getitem__.side_effect = lambda name: users if name == 'users' else activities
+        self.mocks['view'].return_value['strava_sync'] = {'high_water': 90000}
+        self.get.return_value = _response([_activity(1, '1970-01-01T01:00:00Z')])
+
+        with patch('core.strava_sync.ingest_applied_markers', wraps=ingest_applied_markers), \
+                patch('core.strava_ingest.get_db', mock_get_db):
+            strava_sync.backfill_user({'user_id': CHILD_ID})
+
+        update = users.update_one.call_args[0][1]
+        self.assertNotIn('earned_game_time', update.get('$inc', {}))
+        self.assertIn('1970-01-01', update['$addToSet']['activity_dates']['$each'])
+
+    def test_nothing_synced_means_no_history(self):
+        self.mocks['view'].return_value['strava_sync'] = {}
+        strava_sync.backfill_user({'user_id': CHILD_ID})
+        self.get.assert_not_called()
+        self.mocks['update'].assert_called_once_with(CHILD_ID, backfill_done=True)
+
+    def test_finished_backfill_does_nothing(self):
+        self.mocks['view'].return_value['strava_sync'] = {'backfill_done': True}
+        strava_sync.backfill_user({'user_id': CHILD_ID})
+        self.get.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
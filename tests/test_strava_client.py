@@ -0,0 +1,130 @@
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.strava_client import StravaClient, StravaUnavailable
+from core.strava_ratelimit import BACKGROUND, RateLimited
+
+
+class StubStrava(BaseHTTPRequestHandler):
+    """Answers from `server.plan`: path -> list of (status, body, delay) consumed per call.
+
+    A body of None echoes the request path.
+    """
+
+    def _reply(self):
+        server = self.server
+        path = urlparse(self.path).path
+        with server.lock:
+            server.calls.append(self.path)
+            plan = server.plan.get(path) or [(200, None, 0)]
+            status, body, delay = plan.pop(0) if len(plan) > 1 else plan[0]
+        if delay:
+            time.sleep(delay)
+        payload = json.dumps({'path': self.path} if body is None else body).encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out and hung up
+            pass
+
+    do_GET = _reply
+    do_POST = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+class StravaClientTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubStrava)
+        self.server.daemon_threads = True
+        self.server.plan, self.server.calls, self.server.lock = {}, [], threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.client = StravaClient(api_url=f'{base}/api/v3', token_url=f'{base}/oauth/token',
+                                   timeout=(1, 0.3), retries=2, backoff_factor=0)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_retries_gateway_errors(self):
+        self.server.plan['/api/v3/athlete'] = [(503, {}, 0), (200, {'id': 7}, 0)]
+
+        response = self.client.get('/athlete', headers={'Authorization': 'Bearer t'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'id': 7})
+        self.assertEqual(len(self.server.calls), 2)
+
+    def test_client_errors_are_returned_without_retrying(self):
+        self.server.plan['/api/v3/athlete'] = [(401, {'message': 'Authorization Error'}, 0)]
+
+        self.assertEqual(self.client.get('/athlete').status_code, 401)
+        self.assertEqual(len(self.server.calls), 1)
+
+    def test_slow_response_raises_after_retries(self):
+        self.server.plan['/api/v3/athlete'] = [(200, {}, 1.0)]
+
+        with self.assertRaises(StravaUnavailable):
+            self.client.get('/athlete', priority=BACKGROUND)
+        self.assertEqual(len(self.server.calls), 3)
+
+    def test_interactive_call_retries_a_read_timeout_once(self):
+        self.server.plan['/api/v3/athlete'] = [(200, {}, 1.0)]
+
+        with self.assertRaises(StravaUnavailable):
+            self.client.get('/athlete')
+        self.assertEqual(len(self.server.calls), 2)
+
+    def test_token_exchange_is_not_retried_after_a_read_timeout(self):
+        self.server.plan['/oauth/token'] = [(200, {}, 1.0)]
+
+        with self.assertRaises(StravaUnavailable):
+            self.client.post_token({'grant_type': 'authorization_code', 'code': 'once'})
+        self.assertEqual(len(self.server.calls), 1)
+
+    def test_429_holds_back_later_calls_without_sending_them(self):
+        self.server.plan['/api/v3/athlete'] = [(429, {'message': 'Rate Limit Exceeded'}, 0)]
+
+        self.assertEqual(self.client.get('/athlete').status_code, 429)
+        with self.assertRaises(RateLimited):
+            self.client.get('/athlete')
+        self.assertEqual(len(self.server.calls), 1)
+
+    def test_activity_pages_are_fetched_concurrently_and_in_order(self):
+        self.server.plan['/api/v3/athlete/activities'] = [(200, None, 0.2)]
+
+        started = time.monotonic()
+        responses = self.client.activity_pages({'Authorization': 'Bearer t'}, pages=4, per_page=50)
+        elapsed = time.monotonic() - started
+
+        pages = [parse_qs(urlparse(r.json()['path']).query)['page'] for r in responses]
+        self.assertEqual(pages, [['1'], ['2'], ['3'], ['4']])
+        self.assertLess(elapsed, 0.6)
+
+    def test_fetch_many_returns_failures_in_place(self):
+        self.server.plan['/api/v3/slow'] = [(200, {}, 1.0)]
+
+        results = self.client.fetch_many([('/fast', None, None), ('/slow', None, None)])
+
+        self.assertEqual(results[0].status_code, 200)
+        self.assertIsInstance(results[1], StravaUnavailable)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,38 +22,41 @@ class StravaImportTests(unittest.TestCase):
         self.app.config['TESTING'] = True
         self.client = self.app.test_client()
 
-    @patch('app.requests.get')
+    @patch('core.strava_client.StravaClient.get')
     @patch('app.get_user_strava_headers')
     @patch('app.UserDB.add_parent_message')
     @patch('app.UserDB.record_daily_activity')
-    @patch('app.UserDB.add_earned_game_time')
+    @patch('app.UserDB.apply_activity_credits')
     @patch('app.UserDB.add_earned_game_time_and_increase_limit')
-    @patch('app.UserDB.get_user_by_id')
+    @patch('app.UserDB.get_user_view')
     @patch('app.UserDB.get_parent_children')
+    @patch('core.strava_ingest.get_db')
     @patch('app.get_db')
     def test_apply_earned_strava_counts_historical_minutes(
         self,
         mock_get_db,
+        mock_ingest_get_db,
         mock_get_parent_children,
-        mock_get_user_by_id,
+        mock_get_user_view,
         mock_add_today,
-        mock_add_historical,
+        mock_apply_credits,
         mock_record_daily_activity,
         mock_add_parent_message,
         mock_get_user_strava_headers,
-        mock_requests_get,
+        mock_strava_get,
     ):
         mock_db = MagicMock()
         mock_get_db.return_value = mock_db
+        mock_ingest_get_db.return_value = mock_db
         activities_collection = MagicMock()
         mock_db.__getitem__.return_value = activities_collection
-        activities_collection.find_one.return_value = None
-        activities_collection.insert_one.return_value.inserted_id = 'applied1'
+        activities_collection.find.return_value = []
+        mock_apply_credits.return_value = True
 
         parent_id = '507f1f77bcf86cd799439011'
         child_id = '507f1f77bcf86cd799439012'
         mock_get_parent_children.return_value = [{'id': child_id}]
-        mock_get_user_by_id.side_effect = [
+        mock_get_user_view.side_effect = [
             {'_id': child_id, 'strava_connected': True},
             {'_id': parent_id, 'name': 'Parent Tester'},
         ]
@@ -71,7 +74,7 @@ class StravaImportTests(unittest.TestCase):
             'type': 'Ride',
             'average_heartrate': 145,
         }]
-        mock_requests_get.return_value = mock_resp
+        mock_strava_get.return_value = mock_resp
 
         with self.client.session_transaction() as sess:
             sess['user_id'] = parent_id
@@ -81,42 +84,48 @@ class StravaImportTests(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         data = response.get_json()
         self.assertEqual(data['applied_minutes'], data['applied_activities'][0]['earned_minutes'])
-        mock_add_historical.assert_called_once()
+        # One bulk insert of markers and one aggregated credit, none of it counted as today's time
+        activities_collection.bulk_write.assert_called_once()
+        mock_apply_credits.assert_called_once()
+        self.assertEqual(mock_apply_credits.call_args[1]['earned_today'], 0)
         mock_add_today.assert_not_called()
+        mock_record_daily_activity.assert_called_once()
         mock_add_parent_message.assert_called()
 
-    @patch('app.requests.get')
+    @patch('core.strava_client.StravaClient.get')
     @patch('app.get_user_strava_headers')
     @patch('app.UserDB.add_parent_message')
     @patch('app.UserDB.record_daily_activity')
-    @patch('app.UserDB.add_earned_game_time')
+    @patch('app.UserDB.apply_activity_credits')
     @patch('app.UserDB.add_earned_game_time_and_increase_limit')
-    @patch('app.UserDB.get_user_by_id')
+    @patch('app.UserDB.get_user_view')
     @patch('app.UserDB.get_parent_children')
+    @patch('core.strava_ingest.get_db')
     @patch('app.get_db')
     def test_apply_earned_strava_accepts_empty_json_body(
         self,
         mock_get_db,
+        mock_ingest_get_db,
         mock_get_parent_children,
-        mock_get_user_by_id,
+        mock_get_user_view,
         mock_add_today,
-        mock_add_historical,
+        mock_apply_credits,
         mock_record_daily_activity,
         mock_add_parent_message,
         mock_get_user_strava_headers,
-        mock_requests_get,
+        mock_strava_get,
     ):
         mock_db = MagicMock()
         mock_get_db.return_value = mock_db
+        mock_ingest_get_db.return_value = mock_db
         activities_collection = MagicMock()
         mock_db.__getitem__.return_value = activities_collection
-        activities_collection.find_one.return_value = None
-        activities_collection.insert_one.return_value.inserted_id = 'applied2'
+        activities_collection.find.return_value = []
 
         parent_id = '507f1f77bcf86cd799439021'
         child_id = '507f1f77bcf86cd799439022'
         mock_get_parent_children.return_value = [{'id': child_id}]
-        mock_get_user_by_id.side_effect = [
+        mock_get_user_view.side_effect = [
             {'_id': child_id, 'strava_connected': True},
             {'_id': parent_id, 'name': 'Parent Tester'},
         ]
@@ -126,7 +135,7 @@ class StravaImportTests(unittest.TestCase):
         mock_resp = MagicMock()
         mock_resp.status_code = 200
         mock_resp.json.return_value = []
-        mock_requests_get.return_value = mock_resp
+        mock_strava_get.return_value = mock_resp
 
         with self.client.session_transaction() as sess:
             sess['user_id'] = parent_id
@@ -135,43 +144,46 @@ class StravaImportTests(unittest.TestCase):
         response = self.client.post(f'/api/apply-earned-strava/{child_id}', json={})
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.get_json()['applied_minutes'], 0)
-        mock_requests_get.assert_called_once()
+        mock_strava_get.assert_called_once()
+        mock_apply_credits.assert_not_called()
 
-    @patch('app.requests.get')
+    @patch('core.strava_client.StravaClient.get')
     @patch('app.get_user_strava_headers')
     @patch('app.UserDB.record_daily_activity')
-    @patch('app.UserDB.add_earned_game_time')
+    @patch('app.UserDB.apply_activity_credits')
     @patch('app.UserDB.add_earned_game_time_and_increase_limit')
-    @patch('app.UserDB.get_user_by_id')
+    @patch('app.UserDB.get_user_view')
     @patch('app.UserDB.get_parent_children')
+    @patch('core.strava_ingest.get_db')
     @patch('app.get_db')
     def test_apply_earned_strava_rolls_back_marker_on_credit_failure(
         self,
         mock_get_db,
+        mock_ingest_get_db,
         mock_get_parent_children,
-        mock_get_user_by_id,
+        mock_get_user_view,
         mock_add_today,
-        mock_add_historical,
+        mock_apply_credits,
         mock_record_daily_activity,
         mock_get_user_strava_headers,
-        mock_requests_get,
+        mock_strava_get,
     ):
         mock_db = MagicMock()
         mock_get_db.return_value = mock_db
+        mock_ingest_get_db.return_value = mock_db
         activities_collection = MagicMock()
         mock_db.__getitem__.return_value = activities_collection
-        activities_collection.find_one.return_value = None
-        activities_collection.insert_one.return_value.inserted_id = 'applied3'
+        activities_collection.find.return_value = []
 
         parent_id = '507f1f77bcf86cd799439031'
         child_id = '507f1f77bcf86cd799439032'
         mock_get_parent_children.return_value = [{'id': child_id}]
-        mock_get_user_by_id.side_effect = [
+        mock_get_user_view.side_effect = [
             {'_id': child_id, 'strava_connected': True},
             {'_id': parent_id, 'name': 'Parent Tester'},
         ]
         mock_get_user_strava_headers.return_value = {'Authorization': 'Bearer test'}
-        mock_add_historical.side_effect = RuntimeError('credit failed')
+        mock_apply_credits.side_effect = RuntimeError('credit failed')
         mock_record_daily_activity.return_value = {'applied': False, 'reward_minutes': 0, 'streak_count': 1}
 
         mock_resp = MagicMock()
@@ -184,7 +196,7 @@ class StravaImportTests(unittest.TestCase):
             'start_date': '2026-03-10T09:00:00Z',
             'type': 'Run',
         }]
-        mock_requests_get.return_value = mock_resp
+        mock_strava_get.return_value = mock_resp
 
         with self.client.session_transaction() as sess:
             sess['user_id'] = parent_id
@@ -195,7 +207,8 @@ class StravaImportTests(unittest.TestCase):
         data = response.get_json()
         self.assertEqual(data['applied_minutes'], 0)
         self.assertEqual(data['applied_activities'][0]['earned_minutes'], 0)
-        activities_collection.delete_one.assert_called_once()
+        activities_collection.delete_many.assert_called_once()
+        mock_record_daily_activity.assert_not_called()
 
 
 if __name__ == '__main__':
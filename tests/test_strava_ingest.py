@@ -0,0 +1,123 @@
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.strava_ingest import build_applied_marker, ingest_applied_markers
+
+
+class StravaIngestTests(unittest.TestCase):
+
+    def setUp(self):
+        self.child_id = '507f1f77bcf86cd799439061'
+        self.activities = MagicMock()
+        self.db = MagicMock()
+        self.db.__getitem__.return_value = self.activities
+
+    def _marker(self, activity_id, date, minutes):
+        activity = {'id': activity_id, 'name': 'Run', 'type': 'Run', 'start_date': date}
+        return build_applied_marker(self.child_id, activity, 5.0, 30, 'Moderate', minutes)
+
+    @patch('core.strava_ingest.UserDB.record_daily_activity')
+    @patch('core.strava_ingest.UserDB.apply_activity_credits')
+    @patch('core.strava_ingest.get_db')
+    def test_batch_skips_existing_and_credits_once(self, mock_get_db, mock_apply, mock_record):
+        mock_get_db.return_value = self.db
+        self.activities.find.return_value = [{'external_id': '1'}]
+        mock_apply.return_value = True
+        markers = [
+            self._marker(1, '2026-03-08T10:00:00Z', 10),
+            self._marker(2, '2026-03-09T10:00:00Z', 20),
+            self._marker(3, '2026-03-10T10:00:00Z', 30),
+        ]
+
+        result = ingest_applied_markers(self.child_id, markers, reward_days='all')
+
+        self.assertEqual([m['external_id'] for m in result['inserted']], ['2', '3'])
+        self.assertEqual(result['credited_minutes'], 50)
+        self.activities.find.assert_called_once()
+        self.activities.bulk_write.assert_called_once()
+        self.assertEqual(len(self.activities.bulk_write.call_args[0][0]), 2)
+        mock_apply.assert_called_once_with(self.child_id, 50, earned_today=0, activity_dates=[])
+        self.assertEqual([c[1]['activity_date'] for c in mock_record.call_args_list], ['2026-03-09', '2026-03-10'])
+
+    @patch('core.strava_ingest.UserDB.record_daily_activity')
+    @patch('core.strava_ingest.UserDB.apply_activity_credits')
+    @patch('core.strava_ingest.get_db')
+    def test_uncredited_history_only_records_dates(self, mock_get_db, mock_apply, mock_record):
+        mock_get_db.return_value = self.db
+        self.activities.find.return_value = []
+        mock_apply.return_value = True
+        markers = [self._marker(1, '2025-06-01T10:00:00Z', 40), self._marker(2, '2025-06-02T10:00:00Z', 25)]
+
+        result = ingest_applied_markers(self.child_id, markers, credit=False)
+
+        self.assertEqual(result['credited_minutes'], 0)
+        stored = [op._doc for op in self.activities.bulk_write.call_args[0][0]]
+        self.assertEqual({(m['earned_minutes'], m['credited']) for m in stored}, {(0, False)})
+        mock_apply.assert_called_once_with(self.child_id, 0, earned_today=0,
+                                           activity_dates=['2025-06-01', '2025-06-02'])
+        mock_record.assert_not_called()
+
+    @patch('core.strava_ingest.UserDB.record_daily_activity')
+    @patch('core.strava_ingest.UserDB.apply_activity_credits')
+    @patch('core.strava_ingest.get_db')
+    def test_concurrent_duplicate_is_not_credited(self, mock_get_db, mock_apply, mock_record):
+        mock_get_db.return_value = self.db
+        self.activities.find.return_value = []
+        self.activities.bulk_write.side_effect = BulkWriteError({
+            'writeErrors': [{'index': 0, 'code': 11000, 'errmsg': 'duplicate key'}]
+        })
+        mock_apply.return_value = True
+        markers = [self._marker(1, '2026-03-09T10:00:00Z', 10), self._marker(2, '2026-03-09T12:00:00Z', 15)]
+
+        result = ingest_applied_markers(self.child_id, markers, reward_days='today')
+
+        self.assertEqual([m['external_id'] for m in result['inserted']], ['2'])
+        mock_apply.assert_called_once_with(self.child_id, 15, earned_today=0, activity_dates=['2026-03-09'])
+        mock_record.assert_not_called()
+
+
+    @patch('core.strava_ingest.UserDB.apply_activity_credits')
+    @patch('core.strava_ingest.get_db')
+    def test_rejected_marker_fails_the_batch_and_rolls_it_back(self, mock_get_db, mock_apply):
+        mock_get_db.return_value = self.db
+        self.activities.find.return_value = []
+        self.activities.bulk_write.side_effect = BulkWriteError({
+            'writeErrors': [{'index': 1, 'code': 121, 'errmsg': 'Document failed validation'}]
+        })
+        markers = [self._marker(1, '2026-03-09T10:00:00Z', 10), self._marker(2, '2026-03-09T12:00:00Z', 15)]
+
+        result = ingest_applied_markers(self.child_id, markers)
+
+        self.assertTrue(result['credit_failed'])
+        mock_apply.assert_not_called()
+        self.activities.delete_many.assert_called_once_with({'_id': {'$in': [markers[0]['_id']]}})
+
+    @patch('core.strava_ingest.UserDB.apply_activity_credits')
+    @patch('core.strava_ingest.get_db')
+    def test_connection_error_while_storing_reports_credit_failed(self, mock_get_db, mock_apply):
+        mock_get_db.return_value = self.db
+        self.activities.find.return_value = []
+        self.activities.bulk_write.side_effect = AutoReconnect('connection reset')
+        markers = [self._marker(1, '2026-03-09T10:00:00Z', 10)]
+
+        result = ingest_applied_markers(self.child_id, markers)
+
+        self.assertTrue(result['credit_failed'])
+        self.assertEqual(result['inserted'], [])
+        mock_apply.assert_not_called()
+        self.activities.delete_many.assert_called_once_with({'_id': {'$in': [markers[0]['_id']]}})
+
+        self.activities.reset_mock()
+        self.activities.find.side_effect = AutoReconnect('connection reset')
+        self.assertTrue(ingest_applied_markers(self.child_id, [self._marker(2, '2026-03-09T10:00:00Z', 10)])['credit_failed'])
+        self.activities.delete_many.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
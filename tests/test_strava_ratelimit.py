@@ -0,0 +1,90 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.strava_ratelimit import BACKGROUND, INTERACTIVE, RateLimited, RateLimiter
+
+
+class FakeClock:
+
+    def __init__(self, now=1_800_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class RateLimiterTests(unittest.TestCase):
+
+    def setUp(self):
+        # 1_800_000_000 is exactly on a 15-minute boundary
+        self.clock = FakeClock()
+        self.limiter = RateLimiter(limits=(100, 1000), safety_share=0.02, background_share=0.8, clock=self.clock)
+
+    def test_background_stops_at_its_share_while_interactive_continues(self):
+        self.limiter.update({'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '80,300'})
+
+        with self.assertRaises(RateLimited) as ctx:
+            self.limiter.acquire(BACKGROUND)
+        self.assertEqual(ctx.exception.retry_after, 15 * 60)
+        self.limiter.acquire(INTERACTIVE)
+        self.assertEqual(self.limiter.usage, [81, 301])
+
+    def test_interactive_keeps_a_safety_margin(self):
+        self.limiter.update({'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '97,300'})
+        self.limiter.acquire(INTERACTIVE)
+        with self.assertRaises(RateLimited):
+            self.limiter.acquire(INTERACTIVE)
+
+    def test_usage_resets_with_the_window(self):
+        self.limiter.update({'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '99,300'})
+        self.clock.now += 15 * 60
+        self.limiter.acquire(BACKGROUND)
+        self.assertEqual(self.limiter.usage, [1, 301])
+
+    def test_daily_budget_blocks_until_midnight(self):
+        self.limiter.update({'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '5,990'})
+        with self.assertRaises(RateLimited) as ctx:
+            self.limiter.acquire(INTERACTIVE)
+        midnight = (self.clock.now // 86400 + 1) * 86400
+        self.assertEqual(ctx.exception.retry_after, midnight - self.clock.now)
+
+    def test_429_blocks_every_priority_until_the_window_resets(self):
+        self.clock.now += 60
+        self.limiter.exhausted({'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '20,300'})
+        with self.assertRaises(RateLimited) as ctx:
+            self.limiter.acquire(INTERACTIVE)
+        self.assertEqual(ctx.exception.retry_after, 14 * 60)
+
+    def test_malformed_headers_are_ignored(self):
+        self.limiter.update({'X-RateLimit-Limit': 'nope', 'X-RateLimit-Usage': '1,2'})
+        self.assertEqual(self.limiter.limits, [100, 1000])
+
+    def test_waiting_background_call_yields_to_waiting_interactive_call(self):
+        limiter = RateLimiter(limits=(100, 1000), background_share=0.8)
+        limiter.usage = [79, 0]
+        order = []
+        limiter._waiting[INTERACTIVE] = 1
+
+        def background():
+            limiter.acquire(BACKGROUND, wait=2)
+            order.append('background')
+
+        thread = threading.Thread(target=background)
+        thread.start()
+        time.sleep(0.05)
+        self.assertEqual(order, [])
+        with limiter._cond:
+            limiter._waiting[INTERACTIVE] -= 1
+            order.append('interactive')
+            limiter._cond.notify_all()
+        thread.join(timeout=1)
+        self.assertEqual(order, ['interactive', 'background'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.strava_tokens import TokenCache
+
+USER_ID = '507f1f77bcf86cd799439121'
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1_800_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _user(token, expires_in, clock):
+    return {'_id': USER_ID, 'strava_access_token': token, 'strava_refresh_token': 'refresh',
+            'strava_token_expiry': datetime.fromtimestamp(clock.now + expires_in).isoformat()}
+
+
+def _token_response(token, expires_at):
+    resp = MagicMock()
+    resp.status_code = 200
+    resp.json.return_value = {'access_token': token, 'refresh_token': 'refresh-2', 'expires_at': expires_at}
+    return resp
+
+
+class TokenCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TokenCache(size=2, margin=600, ttl=300, clock=self.clock)
+        patches = {
+            'view': patch('core.strava_tokens.UserDB.get_user_view'),
+            'save': patch('core.strava_tokens.UserDB.update_strava_token'),
+            'client': patch('core.strava_tokens.get_client'),
+        }
+        self.mocks = {name: p.start() for name, p in patches.items()}
+        for p in patches.values():
+            self.addCleanup(p.stop)
+        self.post = self.mocks['client'].return_value.post_token
+
+    def test_valid_token_is_reused_without_reading_mongo_again(self):
+        self.mocks['view'].return_value = _user('tok', 3600, self.clock)
+
+        self.assertEqual(self.cache.access_token(USER_ID), 'tok')
+        self.clock.now += 60
+        self.assertEqual(self.cache.access_token(USER_ID), 'tok')
+
+        self.assertEqual(self.mocks['view'].call_count, 1)
+        self.post.assert_not_called()
+
+    def test_token_is_refreshed_ahead_of_expiry_and_saved(self):
+        self.mocks['view'].return_value = _user('old', 300, self.clock)
+        self.post.return_value = _token_response('new', self.clock.now + 21600)
+
+        self.assertEqual(self.cache.access_token(USER_ID), 'new')
+
+        args = self.mocks['save'].call_args[0]
+        self.assertEqual(args[:3], (USER_ID, 'new', 'refresh-2'))
+
+    def test_concurrent_callers_share_one_refresh(self):
+        self.mocks['view'].return_value = _user('old', 0, self.clock)
+
+        def slow_refresh(data):
+            time.sleep(0.1)
+            return _token_response('new', self.clock.now + 21600)
+        self.post.side_effect = slow_refresh
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.access_token(USER_ID)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['new'] * 8)
+        self.assertEqual(self.post.call_count, 1)
+
+    def test_failed_proactive_refresh_keeps_old_token_and_backs_off(self):
+        self.mocks['view'].return_value = _user('old', 300, self.clock)
+        self.post.return_value = MagicMock(status_code=500)
+
+        self.assertEqual(self.cache.access_token(USER_ID), 'old')
+        self.assertEqual(self.cache.access_token(USER_ID), 'old')
+        self.assertEqual(self.post.call_count, 1)
+
+        self.clock.now += 31
+        self.cache.access_token(USER_ID)
+        self.assertEqual(self.post.call_count, 2)
+
+    def test_least_recently_used_user_is_evicted(self):
+        self.mocks['view'].side_effect = lambda uid, *views: dict(_user(f'tok-{uid}', 3600, self.clock), _id=uid)
+
+        for uid in ('a', 'b', 'a', 'c'):
+            self.cache.access_token(uid)
+        self.cache.access_token('a')
+        self.cache.access_token('b')
+
+        # 'a' stayed cached; 'b' was evicted by 'c' and read again
+        self.assertEqual([c[0][0] for c in self.mocks['view'].call_args_list], ['a', 'b', 'c', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
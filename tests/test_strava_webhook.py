@@ -0,0 +1,106 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core import strava_sync, task_queue
+
+CHILD_ID = '507f1f77bcf86cd799439101'
+
+
+class StravaWebhookRouteTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        os.environ['FLASK_SECRET_KEY'] = 'test_key'
+        import app as app_module
+        cls.app_module = app_module
+        cls.app = app_module.app
+
+    def setUp(self):
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+
+    def test_subscription_validation_echoes_challenge(self):
+        with patch('app.STRAVA_WEBHOOK_VERIFY_TOKEN', 'secret'):
+            ok = self.client.get('/strava/webhook?hub.mode=subscribe&hub.verify_token=secret&hub.challenge=abc')
+            bad = self.client.get('/strava/webhook?hub.mode=subscribe&hub.verify_token=wrong&hub.challenge=abc')
+
+        self.assertEqual(ok.get_json(), {'hub.challenge': 'abc'})
+        self.assertEqual(bad.status_code, 403)
+
+    @patch('core.strava_sync.task_queue.enqueue')
+    def test_event_is_queued_not_processed(self, mock_enqueue):
+        event = {'object_type': 'activity', 'object_id': 99, 'aspect_type': 'create', 'owner_id': 7,
+                 'event_time': 1700000000, 'subscription_id': 1}
+
+        response = self.client.post('/strava/webhook', json=event)
+
+        self.assertEqual(response.status_code, 200)
+        mock_enqueue.assert_called_once_with('strava_event', event, dedupe_key='strava:activity:99:create:1700000000')
+
+
+class StravaEventHandlerTests(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch('core.strava_sync.UserDB.get_user_by_strava_id')
+        self.mock_lookup = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_lookup.return_value = {'_id': CHILD_ID, 'account_type': 'child'}
+        self.event = {'object_type': 'activity', 'object_id': 99, 'aspect_type': 'create', 'owner_id': 7}
+
+    @patch('core.strava_sync.ingest_applied_markers')
+    @patch('core.strava_sync.get_client')
+    @patch('core.strava_sync.user_strava_headers')
+    def test_create_fetches_and_ingests_at_background_priority(self, mock_headers, mock_client, mock_ingest):
+        mock_headers.return_value = {'Authorization': 'Bearer t'}
+        resp = mock_client.return_value.get.return_value
+        resp.status_code = 200
+        resp.json.return_value = {'id': 99, 'name': 'Run', 'type': 'Run', 'distance': 5000, 'moving_time': 1800,
+                                  'start_date': '2026-03-10T08:00:00Z'}
+        mock_ingest.return_value = {'inserted': [{}], 'credited_minutes': 6, 'credit_failed': False}
+
+        strava_sync.handle_event(self.event)
+
+        self.assertEqual(mock_client.return_value.get.call_args[1]['priority'], strava_sync.BACKGROUND)
+        user_id, markers = mock_ingest.call_args[0]
+        self.assertEqual(user_id, CHILD_ID)
+        self.assertEqual(markers[0]['external_id'], '99')
+
+    @patch('core.strava_sync.get_client')
+    @patch('core.strava_sync.user_strava_headers')
+    def test_rate_limit_defers_the_task(self, mock_headers, mock_client):
+        from core.strava_ratelimit import RateLimited
+        mock_headers.return_value = {'Authorization': 'Bearer t'}
+        mock_client.return_value.get.side_effect = RateLimited(300)
+
+        with self.assertRaises(task_queue.Defer) as ctx:
+            strava_sync.handle_event(self.event)
+        self.assertEqual(ctx.exception.delay, 300)
+
+    @patch('core.strava_sync.UserDB.bump_state_version')
+    @patch('core.strava_sync.get_db')
+    def test_delete_flags_the_marker(self, mock_get_db, mock_bump):
+        strava_sync.handle_event(dict(self.event, aspect_type='delete'))
+
+        query, update = mock_get_db.return_value['activities'].update_one.call_args[0]
+        self.assertEqual(query['external_id'], '99')
+        self.assertIn('deleted_at', update['$set'])
+
+    @patch('core.strava_sync.UserDB.clear_strava_credentials')
+    def test_deauthorization_clears_tokens(self, mock_clear):
+        strava_sync.handle_event({'object_type': 'athlete', 'object_id': 7, 'aspect_type': 'update', 'owner_id': 7,
+                                  'updates': {'authorized': 'false'}})
+        mock_clear.assert_called_once_with(CHILD_ID)
+
+    @patch('core.strava_sync.get_client')
+    def test_parent_activities_are_ignored(self, mock_client):
+        self.mock_lookup.return_value = {'_id': CHILD_ID, 'account_type': 'parent'}
+        strava_sync.handle_event(self.event)
+        mock_client.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import random
+import sys
+import unittest
+from datetime import date, timedelta
+from unittest.mock import MagicMock, patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core import streaks
+from core.database import UserDB
+
+
+class StreakStateTests(unittest.TestCase):
+
+    def test_advance_matches_full_recompute_in_any_order(self):
+        rng = random.Random(7)
+        start = date(2026, 1, 1)
+        for _ in range(200):
+            days = [(start + timedelta(days=rng.randrange(90))).isoformat() for _ in range(rng.randrange(1, 40))]
+            state = None
+            recorded = []
+            for d in days:
+                recorded.append(d)
+                state = streaks.advance(state, d) or streaks.state_from_dates(recorded)
+            self.assertEqual(state, streaks.state_from_dates(days))
+
+    def test_backfill_joins_older_run(self):
+        state = streaks.state_from_dates(['2026-03-01', '2026-03-02', '2026-03-04', '2026-03-05'])
+        self.assertEqual(streaks.streak_length(state), 2)
+
+        state = streaks.advance(state, '2026-03-03')
+
+        self.assertEqual(streaks.streak_length(state), 5)
+        self.assertTrue(streaks.contains(state, '2026-03-01'))
+
+    def test_backfill_past_window_requests_recompute(self):
+        last = date(2026, 6, 30)
+        run = [(last - timedelta(days=i)).isoformat() for i in range(streaks.WINDOW_DAYS)]
+        state = streaks.state_from_dates(run)
+
+        self.assertIsNone(streaks.advance(state, (last - timedelta(days=streaks.WINDOW_DAYS)).isoformat()))
+        self.assertIsNone(streaks.contains(state, '2020-01-01'))
+
+
+class StreakStorageTests(unittest.TestCase):
+
+    def setUp(self):
+        self.child_id = '507f1f77bcf86cd799439071'
+        self.users = MagicMock()
+        self.db = MagicMock()
+        self.db.__getitem__.return_value = self.users
+
+    @patch('core.database.get_db')
+    def test_current_streak_reads_state_without_dates(self, mock_get_db):
+        mock_get_db.return_value = self.db
+        self.users.find_one.return_value = {
+            '_id': self.child_id,
+            'streak_state': {'length': 4, 'last_day': '2026-03-10', 'bitmap': 15},
+        }
+
+        self.assertEqual(UserDB.calculate_current_streak(self.child_id), 4)
+        self.users.update_one.assert_not_called()
+
+    @patch('core.database.get_db')
+    def test_legacy_document_is_migrated_once(self, mock_get_db):
+        mock_get_db.return_value = self.db
+        self.users.find_one.return_value = {'_id': self.child_id, 'activity_dates': ['2026-03-09', '2026-03-10']}
+
+        self.assertEqual(UserDB.calculate_current_streak(self.child_id), 2)
+        query, update = self.users.update_one.call_args[0]
+        self.assertEqual(query['streak_state'], {'$exists': False})
+        self.assertEqual(update['$set']['streak_state']['length'], 2)
+
+    @patch('core.database.get_db')
+    def test_record_activity_date_compares_and_sets_state(self, mock_get_db):
+        mock_get_db.return_value = self.db
+        stored = {'length': 1, 'last_day': '2026-03-09', 'bitmap': 1}
+        self.users.find_one.return_value = {'_id': self.child_id, 'streak_state': stored}
+        self.users.update_one.return_value.matched_count = 1
+
+        result = UserDB.record_activity_date(self.child_id, '2026-03-10', notify=False)
+
+        self.assertEqual(result['streak_count'], 2)
+        query, update = self.users.update_one.call_args[0]
+        self.assertEqual(query['streak_state'], stored)
+        self.assertEqual(update['$set']['streak_state'], {'length': 2, 'last_day': '2026-03-10', 'bitmap': 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
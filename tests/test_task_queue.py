@@ -0,0 +1,81 @@
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pymongo.errors import DuplicateKeyError
+
+from core import task_queue
+
+
+class TaskQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tasks = MagicMock()
+        self.db = MagicMock()
+        self.db.__getitem__.return_value = self.tasks
+        self.task = {'_id': 't1', 'kind': 'test_kind', 'payload': {'n': 1}, 'attempts': 1, 'max_attempts': 3,
+                     'worker': 'w1'}
+
+    def tearDown(self):
+        task_queue._handlers.pop('test_kind', None)
+
+    def test_duplicate_dedupe_key_is_not_queued_twice(self):
+        self.tasks.insert_one.side_effect = DuplicateKeyError('E11000')
+        self.assertIsNone(task_queue.enqueue('test_kind', {}, dedupe_key='k', database=self.db))
+
+    def test_claim_leases_the_most_urgent_due_task(self):
+        task_queue.claim('w1', kinds=['test_kind'], database=self.db)
+
+        query, update = self.tasks.find_one_and_update.call_args[0]
+        self.assertEqual(query['status'], 'queued')
+        self.assertEqual(query['kind'], {'$in': ['test_kind']})
+        self.assertEqual(update['$set']['worker'], 'w1')
+        self.assertEqual(update['$inc'], {'attempts': 1})
+        self.assertEqual(self.tasks.find_one_and_update.call_args[1]['sort'], [('priority', 1), ('run_at', 1)])
+
+    def test_successful_handler_completes_task(self):
+        seen = []
+        task_queue.handler('test_kind')(seen.append)
+
+        task_queue.run_task(self.task, database=self.db)
+
+        self.assertEqual(seen, [{'n': 1}])
+        query, update = self.tasks.update_one.call_args[0]
+        self.assertEqual(query, {'_id': 't1', 'status': 'running', 'worker': 'w1'})
+        self.assertEqual(update['$set']['status'], 'done')
+
+    def test_failure_retries_with_backoff_then_gives_up(self):
+        @task_queue.handler('test_kind')
+        def boom(payload):
+            raise ValueError('nope')
+
+        task_queue.run_task(self.task, database=self.db)
+        update = self.tasks.update_one.call_args[0][1]
+        self.assertEqual(update['$set']['status'], 'queued')
+        self.assertEqual(update['$set']['last_error'], 'nope')
+
+        task_queue.run_task(dict(self.task, attempts=3), database=self.db)
+        self.assertEqual(self.tasks.update_one.call_args[0][1]['$set']['status'], 'dead')
+
+    def test_defer_does_not_use_up_an_attempt(self):
+        @task_queue.handler('test_kind')
+        def later(payload):
+            raise task_queue.Defer(120)
+
+        task_queue.run_task(dict(self.task, attempts=3), database=self.db)
+
+        update = self.tasks.update_one.call_args[0][1]
+        self.assertEqual(update['$set']['status'], 'queued')
+        self.assertEqual(update['$inc'], {'attempts': -1})
+
+    def test_worker_run_once_reports_idle_queue(self):
+        self.tasks.find_one_and_update.return_value = None
+        worker = task_queue.Worker(threads=1, database=self.db)
+        self.assertFalse(worker.run_once())
+
+
+if __name__ == '__main__':
+    unittest.main()
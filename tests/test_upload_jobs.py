@@ -0,0 +1,173 @@
+import io
+import os
+import sys
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+from bson import ObjectId
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core import upload_jobs
+from core.activity_files import ActivityFileError
+
+USER_ID = '507f1f77bcf86cd799439151'
+JOB_ID = ObjectId('65f0000000000000000000a1')
+
+
+def _job(status=upload_jobs.QUEUED):
+    return {'_id': JOB_ID, 'user_id': USER_ID, 'path': '/tmp/run.gpx', 'filename': 'run.gpx',
+            'extension': '.gpx', 'title': None, 'status': status, 'progress': 0, 'created_at': datetime(2026, 3, 10)}
+
+
+def _ingested():
+    activity = {'_id': ObjectId(), 'title': 'Run upload', 'date': '2026-03-10T09:00:00Z', 'type': 'Run',
+                'distance': 5.0, 'time_minutes': 30, 'elevation_gain': 12.0, 'average_heartrate': 150.0,
+                'intensity': 'Medium', 'earned_minutes': 9}
+    return {'activity': activity, 'duplicate': False, 'streak': {'applied': True, 'reward_minutes': 5, 'streak_count': 3}}
+
+
+class UploadJobProcessingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.jobs = MagicMock()
+        self.database = MagicMock()
+        self.database.__getitem__.return_value = self.jobs
+        patcher = patch('core.upload_jobs.activity_files.ingest_file')
+        self.mock_ingest = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _finished(self):
+        return self.jobs.update_one.call_args[0][1]['$set']
+
+    def test_job_is_claimed_ingested_and_finished_with_result(self):
+        self.jobs.find_one_and_update.return_value = _job(upload_jobs.PROCESSING)
+        self.mock_ingest.return_value = _ingested()
+
+        self.assertTrue(upload_jobs.process(JOB_ID, database=self.database))
+
+        self.assertEqual(self.jobs.find_one_and_update.call_args[0][0], {'_id': JOB_ID, 'status': upload_jobs.QUEUED})
+        finished = self._finished()
+        self.assertEqual(finished['status'], upload_jobs.DONE)
+        self.assertEqual(finished['result']['earned_minutes'], 9)
+        self.assertEqual(finished['result']['streak_count'], 3)
+
+    def test_job_taken_by_another_worker_is_skipped(self):
+        self.jobs.find_one_and_update.return_value = None
+
+        self.assertFalse(upload_jobs.process(JOB_ID, database=self.database))
+        self.mock_ingest.assert_not_called()
+
+    def test_unreadable_file_and_duplicate_outcomes(self):
+        self.jobs.find_one_and_update.return_value = _job(upload_jobs.PROCESSING)
+        self.mock_ingest.side_effect = ActivityFileError('No track points found')
+        upload_jobs.process(JOB_ID, database=self.database)
+        self.assertEqual(self._finished()['status'], upload_jobs.FAILED)
+        self.assertIn('No track points found', self._finished()['error'])
+
+        self.mock_ingest.side_effect = None
+        self.mock_ingest.return_value = {'activity': None, 'duplicate': True, 'streak': {'applied': False}}
+        upload_jobs.process(JOB_ID, database=self.database)
+        self.assertEqual(self._finished()['status'], upload_jobs.DUPLICATE)
+
+    def test_progress_is_written_in_steps(self):
+        self.jobs.find_one_and_update.return_value = _job(upload_jobs.PROCESSING)
+
+        def ingest(*args, progress=None, **kwargs):
+            for i in range(1, 101):
+                progress(i / 100)
+            return _ingested()
+        self.mock_ingest.side_effect = ingest
+
+        upload_jobs.process(JOB_ID, database=self.database)
+
+        written = [c[0][1]['$set']['progress'] for c in self.jobs.update_one.call_args_list]
+        self.assertEqual(written, [10, 20, 30, 40, 50, 60, 70, 80, 90, 100])
+
+    def test_resume_requeues_expired_leases_and_submits_queued_jobs(self):
+        self.jobs.find.return_value = [{'_id': JOB_ID}]
+        self.jobs.update_many.return_value.modified_count = 0
+        processor = upload_jobs.UploadProcessor(threads=1, database=self.database)
+        processor.submit = MagicMock()
+
+        self.assertEqual(processor.resume(), 1)
+
+        requeue_filter = self.jobs.update_many.call_args[0][0]
+        self.assertEqual((requeue_filter['host'], requeue_filter['status']), (upload_jobs.HOST, upload_jobs.PROCESSING))
+        processor.submit.assert_called_once_with(JOB_ID)
+        processor.shutdown()
+
+    def test_resume_fails_jobs_left_behind_by_other_hosts(self):
+        self.jobs.find.return_value = []
+        self.jobs.update_many.return_value.modified_count = 2
+        processor = upload_jobs.UploadProcessor(threads=1, database=self.database)
+
+        processor.resume()
+
+        orphaned, update = self.jobs.update_many.call_args_list[0][0]
+        self.assertEqual(orphaned['host'], {'$ne': upload_jobs.HOST})
+        self.assertEqual(orphaned['$or'][0]['status'], upload_jobs.PROCESSING)
+        self.assertIn('created_at', orphaned['$or'][1])
+        self.assertEqual(update['$set']['status'], upload_jobs.FAILED)
+        processor.shutdown()
+
+    def test_status_of_an_orphaned_job_is_failed(self):
+        orphan = dict(_job(upload_jobs.PROCESSING), host='old-container')
+        failed = dict(orphan, status=upload_jobs.FAILED, error=upload_jobs.ORPHANED_ERROR)
+        self.jobs.find_one.side_effect = [orphan, failed]
+        self.jobs.update_many.return_value.modified_count = 1
+
+        view = upload_jobs.get_job(str(JOB_ID), USER_ID, database=self.database)
+
+        self.assertEqual(self.jobs.update_many.call_args[0][0]['_id'], JOB_ID)
+        self.assertEqual((view['status'], view['error']), (upload_jobs.FAILED, upload_jobs.ORPHANED_ERROR))
+
+        self.jobs.update_many.reset_mock()
+        self.jobs.find_one.side_effect = None
+        self.jobs.find_one.return_value = dict(orphan, host=upload_jobs.HOST)
+        upload_jobs.get_job(str(JOB_ID), USER_ID, database=self.database)
+        self.jobs.update_many.assert_not_called()
+
+
+class UploadRouteTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        os.environ['FLASK_SECRET_KEY'] = 'test_key'
+        import app as app_module
+        cls.app = app_module.app
+
+    def setUp(self):
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = USER_ID
+
+    @patch('app.upload_jobs.submit')
+    def test_upload_returns_job_without_parsing(self, mock_submit):
+        mock_submit.return_value = JOB_ID
+
+        with patch('app.UPLOAD_STORE') as store:
+            store.save_stream.return_value = MagicMock(path='/uploads/ab/cd/abcd.gpx', digest='abcd', created=True)
+            response = self.client.post('/api/upload', data={'file': (io.BytesIO(b'<gpx/>'), 'run.gpx')},
+                                        content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.get_json()['status_url'], f'/api/upload/{JOB_ID}')
+        self.assertEqual(mock_submit.call_args[0][1:4], ('/uploads/ab/cd/abcd.gpx', 'run.gpx', '.gpx'))
+        self.assertEqual(mock_submit.call_args[1]['digest'], 'abcd')
+
+    @patch('app.upload_jobs.get_job')
+    def test_status_is_only_visible_to_the_owner(self, mock_get_job):
+        mock_get_job.return_value = None
+        self.assertEqual(self.client.get(f'/api/upload/{JOB_ID}').status_code, 404)
+        mock_get_job.assert_called_once_with(str(JOB_ID), USER_ID)
+
+        mock_get_job.return_value = upload_jobs.public_view(_job())
+        body = self.client.get(f'/api/upload/{JOB_ID}').get_json()
+        self.assertEqual((body['status'], body['progress']), ('queued', 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+from flask import Flask
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.database import UserDB
+
+
+class UserCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.flask_app = Flask(__name__)
+        self.child_id = '507f1f77bcf86cd799439041'
+        self.users = MagicMock()
+        self.users.find_one.return_value = {
+            '_id': self.child_id,
+            'activity_dates': ['2026-03-09', '2026-03-10'],
+            'used_game_time': 5,
+        }
+        self.db = MagicMock()
+        self.db.__getitem__.return_value = self.users
+
+    @patch('core.database.get_db')
+    def test_repeated_lookups_hit_mongo_once_per_request(self, mock_get_db):
+        mock_get_db.return_value = self.db
+
+        with self.flask_app.test_request_context('/api/gametime-balance'):
+            UserDB.get_user_by_id(self.child_id)
+            UserDB.get_current_used_including_running(self.child_id)
+            self.assertEqual(UserDB.calculate_current_streak(self.child_id), 2)
+
+        self.assertEqual(self.users.find_one.call_count, 1)
+
+    @patch('core.database.get_db')
+    def test_write_invalidates_cached_document(self, mock_get_db):
+        mock_get_db.return_value = self.db
+
+        with self.flask_app.test_request_context('/api/control-timer'):
+            UserDB.get_user_by_id(self.child_id)
+            UserDB.use_game_time(self.child_id, 3)
+            UserDB.get_user_by_id(self.child_id)
+
+        self.assertEqual(self.users.find_one.call_count, 2)
+
+    @patch('core.database.get_db')
+    def test_no_caching_outside_request(self, mock_get_db):
+        mock_get_db.return_value = self.db
+
+        UserDB.get_user_by_id(self.child_id)
+        UserDB.get_user_by_id(self.child_id)
+
+        self.assertEqual(self.users.find_one.call_count, 2)
+
+    @patch('core.database.get_db')
+    def test_cache_does_not_leak_between_requests(self, mock_get_db):
+        mock_get_db.return_value = self.db
+
+        with self.flask_app.test_request_context('/'):
+            UserDB.get_user_by_id(self.child_id)
+        with self.flask_app.test_request_context('/'):
+            UserDB.get_user_by_id(self.child_id)
+
+        self.assertEqual(self.users.find_one.call_count, 2)
+
+    @patch('core.database.get_db')
+    def test_view_fetches_only_its_fields(self, mock_get_db):
+        mock_get_db.return_value = self.db
+
+        UserDB.get_user_view(self.child_id, 'timer')
+
+        projection = self.users.find_one.call_args[0][1]
+        self.assertEqual(set(projection), {'timer_running', 'timer_started_at'})
+
+    @patch('core.database.get_db')
+    def test_views_merge_and_only_fetch_missing_fields(self, mock_get_db):
+        mock_get_db.return_value = self.db
+
+        with self.flask_app.test_request_context('/api/gametime-balance'):
+            UserDB.get_user_view(self.child_id, 'timer')
+            UserDB.get_user_view(self.child_id, 'balance')
+            UserDB.get_user_view(self.child_id, 'timer_running')
+            doc = UserDB.get_user_view(self.child_id, 'timer', 'balance')
+
+        self.assertEqual(self.users.find_one.call_count, 2)
+        second_projection = self.users.find_one.call_args_list[1][0][1]
+        self.assertNotIn('timer_running', second_projection)
+        self.assertIn('daily_screen_time_limit', second_projection)
+        self.assertEqual(doc['used_game_time'], 5)
+
+    @patch('core.database.get_db')
+    def test_full_document_serves_later_views(self, mock_get_db):
+        mock_get_db.return_value = self.db
+
+        with self.flask_app.test_request_context('/'):
+            UserDB.get_user_by_id(self.child_id)
+            UserDB.get_user_view(self.child_id, 'identity')
+
+        self.assertEqual(self.users.find_one.call_count, 1)
+
+
+
+class DirectWriteInvalidationTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        os.environ['FLASK_SECRET_KEY'] = 'test_key'
+        import app as app_module
+        cls.app = app_module.app
+
+    def setUp(self):
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        self.child_id = '507f1f77bcf86cd799439041'
+        self.friend_id = '507f1f77bcf86cd799439042'
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = self.child_id
+            sess['account_type'] = 'child'
+
+    @patch('app.UserDB.invalidate_cached_user')
+    @patch('app.get_db')
+    def test_removing_a_friend_forgets_both_cached_users(self, mock_get_db, mock_invalidate):
+        response = self.client.post('/api/remove-friend', json={'friend_id': self.friend_id})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_get_db.return_value['users'].update_one.call_count, 2)
+        invalidated = {c[0][0] for c in mock_invalidate.call_args_list}
+        self.assertEqual(invalidated, {self.child_id, self.friend_id})
+
+
+if __name__ == '__main__':
+    unittest.main()
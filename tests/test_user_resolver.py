@@ -0,0 +1,79 @@
+import os
+import sys
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+from bson import ObjectId
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+class UserResolverTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        os.environ['FLASK_SECRET_KEY'] = 'test_key'
+
+        from app import app
+        cls.app = app
+
+    def setUp(self):
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        self.parent_id = ObjectId()
+        self.other_parent_id = ObjectId()
+        self.children = [ObjectId() for _ in range(3)]
+        self.people = {self.parent_id: 'Pat', self.other_parent_id: 'Sam'}
+        self.people.update({c: f'Kid {i}' for i, c in enumerate(self.children)})
+
+        self.users = MagicMock()
+        self.users.find_one.return_value = {
+            '_id': self.parent_id, 'name': 'Pat', 'account_type': 'parent', 'children': self.children
+        }
+        self.users.find.side_effect = lambda query, projection=None: [
+            {'_id': oid, 'name': self.people[oid]} for oid in query['_id']['$in'] if oid in self.people
+        ]
+        self.friend_requests = MagicMock()
+        self.friend_requests.find.return_value = [
+            {
+                '_id': ObjectId(), 'from_user_id': str(c), 'to_user_id': str(self.children[0]),
+                'status': 'pending', 'created_at': datetime(2026, 3, 10),
+                'required_approvals': [str(self.parent_id), str(self.other_parent_id)],
+                'approvals': [str(self.parent_id)],
+            }
+            for c in self.children[1:]
+        ]
+        self.db = MagicMock()
+        self.db.__getitem__.side_effect = {'users': self.users, 'friend_requests': self.friend_requests}.get
+
+    def test_friend_approvals_resolve_names_in_one_query(self):
+        with patch('app.get_db', return_value=self.db), patch('core.database.get_db', return_value=self.db):
+            with self.client.session_transaction() as sess:
+                sess['user_id'] = str(self.parent_id)
+                sess['account_type'] = 'parent'
+
+            response = self.client.get('/api/parent-friend-approvals')
+
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual([r['from_name'] for r in data['requests']], ['Kid 1', 'Kid 2'])
+        self.assertEqual(data['requests'][0]['to_name'], 'Kid 0')
+        self.assertEqual([p['name'] for p in data['requests'][0]['required_parents']], ['Pat', 'Sam'])
+        # One projected read for the parent, one $in for everyone referenced
+        self.assertEqual(self.users.find_one.call_count, 1)
+        self.assertEqual(self.users.find.call_count, 1)
+
+    def test_resolver_skips_invalid_and_cached_ids(self):
+        from core.database import UserDB
+
+        with patch('core.database.get_db', return_value=self.db), self.app.test_request_context('/'):
+            UserDB.get_user_view(self.parent_id, 'identity')
+            found = UserDB.get_users_by_ids([self.parent_id, str(self.children[0]), 'not-an-id', self.children[0]], 'identity')
+
+        self.assertEqual(set(found), {str(self.parent_id), str(self.children[0])})
+        self.assertEqual(self.users.find.call_args[0][0], {'_id': {'$in': [self.children[0]]}})
+
+
+if __name__ == '__main__':
+    unittest.main()
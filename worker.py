@@ -0,0 +1,20 @@
+import logging
+import os
+
+from core import task_queue
+# Importing the handler modules registers their task kinds
+from core import strava_sync  # noqa: F401
+# Registers the credit listener, so credits made here reach the leaderboard windows
+from core import leaderboard  # noqa: F401
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+logger = logging.getLogger(__name__)
+
+if __name__ == "__main__":
+    threads = int(os.getenv('TASK_WORKER_THREADS', '4') or 4)
+    logger.info("Starting task worker for %s", ', '.join(task_queue.registered_kinds()))
+    task_queue.Worker(threads=threads).run_forever()
@@ -1,4 +1,5 @@
 import logging
+import os
 from app import app
 
 # Configure logging for production
@@ -8,6 +9,27 @@ logging.basicConfig(
 )
 
 logger = logging.getLogger(__name__)
+
+# Optional deploy gate: refuse to start if a hot query would scan a collection
+# (or if the database cannot be reached to check)
+if os.getenv('INDEX_CHECK_ON_STARTUP', '').lower() in ('1', 'true', 'yes'):
+    from core.database import verify_query_plans
+    scans = verify_query_plans()
+    if scans:
+        for scan in scans:
+            logger.error(f"COLLSCAN on {scan['collection']}: filter={scan['filter']} sort={scan['sort']}")
+        raise RuntimeError(f"{len(scans)} query shape(s) plan a collection scan; see core.database.INDEX_SPECS")
+
+# Optionally run background tasks (Strava webhook events) inside each web worker
+# instead of a separate `python worker.py` process
+if int(os.getenv('TASK_WORKER_THREADS_IN_WEB', '0') or 0) > 0:
+    from core import task_queue
+    task_queue.Worker(threads=int(os.getenv('TASK_WORKER_THREADS_IN_WEB'))).start()
+
+# Pick up uploads this host had not finished processing before a restart
+from core import upload_jobs
+upload_jobs.get_processor()
+
 logger.info("WSGI app initialized")
 
 if __name__ == "__main__":